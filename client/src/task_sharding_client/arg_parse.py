@@ -6,6 +6,124 @@ def parse_input_arguments(parser: argparse.ArgumentParser = None):
         parser = argparse.ArgumentParser(description="inputs for script")
     parser.add_argument("--client_id", help="Unique client identifier", required=True)
     parser.add_argument("--cache_id", help="Unique cache identifier", required=True)
-    parser.add_argument("--schema_path", help="Path to Schema file", required=True)
+    parser.add_argument(
+        "--schema_path",
+        action="append",
+        dest="schema_paths",
+        help="Path to Schema file, which may be given more than once to run several schemas over one connection",
+        required=True,
+    )
+    parser.add_argument(
+        "--recent_tasks_path",
+        help="File in which to remember recently run tasks, so the server can prefer them for this client",
+    )
+    parser.add_argument(
+        "--task_cache_path",
+        help="Directory in which to keep the results of tasks which have passed, so they are not run again",
+    )
+    parser.add_argument(
+        "--task_cache_size_mb",
+        type=int,
+        default=1024,
+        help="Size of the task cache, beyond which the least recently used results are evicted",
+    )
+    parser.add_argument(
+        "--artifact_address",
+        metavar="HOST:PORT",
+        help="Serve the outputs of the tasks in the task cache to other clients at this address (port 0 picks one)",
+    )
+    parser.add_argument(
+        "--artifact_advertise_host",
+        help="Host other clients reach the served outputs at, needed if --artifact_address is on every interface",
+    )
+    parser.add_argument(
+        "--artifact_linger",
+        type=float,
+        default=10.0,
+        help="Seconds to keep serving outputs for after the last request once the client finishes",
+    )
+    parser.add_argument(
+        "--fetch_artifacts",
+        action="store_true",
+        help="Fetch the outputs other clients serve into the task cache as they are announced",
+    )
+    parser.add_argument(
+        "--supersedes",
+        action="append",
+        metavar="REPO=PATCHSET",
+        help="Cancel the runs of another patchset of a repository, e.g. the previous patchset of a change",
+    )
+    parser.add_argument(
+        "--capability",
+        action="append",
+        dest="capability_labels",
+        metavar="LABEL",
+        help="A label of this host, e.g. its OS image or a toolchain, for tasks which require it",
+    )
+    parser.add_argument(
+        "--resource",
+        action="append",
+        metavar="NAME=AMOUNT",
+        help="An amount of a resource this host has, e.g. memory_gb=64, for tasks which require it",
+    )
+    parser.add_argument(
+        "--max_batch_size",
+        type=int,
+        default=1,
+        help="Number of tasks the server may hand out to this client at once, to run together",
+    )
+    parser.add_argument(
+        "--daemon_socket",
+        help="Connect to the server through the client daemon listening on this Unix socket",
+    )
     args = parser.parse_args()
+    args.schema_path = args.schema_paths[0]
+    args.supersedes = _parse_superseded_repo_state(parser, args.supersedes)
+    args.capabilities = _parse_capabilities(parser, args.capability_labels, args.resource)
+    if args.max_batch_size < 1:
+        parser.error("--max_batch_size must be at least 1")
+    if (args.artifact_address or args.fetch_artifacts) and not args.task_cache_path:
+        parser.error("--artifact_address and --fetch_artifacts need a --task_cache_path to keep the outputs in")
+    if args.artifact_address:
+        host, separator, port = args.artifact_address.rpartition(":")
+        if not separator or not host or not port.isdigit():
+            parser.error("--artifact_address must be given as HOST:PORT")
+        if host in ("0.0.0.0", "[::]", "::") and not args.artifact_advertise_host:
+            parser.error("--artifact_address on every interface needs an --artifact_advertise_host")
+        args.artifact_address = (host.strip("[]"), int(port))
     return args
+
+
+def _parse_superseded_repo_state(parser: argparse.ArgumentParser, values: list) -> dict:
+    """
+    Turns `--supersedes` arguments into a repo state, in the form the server compares with INIT messages.
+    """
+    if not values:
+        return None
+    repo_state = {}
+    for value in values:
+        repo_name, separator, patchset = value.partition("=")
+        if not separator or not repo_name or not patchset:
+            parser.error("--supersedes must be given as REPO=PATCHSET")
+        repo_state[repo_name] = {"patchset": patchset}
+    return repo_state
+
+
+def _parse_capabilities(parser: argparse.ArgumentParser, labels: list, resources: list) -> dict:
+    """
+    Turns `--capability` and `--resource` arguments into capabilities, in the form the server matches
+    with the requirements of tasks.
+    """
+    if not labels and not resources:
+        return None
+    capabilities = {"labels": labels or [], "resources": {}}
+    for value in resources or []:
+        name, separator, amount = value.partition("=")
+        try:
+            amount = float(amount)
+        except ValueError:
+            amount = None
+        if not separator or not name or amount is None:
+            parser.error("--resource must be given as NAME=AMOUNT")
+        capabilities["resources"][name] = amount
+    return capabilities
@@ -0,0 +1,245 @@
+import concurrent.futures
+import http.server
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from .task_cache import TaskCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+DEFAULT_FETCH_WORKERS = 4
+DEFAULT_FETCH_TIMEOUT = 30.0
+DEFAULT_LINGER = 10.0
+REQUEST_POLL_INTERVAL = 0.1
+UNSPECIFIED_HOSTS = ("", "0.0.0.0", "::")
+ARTIFACTS_PATH = "/artifacts/"
+KEY_PATTERN = re.compile(r"[0-9a-f]{64}")
+RANGE_PATTERN = re.compile(r"bytes=(\d+)-(\d*)")
+
+
+class ArtifactServer:
+    """
+    Serves the outputs of the tasks in the client's task cache over HTTP, so that the other clients of
+    a schema instance can fetch them directly from this one, e.g. when there is no remote cache or it
+    is slow. The client announces where it serves a task's outputs from with the task's result, and
+    the server passes them on to the other clients as soon as the task passes (see `fetch_artifacts`).
+
+    Files are served as `/artifacts/<cache key>/<path>`, and in part for HTTP Range requests, so that
+    a large file can be fetched in chunks over several connections at once. They are announced at
+    `advertise_host`, which must be given if `host` is an unspecified address such as 0.0.0.0, as
+    other clients cannot reach the server there.
+    """
+
+    def __init__(
+        self,
+        task_cache: TaskCache,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        advertise_host: str = None,
+        linger: float = DEFAULT_LINGER,
+    ):
+        if not advertise_host and host in UNSPECIFIED_HOSTS:
+            raise ValueError("Artifacts served on {!r} need a host to advertise them at".format(host))
+        self._requests = _RequestTracker()
+        handler = lambda *args: _ArtifactRequestHandler(task_cache, self._requests, *args)
+        self._server = http.server.ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._host = advertise_host or host
+        self._port = self._server.server_address[1]
+        self._linger = linger
+        """
+        How long to keep serving for after the last request once closed, as other clients may only just have
+        been told where the outputs are, e.g. of the last task to pass before the schema completes.
+        """
+
+        # Spawn an ARTIFACT THREAD that serves requests, each of them on a thread of its own
+        server_thread = threading.Thread(target=self._server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        logger.info("Serving artifacts on %s:%d", self._host, self._port)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_url(self, key: str) -> str:
+        return "http://{}:{}{}{}/".format(self._host, self._port, ARTIFACTS_PATH, key)
+
+    def close(self):
+        """
+        Stops serving once no request has been served for `linger` seconds, so that the other clients
+        can finish fetching the outputs they have been told about.
+        """
+        self._requests.wait_until_idle(self._linger)
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _RequestTracker:
+    """
+    Keeps track of the requests being served, and of when the last was served.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active_requests = 0
+        self._last_request_time = time.monotonic()
+
+    def start(self):
+        with self._lock:
+            self._active_requests += 1
+
+    def finish(self):
+        with self._lock:
+            self._active_requests -= 1
+            self._last_request_time = time.monotonic()
+
+    def wait_until_idle(self, idle_time: float):
+        """
+        Returns once no request has been served for `idle_time` seconds.
+        """
+        while True:
+            with self._lock:
+                if self._active_requests:
+                    remaining_time = REQUEST_POLL_INTERVAL
+                else:
+                    remaining_time = idle_time - (time.monotonic() - self._last_request_time)
+            if remaining_time <= 0:
+                return
+            time.sleep(remaining_time)
+
+
+class _ArtifactRequestHandler(http.server.BaseHTTPRequestHandler):
+    def __init__(self, task_cache: TaskCache, requests: _RequestTracker, *args):
+        self._task_cache = task_cache
+        self._requests = requests
+        super().__init__(*args)
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool):
+        self._requests.start()
+        try:
+            self._serve_file(send_body)
+        finally:
+            self._requests.finish()
+
+    def _serve_file(self, send_body: bool):
+        path = self._resolve_path()
+        if path is None:
+            self.send_error(404)
+            return
+        try:
+            file = open(path, "rb")
+        except OSError:
+            # e.g. evicted from the task cache since it was announced
+            self.send_error(404)
+            return
+
+        with file:
+            size = os.fstat(file.fileno()).st_size
+            start, end = 0, size - 1
+            range_match = RANGE_PATTERN.fullmatch(self.headers.get("Range", ""))
+            if range_match:
+                start = int(range_match.group(1))
+                end = min(int(range_match.group(2)), size - 1) if range_match.group(2) else size - 1
+                if start > end:
+                    self.send_error(416)
+                    return
+                self.send_response(206)
+                self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, size))
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+            if send_body:
+                file.seek(start)
+                remaining = end - start + 1
+                while remaining > 0:
+                    data = file.read(min(remaining, DEFAULT_CHUNK_SIZE))
+                    if not data:
+                        break
+                    self.wfile.write(data)
+                    remaining -= len(data)
+
+    def _resolve_path(self) -> str:
+        """
+        Returns the file of the task cache a request is for, or None if it is not for one, including
+        if its path leads outside the outputs of the entry.
+        """
+        request_path = urllib.parse.unquote(urllib.parse.urlsplit(self.path).path)
+        if not request_path.startswith(ARTIFACTS_PATH):
+            return None
+        key, _, relative_path = request_path[len(ARTIFACTS_PATH) :].partition("/")
+        if not KEY_PATTERN.fullmatch(key) or key not in self._task_cache:
+            return None
+        outputs_path = os.path.realpath(self._task_cache.get_outputs_path(key))
+        path = os.path.realpath(os.path.join(outputs_path, relative_path))
+        if not path.startswith(outputs_path + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def log_message(self, format: str, *args):
+        logger.debug("Artifact request from %s: %s", self.address_string(), format % args)
+
+
+def fetch_artifacts(
+    url: str,
+    files: dict,
+    destination: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_workers: int = DEFAULT_FETCH_WORKERS,
+    timeout: float = DEFAULT_FETCH_TIMEOUT,
+) -> list:
+    """
+    Fetches the outputs of a task served by another client's `ArtifactServer` at `url`, given as
+    their paths and sizes, into the same paths under `destination`, and returns the paths. Files
+    are fetched in chunks of up to `chunk_size` bytes, up to `max_workers` chunks at a time.
+    """
+    paths = []
+    chunks = []
+    for relative_path, size in files.items():
+        path = os.path.normpath(os.path.join(destination, relative_path))
+        if os.path.isabs(relative_path) or not path.startswith(os.path.normpath(destination) + os.sep):
+            raise ValueError("Artifact path {} leads outside {}".format(relative_path, destination))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Created at its full size up front, so that its chunks can be written in any order
+        with open(path, "wb") as file:
+            file.truncate(int(size))
+        paths.append(path)
+        file_url = urllib.parse.urljoin(url, urllib.parse.quote(relative_path))
+        chunks.extend(
+            (file_url, path, start, min(start + chunk_size, int(size)) - 1) for start in range(0, int(size), chunk_size)
+        )
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # Raises the first error any chunk failed with
+        list(executor.map(lambda chunk: _fetch_chunk(*chunk, timeout), chunks))
+    return paths
+
+
+def _fetch_chunk(file_url: str, path: str, start: int, end: int, timeout: float):
+    request = urllib.request.Request(file_url, headers={"Range": "bytes={}-{}".format(start, end)})
+    with urllib.request.urlopen(request, timeout=timeout) as response, open(path, "r+b") as file:
+        if response.status != 206:
+            raise IOError("Expected part of {}, got status {}".format(file_url, response.status))
+        file.seek(start)
+        shutil.copyfileobj(response, file)
+        if file.tell() != end + 1:
+            raise IOError(
+                "Fetched {} bytes of {} from {}, not {}".format(file.tell() - start, path, file_url, end - start + 1)
+            )
@@ -0,0 +1,335 @@
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+from .task_runner import TaskRunner
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_PATTERN = re.compile(r"\[([\d,]+) / ([\d,]+)\]")
+"""
+Matches Bazel's action counter, e.g. "[1,234 / 5,000]".
+"""
+
+PASSING_TEST_STATUSES = ("PASSED", "FLAKY")
+"""
+Test summary statuses (from the Build Event Protocol) which count as a pass.
+"""
+
+
+class BazelTargetResult:
+    def __init__(self, label: str):
+        self.label = label
+        self.built: bool = None
+        self.test_status: str = None
+        self.duration: float = None
+        """
+        How long the target's test took to run in seconds, or None if it is not a test or did not run.
+        """
+        self.build_metrics: BazelBuildMetrics = None
+        """
+        Metrics of the Bazel invocation the target was run in, shared by every target of the batch.
+        """
+        self.batch_size = 1
+
+    @property
+    def success(self) -> bool:
+        if not self.built:
+            return False
+        return self.test_status is None or self.test_status in PASSING_TEST_STATUSES
+
+    def to_task_stats(self) -> dict:
+        """
+        Returns the statistics reported to the server in the task's TASK_COMPLETE message. Apart
+        from the test status and duration, these describe the whole Bazel invocation; `duration` and
+        `cache_hit_ratio` are only given if the target was the only one in it, as the server takes them
+        to be the task's own, and one target without cache hits would otherwise mark its whole batch.
+        """
+        task_stats = {"test_status": self.test_status, "test_duration": self.duration, "batch_size": self.batch_size}
+        if self.build_metrics:
+            task_stats.update(
+                actions_created=self.build_metrics.actions_created,
+                actions_executed=self.build_metrics.actions_executed,
+                cache_hits=self.build_metrics.cache_hits,
+                cache_misses=self.build_metrics.cache_misses,
+                critical_path_time=self.build_metrics.critical_path_time,
+            )
+            if self.batch_size == 1:
+                task_stats["cache_hit_ratio"] = self.build_metrics.cache_hit_ratio
+                task_stats["duration"] = self.build_metrics.wall_time
+        return {name: value for name, value in task_stats.items() if value is not None}
+
+
+def normalise_label(label: str) -> str:
+    """
+    Removes the repository prefix from labels in the main repository, e.g. "@@//:test" becomes "//:test".
+    """
+    without_repository = label.lstrip("@")
+    return without_repository if without_repository.startswith("//") else label
+
+
+def _parse_duration(event: dict, name: str) -> float:
+    """
+    Reads a duration which newer versions of Bazel write as a string such as "1.500s" (`<name>`)
+    and older versions write in milliseconds (`<name>Millis` or `<name>InMs`).
+    """
+    if name in event:
+        return float(event[name].rstrip("s"))
+    for suffix in ("Millis", "InMs"):
+        if name + suffix in event:
+            return int(event[name + suffix]) / 1000
+    return None
+
+
+def _read_build_events(path: str):
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+class BazelBuildMetrics:
+    """
+    Metrics of a whole Bazel invocation, from its `buildMetrics` build event.
+    """
+
+    def __init__(self):
+        self.actions_created: int = None
+        self.actions_executed: int = None
+        self.cache_hits: int = None
+        """
+        Spawns whose results were taken from a (disk or remote) cache, or actions found in the
+        action cache if Bazel did not report spawns.
+        """
+        self.cache_misses: int = None
+        self.critical_path_time: float = None
+        self.wall_time: float = None
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        if not self.cache_hits and not self.cache_misses:
+            return None
+        return self.cache_hits / (self.cache_hits + self.cache_misses)
+
+
+def parse_build_metrics(path: str) -> BazelBuildMetrics:
+    """
+    Parses the invocation's metrics from a file written by `--build_event_json_file`.
+    """
+    build_metrics = BazelBuildMetrics()
+    for event in _read_build_events(path):
+        if "buildMetrics" not in event.get("id", {}):
+            continue
+        action_summary = event.get("buildMetrics", {}).get("actionSummary", {})
+        timing_metrics = event.get("buildMetrics", {}).get("timingMetrics", {})
+        build_metrics.actions_created = int(action_summary.get("actionsCreated", 0))
+        build_metrics.actions_executed = int(action_summary.get("actionsExecuted", 0))
+
+        runner_counts = {
+            runner["name"]: int(runner.get("count", 0)) for runner in action_summary.get("runnerCount", ())
+        }
+        if runner_counts:
+            spawns = {name: count for name, count in runner_counts.items() if name not in ("total", "internal")}
+            build_metrics.cache_hits = sum(count for name, count in spawns.items() if name.endswith("cache hit"))
+            build_metrics.cache_misses = sum(spawns.values()) - build_metrics.cache_hits
+        elif "actionCacheStatistics" in action_summary:
+            build_metrics.cache_hits = int(action_summary["actionCacheStatistics"].get("hits", 0))
+            build_metrics.cache_misses = int(action_summary["actionCacheStatistics"].get("misses", 0))
+
+        build_metrics.critical_path_time = _parse_duration(timing_metrics, "criticalPathTime")
+        build_metrics.wall_time = _parse_duration(timing_metrics, "wallTime")
+    return build_metrics
+
+
+def parse_build_event_json_file(path: str) -> dict:
+    """
+    Parses a file written by `--build_event_json_file` and returns a `BazelTargetResult`
+    for every target in it, keyed by its normalised label.
+    """
+    results = {}
+
+    def get_result(label: str) -> BazelTargetResult:
+        label = normalise_label(label)
+        if label not in results:
+            results[label] = BazelTargetResult(label)
+        return results[label]
+
+    for event in _read_build_events(path):
+        event_id = event.get("id", {})
+
+        if "targetCompleted" in event_id:
+            # A target can complete once per configuration, and has only been built if every one succeeded
+            result = get_result(event_id["targetCompleted"]["label"])
+            built = event.get("completed", {}).get("success", False)
+            result.built = built if result.built is None else result.built and built
+        elif "testSummary" in event_id:
+            result = get_result(event_id["testSummary"]["label"])
+            test_summary = event.get("testSummary", {})
+            result.test_status = test_summary.get("overallStatus", "NO_STATUS")
+            summary_duration = _parse_duration(test_summary, "totalRunDuration")
+            if summary_duration is not None:
+                result.duration = summary_duration
+        elif "testResult" in event_id:
+            # Only used if the summary has no duration, e.g. with older versions of Bazel
+            result = get_result(event_id["testResult"]["label"])
+            attempt_duration = _parse_duration(event.get("testResult", {}), "testAttemptDuration")
+            if attempt_duration is not None and result.test_status is None:
+                result.duration = (result.duration or 0.0) + attempt_duration
+
+    return results
+
+
+class BazelRunner:
+    """
+    Runs any number of targets in a single `bazel test` invocation, so that Bazel's startup,
+    server lock and analysis costs are paid once for the whole batch rather than per target.
+    The result of each target is read back from the Build Event Protocol.
+    """
+
+    def __init__(
+        self, workspace_path: str, bazel_command: list = None, bazel_args: list = None, progress_callback=None
+    ):
+        self._workspace_path = workspace_path
+        self._bazel_command = bazel_command if bazel_command else ["bazel"]
+        self._bazel_args = bazel_args if bazel_args else []
+        self._progress_callback = progress_callback
+        """
+        Called with the fraction of actions completed, read from Bazel's action counter.
+        """
+        self._process: subprocess.Popen = None
+
+    def run_batch(self, targets: list, bazel_args: list = None) -> dict:
+        """
+        Builds and tests the targets, and returns a `BazelTargetResult` for each of them keyed by
+        the target as given. Targets which Bazel did not report on (e.g. because it crashed) fail.
+        `bazel_args` are passed to this invocation only, after those given to the constructor.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            build_event_json_file = os.path.join(directory, "build_events.json")
+            command = [
+                *self._bazel_command,
+                "test",
+                "--keep_going",
+                "--build_event_json_file=" + build_event_json_file,
+                *self._bazel_args,
+                *(bazel_args or ()),
+                "--",
+                *dict.fromkeys(targets),
+            ]
+
+            logger.info("Running %d targets in one Bazel invocation", len(targets))
+            logger.debug("Bazel command: %s", command)
+            start_time = time.monotonic()
+            if self._progress_callback:
+                self._process = subprocess.Popen(
+                    command, cwd=self._workspace_path, stderr=subprocess.PIPE, universal_newlines=True
+                )
+                self._forward_progress(self._process.stderr)
+            else:
+                self._process = subprocess.Popen(command, cwd=self._workspace_path)
+            exit_code = self._process.wait()
+            self._process = None
+            wall_time = time.monotonic() - start_time
+            logger.info("Bazel exited with code %d after %.1fs", exit_code, wall_time)
+
+            if os.path.exists(build_event_json_file):
+                target_results = parse_build_event_json_file(build_event_json_file)
+                build_metrics = parse_build_metrics(build_event_json_file)
+            else:
+                logger.error("Bazel did not write a build event file")
+                target_results = {}
+                build_metrics = BazelBuildMetrics()
+            if build_metrics.wall_time is None:
+                build_metrics.wall_time = wall_time
+
+        results = {}
+        for target in targets:
+            result = target_results.get(normalise_label(target), BazelTargetResult(normalise_label(target)))
+            result.build_metrics = build_metrics
+            result.batch_size = len(dict.fromkeys(targets))
+            results[target] = result
+        return results
+
+    def query(self, expression: str):
+        """
+        Runs `bazel query` and yields each target it finds as Bazel prints it, so that the targets
+        can be used before the query has finished.
+        """
+        command = [*self._bazel_command, "query", "--output=label", "--", expression]
+        logger.debug("Bazel command: %s", command)
+        process = subprocess.Popen(command, cwd=self._workspace_path, stdout=subprocess.PIPE, universal_newlines=True)
+        with process.stdout:
+            for line in process.stdout:
+                if line.strip():
+                    yield line.strip()
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, command)
+
+    def _forward_progress(self, stderr):
+        """
+        Passes Bazel's output through, calling the progress callback whenever the action counter changes.
+        """
+        with stderr:
+            for line in stderr:
+                sys.stderr.write(line)
+                match = PROGRESS_PATTERN.search(line)
+                if match:
+                    completed_actions, total_actions = (int(group.replace(",", "")) for group in match.groups())
+                    if total_actions:
+                        self._progress_callback(completed_actions / total_actions)
+
+    def abort(self):
+        process = self._process
+        if process:
+            process.terminate()
+
+
+class BazelTaskRunner(TaskRunner):
+    """
+    Runs the targets of a schema, whose tasks each name one Bazel target, from the workspace at
+    `config.workspace_path`. Several tasks can be run in one Bazel invocation with `run_batch`,
+    or `run_targets` for the result of each target.
+    A shard of a task is run by passing TEST_SHARD_INDEX and TEST_TOTAL_SHARDS to its test, which
+    must not also be sharded by Bazel (i.e. have no `shard_count`).
+    """
+
+    def __init__(self, schema: dict, config: any):
+        super().__init__(schema, config)
+        self._bazel_runner = BazelRunner(config.workspace_path, progress_callback=self.report_progress)
+        self._task_stats = {}
+
+    def get_target(self, task_id: str) -> str:
+        return self._schema["tasks"][int(task_id)]["task"]
+
+    def run(self, task_id: str) -> int:
+        return self.run_batch([task_id])[task_id]
+
+    def run_batch(self, task_ids: list) -> dict:
+        return_codes = {}
+        for task_id, result in self.run_targets(task_ids).items():
+            if not result.success:
+                logger.error("Target %s failed (test status: %s)", result.label, result.test_status)
+            return_codes[task_id] = 0 if result.success else 1
+        return return_codes
+
+    def run_targets(self, task_ids: list) -> dict:
+        """
+        Runs several tasks in one Bazel invocation, and returns a `BazelTargetResult` for each task ID.
+        """
+        targets = {task_id: self.get_target(task_id) for task_id in task_ids}
+        shard_args = ["--test_env=%s=%s" % variable for variable in self.get_shard_env().items()]
+        target_results = self._bazel_runner.run_batch(list(targets.values()), shard_args)
+        for task_id, target in targets.items():
+            self._task_stats[task_id] = target_results[target].to_task_stats()
+        return {task_id: target_results[target] for task_id, target in targets.items()}
+
+    def get_task_stats(self, task_id: str) -> dict:
+        return self._task_stats.get(task_id)
+
+    def abort(self):
+        self._bazel_runner.abort()
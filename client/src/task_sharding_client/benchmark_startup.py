@@ -0,0 +1,147 @@
+import argparse
+import base64
+import hashlib
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+WEBSOCKET_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+CLIENT_SCRIPT = """
+import sys
+from task_sharding_client.client import Client
+from task_sharding_client.connection import Connection
+from task_sharding_client.task_runner import TaskRunner
+
+
+class Config:
+    client_id = "benchmark"
+    cache_id = "benchmark"
+    schema_path = sys.argv[2]
+
+
+repo_state = {"benchmark/repo": {"base_ref": "main", "patchset": "0" * 40}} if sys.argv[3] == "fixed" else None
+with Connection(sys.argv[1], "benchmark") as connection:
+    Client(Config(), connection, TaskRunner, repo_state=repo_state).run()
+"""
+
+SCHEMA = "name: benchmark\ntasks:\n{}"
+
+
+def measure_startup(schema_path: str, parse_repo_state: bool = False) -> float:
+    """
+    Starts a client in a new Python process, and returns the seconds from then until the server
+    receives its INIT message. The server is stood in for by a socket which accepts the websocket
+    handshake and then times the client's first frame.
+    """
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.bind(("127.0.0.1", 0))
+    server_socket.listen(1)
+    received = []
+    server_thread = threading.Thread(target=lambda: received.append(_receive_first_frame(server_socket)))
+    server_thread.start()
+
+    env = {**os.environ, "PYTHONPATH": os.path.dirname(os.path.dirname(os.path.abspath(__file__)))}
+    url = "127.0.0.1:{}".format(server_socket.getsockname()[1])
+    start_time = time.monotonic()
+    process = subprocess.Popen(
+        [sys.executable, "-c", CLIENT_SCRIPT, url, schema_path, "parse" if parse_repo_state else "fixed"],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        server_thread.join()
+    finally:
+        process.kill()
+        process.wait()
+        server_socket.close()
+
+    receive_time, frame = received[0]
+    if b'"message_type": 1' not in frame:
+        raise Exception("Expected an INIT message from the client, received {!r}".format(frame))
+    return receive_time - start_time
+
+
+def _receive_first_frame(server_socket: socket.socket) -> tuple:
+    connection, _ = server_socket.accept()
+    with connection:
+        request = b""
+        while b"\r\n\r\n" not in request:
+            request += connection.recv(4096)
+        key = re.search(rb"Sec-WebSocket-Key: *(\S+)", request, re.IGNORECASE).group(1)
+        accept = base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest())
+        connection.sendall(
+            b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n"
+        )
+
+        header = _receive_exactly(connection, 2)
+        receive_time = time.monotonic()
+        length = header[1] & 0x7F
+        if length == 126:
+            length = int.from_bytes(_receive_exactly(connection, 2), "big")
+        elif length == 127:
+            length = int.from_bytes(_receive_exactly(connection, 8), "big")
+        mask = _receive_exactly(connection, 4)
+        payload = _receive_exactly(connection, length)
+        return receive_time, bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+
+
+def _receive_exactly(connection: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = connection.recv(size - len(data))
+        if not chunk:
+            raise Exception("Client disconnected before sending its INIT message")
+        data += chunk
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measures the time from starting a client process until the server receives its INIT message"
+    )
+    parser.add_argument("--runs", type=int, default=10, help="Number of clients to start, one after another")
+    parser.add_argument("--tasks", type=int, default=100, help="Tasks in the schema the clients load")
+    parser.add_argument(
+        "--parse_repo_state",
+        action="store_true",
+        help="Parse the repo state of the working directory, rather than giving the clients a fixed one",
+    )
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        schema_path = os.path.join(directory, "schema.yaml")
+        with open(schema_path, "w") as file:
+            file.write(SCHEMA.format("".join("  - task: {}\n".format(task) for task in range(args.tasks))))
+        startup_times = [measure_startup(schema_path, args.parse_repo_state) for _ in range(args.runs)]
+
+    results = {
+        "runs": args.runs,
+        "startup_seconds": {
+            "min": min(startup_times),
+            "median": statistics.median(startup_times),
+            "max": max(startup_times),
+        },
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(
+        "Process start to INIT sent: min={min:.3f}s median={median:.3f}s max={max:.3f}s (n={runs})".format(
+            runs=args.runs, **results["startup_seconds"]
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
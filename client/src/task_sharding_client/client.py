@@ -1,19 +1,23 @@
+import concurrent.futures
 import json
 import logging
-from multiprocessing.managers import BaseManager
 import queue
+import tempfile
 import threading
+import time
 
-from websocket import WebSocketConnectionClosedException
-
-from .connection import Connection
+from .connection import BaseConnection, ConnectionClosedException
 from .message_type import MessageType
-from .repo_state_parser import RepoStateParser
-from .schema_loader import SchemaLoader
+from .recent_tasks import RecentTasks
+from .task_cache import TaskCache
 from .task_runner import TaskRunner
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_PROGRESS_INTERVAL = 5.0
+DEFAULT_STREAM_BATCH_SIZE = 100
+DEFAULT_STREAM_INTERVAL = 1.0
+
 
 class ClientConfig:
     client_id: str
@@ -25,34 +29,118 @@ class Client:
     def __init__(
         self,
         config: ClientConfig,
-        connection: Connection,
+        connection: BaseConnection,
         task_runner_type: TaskRunner,
         complex_patchset: bool = False,
         repo_state: dict = None,
+        recent_tasks: RecentTasks = None,
+        progress_interval: float = DEFAULT_PROGRESS_INTERVAL,
+        task_stream=None,
+        stream_batch_size: int = DEFAULT_STREAM_BATCH_SIZE,
+        stream_interval: float = DEFAULT_STREAM_INTERVAL,
+        supersedes: dict = None,
+        object_manager=None,
+        capabilities: dict = None,
+        task_cache: TaskCache = None,
+        artifact_server=None,
+        fetch_artifacts: bool = False,
+        max_batch_size: int = 1,
     ):
         self._complex_patchset = complex_patchset
         self._config = config
         self._connection = connection
+        self._recent_tasks = recent_tasks
+        self._progress_interval = progress_interval
+        self._task_stream = task_stream
+        """
+        An iterable of further tasks, in the same form as those of the schema, which are sent to the
+        server as they are produced. It is typically a generator which enumerates them slowly.
+        """
+        self._stream_batch_size = stream_batch_size
+        self._stream_interval = stream_interval
+        self._supersedes = supersedes
+        """
+        A repo state (e.g. the previous patchset of a change) whose runs are cancelled before this one starts.
+        """
+        self._capabilities = capabilities
+        """
+        The labels and resources of this host, as `{"labels": [...], "resources": {name: amount}}`, which
+        the server matches with the `requires` of each task of the schema.
+        """
+        self._task_cache = task_cache
+        """
+        Results of the tasks which have passed on this machine, so that they are not run again for the same inputs.
+        """
+        self._artifact_server = artifact_server
+        """
+        An `ArtifactServer`, which serves the outputs of the tasks in the task cache to other clients, which are told
+        where they are.
+        """
+        self._fetch_artifacts = fetch_artifacts
+        """
+        Whether to fetch the outputs which other clients serve into the task cache, as they are announced.
+        """
+        self._fetch_executor: concurrent.futures.ThreadPoolExecutor = None
+        self._max_batch_size = max_batch_size
+        """
+        How many tasks the server may hand out to this client at once, which it runs together with
+        `TaskRunner.run_batch`.
+        """
+        self._initial_message: dict = None
+        self._stream_lock = threading.Lock()
+        """
+        Held while sending streamed tasks, so that they are not sent in between those resent by `_process_retry_after`.
+        """
+        self._end_of_tasks_sent = False
 
-        self._repo_state = repo_state if repo_state else RepoStateParser.parse_repo_state()
-        self._schema = SchemaLoader.load_schema(config.schema_path)
+        # Both are parsed through the connection, which may share them with other clients on this host.
+        # The repo state mostly waits on git, so it is parsed on a REPO STATE THREAD while the schema
+        # loads (and the connection opens), and only waited for once the INIT message is sent
+        self._repo_state = repo_state
+        self._repo_state_error: Exception = None
+        self._repo_state_thread: threading.Thread = None
+        if not self._repo_state:
+            self._repo_state_thread = threading.Thread(target=self._parse_repo_state)
+            self._repo_state_thread.daemon = True
+            self._repo_state_thread.start()
+        self._schema = self._connection.load_schema(config.schema_path)
+        self._schema["tasks"] = self._schema.get("tasks") or []
+        self._schema_lock = threading.Lock()
         self._dispatch = {
             MessageType.BUILD_INSTRUCTION: self._process_build_instructions,
             MessageType.SCHEMA_COMPLETE: self._process_schema_complete,
+            MessageType.SCHEMA_FAILED: self._process_schema_failed,
+            MessageType.SCHEMA_SUPERSEDED: self._process_schema_superseded,
             MessageType.ABORT_TASK: self._process_abort_task,
             MessageType.WEBSOCKET_CLOSED: self._process_websocket_closed,
+            MessageType.RETRY_AFTER: self._process_retry_after,
+            MessageType.ARTIFACTS: self._process_artifacts,
         }
         self._message_listening = False
         self._task_in_progress_lock = threading.Lock()
 
-        # This object manager here allows us to share instances of TaskRunner across processes
-        BaseManager.register("TaskRunner", task_runner_type)
-        self._object_manager = BaseManager()
-        self._object_manager.start()
+        # This object manager allows us to share instances of TaskRunner across processes. Its process
+        # is only started once there is a task to run (see `_get_object_manager`)
+        self._task_runner_type = task_runner_type
+        self._shared_object_manager = object_manager
+        """
+        A `SharedObjectManager` whose process is shared with the clients of other schemas, if any.
+        """
+        self._object_manager = None
         self._task_runner_instance: TaskRunner = None
         self._task_return_code: int = 1
 
     def run(self) -> int:
+        if self._supersedes:
+            # Frees the clients running the superseded repo state, so they can join this run instead
+            logger.info("Superseding repo state %s", self._supersedes)
+            self._connection.send_message({"message_type": MessageType.SUPERSEDE, "repo_state": self._supersedes})
+
+        if self._repo_state_thread:
+            self._repo_state_thread.join()
+            if self._repo_state_error:
+                raise self._repo_state_error
+
         # Send a message to the server about our requirements.
         initial_message = {
             "message_type": MessageType.INIT,
@@ -62,12 +150,36 @@ class Client:
             "schema_id": self._schema["name"],
             "total_tasks": len(self._schema["tasks"]),
         }
+        shardable_tasks = self._get_shardable_tasks()
+        if shardable_tasks:
+            initial_message["shardable_tasks"] = shardable_tasks
+        task_requirements = self._get_task_requirements()
+        if task_requirements:
+            initial_message["task_requirements"] = task_requirements
+        if self._capabilities:
+            initial_message["capabilities"] = self._capabilities
+        if self._max_batch_size > 1:
+            initial_message["max_batch_size"] = self._max_batch_size
+        if self._recent_tasks:
+            # Lets the server prefer giving us tasks we have warm local state for
+            initial_message["recent_tasks"] = self._recent_tasks.get(self._schema["name"])
+        if self._task_stream is not None:
+            # The server will not complete the schema until we have sent every streamed task
+            initial_message["streaming"] = True
 
-        logger.info("Sending initial message: %s", str(initial_message))
+        logger.info("Sending initial message for schema %s", initial_message["schema_id"])
+        logger.debug("Initial message: %s", initial_message)
+        self._initial_message = initial_message
         self._connection.send_message(initial_message)
 
         self._message_listening = True
 
+        if self._task_stream is not None:
+            # Spawn a STREAM THREAD that sends tasks to the server as they are enumerated
+            stream_thread = threading.Thread(target=self._stream_tasks)
+            stream_thread.daemon = True
+            stream_thread.start()
+
         # Run an infinite loop on the MAIN THREAD that is constantly waiting for messages.
         while self._message_listening:
             try:
@@ -79,8 +191,117 @@ class Client:
         logger.info("Closing websocket")
         self._connection.close_websocket()
 
+        if self._fetch_executor:
+            # The outputs announced last, e.g. just before the schema completed, may still be being fetched
+            self._fetch_executor.shutdown(wait=True)
+
         return self._task_return_code
 
+    # Repo State Thread
+    def _parse_repo_state(self):
+        try:
+            self._repo_state = self._connection.get_repo_state()
+        except Exception as exception:
+            # Raised on the main thread by `run`
+            self._repo_state_error = exception
+
+    def _get_object_manager(self):
+        if self._object_manager is None and self._shared_object_manager is not None:
+            self._object_manager = self._shared_object_manager.get()
+        elif self._object_manager is None:
+            # Imported here, as most of the client's work before its first task does not need it
+            from multiprocessing.managers import BaseManager
+
+            BaseManager.register("TaskRunner", self._task_runner_type)
+            self._object_manager = BaseManager()
+            self._object_manager.start()
+        return self._object_manager
+
+    def _stream_tasks(self):
+        """
+        Sends the tasks of the task stream to the server in batches, followed by an end of tasks
+        message. A batch is sent once it holds `stream_batch_size` tasks, or when a task is produced
+        `stream_interval` seconds or more after the last batch was sent, so that the first tasks can
+        be handed out while later ones are still being enumerated.
+        """
+        # Counted from the initial message, as the schema's tasks may already be growing by the time this runs
+        first_task_id = self._initial_message["total_tasks"]
+        batch = []
+        last_sent_time = time.monotonic()
+        try:
+            for task in self._task_stream:
+                batch.append(task)
+                if len(batch) >= self._stream_batch_size or time.monotonic() - last_sent_time >= self._stream_interval:
+                    self._send_added_tasks(first_task_id, batch)
+                    first_task_id += len(batch)
+                    batch = []
+                    last_sent_time = time.monotonic()
+            if batch:
+                self._send_added_tasks(first_task_id, batch)
+                first_task_id += len(batch)
+
+            logger.info("Finished streaming tasks: %d in total", first_task_id)
+            with self._stream_lock:
+                self._connection.send_message(
+                    {"message_type": MessageType.END_OF_TASKS, "schema_id": self._schema["name"]}
+                )
+                self._end_of_tasks_sent = True
+        except ConnectionClosedException as exception:
+            logger.error("Failed to send message to server: %s", exception)
+            self._message_listening = False
+        except Exception:
+            # Without every task, the schema can never be completed
+            logger.exception("Failed to enumerate tasks")
+            self._task_return_code = 1
+            self._message_listening = False
+
+    def _send_added_tasks(self, first_task_id: int, tasks: list):
+        with self._stream_lock:
+            for task_id, task in enumerate(tasks, first_task_id):
+                self._set_schema_task(task_id, task)
+
+            logger.debug("Sending tasks %d to %d", first_task_id, first_task_id + len(tasks) - 1)
+            self._connection.send_message(
+                {
+                    "message_type": MessageType.ADD_TASKS,
+                    "schema_id": self._schema["name"],
+                    "first_task_id": first_task_id,
+                    "tasks": tasks,
+                }
+            )
+
+    def _set_schema_task(self, task_id: int, task: dict):
+        with self._schema_lock:
+            tasks = self._schema["tasks"]
+            if task_id >= len(tasks):
+                tasks.extend([None] * (task_id + 1 - len(tasks)))
+            tasks[task_id] = task
+
+    def _get_shardable_tasks(self) -> dict:
+        """
+        Returns the tasks which the schema allows the server to split into shards, with their
+        `shards` count, or 0 for `shards: auto` to have the server choose from their past durations.
+        """
+        shardable_tasks = {}
+        for task_id, task in enumerate(self._schema["tasks"]):
+            shards = task.get("shards") if isinstance(task, dict) else None
+            if shards == "auto":
+                shardable_tasks[str(task_id)] = 0
+            elif shards:
+                shardable_tasks[str(task_id)] = int(shards)
+        return shardable_tasks
+
+    def _get_task_requirements(self) -> dict:
+        """
+        Returns the tasks which the schema only allows to be run by a client with certain capabilities,
+        with their `requires`, e.g. `{"labels": ["ubuntu-22.04"], "resources": {"memory_gb": 64}}`.
+        """
+        return {
+            str(task_id): task["requires"]
+            for task_id, task in enumerate(self._schema["tasks"])
+            if isinstance(task, dict) and task.get("requires")
+        }
+
     def _process_message(self, msg: dict) -> bool:
         """
         Proxies the message to the relevant function depending on the message type.
@@ -93,54 +314,260 @@ class Client:
         """
         This method is reached when the server sends us a build instruction message.
         The task itself is given to another thread so that the message receiving
-        thread continues to operate in the background.
+        thread continues to operate in the background. The tasks the server has
+        batched with it, if any, are run along with it.
         """
 
-        logger.info("Received build instructions message: %s", str(msg))
+        logger.info("Received build instructions for task %s", msg["task_id"])
+        logger.debug("Build instructions message: %s", msg)
+
+        units = [msg, *msg.get("batch", ())]
+        for unit in units:
+            # A streamed task may not have been enumerated here yet, so the server sends it along
+            if "task" in unit:
+                self._set_schema_task(int(unit["task_id"]), unit["task"])
+
+        results = [self._get_cached_task_result(unit) if self._task_cache else None for unit in units]
+        if None not in results:
+            self._task_return_code = 0
+            self._send_task_results(results)
+            return
 
         # Create a new task runner instance
-        with self._task_in_progress_lock:
+        with self._task_in_progress_lock, self._schema_lock:
             if self._task_runner_instance:
                 raise Exception("Instance is running when it shouldn't be!")
-            self._task_runner_instance = self._object_manager.TaskRunner(self._schema, self._config)
+            self._task_runner_instance = self._get_object_manager().TaskRunner(self._schema, self._config)
+            task_runner = self._task_runner_instance
 
-        # Spawn a new TASK THREAD that processes the build instructions
-        task_thread = threading.Thread(target=lambda: self._run_build_instructions(msg))
+        # Spawn a new TASK THREAD that processes the build instructions. The instance is cleared if
+        # the task is aborted, possibly before the thread starts, so it is handed to the thread
+        task_thread = threading.Thread(target=lambda: self._run_build_instructions(units, results, task_runner))
         task_thread.daemon = True
         task_thread.start()
 
-    def _run_build_instructions(self, msg: dict):
+    def _run_build_instructions(self, units: list, results: list, task_runner: TaskRunner):
         """
-        This method starts the task runner and passes to it a task ID.
+        This method starts the task runner and passes to it the IDs of the tasks which
+        have no result yet, i.e. were not found in the task cache.
         """
 
-        task_id = msg["task_id"]
+        units_to_run = [unit for unit, result in zip(units, results) if result is None]
+        task_ids = [unit["task_id"] for unit in units_to_run]
+
+        # Run the tasks (BLOCKING). The server only batches whole tasks, so a shard is always run on its own
+        if "total_shards" in units_to_run[0]:
+            task_runner.set_shard(int(units_to_run[0]["shard_index"]), int(units_to_run[0]["total_shards"]))
+        task_finished = threading.Event()
+        # Progress is reported for the task the server sent first, which it takes as the one in progress
+        task_fields = self._get_task_fields(units[0])
+        progress_thread = threading.Thread(target=lambda: self._send_progress(task_runner, task_fields, task_finished))
+        progress_thread.daemon = True
+        progress_thread.start()
+        try:
+            if len(task_ids) == 1:
+                return_codes = {task_ids[0]: task_runner.run(task_ids[0])}
+            else:
+                return_codes = task_runner.run_batch(task_ids)
+        finally:
+            task_finished.set()
 
-        # Run the task (BLOCKING)
-        self._task_return_code = self._task_runner_instance.run(task_id)
+        run_results = []
+        for unit in units_to_run:
+            return_code = return_codes.get(unit["task_id"], 1)
+            task_stats = task_runner.get_task_stats(unit["task_id"])
+            cache_key = None
+            if self._task_cache and return_code == 0:
+                cache_key = self._cache_task_result(unit, task_runner)
+            if self._recent_tasks:
+                self._recent_tasks.record(self._schema["name"], unit["task_id"])
+
+            result = {**self._get_task_fields(unit), "task_success": return_code == 0}
+            if task_stats:
+                result["task_stats"] = task_stats
+            if cache_key:
+                self._announce_artifacts(result, cache_key)
+            run_results.append(result)
+        self._task_return_code = 0 if all(result["task_success"] for result in run_results) else 1
 
         # Setting this to None signifies that the task has finished
         self._task_runner_instance = None
 
-        task_message = {
-            "message_type": MessageType.TASK_COMPLETE,
-            "schema_id": self._schema["name"],
-            "task_id": task_id,
-            "task_success": bool(True if self._task_return_code == 0 else False),
-        }
+        run_results = iter(run_results)
+        self._send_task_results([result if result is not None else next(run_results) for result in results])
+
+        # On a failure, keep listening: the server decides whether the task is retried (here or on
+        # another client) or the whole schema has failed
+
+    def _get_task_fields(self, msg: dict) -> dict:
+        """
+        Returns the fields which identify a task, and the shard of it if it has been sharded, in messages to the server.
+        """
+        task_fields = {"task_id": msg["task_id"]}
+        if "total_shards" in msg:
+            task_fields.update(shard_index=msg["shard_index"], total_shards=msg["total_shards"])
+        return task_fields
 
-        logger.info("Sending task complete message: %s", str(task_message))
+    def _send_task_results(self, results: list):
+        """
+        Sends the results of the tasks of a build instruction to the server, in one task complete
+        message: the result of the task the server sent first, with those batched with it after it.
+        """
+        task_message = {"message_type": MessageType.TASK_COMPLETE, "schema_id": self._schema["name"], **results[0]}
+        if len(results) > 1:
+            task_message["batch"] = results[1:]
+
+        logger.info(
+            "Sending task complete message for task %s (success: %s)", results[0]["task_id"], results[0]["task_success"]
+        )
+        logger.debug("Task complete message: %s", task_message)
         try:
             self._connection.send_message(task_message)
-        except WebSocketConnectionClosedException as exception:
-            logger.error("Failed to send message to server: %s", str(exception))
+        except ConnectionClosedException as exception:
+            logger.error("Failed to send message to server: %s", exception)
             self._message_listening = False
 
-        if self._task_return_code != 0:
-            self._message_listening = False
+    def _get_task_cache_key(self, msg: dict) -> str:
+        with self._schema_lock:
+            task = self._schema["tasks"][int(msg["task_id"])]
+        return TaskCache.get_key(
+            self._schema["name"], task, self._repo_state, msg.get("shard_index"), msg.get("total_shards")
+        )
+
+    def _get_cached_task_result(self, msg: dict) -> dict:
+        """
+        Returns the result of a task without running it, if it has passed on this machine before with
+        the same inputs, or None if it has not. Its outputs are restored from the cache.
+        """
+        key = self._get_task_cache_key(msg)
+        if self._task_cache.get(key) is None:
+            return None
+        logger.info("Task %s found in the task cache, skipping it", msg["task_id"])
+        self._task_cache.restore_outputs(key)
+        if self._recent_tasks:
+            self._recent_tasks.record(self._schema["name"], msg["task_id"])
+
+        result = {
+            **self._get_task_fields(msg),
+            "task_success": True,
+            # The server does not take how long it waited for a cached result as the task's duration
+            "cached": True,
+        }
+        self._announce_artifacts(result, key)
+        return result
+
+    def _cache_task_result(self, msg: dict, task_runner: TaskRunner) -> str:
+        """
+        Stores the result of a task which has passed in the task cache, and returns its key, or None if
+        it could not be stored.
+        """
+        key = self._get_task_cache_key(msg)
+        try:
+            if self._task_cache.put(key, {"task_id": msg["task_id"]}, task_runner.get_task_outputs(msg["task_id"])):
+                return key
+        except (OSError, ValueError):
+            # The task has passed all the same, it will just be run again next time
+            logger.exception("Failed to cache the result of task %s", msg["task_id"])
+        return None
+
+    def _announce_artifacts(self, task_message: dict, key: str):
+        """
+        Tells the server where the outputs of a task are served from, if they are, in its result.
+        """
+        if not self._artifact_server:
+            return
+        output_sizes = self._task_cache.get_output_sizes(key)
+        if output_sizes:
+            task_message["artifacts"] = {"url": self._artifact_server.get_url(key), "files": output_sizes}
+
+    def _fetch_announced_artifacts(self, announced_artifacts: list):
+        """
+        Fetches the outputs of tasks which other clients have passed, and serve, into the task cache, so
+        that the tasks are not run here for the same inputs. The outputs of a task are only fetched if
+        they are cached under the same key here, i.e. the task was run with the same inputs.
+        """
+        # Imported here, as it is only needed once another client has announced artifacts
+        from .artifacts import fetch_artifacts
+
+        for artifacts in announced_artifacts:
+            task_id = int(artifacts["task_id"])
+            with self._schema_lock:
+                known_task = 0 <= task_id < len(self._schema["tasks"]) and self._schema["tasks"][task_id] is not None
+            if not known_task:
+                continue
+            key = self._get_task_cache_key(artifacts)
+            if key in self._task_cache or not artifacts["url"].rstrip("/").endswith("/" + key):
+                continue
+
+            logger.info("Fetching the outputs of task %s from %s", artifacts["task_id"], artifacts["url"])
+            try:
+                with tempfile.TemporaryDirectory() as directory:
+                    outputs = fetch_artifacts(artifacts["url"], artifacts["files"], directory)
+                    self._task_cache.put(
+                        key, {"task_id": artifacts["task_id"], "fetched_from": artifacts["url"]}, outputs, directory
+                    )
+            except (OSError, ValueError):
+                # e.g. the other client has gone, in which case the task is run here if it is needed
+                logger.exception("Failed to fetch the outputs of task %s", artifacts["task_id"])
+
+    def _send_progress(self, task_runner: TaskRunner, task_fields: dict, task_finished: threading.Event):
+        """
+        Sends the progress reported by the task runner to the server every `progress_interval`
+        seconds while the task runs, whenever it has changed.
+        """
+        last_progress = None
+        while not task_finished.wait(self._progress_interval):
+            progress = task_runner.get_progress()
+            if progress is None or progress == last_progress:
+                continue
+            last_progress = progress
+
+            logger.debug("Sending progress %s for task %s", progress, task_fields["task_id"])
+            try:
+                self._connection.send_message(
+                    {
+                        "message_type": MessageType.TASK_PROGRESS,
+                        "schema_id": self._schema["name"],
+                        **task_fields,
+                        "progress": progress,
+                    }
+                )
+            except ConnectionClosedException:
+                return
+
+    def _process_artifacts(self, msg: dict):
+        """
+        This method is reached when other clients have passed tasks and serve their outputs. They are
+        fetched while the schema runs, as the other clients only serve them until they finish.
+        """
+        logger.debug("Artifacts message: %s", msg)
+        if not self._fetch_artifacts or not self._task_cache:
+            return
+        if not self._fetch_executor:
+            # Spawn a FETCH THREAD that fetches the announced outputs one task at a time, so that
+            # the main thread keeps receiving messages
+            self._fetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._fetch_executor.submit(self._fetch_announced_artifacts, msg["artifacts"])
 
     def _process_schema_complete(self, msg: dict):
-        logger.info("Received schema complete message: %s", str(msg))
+        logger.info("Received schema complete message")
+        logger.debug("Schema complete message: %s", msg)
+        # Every task has passed, even if one run by this client failed and was retried elsewhere
+        self._task_return_code = 0
+        self._message_listening = False
+
+    def _process_schema_failed(self, msg: dict):
+        logger.error("Schema failed: task %s ran out of attempts", msg["task_id"])
+        logger.debug("Schema failed message: %s", msg)
+        self._process_abort_task(msg)
+        self._task_return_code = 1
+        self._message_listening = False
+
+    def _process_schema_superseded(self, msg: dict):
+        logger.warning("Schema superseded: a newer repo state is being run instead")
+        logger.debug("Schema superseded message: %s", msg)
+        self._process_abort_task(msg)
+        self._task_return_code = 1
         self._message_listening = False
 
     def _process_abort_task(self, msg: dict):
@@ -153,3 +580,32 @@ class Client:
     def _process_websocket_closed(self, msg: dict):
         self._process_abort_task(msg)
         self._message_listening = False
+
+    def _process_retry_after(self, msg: dict):
+        """
+        This method is reached when the server is too busy to take our initial message, and tells us
+        how long to wait before sending it again. Any tasks streamed meanwhile were not taken either,
+        so they are sent again with it.
+        """
+        logger.warning("Server is busy, retrying in %.1f seconds", msg["retry_after"])
+        time.sleep(msg["retry_after"])
+        with self._stream_lock:
+            self._connection.send_message(self._initial_message)
+            if self._task_stream is None:
+                return
+            first_task_id = self._initial_message["total_tasks"]
+            with self._schema_lock:
+                streamed_tasks = self._schema["tasks"][first_task_id:]
+            if streamed_tasks:
+                self._connection.send_message(
+                    {
+                        "message_type": MessageType.ADD_TASKS,
+                        "schema_id": self._schema["name"],
+                        "first_task_id": first_task_id,
+                        "tasks": streamed_tasks,
+                    }
+                )
+            if self._end_of_tasks_sent:
+                self._connection.send_message(
+                    {"message_type": MessageType.END_OF_TASKS, "schema_id": self._schema["name"]}
+                )
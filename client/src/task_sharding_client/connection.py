@@ -1,12 +1,11 @@
-from time import sleep
-
 import json
 import logging
 import queue
 import threading
-import websocket
 
 from .message_type import MessageType
+from .repo_state_parser import RepoStateParser
+from .schema_loader import SchemaLoader
 
 
 INITIAL_CONN_TIMEOUT = 5
@@ -15,71 +14,117 @@ URL_FORMAT = "ws://{}/ws/api/1/{}/"
 logger = logging.getLogger(__name__)
 
 
-class Connection:
-    def __init__(self, server_url: str, client_id: str):
+class ConnectionClosedException(Exception):
+    """
+    Raised when a message is sent over a connection which has closed, or failed to open.
+    """
+
+
+class BaseConnection:
+    """
+    A connection to the server, however it reaches it (see `Connection`). Messages received from the
+    server are queued as JSON for `get_latest_message`, and a closed connection is announced by a
+    WEBSOCKET_CLOSED message.
+    """
+
+    def __init__(self):
         self._received_messages = queue.Queue()
-        self._websocket = self._init_connection(URL_FORMAT.format(server_url, client_id))
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        if self._websocket:
-            self._websocket.close()
+        self.close_websocket()
+
+    def send_message(self, message: dict):
+        raise NotImplementedError()
 
-    def _init_connection(self, server_url: str) -> websocket.WebSocketApp:
+    def close_websocket(self):
+        raise NotImplementedError()
+
+    def get_latest_message(self, block: bool = False) -> dict:
+        return self._received_messages.get(block=block, timeout=1)
+
+    def get_repo_state(self) -> dict:
+        return RepoStateParser.parse_repo_state()
+
+    def load_schema(self, path: str) -> dict:
+        return SchemaLoader.load_schema(path)
+
+
+class Connection(BaseConnection):
+    """
+    A websocket of the client's own to the server.
+    """
+
+    def __init__(self, server_url: str, client_id: str):
+        super().__init__()
+        self._websocket = None
+        self._connected = threading.Event()
+        """
+        Set once the websocket has opened, or has failed to.
+        """
+        self._init_connection(URL_FORMAT.format(server_url, client_id))
+
+    def _init_connection(self, server_url: str):
+        """
+        Connects to the server in the background, so that the client can prepare its first
+        messages meanwhile. Sending a message waits for the connection to open.
+        """
         logger.info("Initialising connection...")
+        wst = threading.Thread(target=lambda: self._run_websocket(server_url))
+        wst.daemon = True
+        wst.start()
+
+    # WS Thread
+    def _run_websocket(self, server_url: str):
+        # Imported here, as it takes longer than anything else the client does before connecting
+        import websocket
+
         websocket.enableTrace(False)
-        web_socket = websocket.WebSocketApp(
+        self._websocket = websocket.WebSocketApp(
             server_url,
             on_open=self._on_open,
             on_message=self._on_message,
             on_error=self._on_error,
             on_close=self._on_close,
         )
-        wst = threading.Thread(target=web_socket.run_forever)
-        wst.daemon = True
-        wst.start()
-
-        sleep(1)
-
-        connection_timeout = INITIAL_CONN_TIMEOUT
-        if web_socket.sock:
-            while not web_socket.sock.connected and connection_timeout > 0:
-                connection_timeout -= 1
-                sleep(1)
-
-        if not web_socket.sock.connected:
-            raise websocket.WebSocketException("Failed to connect")
-
-        return web_socket
+        self._websocket.run_forever()
+        # Reached without calling _on_close if the connection could not be made
+        self._connected.set()
 
     # WS Thread
-    def _on_message(self, web_socket: websocket.WebSocketApp, message: dict):
+    def _on_message(self, web_socket, message: dict):
         self._received_messages.put(message)
 
     # WS Thread
-    def _on_error(self, web_socket: websocket.WebSocketApp, error):
-        logger.error("ERROR: %s", str(error))
+    def _on_error(self, web_socket, error):
+        logger.error("ERROR: %s", error)
 
     # WS Thread
-    def _on_close(self, web_socket: websocket.WebSocketApp, close_status_code, close_msg):
+    def _on_close(self, web_socket, close_status_code, close_msg):
         logger.info("### closed ###")
+        self._connected.set()
         self._received_messages.put(json.dumps({"message_type": MessageType.WEBSOCKET_CLOSED}))
 
-    # Main Thread
-    def _on_open(self, web_socket: websocket.WebSocketApp):
+    # WS Thread
+    def _on_open(self, web_socket):
         logger.info("Opened connection")
+        self._connected.set()
 
     # Main Thread
     def send_message(self, message: dict):
-        self._websocket.send(json.dumps(message))
+        if not self._connected.wait(INITIAL_CONN_TIMEOUT):
+            raise ConnectionClosedException("Failed to connect")
+
+        from websocket import WebSocketConnectionClosedException
+
+        try:
+            self._websocket.send(json.dumps(message))
+        except WebSocketConnectionClosedException as exception:
+            raise ConnectionClosedException(str(exception)) from exception
 
     # Main Thread
     def close_websocket(self):
         if self._websocket:
             self._websocket.close()
-
-    # Main Thread
-    def get_latest_message(self) -> dict:
-        return self._received_messages.get(block=False, timeout=1)
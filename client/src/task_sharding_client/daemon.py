@@ -0,0 +1,297 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+
+from .connection import BaseConnection, Connection, ConnectionClosedException
+from .message_type import MessageType
+from .repo_state_parser import RepoStateParser
+from .schema_loader import SchemaLoader
+
+DEFAULT_SOCKET_PATH = "/tmp/task_sharding_client.sock"
+SOCKET_UMASK = 0o177
+
+logger = logging.getLogger(__name__)
+
+
+class ClientDaemon:
+    """
+    Shares one connection to the server between the clients running on a host. Clients connect to
+    the daemon over a Unix socket (see `DaemonConnection`) and exchange newline-delimited JSON with
+    it. Each client is a session of the daemon: its messages are tagged with a `session_id` before
+    being sent to the server, and the server's replies are routed back by the same tag.
+
+    The daemon also keeps the schemas and repo states parsed for its clients, so that clients
+    running the same schema, or in the same repository, do not each parse them again.
+    """
+
+    def __init__(self, connection: Connection, socket_path: str = DEFAULT_SOCKET_PATH):
+        self._connection = connection
+        self._socket_path = socket_path
+        self._server: socketserver.UnixStreamServer = None
+        self._running = False
+
+        self._sessions: dict[str, "_Session"] = {}
+        self._sessions_lock = threading.Lock()
+        self._session_ids = itertools.count()
+
+        self._cache_lock = threading.Lock()
+        self._schemas: dict[str, tuple] = {}
+        """
+        Maps the path of each schema file to the modification time and size it was parsed at, and its contents.
+        """
+        self._repos: dict[str, tuple] = {}
+        """
+        Maps the path of each repository to its name and default branch. Only the checked out
+        patchset is parsed again, as the rest is found by querying the remote.
+        """
+
+    def serve_forever(self):
+        if os.path.exists(self._socket_path):
+            # Left behind by a daemon which did not shut down cleanly
+            os.unlink(self._socket_path)
+        self._server = socketserver.ThreadingUnixStreamServer(
+            self._socket_path, _SessionHandler, bind_and_activate=False
+        )
+        # Only the user running the daemon may connect to it, as it reads files and sends messages on behalf of
+        # its clients. The socket takes its mode from the umask when it is bound, so it is never open to others.
+        previous_umask = os.umask(SOCKET_UMASK)
+        try:
+            self._server.server_bind()
+            self._server.server_activate()
+        except OSError:
+            self._server.server_close()
+            raise
+        finally:
+            os.umask(previous_umask)
+        self._server.daemon_threads = True
+        self._server.client_daemon = self
+        self._running = True
+
+        # Spawn a RECEIVE THREAD that routes messages from the server to the sessions
+        receive_thread = threading.Thread(target=self._receive_messages)
+        receive_thread.daemon = True
+        receive_thread.start()
+
+        logger.info("Serving clients on %s", self._socket_path)
+        try:
+            self._server.serve_forever()
+        finally:
+            self._running = False
+            self._server.server_close()
+            os.unlink(self._socket_path)
+
+    def shutdown(self):
+        if self._server:
+            self._server.shutdown()
+
+    # Receive Thread
+    def _receive_messages(self):
+        while self._running:
+            try:
+                message = json.loads(self._connection.get_latest_message(block=True))
+            except queue.Empty:
+                continue
+
+            session_id = message.pop("session_id", None)
+            with self._sessions_lock:
+                if session_id is None:
+                    # Concerns the connection as a whole, so every session
+                    sessions = list(self._sessions.values())
+                else:
+                    sessions = [self._sessions[session_id]] if session_id in self._sessions else []
+            for session in sessions:
+                session.write(message)
+
+            # A session may also be closed by the server on its own, e.g. if it has been evicted
+            if session_id is None and message.get("message_type") == MessageType.WEBSOCKET_CLOSED:
+                logger.error("Lost connection to the server")
+                # serve_forever must not be shut down from its own thread, which this is not
+                self.shutdown()
+                return
+
+    # Session Thread
+    def serve_session(self, rfile, wfile):
+        session = _Session(str(next(self._session_ids)), wfile)
+        with self._sessions_lock:
+            self._sessions[session.session_id] = session
+        logger.info("Opened session %s", session.session_id)
+
+        try:
+            for line in rfile:
+                message = json.loads(line)
+                if "daemon_request" in message:
+                    session.write(self._handle_request(session, message))
+                else:
+                    self._connection.send_message(
+                        {**message, "session_id": session.session_id, "client_id": session.client_id}
+                    )
+        finally:
+            with self._sessions_lock:
+                del self._sessions[session.session_id]
+            logger.info("Closed session %s", session.session_id)
+            if self._running:
+                try:
+                    self._connection.send_message(
+                        {"message_type": MessageType.SESSION_CLOSED, "session_id": session.session_id}
+                    )
+                except ConnectionClosedException as exception:
+                    logger.error("Failed to send message to server: %s", exception)
+
+    def _handle_request(self, session: "_Session", request: dict) -> dict:
+        reply = {"daemon_reply": request["daemon_request"]}
+        try:
+            if request["daemon_request"] == "open_session":
+                session.client_id = request["client_id"]
+            elif request["daemon_request"] == "repo_state":
+                reply["repo_state"] = self.get_repo_state(request["path"])
+            elif request["daemon_request"] == "schema":
+                reply["schema"] = self.load_schema(request["path"])
+            else:
+                reply["error"] = "Unknown request {}".format(request["daemon_request"])
+        except Exception as exception:
+            logger.exception("Failed to handle request %s", request)
+            reply["error"] = str(exception)
+        return reply
+
+    def get_repo_state(self, path: str) -> dict:
+        with self._cache_lock:
+            repo = self._repos.get(path)
+        if repo is None:
+            repo = (RepoStateParser.get_current_repo_name(path), RepoStateParser.get_default_branch(path))
+            with self._cache_lock:
+                self._repos[path] = repo
+        repo_name, default_branch = repo
+        return RepoStateParser.parse_repo_state(path, repo_name, default_branch)
+
+    def load_schema(self, path: str) -> dict:
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._cache_lock:
+            cached_version, schema = self._schemas.get(path, (None, None))
+        if cached_version != version:
+            schema = SchemaLoader.load_schema(path)
+            with self._cache_lock:
+                self._schemas[path] = (version, schema)
+        return schema
+
+
+class _Session:
+    def __init__(self, session_id: str, wfile):
+        self.session_id = session_id
+        self.client_id: str = None
+        self._wfile = wfile
+        self._write_lock = threading.Lock()
+
+    def write(self, message: dict):
+        try:
+            with self._write_lock:
+                self._wfile.write(json.dumps(message).encode("utf-8") + b"\n")
+                self._wfile.flush()
+        except (OSError, ValueError) as exception:
+            # The client has disconnected (or its file has been closed), and the session will be closed
+            logger.warning("Failed to send message to session %s: %s", self.session_id, exception)
+
+
+class _SessionHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.client_daemon.serve_session(self.rfile, self.wfile)
+
+
+class DaemonConnection(BaseConnection):
+    """
+    A connection to the server through the client daemon of this host, in place of a websocket of
+    the client's own. Repo states and schemas are also parsed by the daemon, which keeps them for
+    other clients.
+    """
+
+    def __init__(self, socket_path: str, client_id: str):
+        super().__init__()
+        self._replies = queue.Queue()
+        self._request_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        """
+        Held while a message is written, as messages are sent from several threads and must not interleave.
+        """
+        self._socket = self._init_connection(socket_path)
+        self._file = self._socket.makefile("rwb")
+
+        # Spawn a RECEIVE THREAD that reads messages from the daemon
+        receive_thread = threading.Thread(target=self._receive_messages)
+        receive_thread.daemon = True
+        receive_thread.start()
+
+        self._request("open_session", client_id=client_id)
+
+    def _init_connection(self, socket_path: str) -> socket.socket:
+        logger.info("Connecting to client daemon on %s", socket_path)
+        daemon_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        daemon_socket.connect(socket_path)
+        return daemon_socket
+
+    # Receive Thread
+    def _receive_messages(self):
+        try:
+            for line in self._file:
+                message = json.loads(line)
+                if "daemon_reply" in message:
+                    self._replies.put(message)
+                else:
+                    self._received_messages.put(line.decode("utf-8"))
+        except (OSError, ValueError):
+            # The file is closed under the thread when the connection is closed
+            pass
+        logger.info("### closed ###")
+        self._replies.put({"error": "connection closed"})
+        self._received_messages.put(json.dumps({"message_type": MessageType.WEBSOCKET_CLOSED}))
+
+    def _request(self, request: str, **fields) -> dict:
+        with self._request_lock:
+            self.send_message({"daemon_request": request, **fields})
+            reply = self._replies.get()
+        if "error" in reply:
+            raise Exception("Client daemon failed to handle {} request: {}".format(request, reply["error"]))
+        return reply
+
+    def send_message(self, message: dict):
+        try:
+            with self._send_lock:
+                self._socket.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        except OSError as exception:
+            raise ConnectionClosedException(str(exception)) from exception
+
+    def close_websocket(self):
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            # Already closed, e.g. by the daemon
+            pass
+        self._file.close()
+        self._socket.close()
+
+    def get_repo_state(self) -> dict:
+        return self._request("repo_state", path=os.getcwd())["repo_state"]
+
+    def load_schema(self, path: str) -> dict:
+        return self._request("schema", path=os.path.abspath(path))["schema"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shares one connection to the server between the clients of a host")
+    parser.add_argument("--server_url", help="Address of the server, e.g. localhost:8000", required=True)
+    parser.add_argument("--daemon_id", help="Unique identifier of this daemon, e.g. the host name", required=True)
+    parser.add_argument("--socket_path", help="Unix socket to serve clients on", default=DEFAULT_SOCKET_PATH)
+    args = parser.parse_args()
+
+    with Connection(args.server_url, args.daemon_id) as connection:
+        ClientDaemon(connection, args.socket_path).serve_forever()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -8,3 +8,12 @@ class MessageType(int, enum.Enum):
     SCHEMA_COMPLETE = 4
     ABORT_TASK = 5
     WEBSOCKET_CLOSED = 6
+    SCHEMA_FAILED = 7
+    TASK_PROGRESS = 8
+    ADD_TASKS = 9
+    END_OF_TASKS = 10
+    SUPERSEDE = 11
+    SCHEMA_SUPERSEDED = 12
+    SESSION_CLOSED = 13
+    RETRY_AFTER = 14
+    ARTIFACTS = 15
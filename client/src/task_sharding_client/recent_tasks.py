@@ -0,0 +1,51 @@
+import json
+import logging
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_TASKS_PER_SCHEMA = 50
+
+
+class RecentTasks:
+    """
+    Remembers which tasks of each schema were run on this machine most recently, across runs of
+    the client. They are reported to the server, which prefers to give a client the tasks it has
+    warm local state (e.g. a Bazel output base) for.
+    """
+
+    def __init__(self, path: str, max_tasks_per_schema: int = DEFAULT_MAX_TASKS_PER_SCHEMA):
+        self._path = path
+        self._max_tasks_per_schema = max_tasks_per_schema
+        self._recent_tasks = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self._path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as exception:
+            logger.warning("Ignoring unreadable recent tasks file %s: %s", self._path, exception)
+            return {}
+
+    def get(self, schema_id: str) -> list:
+        """
+        Returns the recently run tasks of a schema, least recent first.
+        """
+        return list(self._recent_tasks.get(schema_id, []))
+
+    def record(self, schema_id: str, task_id: str):
+        tasks = [task for task in self._recent_tasks.get(schema_id, []) if task != task_id]
+        tasks.append(task_id)
+        self._recent_tasks[schema_id] = tasks[-self._max_tasks_per_schema :]
+        self._save()
+
+    def _save(self):
+        # Write to a temporary file first, so that a crash never leaves a partially written file
+        directory = os.path.dirname(os.path.abspath(self._path))
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as file:
+            json.dump(self._recent_tasks, file)
+        os.replace(file.name, self._path)
@@ -4,10 +4,15 @@ import subprocess
 
 class RepoStateParser:
     @staticmethod
-    def parse_repo_state() -> dict:
-        default_branch = RepoStateParser.get_default_branch()
-        repo_name = RepoStateParser.get_current_repo_name()
-        current_patchset = RepoStateParser.get_current_patchset()
+    def parse_repo_state(path: str = None, repo_name: str = None, default_branch: str = None) -> dict:
+        """
+        Parses the state of the repository checked out at `path` (by default the working directory).
+        The repository's name and default branch may be given, e.g. if they have been parsed before,
+        as finding the default branch queries the remote.
+        """
+        default_branch = default_branch or RepoStateParser.get_default_branch(path)
+        repo_name = repo_name or RepoStateParser.get_current_repo_name(path)
+        current_patchset = RepoStateParser.get_current_patchset(path)
 
         return {
             repo_name: {
@@ -17,10 +22,11 @@ class RepoStateParser:
         }
 
     @staticmethod
-    def get_default_branch() -> str:
+    def get_default_branch(path: str = None) -> str:
         proc = subprocess.Popen(
             ["git", "remote", "show", "origin"],
             stdout=subprocess.PIPE,
+            cwd=path,
         )
         output = proc.communicate()[0].decode("utf-8")
         match = re.search("HEAD branch: (.+?)\n", output)
@@ -30,11 +36,11 @@ class RepoStateParser:
         raise Exception("Unable to parse git response")
 
     @staticmethod
-    def get_current_repo_name() -> str:
-        proc = subprocess.Popen(["git", "config", "--get", "remote.origin.url"], stdout=subprocess.PIPE)
+    def get_current_repo_name(path: str = None) -> str:
+        proc = subprocess.Popen(["git", "config", "--get", "remote.origin.url"], stdout=subprocess.PIPE, cwd=path)
         return proc.communicate()[0].decode("utf-8")
 
     @staticmethod
-    def get_current_patchset() -> str:
-        proc = subprocess.Popen(["git", "rev-parse", "--verify", "HEAD"], stdout=subprocess.PIPE)
+    def get_current_patchset(path: str = None) -> str:
+        proc = subprocess.Popen(["git", "rev-parse", "--verify", "HEAD"], stdout=subprocess.PIPE, cwd=path)
         return proc.communicate()[0].decode("utf-8")
@@ -1,8 +1,8 @@
-import yaml
-
-
 class SchemaLoader:
     @staticmethod
     def load_schema(path: str) -> dict:
+        # Imported here, so that clients which are given their schema by a client daemon never import it
+        import yaml
+
         with open(path) as file:
             return yaml.safe_load(file)
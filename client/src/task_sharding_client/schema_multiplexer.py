@@ -0,0 +1,175 @@
+import copy
+import json
+import logging
+import queue
+import threading
+
+from .client import Client
+from .connection import BaseConnection
+from .message_type import MessageType
+from .task_runner import TaskRunner
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaMultiplexer:
+    """
+    Shares one connection to the server between clients running different schemas (e.g. the build
+    and test schemas of one pipeline), so that the server sees a single consumer which has joined
+    an instance of each schema, and can hand it tasks from all of them in turn.
+
+    Messages from the server are routed to the client of the schema they name. Those which do not
+    name one (e.g. the connection closing) are given to every client.
+    """
+
+    def __init__(self, connection: BaseConnection):
+        self._connection = connection
+        self._schema_queues: dict[str, queue.Queue] = {}
+        self._lock = threading.Lock()
+        self._repo_state: dict = None
+
+        # Spawn a RECEIVE THREAD that routes messages from the server to the clients
+        receive_thread = threading.Thread(target=self._receive_messages)
+        receive_thread.daemon = True
+        receive_thread.start()
+
+    def create_connection(self) -> "SchemaConnection":
+        return SchemaConnection(self)
+
+    # Receive Thread
+    def _receive_messages(self):
+        while True:
+            try:
+                message = self._connection.get_latest_message(block=True)
+            except queue.Empty:
+                continue
+            parsed_message = json.loads(message)
+            schema_id = parsed_message.get("schema_id")
+            with self._lock:
+                if schema_id is None:
+                    schema_queues = list(self._schema_queues.values())
+                else:
+                    schema_queues = [self._schema_queues[schema_id]] if schema_id in self._schema_queues else []
+            if not schema_queues:
+                logger.warning("Ignoring message for schema %s, which no client is running", schema_id)
+            for schema_queue in schema_queues:
+                schema_queue.put(message)
+            if parsed_message["message_type"] == MessageType.WEBSOCKET_CLOSED:
+                return
+
+    def attach(self, schema_id: str) -> queue.Queue:
+        """
+        Returns the queue the messages for a schema are routed to, which only one client may run at a time.
+        """
+        with self._lock:
+            if schema_id in self._schema_queues:
+                raise Exception("Schema {} is already being run over this connection".format(schema_id))
+            self._schema_queues[schema_id] = queue.Queue()
+            return self._schema_queues[schema_id]
+
+    def detach(self, schema_id: str):
+        with self._lock:
+            self._schema_queues.pop(schema_id, None)
+
+    def send_message(self, message: dict):
+        self._connection.send_message(message)
+
+    def get_repo_state(self) -> dict:
+        """
+        Returns the repo state of the checkout every client runs in, which is only parsed once.
+        """
+        with self._lock:
+            if self._repo_state is None:
+                self._repo_state = self._connection.get_repo_state()
+            return self._repo_state
+
+    def load_schema(self, path: str) -> dict:
+        return self._connection.load_schema(path)
+
+
+class SchemaConnection(BaseConnection):
+    """
+    The connection of one client of a `SchemaMultiplexer`, which receives the messages for the
+    schema it has sent an INIT message for.
+    """
+
+    def __init__(self, multiplexer: SchemaMultiplexer):
+        super().__init__()
+        self._multiplexer = multiplexer
+        self._schema_id: str = None
+
+    def send_message(self, message: dict):
+        if message["message_type"] == MessageType.INIT and self._schema_id is None:
+            # Attached before the message is sent, so that no reply to it can be missed
+            self._schema_id = message["schema_id"]
+            self._received_messages = self._multiplexer.attach(self._schema_id)
+        self._multiplexer.send_message(message)
+
+    def close_websocket(self):
+        # The connection itself is closed by its owner, once every client has finished
+        if self._schema_id is not None:
+            self._multiplexer.detach(self._schema_id)
+
+    def get_repo_state(self) -> dict:
+        return self._multiplexer.get_repo_state()
+
+    def load_schema(self, path: str) -> dict:
+        return self._multiplexer.load_schema(path)
+
+
+class SharedObjectManager:
+    """
+    Starts a single process for the task runners of several clients, once the first of them has a
+    task to run.
+    """
+
+    def __init__(self, task_runner_type: TaskRunner):
+        self._task_runner_type = task_runner_type
+        self._object_manager = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._object_manager is None:
+                # Imported here, as most of the client's work before its first task does not need it
+                from multiprocessing.managers import BaseManager
+
+                BaseManager.register("TaskRunner", self._task_runner_type)
+                self._object_manager = BaseManager()
+                self._object_manager.start()
+            return self._object_manager
+
+
+def run_schemas(
+    config, schema_paths: list, connection: BaseConnection, task_runner_type: TaskRunner, **client_kwargs
+) -> int:
+    """
+    Runs a client for each of `schema_paths` over the one connection, each on a CLIENT THREAD, and
+    returns the worst of their return codes. `config` is copied for each client, with its schema path.
+    """
+    multiplexer = SchemaMultiplexer(connection)
+    object_manager = SharedObjectManager(task_runner_type)
+    return_codes = []
+
+    def run_client(schema_path: str):
+        schema_config = copy.copy(config)
+        schema_config.schema_path = schema_path
+        try:
+            client = Client(
+                schema_config,
+                multiplexer.create_connection(),
+                task_runner_type,
+                object_manager=object_manager,
+                **client_kwargs,
+            )
+            return_codes.append(client.run())
+        except Exception:
+            logger.exception("Failed to run schema %s", schema_path)
+            return_codes.append(1)
+
+    client_threads = [threading.Thread(target=run_client, args=(schema_path,)) for schema_path in schema_paths]
+    for client_thread in client_threads:
+        client_thread.start()
+    for client_thread in client_threads:
+        client_thread.join()
+    return max(return_codes)
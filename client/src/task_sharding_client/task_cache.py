@@ -0,0 +1,185 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024
+RESULT_FILE = "result.json"
+OUTPUTS_DIRECTORY = "outputs"
+
+
+class TaskCache:
+    """
+    Remembers which tasks have passed on this machine, and the files they produced, so that a task
+    whose inputs are unchanged since it last passed here is not run again. Each entry is stored in a
+    directory named by a hash of the task's inputs (see `get_key`): its definition in the schema, the
+    shard of it and the patchsets of the repo state.
+
+    The outputs of a task are stored by their paths relative to `root`, the directory tasks are run in
+    (the working directory by default). Entries are kept under `max_size` bytes in total, evicting the
+    least recently used first. How recently an entry was used is kept as the modification time of its
+    result file, so that it survives across runs of the client.
+    """
+
+    def __init__(self, path: str, max_size: int = DEFAULT_MAX_SIZE, root: str = None):
+        self._path = path
+        self._max_size = max_size
+        self._root = os.path.abspath(root or os.getcwd())
+        self._lock = threading.Lock()
+        os.makedirs(self._path, exist_ok=True)
+        self._entries: collections.OrderedDict[str, int] = self._load()
+        """
+        Maps the key of each entry, least recently used first, to its size in bytes.
+        """
+        self._total_size = sum(self._entries.values())
+
+    def _load(self) -> collections.OrderedDict:
+        entries = []
+        for key in os.listdir(self._path):
+            if key.startswith(".staging-"):
+                # Left behind by a client which stopped while storing an entry
+                shutil.rmtree(os.path.join(self._path, key), ignore_errors=True)
+                continue
+            result_path = os.path.join(self._path, key, RESULT_FILE)
+            try:
+                entries.append((os.path.getmtime(result_path), key, self._get_size(os.path.join(self._path, key))))
+            except OSError:
+                shutil.rmtree(os.path.join(self._path, key), ignore_errors=True)
+        return collections.OrderedDict((key, size) for _, key, size in sorted(entries))
+
+    @staticmethod
+    def get_key(schema_id: str, task, repo_state: dict, shard_index: int = None, total_shards: int = None) -> str:
+        """
+        Returns the key of a task's entry. Only the patchsets of the repo state are part of it, as the
+        branch they are on does not change what is built from them.
+        """
+        patchsets = {
+            repo_name: [repo["patchset"], sorted(repo.get("additional_patchsets", ()))]
+            for repo_name, repo in (repo_state or {}).items()
+        }
+        inputs = {
+            "schema_id": schema_id,
+            "task": task,
+            "repo_state": patchsets,
+            "shard": [shard_index, total_shards] if total_shards else None,
+        }
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> dict:
+        """
+        Returns the result stored for a key, and marks its entry as the most recently used, or None
+        if there is no entry for it.
+        """
+        with self._lock:
+            if key not in self._entries:
+                return None
+            result_path = os.path.join(self._path, key, RESULT_FILE)
+            try:
+                with open(result_path) as file:
+                    result = json.load(file)
+                os.utime(result_path)
+            except (OSError, ValueError) as exception:
+                logger.warning("Evicting unreadable task cache entry %s: %s", key, exception)
+                self._evict(key)
+                return None
+            self._entries.move_to_end(key)
+            return result
+
+    def get_outputs_path(self, key: str) -> str:
+        """
+        Returns the directory holding the outputs of an entry, by their paths relative to the directory
+        the task was run in.
+        """
+        return os.path.join(self._path, key, OUTPUTS_DIRECTORY)
+
+    def get_output_sizes(self, key: str) -> dict:
+        """
+        Returns the size of each output of an entry, by its path relative to the directory the task was run in.
+        """
+        outputs_path = self.get_outputs_path(key)
+        return {
+            os.path.relpath(os.path.join(directory, name), outputs_path): os.path.getsize(os.path.join(directory, name))
+            for directory, _, files in os.walk(outputs_path)
+            for name in files
+        }
+
+    def put(self, key: str, result: dict, outputs=(), root: str = None) -> bool:
+        """
+        Stores the result of a task, along with copies of the files it produced. `outputs` are stored by
+        their paths relative to `root` (the cache's own by default), which they must be under.
+        Returns whether the entry was stored, which it is not if it is larger than the whole cache.
+        """
+        root = os.path.abspath(root or self._root)
+        staging_path = tempfile.mkdtemp(prefix=".staging-", dir=self._path)
+        try:
+            for output in outputs:
+                relative_path = os.path.relpath(os.path.abspath(output), root)
+                if relative_path == os.pardir or relative_path.startswith(os.pardir + os.sep):
+                    raise ValueError("Task output {} is not under {}".format(output, root))
+                output_path = os.path.join(staging_path, OUTPUTS_DIRECTORY, relative_path)
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                shutil.copy2(output, output_path)
+            with open(os.path.join(staging_path, RESULT_FILE), "w") as file:
+                json.dump({**result, "stored_at": time.time()}, file)
+            size = self._get_size(staging_path)
+            if size > self._max_size:
+                logger.info("Not caching task %s, as its outputs are larger than the task cache", key)
+                return False
+
+            with self._lock:
+                if key in self._entries:
+                    self._evict(key)
+                # Renamed into place, so that an entry is never seen partially written
+                os.replace(staging_path, os.path.join(self._path, key))
+                self._entries[key] = size
+                self._total_size += size
+                while self._total_size > self._max_size:
+                    self._evict(next(iter(self._entries)))
+            return True
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+
+    def restore_outputs(self, key: str, root: str = None) -> list:
+        """
+        Copies the outputs of an entry back to their paths under `root` (the cache's own by default),
+        and returns the paths.
+        """
+        root = os.path.abspath(root or self._root)
+        outputs_path = self.get_outputs_path(key)
+        restored = []
+        # Held so that the entry is not evicted while it is copied
+        with self._lock:
+            for directory, _, files in os.walk(outputs_path):
+                for name in files:
+                    relative_path = os.path.relpath(os.path.join(directory, name), outputs_path)
+                    output = os.path.join(root, relative_path)
+                    os.makedirs(os.path.dirname(output), exist_ok=True)
+                    shutil.copy2(os.path.join(directory, name), output)
+                    restored.append(output)
+        return restored
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get_total_size(self) -> int:
+        return self._total_size
+
+    def _evict(self, key: str):
+        """
+        Must be called with `_lock` held.
+        """
+        self._total_size -= self._entries.pop(key)
+        shutil.rmtree(os.path.join(self._path, key), ignore_errors=True)
+
+    @staticmethod
+    def _get_size(path: str) -> int:
+        return sum(
+            os.path.getsize(os.path.join(directory, name)) for directory, _, files in os.walk(path) for name in files
+        )
@@ -2,6 +2,9 @@ class TaskRunner:
     def __init__(self, schema: dict, config: any):
         self._config = config
         self._schema = schema
+        self._progress: float = None
+        self._shard_index: int = None
+        self._total_shards: int = None
 
     def __enter__(self):
         return self
@@ -12,5 +15,54 @@ class TaskRunner:
     def run(self, task_id: str) -> int:
         raise NotImplementedError()
 
+    def run_batch(self, task_ids: list) -> dict:
+        """
+        Runs several tasks the server has handed out at once, and returns the return code of each,
+        keyed by task ID. They are run one after another, unless the runner can run them together.
+        """
+        return {task_id: self.run(task_id) for task_id in task_ids}
+
     def abort(self):
         raise NotImplementedError()
+
+    def report_progress(self, progress: float):
+        """
+        Called from `run` to report how far through the task it is, from 0 to 1. The client
+        periodically sends the latest progress to the server.
+        """
+        self._progress = progress
+
+    def get_progress(self) -> float:
+        return self._progress
+
+    def get_task_stats(self, task_id: str) -> dict:
+        """
+        Returns statistics about the last run of a task (e.g. its cache hit ratio) to be sent to the
+        server with its result, or None if the runner does not collect any.
+        """
+        return None
+
+    def get_task_outputs(self, task_id: str) -> list:
+        """
+        Returns the files produced by the last run of a task, which are kept in the client's task cache
+        along with its result and restored if the task is found there, or an empty list if the task
+        produces no files of interest.
+        """
+        return []
+
+    def set_shard(self, shard_index: int, total_shards: int):
+        """
+        Called before `run` when the server has split the task into shards, of which only
+        `shard_index` (counting from 0) is to be run.
+        """
+        self._shard_index = shard_index
+        self._total_shards = total_shards
+
+    def get_shard_env(self) -> dict:
+        """
+        Returns the environment variables that tell a test which shard to run, as Bazel sets
+        them for its own test sharding, or an empty dict if the task is not sharded.
+        """
+        if self._total_shards is None:
+            return {}
+        return {"TEST_SHARD_INDEX": str(self._shard_index), "TEST_TOTAL_SHARDS": str(self._total_shards)}
@@ -0,0 +1,45 @@
+"""
+Stands in for `bazel test` in the tests. It writes a build event file in which targets whose name
+contains "fail" fail their test, targets whose name contains "broken" fail to build, and every
+other target passes in 0.25 seconds.
+
+As `bazel query`, it prints every target in an expression of targets joined by "+".
+"""
+
+import json
+import sys
+
+if sys.argv[1] == "query":
+    for target in sys.argv[sys.argv.index("--") + 1].split("+"):
+        print(target.strip())
+    sys.exit(0)
+
+build_event_json_file = next(arg.split("=", 1)[1] for arg in sys.argv if arg.startswith("--build_event_json_file="))
+targets = sys.argv[sys.argv.index("--") + 1 :]
+
+sys.stderr.write("[1 / 4] Compiling\n[4 / 4] Testing\n")
+
+with open(build_event_json_file, "w") as file:
+    for target in targets:
+        label = "@@" + target
+        built = "broken" not in target
+        file.write(json.dumps({"id": {"targetCompleted": {"label": label}}, "completed": {"success": built}}) + "\n")
+        if built:
+            test_summary = {"overallStatus": "FAILED" if "fail" in target else "PASSED", "totalRunDuration": "0.250s"}
+            file.write(json.dumps({"id": {"testSummary": {"label": label}}, "testSummary": test_summary}) + "\n")
+
+    build_metrics = {
+        "actionSummary": {
+            "actionsCreated": "10",
+            "actionsExecuted": "4",
+            "runnerCount": [
+                {"name": "total", "count": 4},
+                {"name": "remote cache hit", "count": 3},
+                {"name": "linux-sandbox", "count": 1},
+            ],
+        },
+        "timingMetrics": {"wallTimeInMs": "2000", "criticalPathTime": "1.500s"},
+    }
+    file.write(json.dumps({"id": {"buildMetrics": {}}, "buildMetrics": build_metrics}) + "\n")
+
+sys.exit(3 if any("fail" in target or "broken" in target for target in targets) else 0)
@@ -1,12 +1,26 @@
 import json
 import logging
+import os
 import queue
+import sys
+import tempfile
 import threading
+import time
 import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
 
+from src.task_sharding_client.artifacts import ArtifactServer, fetch_artifacts
+from src.task_sharding_client.bazel_runner import BazelRunner, parse_build_event_json_file
 from src.task_sharding_client.client import Client
 from src.task_sharding_client.connection import Connection
+from src.task_sharding_client.daemon import ClientDaemon, DaemonConnection
 from src.task_sharding_client.message_type import MessageType
+from src.task_sharding_client.recent_tasks import RecentTasks
+from src.task_sharding_client.schema_loader import SchemaLoader
+from src.task_sharding_client.schema_multiplexer import run_schemas
+from src.task_sharding_client.task_cache import TaskCache
 from src.task_sharding_client.task_runner import TaskRunner
 
 logger = logging.getLogger(__name__)
@@ -47,6 +61,43 @@ class MockFailedTaskRunner(TaskRunner):
         pass
 
 
+class MockSuccessfulTaskRunnerWithStats(MockSuccessfulTaskRunner):
+    def get_task_stats(self, task_id: str) -> dict:
+        return {"cache_hit_ratio": 0.5}
+
+
+class MockShardEnvReportingTaskRunner(MockSuccessfulTaskRunner):
+    def get_task_stats(self, task_id: str) -> dict:
+        return self.get_shard_env()
+
+
+class MockSchemaTaskReportingTaskRunner(MockSuccessfulTaskRunner):
+    def get_task_stats(self, task_id: str) -> dict:
+        return self._schema["tasks"][int(task_id)]
+
+
+class MockBatchRunningTaskRunner(MockSuccessfulTaskRunner):
+    def run(self, task_id: str) -> int:
+        raise AssertionError("Expected task {} to be run in a batch".format(task_id))
+
+    def run_batch(self, task_ids: list) -> dict:
+        self._batch_size = len(task_ids)
+        return {task_id: 1 if task_id == "2" else 0 for task_id in task_ids}
+
+    def get_task_stats(self, task_id: str) -> dict:
+        return {"batch_size": self._batch_size}
+
+
+class MockTaskRunnerReportingProgress(TaskRunner):
+    def run(self, task_id: str) -> int:
+        self.report_progress(0.5)
+        time.sleep(0.1)
+        return 0
+
+    def abort(self):
+        pass
+
+
 class MockRunUntilAbortedRunner(TaskRunner):
     def __init__(self, schema: dict, config: any):
         super().__init__(schema, config)
@@ -61,6 +112,20 @@ class MockRunUntilAbortedRunner(TaskRunner):
         self._run_loop = False
 
 
+class MockOutputProducingTaskRunner(MockSuccessfulTaskRunner):
+    def run(self, task_id: str) -> int:
+        os.makedirs(os.path.dirname(self._get_output_path(task_id)), exist_ok=True)
+        with open(self._get_output_path(task_id), "w") as file:
+            file.write("Output of task {}\n".format(task_id) * 100)
+        return 0
+
+    def get_task_outputs(self, task_id: str) -> list:
+        return [self._get_output_path(task_id)]
+
+    def _get_output_path(self, task_id: str) -> str:
+        return os.path.join(self._config.workspace_path, "out", "{}.txt".format(task_id))
+
+
 class MockConfiguration:
     def __init__(self, client_id, cache_id, schema_path):
         self.client_id = client_id
@@ -142,13 +207,16 @@ class TestClient(unittest.TestCase):
                 task_complete_msg,
             )
 
-    def test__when_a_client_connects_to_the_server__and_the_build_task_fails__expect_client_to_disconnect(self):
+    def test__when_a_client_connects_to_the_server__and_the_build_task_fails__expect_client_to_disconnect_when_the_schema_fails(
+        self,
+    ):
         """
         GIVEN a client connected to the server with a designated schema.
         WHEN the client receives build instructions,
-          AND subsequently fails to complete those build instructions.
+          AND subsequently fails to complete those build instructions,
+          AND the server then sends a schema failed message.
         EXPECT client to send a failed task complete message
-          AND disconnect.
+          AND disconnect with a non-zero return code.
         """
         repo_state = {
             "org/repo_1": {
@@ -159,7 +227,8 @@ class TestClient(unittest.TestCase):
         config = MockConfiguration("1", "1", "./client/test/data/test_schema.yaml")
         with MockConnection("localhost:8000", "1") as connection:
             client = Client(config, connection, MockFailedTaskRunner, False, repo_state)
-            client_thread = threading.Thread(target=client.run)
+            return_codes = []
+            client_thread = threading.Thread(target=lambda: return_codes.append(client.run()))
             client_thread.start()
 
             # Get init_message sent from client (BLOCKING)
@@ -179,8 +248,23 @@ class TestClient(unittest.TestCase):
             # Get task_complete message from client (BLOCKING)
             task_complete_msg = connection.get_sent_msg()
 
+            # The client waits for the server to decide what happens after a failure
+            self.assertTrue(client_thread.is_alive())
+
+            # Mock schema failed message from server
+            connection._received_messages.put(
+                json.dumps(
+                    {
+                        "message_type": MessageType.SCHEMA_FAILED,
+                        "schema_id": "mock_schema",
+                        "task_id": "0",
+                    }
+                )
+            )
+
             # Join the client thread (Assert that the client's infinite message receiving loop ends)
             client_thread.join()
+            self.assertEqual([1], return_codes)
 
             self.assertDictEqual(
                 {
@@ -264,3 +348,881 @@ class TestClient(unittest.TestCase):
                 },
                 init_msg,
             )
+
+    def test__when_the_task_runner_collects_task_stats__expect_them_sent_with_the_task_result(self):
+        """
+        GIVEN a client connected to the server with a task runner which collects task stats.
+        WHEN the client receives build instructions and completes them.
+        EXPECT the task complete message to include the task stats.
+        """
+        repo_state = {"org/repo_1": {"base_ref": "main", "patchset": "5bfb44678a27f9bc3b6a96ced8d0b464d7ea9b71"}}
+        config = MockConfiguration("1", "1", "./client/test/data/test_schema.yaml")
+        with MockConnection("localhost:8000", "1") as connection:
+            client = Client(config, connection, MockSuccessfulTaskRunnerWithStats, False, repo_state)
+            client_thread = threading.Thread(target=client.run)
+            client_thread.start()
+
+            connection.get_sent_msg()
+            connection._received_messages.put(
+                json.dumps({"message_type": MessageType.BUILD_INSTRUCTION, "schema_id": "mock_schema", "task_id": "0"})
+            )
+            task_complete_msg = connection.get_sent_msg()
+            connection._received_messages.put(
+                json.dumps({"message_type": MessageType.SCHEMA_COMPLETE, "schema_id": "mock_schema"})
+            )
+            client_thread.join()
+
+            self.assertEqual({"cache_hit_ratio": 0.5}, task_complete_msg["task_stats"])
+
+    def test__when_the_server_hands_out_a_batch_of_tasks__expect_them_run_together_and_reported_in_one_message(self):
+        """
+        GIVEN a client connected to the server which runs up to three tasks at a time.
+        WHEN the client receives build instructions for task 0, with tasks 1 and 2 batched with it,
+          AND task 2 fails.
+        EXPECT the INIT message to declare the batch size,
+          AND the tasks to be run in one batch,
+          AND one task complete message with the result of task 0, and those of tasks 1 and 2 in its batch.
+        """
+        repo_state = {"org/repo_1": {"base_ref": "main", "patchset": "5bfb44678a27f9bc3b6a96ced8d0b464d7ea9b71"}}
+        config = MockConfiguration("1", "1", "./client/test/data/test_schema.yaml")
+        with MockConnection("localhost:8000", "1") as connection:
+            client = Client(config, connection, MockBatchRunningTaskRunner, False, repo_state, max_batch_size=3)
+            client_thread = threading.Thread(target=client.run)
+            client_thread.start()
+
+            init_msg = connection.get_sent_msg()
+            connection._received_messages.put(
+                json.dumps(
+                    {
+                        "message_type": MessageType.BUILD_INSTRUCTION,
+                        "schema_id": "mock_schema",
+                        "task_id": "0",
+                        "batch": [{"task_id": "1"}, {"task_id": "2"}],
+                    }
+                )
+            )
+            task_complete_msg = connection.get_sent_msg()
+            connection._received_messages.put(
+                json.dumps({"message_type": MessageType.SCHEMA_COMPLETE, "schema_id": "mock_schema"})
+            )
+            client_thread.join()
+
+            self.assertEqual(3, init_msg["max_batch_size"])
+            self.assertEqual(
+                {
+                    "message_type": MessageType.TASK_COMPLETE,
+                    "schema_id": "mock_schema",
+                    "task_id": "0",
+                    "task_success": True,
+                    "task_stats": {"batch_size": 3},
+                    "batch": [
+                        {"task_id": "1", "task_success": True, "task_stats": {"batch_size": 3}},
+                        {"task_id": "2", "task_success": False, "task_stats": {"batch_size": 3}},
+                    ],
+                },
+                task_complete_msg,
+            )
+
+    def test__when_the_task_runner_reports_progress__expect_progress_sent_to_the_server(self):
+        """
+        GIVEN a client connected to the server which sends progress every 10ms.
+        WHEN the client runs a task which reports being half way through.
+        EXPECT a single progress message for the task before the task complete message.
+        """
+        repo_state = {"org/repo_1": {"base_ref": "main", "patchset": "5bfb44678a27f9bc3b6a96ced8d0b464d7ea9b71"}}
+        config = MockConfiguration("1", "1", "./client/test/data/test_schema.yaml")
+        with MockConnection("localhost:8000", "1") as connection:
+            client = Client(
+                config, connection, MockTaskRunnerReportingProgress, False, repo_state, progress_interval=0.01
+            )
+            client_thread = threading.Thread(target=client.run)
+            client_thread.start()
+
+            connection.get_sent_msg()
+            connection._received_messages.put(
+                json.dumps({"message_type": MessageType.BUILD_INSTRUCTION, "schema_id": "mock_schema", "task_id": "0"})
+            )
+            progress_msg = connection.get_sent_msg()
+            task_complete_msg = connection.get_sent_msg()
+            connection._received_messages.put(
+                json.dumps({"message_type": MessageType.SCHEMA_COMPLETE, "schema_id": "mock_schema"})
+            )
+            client_thread.join()
+
+            self.assertDictEqual(
+                {
+                    "message_type": MessageType.TASK_PROGRESS,
+                    "schema_id": "mock_schema",
+                    "task_id": "0",
+                    "progress": 0.5,
+                },
+                progress_msg,
+            )
+            self.assertEqual(MessageType.TASK_COMPLETE, task_complete_msg["message_type"])
+
+    def test__when_the_schema_has_shardable_tasks__expect_them_declared_and_shards_run_with_the_shard_env(self):
+        """
+        GIVEN a client connected to the server with a schema where task 1 has 4 shards and task 2 is auto-sharded.
+        WHEN the client receives build instructions for shard 2 of task 1 and completes them.
+        EXPECT the INIT message to declare both shardable tasks,
+          AND the task runner to be given TEST_SHARD_INDEX and TEST_TOTAL_SHARDS,
+          AND the task complete message to identify the shard.
+        """
+        repo_state = {"org/repo_1": {"base_ref": "main", "patchset": "5bfb44678a27f9bc3b6a96ced8d0b464d7ea9b71"}}
+        config = MockConfiguration("1", "1", "./client/test/data/test_sharded_schema.yaml")
+        with MockConnection("localhost:8000", "1") as connection:
+            client = Client(config, connection, MockShardEnvReportingTaskRunner, False, repo_state)
+            client_thread = threading.Thread(target=client.run)
+            client_thread.start()
+
+            init_msg = connection.get_sent_msg()
+            connection._received_messages.put(
+                json.dumps(
+                    {
+                        "message_type": MessageType.BUILD_INSTRUCTION,
+                        "schema_id": "mock_sharded_schema",
+                        "task_id": "1",
+                        "shard_index": 2,
+                        "total_shards": 4,
+                    }
+                )
+            )
+            task_complete_msg = connection.get_sent_msg()
+            connection._received_messages.put(
+                json.dumps({"message_type": MessageType.SCHEMA_COMPLETE, "schema_id": "mock_sharded_schema"})
+            )
+            client_thread.join()
+
+            self.assertEqual({"1": 4, "2": 0}, init_msg["shardable_tasks"])
+            self.assertDictEqual(
+                {
+                    "message_type": MessageType.TASK_COMPLETE,
+                    "schema_id": "mock_sharded_schema",
+                    "task_id": "1",
+                    "shard_index": 2,
+                    "total_shards": 4,
+                    "task_success": True,
+                    "task_stats": {"TEST_SHARD_INDEX": "2", "TEST_TOTAL_SHARDS": "4"},
+                },
+                task_complete_msg,
+            )
+
+    def test__when_the_client_streams_tasks__expect_them_sent_in_batches_and_given_to_the_task_runner(self):
+        """
+        GIVEN a client connected to the server which streams three tasks in batches of two.
+        WHEN every task has been streamed,
+          AND the client receives build instructions for a streamed task it did not enumerate itself.
+        EXPECT an INIT message marked as streaming, two add tasks messages and an end of tasks message,
+          AND the task runner to be given the task from the build instructions.
+        """
+        repo_state = {"org/repo_1": {"base_ref": "main", "patchset": "5bfb44678a27f9bc3b6a96ced8d0b464d7ea9b71"}}
+        config = MockConfiguration("1", "1", "./client/test/data/test_schema.yaml")
+        task_stream = ({"task": task} for task in (5, 6, 7))
+        with MockConnection("localhost:8000", "1") as connection:
+            client = Client(
+                config,
+                connection,
+                MockSchemaTaskReportingTaskRunner,
+                False,
+                repo_state,
+                task_stream=task_stream,
+                stream_batch_size=2,
+            )
+            client_thread = threading.Thread(target=client.run)
+            client_thread.start()
+
+            init_msg = connection.get_sent_msg()
+            stream_msgs = [connection.get_sent_msg() for _ in range(3)]
+            connection._received_messages.put(
+                json.dumps(
+                    {
+                        "message_type": MessageType.BUILD_INSTRUCTION,
+                        "schema_id": "mock_schema",
+                        "task_id": "8",
+                        "task": {"task": 8},
+                    }
+                )
+            )
+            task_complete_msg = connection.get_sent_msg()
+            connection._received_messages.put(
+                json.dumps({"message_type": MessageType.SCHEMA_COMPLETE, "schema_id": "mock_schema"})
+            )
+            client_thread.join()
+
+            self.assertTrue(init_msg["streaming"])
+            self.assertEqual(4, init_msg["total_tasks"])
+            self.assertEqual(
+                [
+                    {
+                        "message_type": MessageType.ADD_TASKS,
+                        "schema_id": "mock_schema",
+                        "first_task_id": 4,
+                        "tasks": [{"task": 5}, {"task": 6}],
+                    },
+                    {
+                        "message_type": MessageType.ADD_TASKS,
+                        "schema_id": "mock_schema",
+                        "first_task_id": 6,
+                        "tasks": [{"task": 7}],
+                    },
+                    {"message_type": MessageType.END_OF_TASKS, "schema_id": "mock_schema"},
+                ],
+                stream_msgs,
+            )
+            self.assertEqual({"task": 8}, task_complete_msg["task_stats"])
+
+    def test__when_a_client_starts__expect_its_task_runner_process_started_only_for_its_first_task(self):
+        """
+        GIVEN a client connected to the server with a designated schema.
+        WHEN the client sends its INIT message,
+          AND then receives a build instruction.
+        EXPECT no process to have been started for its task runners before the build instruction,
+          AND one to have been started for it.
+        """
+        repo_state = {"org/repo_1": {"base_ref": "main", "patchset": "5bfb44678a27f9bc3b6a96ced8d0b464d7ea9b71"}}
+        config = MockConfiguration("1", "1", "./client/test/data/test_schema.yaml")
+        with MockConnection("localhost:8000", "1") as connection:
+            client = Client(config, connection, MockSuccessfulTaskRunner, False, repo_state)
+            client_thread = threading.Thread(target=client.run)
+            client_thread.start()
+
+            connection.get_sent_msg()
+            object_manager_before_task = client._object_manager
+            connection._received_messages.put(
+                json.dumps({"message_type": MessageType.BUILD_INSTRUCTION, "schema_id": "mock_schema", "task_id": "0"})
+            )
+            connection.get_sent_msg()
+            connection._received_messages.put(
+                json.dumps({"message_type": MessageType.SCHEMA_COMPLETE, "schema_id": "mock_schema"})
+            )
+            client_thread.join()
+
+            self.assertIsNone(object_manager_before_task)
+            self.assertIsNotNone(client._object_manager)
+
+    def test__when_the_client_supersedes_a_repo_state_and_is_then_superseded__expect_its_task_aborted(self):
+        """
+        GIVEN a client which supersedes another patchset of its repository.
+        WHEN the client starts a task which runs until aborted,
+          AND then receives a schema superseded message.
+        EXPECT a supersede message to be sent before the INIT message,
+          AND the task to be aborted and the client to finish with a failure.
+        """
+        repo_state = {"org/repo_1": {"base_ref": "main", "patchset": "5bfb44678a27f9bc3b6a96ced8d0b464d7ea9b71"}}
+        supersedes = {"org/repo_1": {"patchset": "0123456789abcdef0123456789abcdef01234567"}}
+        config = MockConfiguration("1", "1", "./client/test/data/test_schema.yaml")
+        with MockConnection("localhost:8000", "1") as connection:
+            client = Client(config, connection, MockRunUntilAbortedRunner, False, repo_state, supersedes=supersedes)
+            return_codes = []
+            client_thread = threading.Thread(target=lambda: return_codes.append(client.run()))
+            client_thread.start()
+
+            supersede_msg = connection.get_sent_msg()
+            init_msg = connection.get_sent_msg()
+            connection._received_messages.put(
+                json.dumps({"message_type": MessageType.BUILD_INSTRUCTION, "schema_id": "mock_schema", "task_id": "0"})
+            )
+            connection._received_messages.put(
+                json.dumps({"message_type": MessageType.SCHEMA_SUPERSEDED, "schema_id": "mock_schema"})
+            )
+            client_thread.join()
+
+            self.assertDictEqual({"message_type": MessageType.SUPERSEDE, "repo_state": supersedes}, supersede_msg)
+            self.assertEqual(MessageType.INIT, init_msg["message_type"])
+            self.assertEqual([1], return_codes)
+
+    def test__when_the_server_is_too_busy_for_the_init_message__expect_it_resent_with_the_streamed_tasks(self):
+        """
+        GIVEN a client connected to the server which streams a single task.
+        WHEN the task has been streamed,
+          AND the client is told to retry its INIT message after a short while.
+        EXPECT the INIT message to be sent again, followed by the streamed task and the end of tasks.
+        """
+        repo_state = {"org/repo_1": {"base_ref": "main", "patchset": "5bfb44678a27f9bc3b6a96ced8d0b464d7ea9b71"}}
+        config = MockConfiguration("1", "1", "./client/test/data/test_schema.yaml")
+        with MockConnection("localhost:8000", "1") as connection:
+            client = Client(config, connection, MockSuccessfulTaskRunner, False, repo_state, task_stream=[{"task": 5}])
+            client_thread = threading.Thread(target=client.run)
+            client_thread.start()
+
+            init_msg = connection.get_sent_msg()
+            stream_msgs = [connection.get_sent_msg() for _ in range(2)]
+            connection._received_messages.put(
+                json.dumps({"message_type": MessageType.RETRY_AFTER, "retry_after": 0.01})
+            )
+            resent_msgs = [connection.get_sent_msg() for _ in range(3)]
+            connection._received_messages.put(
+                json.dumps({"message_type": MessageType.SCHEMA_COMPLETE, "schema_id": "mock_schema"})
+            )
+            client_thread.join()
+
+            self.assertEqual([init_msg, *stream_msgs], resent_msgs)
+
+    def test__when_the_schema_has_task_requirements__expect_them_declared_with_the_clients_capabilities(self):
+        """
+        GIVEN a client with capabilities, and a schema of which one task requires a label and an amount of memory.
+        WHEN the client sends its INIT message.
+        EXPECT the message to declare the requirements of the task and the capabilities of the client.
+        """
+        repo_state = {"org/repo_1": {"base_ref": "main", "patchset": "5bfb44678a27f9bc3b6a96ced8d0b464d7ea9b71"}}
+        capabilities = {"labels": ["large-memory"], "resources": {"memory_gb": 128.0}}
+        config = MockConfiguration("1", "1", "./client/test/data/test_schema_with_requirements.yaml")
+        with MockConnection("localhost:8000", "1") as connection:
+            client = Client(config, connection, MockSuccessfulTaskRunner, False, repo_state, capabilities=capabilities)
+            client_thread = threading.Thread(target=client.run)
+            client_thread.start()
+
+            init_msg = connection.get_sent_msg()
+            connection._received_messages.put(
+                json.dumps({"message_type": MessageType.SCHEMA_COMPLETE, "schema_id": "mock_schema_with_requirements"})
+            )
+            client_thread.join()
+
+            self.assertEqual(
+                {"1": {"labels": ["large-memory"], "resources": {"memory_gb": 64}}}, init_msg["task_requirements"]
+            )
+            self.assertEqual(capabilities, init_msg["capabilities"])
+
+    def test__when_a_task_has_passed_with_the_same_inputs__expect_it_reported_from_the_task_cache_without_running(
+        self,
+    ):
+        """
+        GIVEN a task cache shared by two clients, the first of which runs task 0 successfully.
+        WHEN the second client, whose task runner would fail, is given task 0 with the same repo state.
+        EXPECT the second client to report task 0 as passed from the cache, without running it.
+        """
+        repo_state = {"org/repo_1": {"base_ref": "main", "patchset": "5bfb44678a27f9bc3b6a96ced8d0b464d7ea9b71"}}
+        config = MockConfiguration("1", "1", "./client/test/data/test_schema.yaml")
+        with tempfile.TemporaryDirectory() as directory:
+            task_cache = TaskCache(directory)
+            task_complete_msgs = []
+            for task_runner_type in (MockSuccessfulTaskRunner, MockFailedTaskRunner):
+                with MockConnection("localhost:8000", "1") as connection:
+                    client = Client(config, connection, task_runner_type, False, repo_state, task_cache=task_cache)
+                    client_thread = threading.Thread(target=client.run)
+                    client_thread.start()
+
+                    connection.get_sent_msg()
+                    connection._received_messages.put(
+                        json.dumps(
+                            {"message_type": MessageType.BUILD_INSTRUCTION, "schema_id": "mock_schema", "task_id": "0"}
+                        )
+                    )
+                    task_complete_msgs.append(connection.get_sent_msg())
+                    connection._received_messages.put(
+                        json.dumps({"message_type": MessageType.SCHEMA_COMPLETE, "schema_id": "mock_schema"})
+                    )
+                    client_thread.join()
+
+            self.assertNotIn("cached", task_complete_msgs[0])
+            self.assertEqual(
+                {
+                    "message_type": MessageType.TASK_COMPLETE,
+                    "schema_id": "mock_schema",
+                    "task_id": "0",
+                    "task_success": True,
+                    "cached": True,
+                },
+                task_complete_msgs[1],
+            )
+            self.assertIsNone(client._object_manager)
+
+    def test__when_another_client_announces_the_outputs_of_a_task__expect_them_fetched_into_the_task_cache(self):
+        """
+        GIVEN two clients of the same schema on this machine, each with a task cache of its own, of which
+          the first serves the outputs of its cached tasks until a second after its last request once it finishes.
+        WHEN the first client runs task 0, which produces an output file,
+          AND the second client is told where the output is served from just as both are told the schema completed.
+        EXPECT the first client to announce the output with the task's result,
+          AND the second client to fetch it into its task cache before it finishes, from which it can be restored.
+        """
+        repo_state = {"org/repo_1": {"base_ref": "main", "patchset": "5bfb44678a27f9bc3b6a96ced8d0b464d7ea9b71"}}
+        schema_complete_msg = json.dumps({"message_type": MessageType.SCHEMA_COMPLETE, "schema_id": "mock_schema"})
+        with tempfile.TemporaryDirectory() as directory:
+            configs = []
+            task_caches = []
+            for name in ("1", "2"):
+                config = MockConfiguration(name, "1", "./client/test/data/test_schema.yaml")
+                config.workspace_path = os.path.join(directory, "workspace" + name)
+                configs.append(config)
+                task_caches.append(TaskCache(os.path.join(directory, "cache" + name), root=config.workspace_path))
+
+            artifact_server = ArtifactServer(task_caches[0], linger=1.0)
+            with MockConnection("localhost:8000", "1") as serving_connection, MockConnection(
+                "localhost:8000", "2"
+            ) as fetching_connection:
+                serving_client = Client(
+                    configs[0],
+                    serving_connection,
+                    MockOutputProducingTaskRunner,
+                    False,
+                    repo_state,
+                    task_cache=task_caches[0],
+                    artifact_server=artifact_server,
+                )
+                fetching_client = Client(
+                    configs[1],
+                    fetching_connection,
+                    MockSuccessfulTaskRunner,
+                    False,
+                    repo_state,
+                    task_cache=task_caches[1],
+                    fetch_artifacts=True,
+                )
+                # As a client process does, the artifact server is closed once the serving client finishes
+                serving_thread = threading.Thread(target=lambda: (serving_client.run(), artifact_server.close()))
+                serving_thread.start()
+                fetching_thread = threading.Thread(target=fetching_client.run)
+                fetching_thread.start()
+                serving_connection.get_sent_msg()
+                fetching_connection.get_sent_msg()
+
+                serving_connection._received_messages.put(
+                    json.dumps(
+                        {"message_type": MessageType.BUILD_INSTRUCTION, "schema_id": "mock_schema", "task_id": "0"}
+                    )
+                )
+                task_complete_msg = serving_connection.get_sent_msg()
+                serving_connection._received_messages.put(schema_complete_msg)
+                fetching_connection._received_messages.put(
+                    json.dumps(
+                        {
+                            "message_type": MessageType.ARTIFACTS,
+                            "schema_id": "mock_schema",
+                            "artifacts": [{"task_id": "0", **task_complete_msg["artifacts"]}],
+                        }
+                    )
+                )
+                fetching_connection._received_messages.put(schema_complete_msg)
+                fetching_thread.join()
+                serving_thread.join()
+
+            key = TaskCache.get_key("mock_schema", {"task": 2}, repo_state)
+            self.assertEqual(artifact_server.get_url(key), task_complete_msg["artifacts"]["url"])
+            self.assertEqual({os.path.join("out", "0.txt"): 1700}, task_complete_msg["artifacts"]["files"])
+            self.assertIn(key, task_caches[1])
+            restored = task_caches[1].restore_outputs(key)
+            with open(restored[0]) as file:
+                self.assertEqual("Output of task 0\n" * 100, file.read())
+
+    def test__when_a_client_runs_two_schemas__expect_each_schemas_messages_routed_to_its_own_client(self):
+        """
+        GIVEN a client connected to the server with two designated schemas.
+        WHEN the server sends a build instruction for each schema in turn,
+          AND then a schema complete message for each schema.
+        EXPECT an INIT message for each schema to be sent over the one connection,
+          AND each task complete message to name the schema of its build instruction,
+          AND both clients to finish successfully.
+        """
+        repo_state = {"org/repo_1": {"base_ref": "main", "patchset": "5bfb44678a27f9bc3b6a96ced8d0b464d7ea9b71"}}
+        config = MockConfiguration("1", "1", None)
+        schema_paths = ["./client/test/data/test_schema.yaml", "./client/test/data/test_sharded_schema.yaml"]
+        with MockConnection("localhost:8000", "1") as connection:
+            return_codes = []
+            client_thread = threading.Thread(
+                target=lambda: return_codes.append(
+                    run_schemas(config, schema_paths, connection, MockSuccessfulTaskRunner, repo_state=repo_state)
+                )
+            )
+            client_thread.start()
+
+            init_msgs = [connection.get_sent_msg(), connection.get_sent_msg()]
+            task_complete_msgs = []
+            for schema_id in ["mock_schema", "mock_sharded_schema"]:
+                connection._received_messages.put(
+                    json.dumps({"message_type": MessageType.BUILD_INSTRUCTION, "schema_id": schema_id, "task_id": "0"})
+                )
+                task_complete_msgs.append(connection.get_sent_msg())
+            for schema_id in ["mock_schema", "mock_sharded_schema"]:
+                connection._received_messages.put(
+                    json.dumps({"message_type": MessageType.SCHEMA_COMPLETE, "schema_id": schema_id})
+                )
+            client_thread.join()
+
+            self.assertEqual({"mock_schema", "mock_sharded_schema"}, {init_msg["schema_id"] for init_msg in init_msgs})
+            self.assertEqual(
+                ["mock_schema", "mock_sharded_schema"],
+                [task_complete_msg["schema_id"] for task_complete_msg in task_complete_msgs],
+            )
+            self.assertEqual([0], return_codes)
+
+
+class TestTaskCache(unittest.TestCase):
+    def test__when_the_task_cache_is_full__expect_the_least_recently_used_entry_evicted(self):
+        """
+        GIVEN a task cache with room for two entries, holding entries for tasks A and B, each with an output file.
+        WHEN entry A is used, and then an entry for task C is stored.
+        EXPECT entry B to be evicted, even once the cache is loaded again,
+          AND the output of entry A to be restored to its path.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            output_root = os.path.join(directory, "workspace")
+            os.makedirs(os.path.join(output_root, "out"))
+            with open(os.path.join(output_root, "out", "a.txt"), "w") as file:
+                file.write("a" * 200)
+            task_cache = TaskCache(os.path.join(directory, "cache"), max_size=600)
+            keys = {task: TaskCache.get_key("schema", {"task": task}, {}) for task in "ABC"}
+
+            for task in "ABC":
+                if task == "C":
+                    self.assertIsNotNone(task_cache.get(keys["A"]))
+                task_cache.put(keys[task], {"task_id": task}, [os.path.join(output_root, "out", "a.txt")], output_root)
+            os.remove(os.path.join(output_root, "out", "a.txt"))
+
+            for cache in (task_cache, TaskCache(os.path.join(directory, "cache"), max_size=600)):
+                self.assertEqual([True, False, True], [keys[task] in cache for task in "ABC"])
+                self.assertLessEqual(cache.get_total_size(), 600)
+            self.assertEqual(
+                [os.path.join(output_root, "out", "a.txt")], task_cache.restore_outputs(keys["A"], output_root)
+            )
+            self.assertNotEqual(keys["A"], TaskCache.get_key("schema", {"task": "A"}, {"org/repo": {"patchset": "1"}}))
+
+
+class TestArtifacts(unittest.TestCase):
+    def test__when_a_client_serves_the_outputs_of_a_task__expect_another_client_to_fetch_them_in_chunks(self):
+        """
+        GIVEN an artifact server on this machine,
+          AND a task cache with an entry for a task with a 10000 byte output.
+        WHEN the output is fetched in chunks of 1024 bytes,
+          AND a file of the entry outside its outputs is requested.
+        EXPECT the fetched output to be the same as the original,
+          AND the file outside the outputs not to be served.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            workspace = os.path.join(directory, "workspace")
+            os.makedirs(os.path.join(workspace, "out"))
+            output = os.urandom(10000)
+            with open(os.path.join(workspace, "out", "report.xml"), "wb") as file:
+                file.write(output)
+            task_cache = TaskCache(os.path.join(directory, "cache"), root=workspace)
+            key = TaskCache.get_key("schema", {"task": 1}, {})
+            task_cache.put(key, {}, [os.path.join(workspace, "out", "report.xml")])
+
+            with ArtifactServer(task_cache, linger=0) as artifact_server:
+                paths = fetch_artifacts(
+                    artifact_server.get_url(key),
+                    task_cache.get_output_sizes(key),
+                    os.path.join(directory, "fetched"),
+                    chunk_size=1024,
+                )
+                with self.assertRaises(urllib.error.HTTPError):
+                    urllib.request.urlopen(artifact_server.get_url(key) + "../result.json")
+
+            self.assertEqual([os.path.join(directory, "fetched", "out", "report.xml")], paths)
+            with open(paths[0], "rb") as file:
+                self.assertEqual(output, file.read())
+
+    def test__when_artifacts_are_served_on_every_interface__expect_them_announced_at_the_advertised_host(self):
+        """
+        GIVEN a task cache.
+        WHEN artifact servers are started on every interface, with and without a host to advertise.
+        EXPECT the one without a host to advertise to be refused, as other clients could not reach it,
+          AND the other to announce its outputs at the advertised host.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            task_cache = TaskCache(os.path.join(directory, "cache"))
+            key = TaskCache.get_key("schema", {"task": 1}, {})
+
+            with self.assertRaises(ValueError):
+                ArtifactServer(task_cache, "0.0.0.0")
+            with ArtifactServer(task_cache, "0.0.0.0", advertise_host="127.0.0.1", linger=0) as artifact_server:
+                url = artifact_server.get_url(key)
+
+            self.assertTrue(url.startswith("http://127.0.0.1:"))
+
+
+class TestClientDaemon(unittest.TestCase):
+    def test__when_two_clients_connect_through_the_daemon__expect_their_messages_multiplexed_over_one_connection(
+        self,
+    ):
+        """
+        GIVEN a client daemon with a connection to the server.
+        WHEN two clients with the same schema connect through the daemon,
+          AND the server sends each of them a build instruction and then a schema complete message.
+        EXPECT each client's messages to be sent over the daemon's connection, tagged with its session,
+          AND the schema to have been parsed once by the daemon,
+          AND only the user running the daemon to be able to connect to its socket,
+          AND the session of each client to be closed once it disconnects.
+        """
+        repo_state = {"org/repo_1": {"base_ref": "main", "patchset": "5bfb44678a27f9bc3b6a96ced8d0b464d7ea9b71"}}
+        load_schema = mock.patch.object(SchemaLoader, "load_schema", wraps=SchemaLoader.load_schema)
+        with tempfile.TemporaryDirectory() as directory, load_schema as load_schema, MockConnection(
+            "localhost:8000", "host"
+        ) as connection:
+            daemon = ClientDaemon(connection, os.path.join(directory, "daemon.sock"))
+            daemon_thread = threading.Thread(target=daemon.serve_forever)
+            daemon_thread.start()
+            while not os.path.exists(os.path.join(directory, "daemon.sock")):
+                time.sleep(0.01)
+            self.assertEqual(0o600, os.stat(os.path.join(directory, "daemon.sock")).st_mode & 0o777)
+
+            init_msgs = {}
+            client_threads = []
+            for client_id in ("1", "2"):
+                config = MockConfiguration(client_id, "1", "./client/test/data/test_schema.yaml")
+                daemon_connection = DaemonConnection(os.path.join(directory, "daemon.sock"), client_id)
+                client = Client(config, daemon_connection, MockSuccessfulTaskRunner, False, repo_state)
+                client_threads.append(threading.Thread(target=client.run))
+                client_threads[-1].start()
+                init_msg = connection.get_sent_msg()
+                init_msgs[init_msg.pop("client_id")] = init_msg
+
+            for init_msg in init_msgs.values():
+                connection._received_messages.put(
+                    json.dumps(
+                        {
+                            "message_type": MessageType.BUILD_INSTRUCTION,
+                            "schema_id": "mock_schema",
+                            "task_id": init_msg["session_id"],
+                            "session_id": init_msg["session_id"],
+                        }
+                    )
+                )
+            task_complete_msgs = [connection.get_sent_msg() for _ in init_msgs]
+            for init_msg in init_msgs.values():
+                connection._received_messages.put(
+                    json.dumps(
+                        {
+                            "message_type": MessageType.SCHEMA_COMPLETE,
+                            "schema_id": "mock_schema",
+                            "session_id": init_msg["session_id"],
+                        }
+                    )
+                )
+            for client_thread in client_threads:
+                client_thread.join()
+            session_closed_msgs = [connection.get_sent_msg() for _ in init_msgs]
+
+            daemon.shutdown()
+            daemon_thread.join()
+
+            self.assertEqual({"0", "1"}, {init_msg.pop("session_id") for init_msg in init_msgs.values()})
+            self.assertEqual(MessageType.INIT, init_msgs["1"]["message_type"])
+            self.assertDictEqual(init_msgs["1"], init_msgs["2"])
+            self.assertCountEqual(
+                [
+                    {
+                        "message_type": MessageType.TASK_COMPLETE,
+                        "schema_id": "mock_schema",
+                        "task_id": session_id,
+                        "task_success": True,
+                        "session_id": session_id,
+                        "client_id": client_id,
+                    }
+                    for client_id, session_id in (("1", "0"), ("2", "1"))
+                ],
+                task_complete_msgs,
+            )
+            self.assertCountEqual(
+                [{"message_type": MessageType.SESSION_CLOSED, "session_id": session_id} for session_id in ("0", "1")],
+                session_closed_msgs,
+            )
+            self.assertEqual(1, load_schema.call_count)
+
+    def test__when_a_client_sends_messages_from_several_threads__expect_each_to_reach_the_daemon_whole(self):
+        """
+        GIVEN a client daemon with a connection to the server, and a client connected through it.
+        WHEN the client sends large messages from four threads at once.
+        EXPECT every message to be forwarded to the server intact.
+        """
+        with tempfile.TemporaryDirectory() as directory, MockConnection("localhost:8000", "host") as connection:
+            daemon = ClientDaemon(connection, os.path.join(directory, "daemon.sock"))
+            daemon_thread = threading.Thread(target=daemon.serve_forever)
+            daemon_thread.start()
+            while not os.path.exists(os.path.join(directory, "daemon.sock")):
+                time.sleep(0.01)
+
+            daemon_connection = DaemonConnection(os.path.join(directory, "daemon.sock"), "1")
+
+            def send_messages(thread_index: int):
+                for message_index in range(50):
+                    daemon_connection.send_message(
+                        {
+                            "message_type": MessageType.TASK_PROGRESS,
+                            "task_id": (thread_index, message_index),
+                            "padding": "x" * 100000,
+                        }
+                    )
+
+            sender_threads = [threading.Thread(target=send_messages, args=(thread_index,)) for thread_index in range(4)]
+            for sender_thread in sender_threads:
+                sender_thread.start()
+            for sender_thread in sender_threads:
+                sender_thread.join()
+            sent_task_ids = [tuple(connection.sent_messages.get(timeout=5)["task_id"]) for _ in range(200)]
+
+            daemon_connection.close_websocket()
+            connection.get_sent_msg()
+            daemon.shutdown()
+            daemon_thread.join()
+
+            self.assertCountEqual(
+                [(thread_index, message_index) for thread_index in range(4) for message_index in range(50)],
+                sent_task_ids,
+            )
+
+
+class TestRecentTasks(unittest.TestCase):
+    def test__when_a_client_with_recent_tasks_completes_a_task__expect_the_task_reported_in_the_next_init_message(self):
+        """
+        GIVEN a client which remembers its recent tasks in a file that lists task 3.
+        WHEN the client connects, runs task 0, and a new client is created with the same file.
+        EXPECT the first INIT message to report task 3,
+          AND the second client to report tasks 3 and 0, least recent first.
+        """
+        repo_state = {"org/repo_1": {"base_ref": "main", "patchset": "5bfb44678a27f9bc3b6a96ced8d0b464d7ea9b71"}}
+        config = MockConfiguration("1", "1", "./client/test/data/test_schema.yaml")
+        with tempfile.TemporaryDirectory() as directory:
+            recent_tasks_path = os.path.join(directory, "recent_tasks.json")
+            RecentTasks(recent_tasks_path).record("mock_schema", "3")
+
+            with MockConnection("localhost:8000", "1") as connection:
+                client = Client(
+                    config, connection, MockSuccessfulTaskRunner, False, repo_state, RecentTasks(recent_tasks_path)
+                )
+                client_thread = threading.Thread(target=client.run)
+                client_thread.start()
+
+                init_msg = connection.get_sent_msg()
+                connection._received_messages.put(
+                    json.dumps(
+                        {"message_type": MessageType.BUILD_INSTRUCTION, "schema_id": "mock_schema", "task_id": "0"}
+                    )
+                )
+                connection.get_sent_msg()
+                connection._received_messages.put(
+                    json.dumps({"message_type": MessageType.SCHEMA_COMPLETE, "schema_id": "mock_schema"})
+                )
+                client_thread.join()
+
+            self.assertEqual(["3"], init_msg["recent_tasks"])
+            self.assertEqual(["3", "0"], RecentTasks(recent_tasks_path).get("mock_schema"))
+
+    def test__when_more_tasks_are_run_than_are_remembered__expect_the_least_recent_forgotten(self):
+        """
+        GIVEN recent tasks which remembers two tasks per schema.
+        WHEN tasks 0, 1, 0 and 2 are recorded.
+        EXPECT tasks 0 and 2 to be remembered.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            recent_tasks = RecentTasks(os.path.join(directory, "recent_tasks.json"), max_tasks_per_schema=2)
+            for task_id in ("0", "1", "0", "2"):
+                recent_tasks.record("mock_schema", task_id)
+
+            self.assertEqual(["0", "2"], recent_tasks.get("mock_schema"))
+
+
+class TestBazelRunner(unittest.TestCase):
+    def test__when_several_targets_are_run__expect_one_invocation_and_a_result_per_target(self):
+        """
+        GIVEN a Bazel runner.
+        WHEN a passing, a failing and a broken target are run in one batch.
+        EXPECT each target's success to be read back from the build event file,
+          AND the test duration of the targets whose tests ran.
+        """
+        bazel_runner = BazelRunner(".", [sys.executable, "./client/test/data/fake_bazel.py"])
+
+        results = bazel_runner.run_batch(["//:pass", "//:fail", "//:broken"])
+
+        self.assertEqual([True, False, False], [result.success for result in results.values()])
+        self.assertEqual([0.25, 0.25, None], [result.duration for result in results.values()])
+        self.assertEqual(["PASSED", "FAILED", None], [result.test_status for result in results.values()])
+
+    def test__when_a_single_target_is_run__expect_its_task_stats_to_describe_the_invocation(self):
+        """
+        GIVEN a Bazel runner.
+        WHEN a single passing target is run.
+        EXPECT its task stats to include its test duration, the action counts, cache hit ratio and
+          critical path time of the invocation, and the invocation's wall time as its duration.
+        """
+        bazel_runner = BazelRunner(".", [sys.executable, "./client/test/data/fake_bazel.py"])
+
+        task_stats = bazel_runner.run_batch(["//:pass"])["//:pass"].to_task_stats()
+
+        self.assertDictEqual(
+            {
+                "test_status": "PASSED",
+                "test_duration": 0.25,
+                "batch_size": 1,
+                "actions_created": 10,
+                "actions_executed": 4,
+                "cache_hits": 3,
+                "cache_misses": 1,
+                "cache_hit_ratio": 0.75,
+                "critical_path_time": 1.5,
+                "duration": 2.0,
+            },
+            task_stats,
+        )
+
+    def test__when_several_targets_are_run__expect_no_cache_hit_ratio_or_duration_in_their_task_stats(self):
+        """
+        GIVEN a Bazel runner.
+        WHEN two passing targets are run in one batch.
+        EXPECT their task stats to leave out the invocation's cache hit ratio and wall time, which are not
+          their own,
+          AND to keep the action counts of the invocation.
+        """
+        bazel_runner = BazelRunner(".", [sys.executable, "./client/test/data/fake_bazel.py"])
+
+        results = bazel_runner.run_batch(["//:a", "//:b"])
+
+        for result in results.values():
+            task_stats = result.to_task_stats()
+            self.assertEqual(2, task_stats["batch_size"])
+            self.assertEqual(3, task_stats["cache_hits"])
+            self.assertNotIn("cache_hit_ratio", task_stats)
+            self.assertNotIn("duration", task_stats)
+
+    def test__when_targets_are_queried__expect_each_target_yielded(self):
+        """
+        GIVEN a Bazel runner.
+        WHEN a query matching two targets is run.
+        EXPECT both targets to be yielded, in the order Bazel printed them.
+        """
+        bazel_runner = BazelRunner(".", [sys.executable, "./client/test/data/fake_bazel.py"])
+
+        self.assertEqual(["//:a", "//:b"], list(bazel_runner.query("//:a + //:b")))
+
+    def test__when_bazel_prints_its_action_counter__expect_progress_reported(self):
+        """
+        GIVEN a Bazel runner with a progress callback.
+        WHEN Bazel prints "[1 / 4]" and then "[4 / 4]".
+        EXPECT progress of 0.25 and then 1.0 to be reported.
+        """
+        progress = []
+        bazel_runner = BazelRunner(
+            ".", [sys.executable, "./client/test/data/fake_bazel.py"], progress_callback=progress.append
+        )
+
+        bazel_runner.run_batch(["//:pass"])
+
+        self.assertEqual([0.25, 1.0], progress)
+
+    def test__when_a_build_event_file_uses_millisecond_durations__expect_test_attempts_summed(self):
+        """
+        GIVEN a build event file, as written by older versions of Bazel, of a flaky test run twice.
+        WHEN the file is parsed.
+        EXPECT the test to pass, with the duration of both attempts.
+        """
+        events = [
+            {
+                "id": {"testResult": {"label": "//:flaky", "attempt": 1}},
+                "testResult": {"testAttemptDurationMillis": "300"},
+            },
+            {
+                "id": {"testResult": {"label": "//:flaky", "attempt": 2}},
+                "testResult": {"testAttemptDurationMillis": "200"},
+            },
+            {"id": {"testSummary": {"label": "//:flaky"}}, "testSummary": {"overallStatus": "FLAKY"}},
+            {"id": {"targetCompleted": {"label": "//:flaky"}}, "completed": {"success": True}},
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            build_event_json_file = os.path.join(directory, "build_events.json")
+            with open(build_event_json_file, "w") as file:
+                file.write("\n".join(json.dumps(event) for event in events))
+
+            result = parse_build_event_json_file(build_event_json_file)["//:flaky"]
+
+        self.assertTrue(result.success)
+        self.assertEqual(0.5, result.duration)
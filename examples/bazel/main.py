@@ -1,49 +1,114 @@
 import argparse
 import logging
-import subprocess
 import sys
 
 from task_sharding_client.arg_parse import parse_input_arguments
+from task_sharding_client.artifacts import ArtifactServer
+from task_sharding_client.bazel_runner import BazelRunner, BazelTaskRunner
 from task_sharding_client.connection import Connection
 from task_sharding_client.client import Client
-from task_sharding_client.task_runner import TaskRunner
+from task_sharding_client.daemon import DaemonConnection
+from task_sharding_client.recent_tasks import RecentTasks
+from task_sharding_client.schema_multiplexer import run_schemas
+from task_sharding_client.task_cache import TaskCache
+from task_sharding_client.schema_loader import SchemaLoader
 
 logger = logging.getLogger(__name__)
 
 
-class BazelTask(TaskRunner):
-    def __init__(self, schema: dict, config: any):
-        super().__init__(schema, config)
-        self._process = None
+def query_tasks(configuration):
+    """
+    Yields a task for each target matched by the `--query` expression, as Bazel finds it.
+    """
+    for target in BazelRunner(configuration.workspace_path).query(configuration.query):
+        yield {"task": target}
 
-    def run(self, task_id: str) -> int:
-        logger.info("Starting build task")
 
-        target = self._schema["tasks"][int(task_id)]["task"]
-        self._process = subprocess.Popen(["bazel", "test", target], cwd=self._config.workspace_path)
-        stdout, stderr = self._process.communicate()
-        exit_code = self._process.wait()
-
-        if exit_code != 0:
-            logger.error("Build did not complete successfully: %s -- %s", str(stderr), str(stdout))
-        else:
-            logger.info("Finished build task")
-
-        return exit_code
-
-    def abort(self):
-        if self._process:
-            self._process.terminate()
+def run_locally(configuration) -> int:
+    """
+    Runs every task of the schema on this machine, in a single Bazel invocation.
+    """
+    schema = SchemaLoader.load_schema(configuration.schema_path)
+    if configuration.query:
+        schema["tasks"] = [*(schema.get("tasks") or []), *query_tasks(configuration)]
+    task_runner = BazelTaskRunner(schema, configuration)
+    results = task_runner.run_targets([str(task_id) for task_id in range(len(schema["tasks"]))])
+    for task_id, result in results.items():
+        logger.info("Task %s (%s): %s", task_id, result.label, "passed" if result.success else "failed")
+    return 0 if all(result.success for result in results.values()) else 1
 
 
 def main():
     parser = argparse.ArgumentParser(description="inputs for script")
     parser.add_argument("--workspace_path", help="Path to workspace", required=True)
+    parser.add_argument(
+        "--local", action="store_true", help="Run every task in one Bazel invocation, without the server"
+    )
+    parser.add_argument("--query", help="Bazel query expression whose targets are added to the schema's tasks")
     configuration = parse_input_arguments(parser)
+    if len(configuration.schema_paths) > 1 and (configuration.local or configuration.query):
+        parser.error("--local and --query take a single --schema_path")
+
+    if configuration.local:
+        sys.exit(run_locally(configuration))
 
-    with Connection("localhost:8000", configuration.client_id) as connection:
-        client = Client(configuration, connection, BazelTask)
-        sys.exit(client.run())
+    if configuration.daemon_socket:
+        connection = DaemonConnection(configuration.daemon_socket, configuration.client_id)
+    else:
+        connection = Connection("localhost:8000", configuration.client_id)
+    with connection:
+        recent_tasks = RecentTasks(configuration.recent_tasks_path) if configuration.recent_tasks_path else None
+        task_cache = (
+            TaskCache(configuration.task_cache_path, configuration.task_cache_size_mb * 1024 * 1024)
+            if configuration.task_cache_path
+            else None
+        )
+        artifact_server = (
+            ArtifactServer(
+                task_cache,
+                *configuration.artifact_address,
+                advertise_host=configuration.artifact_advertise_host,
+                linger=configuration.artifact_linger,
+            )
+            if configuration.artifact_address
+            else None
+        )
+        try:
+            if len(configuration.schema_paths) > 1:
+                sys.exit(
+                    run_schemas(
+                        configuration,
+                        configuration.schema_paths,
+                        connection,
+                        BazelTaskRunner,
+                        recent_tasks=recent_tasks,
+                        supersedes=configuration.supersedes,
+                        capabilities=configuration.capabilities,
+                        task_cache=task_cache,
+                        artifact_server=artifact_server,
+                        fetch_artifacts=configuration.fetch_artifacts,
+                        max_batch_size=configuration.max_batch_size,
+                    )
+                )
+            task_stream = query_tasks(configuration) if configuration.query else None
+            client = Client(
+                configuration,
+                connection,
+                BazelTaskRunner,
+                recent_tasks=recent_tasks,
+                task_stream=task_stream,
+                supersedes=configuration.supersedes,
+                capabilities=configuration.capabilities,
+                task_cache=task_cache,
+                artifact_server=artifact_server,
+                fetch_artifacts=configuration.fetch_artifacts,
+                max_batch_size=configuration.max_batch_size,
+            )
+            sys.exit(client.run())
+        finally:
+            if artifact_server:
+                # Keeps serving the outputs of this client's tasks while the other clients fetch them
+                artifact_server.close()
 
 
 if __name__ == "__main__":
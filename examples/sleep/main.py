@@ -3,8 +3,12 @@ import sys
 from time import sleep
 
 from task_sharding_client.arg_parse import parse_input_arguments
+from task_sharding_client.artifacts import ArtifactServer
 from task_sharding_client.connection import Connection
 from task_sharding_client.client import Client
+from task_sharding_client.daemon import DaemonConnection
+from task_sharding_client.schema_multiplexer import run_schemas
+from task_sharding_client.task_cache import TaskCache
 from task_sharding_client.task_runner import TaskRunner
 
 logger = logging.getLogger(__name__)
@@ -27,9 +31,58 @@ class SleepTask(TaskRunner):
 
 def main():
     configuration = parse_input_arguments()
-    with Connection("localhost:8000", configuration.client_id) as connection:
-        client = Client(configuration, connection, SleepTask)
-        sys.exit(client.run())
+    if configuration.daemon_socket:
+        connection = DaemonConnection(configuration.daemon_socket, configuration.client_id)
+    else:
+        connection = Connection("localhost:8000", configuration.client_id)
+    with connection:
+        task_cache = (
+            TaskCache(configuration.task_cache_path, configuration.task_cache_size_mb * 1024 * 1024)
+            if configuration.task_cache_path
+            else None
+        )
+        artifact_server = (
+            ArtifactServer(
+                task_cache,
+                *configuration.artifact_address,
+                advertise_host=configuration.artifact_advertise_host,
+                linger=configuration.artifact_linger,
+            )
+            if configuration.artifact_address
+            else None
+        )
+        try:
+            if len(configuration.schema_paths) > 1:
+                sys.exit(
+                    run_schemas(
+                        configuration,
+                        configuration.schema_paths,
+                        connection,
+                        SleepTask,
+                        supersedes=configuration.supersedes,
+                        capabilities=configuration.capabilities,
+                        task_cache=task_cache,
+                        artifact_server=artifact_server,
+                        fetch_artifacts=configuration.fetch_artifacts,
+                        max_batch_size=configuration.max_batch_size,
+                    )
+                )
+            client = Client(
+                configuration,
+                connection,
+                SleepTask,
+                supersedes=configuration.supersedes,
+                capabilities=configuration.capabilities,
+                task_cache=task_cache,
+                artifact_server=artifact_server,
+                fetch_artifacts=configuration.fetch_artifacts,
+                max_batch_size=configuration.max_batch_size,
+            )
+            sys.exit(client.run())
+        finally:
+            if artifact_server:
+                # Keeps serving the outputs of this client's tasks while the other clients fetch them
+                artifact_server.close()
 
 
 if __name__ == "__main__":
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -137,13 +138,96 @@ CHANNEL_LAYERS = {
         ### Method 2: Via local Redis => `docker run -p 6379:6379 -d redis:5`
         "BACKEND": "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
-            "hosts": [("172.17.0.1", 6379)],
+            "hosts": [(os.environ.get("REDIS_HOST", "172.17.0.1"), int(os.environ.get("REDIS_PORT", "6379")))],
         },
         ### Method 3: Via In-memory channel layer
         # "BACKEND": "channels.layers.InMemoryChannelLayer"
     },
 }
 
+# The controller publishes its status and metrics snapshots to the TASK_SHARDING_STATUS_CACHE cache, from which
+# /status and /metrics serve them, so the cache must be shared by the server and `manage.py runworker controller`
+# processes (e.g. a file-based cache on a single host, or memcached once they are spread across hosts).
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "status": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get(
+            "TASK_SHARDING_STATUS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "task_sharding_status")
+        ),
+    },
+}
+
+# Single-process deployments can set TASK_SHARDING_EMBEDDED=1 in the environment to run the controller inside the
+# server process, where consumers call it directly instead of going through Redis to `manage.py runworker controller`.
+# A channel layer (or status cache) shared between processes is only needed once the server is scaled out.
+if os.environ.get("TASK_SHARDING_EMBEDDED", "").lower() in ("1", "true", "yes"):
+    CHANNEL_LAYERS = {"default": {"BACKEND": "task_sharding.src.embedded_channel_layer.EmbeddedChannelLayer"}}
+    CACHES["status"] = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "status"}
+
+# Task sharding
+
+# The order in which a schema instance hands out its tasks: "lifo", "longest_first" or "critical_path".
+# Use `manage.py simulate_schedule` to compare policies before changing this.
+TASK_SHARDING_SCHEDULING_POLICY = "lifo"
+
+# Overrides for the level of individual scheduling events (e.g. {"assigned": "INFO"}), and the fraction
+# of each event type to keep (e.g. {"registered": 0.1}). Per-task events are logged at DEBUG by default.
+TASK_SHARDING_EVENT_LOG_LEVELS = {}
+TASK_SHARDING_EVENT_LOG_SAMPLE_RATES = {}
+
+# The controller publishes a status and metrics snapshot at most every STATUS_SNAPSHOT_INTERVAL seconds while its
+# state changes, to the STATUS_CACHE cache. /status and /metrics read the last one from the cache without going
+# through the controller, so polling them adds nothing to the controller's work, and this bounds how stale they can be.
+TASK_SHARDING_STATUS_SNAPSHOT_INTERVAL = 1.0
+TASK_SHARDING_STATUS_CACHE = "status"
+
+# A failed task is retried (on a consumer which has not failed it yet, where there is one) until it has
+# failed RETRY_MAX_ATTEMPTS times, at which point its schema instance is failed. Retries can be delayed
+# by RETRY_BACKOFF seconds, multiplied by RETRY_BACKOFF_MULTIPLIER for every further failure.
+TASK_SHARDING_RETRY_MAX_ATTEMPTS = 3
+TASK_SHARDING_RETRY_BACKOFF = 0.0
+TASK_SHARDING_RETRY_BACKOFF_MULTIPLIER = 2.0
+TASK_SHARDING_RETRY_EXCLUDE_FAILED_PEERS = True
+
+# Consumers can report the tasks they ran recently (and so have warm local state for) when they connect.
+# Those tasks are held back from other consumers for up to AFFINITY_WAIT seconds. Set to 0 to only
+# prefer warm tasks, without ever holding them back.
+TASK_SHARDING_AFFINITY_WAIT = 5.0
+
+# The status of each schema instance lists (up to ten of) the tasks whose latest run, as reported by the consumer
+# which ran it, had a cache hit ratio of at most LOW_CACHE_HIT_RATIO.
+TASK_SHARDING_LOW_CACHE_HIT_RATIO = 0.5
+
+# Tasks which a schema declares as shardable without a shard count are split into enough shards to take about
+# SHARD_TARGET_DURATION seconds each (by default the median duration of the schema's other tasks), and at most
+# MAX_AUTO_SHARDS shards.
+TASK_SHARDING_SHARD_TARGET_DURATION = None
+TASK_SHARDING_MAX_AUTO_SHARDS = 16
+
+# When every consumer of a schema instance has left before it finished, the units already done are remembered for
+# the last MAX_RESUMABLE_INSTANCES such instances. A new instance for the same schema, cache and patchsets then
+# only runs the rest. Set to 0 to always start over.
+TASK_SHARDING_MAX_RESUMABLE_INSTANCES = 20
+
+# Consumers whose disconnection the controller is never told of (e.g. when it is lost with a Redis connection) are
+# found every SWEEP_INTERVAL seconds: consumers silent for CONSUMER_IDLE_TIMEOUT seconds are pinged, and evicted if
+# they have not replied PING_TIMEOUT seconds later. Beyond MAX_CONSUMERS consumers or MAX_SCHEMA_INSTANCES schema
+# instances, those least recently heard from are evicted. Set SWEEP_INTERVAL to 0 to never sweep.
+TASK_SHARDING_SWEEP_INTERVAL = 10.0
+TASK_SHARDING_CONSUMER_IDLE_TIMEOUT = 60.0
+TASK_SHARDING_PING_TIMEOUT = 30.0
+TASK_SHARDING_MAX_CONSUMERS = 10000
+TASK_SHARDING_MAX_SCHEMA_INSTANCES = 1000
+
+# When many clients start at once, their INIT messages can be matched to schema instances in batches: each INIT is
+# held for up to INIT_BATCH_WINDOW seconds, and every INIT received meanwhile is matched in the same pass. Beyond
+# MAX_PENDING_INITS waiting INITs, or when the controller's channel is full, clients are told to retry after
+# INIT_RETRY_AFTER to twice INIT_RETRY_AFTER seconds. Set INIT_BATCH_WINDOW to 0 to match every INIT as it arrives.
+TASK_SHARDING_INIT_BATCH_WINDOW = 0.0
+TASK_SHARDING_MAX_PENDING_INITS = 1000
+TASK_SHARDING_INIT_RETRY_AFTER = 1.0
+
 # Logging
 
 LOGGING = {
@@ -168,6 +252,12 @@ LOGGING = {
             "class": "logging.StreamHandler",
             "formatter": "simple",
         },
+        # Formats and writes records on a background thread, so the scheduler never waits on logging
+        "non_blocking_console": {
+            "level": "INFO",
+            "()": "task_sharding.src.event_log.NonBlockingLogHandler",
+            "formatter": "simple",
+        },
         "file": {
             "level": "WARNING",
             "class": "logging.FileHandler",
@@ -185,5 +275,13 @@ LOGGING = {
             "level": "INFO",
             "propagate": True,
         },
+        "task_sharding": {
+            "handlers": [
+                "non_blocking_console",
+                "file",
+            ],
+            "level": "INFO",
+            "propagate": False,
+        },
     },
 }
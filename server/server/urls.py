@@ -16,6 +16,16 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path
 
+from task_sharding import views
+
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics", views.metrics, name="metrics"),
+    path("status", views.status, name="status"),
+    path("supersede", views.supersede, name="supersede"),
+    path(
+        "instances/<uuid:schema_instance_id>/timeline",
+        views.schema_instance_timeline,
+        name="schema_instance_timeline",
+    ),
 ]
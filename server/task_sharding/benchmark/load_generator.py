@@ -0,0 +1,264 @@
+import asyncio
+import json
+import math
+import random
+import time
+
+from channels.layers import get_channel_layer
+from channels.routing import ChannelNameRouter, ProtocolTypeRouter, URLRouter
+from channels.testing import WebsocketCommunicator
+from channels.worker import Worker
+
+from task_sharding.routing import websocket_urlpatterns
+from task_sharding.src.controller import Controller
+from task_sharding.src.embedded_channel_layer import EmbeddedChannelLayer
+from task_sharding.src.message_type import MessageType
+
+DURATION_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+
+
+class LoadGeneratorConfig:
+    def __init__(
+        self,
+        peers: int = 1000,
+        schemas: int = 10,
+        tasks_per_schema: int = 100,
+        duration_distribution: str = "exponential",
+        mean_task_duration: float = 0.01,
+        churn: float = 0.0,
+        seed: int = 0,
+        timeout: float = 60,
+    ):
+        self.peers = peers
+        self.schemas = schemas
+        self.tasks_per_schema = tasks_per_schema
+        self.duration_distribution = duration_distribution
+        self.mean_task_duration = mean_task_duration
+        self.churn = churn
+        self.seed = seed
+        self.timeout = timeout
+
+
+class LoadGeneratorResults:
+    def __init__(self):
+        self.messages = 0
+        self.tasks_completed = 0
+        self.tasks_abandoned = 0
+        self.peers_churned = 0
+        self.schemas_completed = set()
+        self.init_to_first_task_latencies = []
+        self.assignment_latencies = []
+        self.wall_time = 0.0
+        self.process_cpu_time = 0.0
+        self.controller_busy_time = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "messages": self.messages,
+            "messages_per_second": self.messages / self.wall_time if self.wall_time else 0.0,
+            "tasks_completed": self.tasks_completed,
+            "tasks_abandoned": self.tasks_abandoned,
+            "peers_churned": self.peers_churned,
+            "schemas_completed": len(self.schemas_completed),
+            "init_to_first_task_seconds": summarise_latencies(self.init_to_first_task_latencies),
+            "assignment_latency_seconds": summarise_latencies(self.assignment_latencies),
+            "wall_time_seconds": self.wall_time,
+            "process_cpu_seconds": self.process_cpu_time,
+            "controller_busy_seconds": self.controller_busy_time,
+        }
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def summarise_latencies(latencies: list) -> dict:
+    sorted_latencies = sorted(latencies)
+    return {
+        "count": len(sorted_latencies),
+        "p50": percentile(sorted_latencies, 0.5),
+        "p90": percentile(sorted_latencies, 0.9),
+        "p99": percentile(sorted_latencies, 0.99),
+        "max": sorted_latencies[-1] if sorted_latencies else 0.0,
+    }
+
+
+class TaskDurationSampler:
+    def __init__(self, distribution: str, mean: float, rng: random.Random):
+        if distribution not in DURATION_DISTRIBUTIONS:
+            raise ValueError("Unknown task duration distribution: " + distribution)
+        self._distribution = distribution
+        self._mean = mean
+        self._rng = rng
+
+    def sample(self) -> float:
+        if self._distribution == "fixed":
+            return self._mean
+        if self._distribution == "uniform":
+            return self._rng.uniform(0, 2 * self._mean)
+        if self._distribution == "exponential":
+            return self._rng.expovariate(1 / self._mean) if self._mean > 0 else 0.0
+        # A lognormal with sigma=1 has a mean of exp(mu + 0.5), so mu is chosen to keep the requested mean
+        return self._rng.lognormvariate(math.log(self._mean) - 0.5, 1.0) if self._mean > 0 else 0.0
+
+
+class ProfiledController(Controller):
+    """
+    A controller which keeps track of how long it spends handling messages.
+    """
+
+    busy_time = 0.0
+
+    async def dispatch(self, message):
+        start_time = time.perf_counter()
+        try:
+            await super().dispatch(message)
+        finally:
+            ProfiledController.busy_time += time.perf_counter() - start_time
+
+
+def create_benchmark_application():
+    return ProtocolTypeRouter(
+        {
+            "channel": ChannelNameRouter({"controller": ProfiledController.as_asgi()}),
+            "websocket": URLRouter(websocket_urlpatterns),
+        }
+    )
+
+
+def create_init_message(schema_index: int, total_tasks: int) -> dict:
+    return {
+        "message_type": MessageType.INIT,
+        "repo_state": {
+            "org/benchmark": {
+                "base_ref": "main",
+                "patchset": "{:040d}".format(schema_index),
+            }
+        },
+        "complex_patchset": False,
+        "cache_id": "benchmark",
+        "schema_id": "schema_" + str(schema_index),
+        "total_tasks": total_tasks,
+    }
+
+
+class SyntheticPeer:
+    def __init__(
+        self,
+        application,
+        peer_id: str,
+        init_message: dict,
+        config: LoadGeneratorConfig,
+        sampler: TaskDurationSampler,
+        rng: random.Random,
+        results: LoadGeneratorResults,
+    ):
+        self._application = application
+        self._peer_id = peer_id
+        self._init_message = init_message
+        self._config = config
+        self._sampler = sampler
+        self._rng = rng
+        self._results = results
+
+    async def run(self) -> bool:
+        """
+        Runs the peer until its schema completes. Returns True if the peer churned, i.e. it
+        disconnected part way through a task and should be replaced by a fresh peer.
+        """
+        communicator = WebsocketCommunicator(self._application, "/ws/api/1/{}/".format(self._peer_id))
+        await communicator.connect(timeout=self._config.timeout)
+        await communicator.send_to(text_data=json.dumps(self._init_message))
+        self._results.messages += 1
+        init_sent_time = time.perf_counter()
+        last_completed_time = None
+
+        while True:
+            msg = json.loads(await communicator.receive_from(timeout=self._config.timeout))
+            received_time = time.perf_counter()
+            self._results.messages += 1
+            message_type = MessageType(int(msg["message_type"]))
+
+            if message_type == MessageType.SCHEMA_COMPLETE:
+                self._results.schemas_completed.add(self._init_message["schema_id"])
+                break
+            if message_type != MessageType.BUILD_INSTRUCTION:
+                continue
+
+            if last_completed_time is None:
+                self._results.init_to_first_task_latencies.append(received_time - init_sent_time)
+            else:
+                self._results.assignment_latencies.append(received_time - last_completed_time)
+
+            if self._rng.random() < self._config.churn:
+                self._results.peers_churned += 1
+                self._results.tasks_abandoned += 1
+                await communicator.disconnect()
+                return True
+
+            await asyncio.sleep(self._sampler.sample())
+            await communicator.send_to(
+                text_data=json.dumps(
+                    {
+                        "message_type": MessageType.TASK_COMPLETE,
+                        "schema_id": msg["schema_id"],
+                        "task_id": msg["task_id"],
+                        "task_success": True,
+                    }
+                )
+            )
+            self._results.messages += 1
+            self._results.tasks_completed += 1
+            last_completed_time = time.perf_counter()
+
+        await communicator.disconnect()
+        return False
+
+
+async def run_load_generator(config: LoadGeneratorConfig, application=None) -> LoadGeneratorResults:
+    """
+    Runs the controller as a channel worker (as `manage.py runworker controller` does) on the
+    configured channel layer, and drives it with synthetic peers connected over websockets. With
+    an `EmbeddedChannelLayer` no worker is run, as the layer calls its own controller directly.
+    """
+    application = application if application else create_benchmark_application()
+    rng = random.Random(config.seed)
+    sampler = TaskDurationSampler(config.duration_distribution, config.mean_task_duration, rng)
+    results = LoadGeneratorResults()
+    ProfiledController.busy_time = 0.0
+
+    channel_layer = get_channel_layer()
+    worker = None
+    if not isinstance(channel_layer, EmbeddedChannelLayer):
+        worker = Worker(application=application, channels=["controller"], channel_layer=channel_layer)
+        worker_task = asyncio.ensure_future(worker.arun())
+
+    peer_counter = 0
+
+    async def run_peer_slot(schema_index: int):
+        nonlocal peer_counter
+        init_message = create_init_message(schema_index, config.tasks_per_schema)
+        churned = True
+        # A churned peer is replaced by a fresh one, unless its schema has already been completed
+        while churned and init_message["schema_id"] not in results.schemas_completed:
+            peer_counter += 1
+            peer = SyntheticPeer(application, "peer" + str(peer_counter), init_message, config, sampler, rng, results)
+            churned = await peer.run()
+
+    start_wall_time = time.perf_counter()
+    start_cpu_time = time.process_time()
+    try:
+        await asyncio.gather(*(run_peer_slot(index % config.schemas) for index in range(config.peers)))
+    finally:
+        results.wall_time = time.perf_counter() - start_wall_time
+        results.process_cpu_time = time.process_time() - start_cpu_time
+        results.controller_busy_time = ProfiledController.busy_time
+        if worker:
+            worker_task.cancel()
+            for instance in worker.application_instances.values():
+                instance["future"].cancel()
+
+    return results
@@ -0,0 +1,266 @@
+import asyncio
+import heapq
+import math
+import random
+
+from task_sharding.src.message_type import MessageType
+from task_sharding.src.retry_policy import DEFAULT_BACKOFF, DEFAULT_MAX_ATTEMPTS, RetryPolicy
+from task_sharding.src.schema_details import SchemaDetails
+from task_sharding.src.schema_instance import SchemaInstance
+from task_sharding.src.task_history import TaskHistory
+from task_sharding.src.task_queue import create_task_queue
+
+SIMULATED_SCHEMA_ID = "simulated"
+SIMULATED_REPO_STATE = {"org/simulated": {"base_ref": "main", "patchset": "0" * 40}}
+
+
+class SimulatedChannelLayer:
+    """
+    Stands in for the channel layer of a schema instance, collecting the messages it sends so the
+    simulator can act on them.
+    """
+
+    def __init__(self):
+        self.sent_messages = []
+        self._message_sent = asyncio.Event()
+
+    async def send(self, channel: str, message: dict):
+        self.sent_messages.append((channel, message))
+        self._message_sent.set()
+
+    async def wait_for_message(self, timeout: float) -> bool:
+        """
+        Waits up to `timeout` seconds for a message to be sent, returning whether one has been.
+        """
+        if not self.sent_messages:
+            self._message_sent.clear()
+            try:
+                await asyncio.wait_for(self._message_sent.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+
+class SimulationConfig:
+    def __init__(
+        self,
+        peers: int = 10,
+        join_times: list = None,
+        join_window: float = 0.0,
+        failure_rate: float = 0.0,
+        estimate_error: float = 0.0,
+        seed: int = 0,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        backoff: float = DEFAULT_BACKOFF,
+    ):
+        self.peers = peers
+        self.join_times = join_times
+        self.join_window = join_window
+        self.failure_rate = failure_rate
+        self.estimate_error = estimate_error
+        self.seed = seed
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+
+class SimulationResults:
+    def __init__(self, scheduling_policy: str):
+        self.scheduling_policy = scheduling_policy
+        self.makespan = 0.0
+        self.busy_time = 0.0
+        self.available_time = 0.0
+        self.wasted_work = 0.0
+        self.tasks_completed = 0
+        self.task_failures = 0
+        self.schema_failed = False
+        self.lower_bound = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "scheduling_policy": self.scheduling_policy,
+            "makespan": self.makespan,
+            "lower_bound": self.lower_bound,
+            "peer_utilisation": self.busy_time / self.available_time if self.available_time else 0.0,
+            "wasted_work": self.wasted_work,
+            "tasks_completed": self.tasks_completed,
+            "task_failures": self.task_failures,
+            "schema_failed": self.schema_failed,
+        }
+
+
+class ScheduleSimulator:
+    """
+    A discrete-event simulation of a single schema instance. The real `SchemaInstance` makes every
+    scheduling decision; the simulator only plays the part of the peers, against a virtual clock.
+    Peers join at the configured times, run each task they are given for its duration, and fail
+    an attempt with the configured probability part way through (the time spent is wasted work).
+    The simulator also plays the part of the controller for the messages the instance sends itself,
+    such as retries after a backoff. Backoffs are waited out in real time while the simulated clock
+    stands still, so they should be kept short, and do not add to the makespan.
+    """
+
+    def __init__(self, durations: list, config: SimulationConfig, dependencies: dict = None):
+        self._durations = durations
+        self._config = config
+        self._dependencies = dependencies
+
+    def get_join_times(self, rng: random.Random) -> list:
+        if self._config.join_times is not None:
+            return list(self._config.join_times)
+        return sorted(rng.uniform(0, self._config.join_window) for _ in range(self._config.peers))
+
+    def create_task_history(self, rng: random.Random) -> TaskHistory:
+        """
+        Seeds the task history with the recorded durations, optionally scaled by lognormal noise
+        to model imperfect estimates.
+        """
+        task_history = TaskHistory()
+        for task_id, duration in enumerate(self._durations):
+            if self._config.estimate_error > 0:
+                duration *= math.exp(rng.gauss(0, self._config.estimate_error))
+            task_history.record_duration(SIMULATED_SCHEMA_ID, task_id, duration)
+        return task_history
+
+    def get_lower_bound(self, join_times: list) -> float:
+        """
+        No schedule can finish before all the work is spread evenly over every peer, nor before
+        the longest task (or chain of dependent tasks) has run.
+        """
+        if not self._durations:
+            return 0.0
+        total_work = sum(self._durations) + sum(join_times)
+        longest_chain = max(self._durations)
+        if self._dependencies:
+            chain_lengths = {}
+            for task_id in self._topological_order():
+                chain_lengths[task_id] = self._durations[task_id] + max(
+                    (chain_lengths[dependency] for dependency in self._dependencies.get(task_id, ())), default=0.0
+                )
+            longest_chain = max(chain_lengths.values())
+        return max(total_work / len(join_times), min(join_times) + longest_chain)
+
+    def _topological_order(self) -> list:
+        remaining = {task_id: len(self._dependencies.get(task_id, ())) for task_id in range(len(self._durations))}
+        dependents = {}
+        for task_id, task_dependencies in self._dependencies.items():
+            for dependency in task_dependencies:
+                dependents.setdefault(dependency, []).append(task_id)
+        order = [task_id for task_id, count in remaining.items() if count == 0]
+        for task_id in order:
+            for dependent in dependents.get(task_id, ()):
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    order.append(dependent)
+        return order
+
+    async def run(self, scheduling_policy: str) -> SimulationResults:
+        rng = random.Random(self._config.seed)
+        join_times = self.get_join_times(rng)
+        task_history = self.create_task_history(rng)
+        results = SimulationResults(scheduling_policy)
+        results.lower_bound = self.get_lower_bound(join_times)
+
+        now = 0.0
+        channel_layer = SimulatedChannelLayer()
+        retry_policy = RetryPolicy(self._config.max_attempts, self._config.backoff)
+        schema_details = SchemaDetails("simulated", SIMULATED_SCHEMA_ID, len(self._durations))
+        schema_instance = SchemaInstance(
+            schema_details,
+            task_queue=create_task_queue(
+                scheduling_policy, len(self._durations), SIMULATED_SCHEMA_ID, task_history, self._dependencies
+            ),
+            task_history=task_history,
+            channel_layer=channel_layer,
+            clock=lambda: now,
+            retry_policy=retry_policy,
+        )
+
+        # Events are ordered by time, then by the order they were scheduled in
+        events = []
+        sequence = 0
+
+        def schedule(event_time: float, event: tuple):
+            nonlocal sequence
+            sequence += 1
+            heapq.heappush(events, (event_time, sequence, event))
+
+        for peer_index, join_time in enumerate(join_times):
+            schedule(join_time, ("join", "peer" + str(peer_index)))
+
+        peer_join_times = {}
+        schema_completed = not self._durations
+        while not schema_completed and not results.schema_failed:
+            if events:
+                now, _, event = heapq.heappop(events)
+            elif retry_policy.backoff > 0 and await channel_layer.wait_for_message(
+                retry_policy.get_backoff(self._config.max_attempts) + 1.0
+            ):
+                # No peer is running a task, but a failed task's backoff has passed
+                event = ("controller",)
+            else:
+                break
+
+            if event[0] == "join":
+                consumer_id = event[1]
+                peer_join_times[consumer_id] = now
+                init_message = {
+                    "message_type": MessageType.INIT,
+                    "repo_state": SIMULATED_REPO_STATE,
+                    "complex_patchset": False,
+                    "cache_id": "simulated",
+                    "schema_id": SIMULATED_SCHEMA_ID,
+                    "total_tasks": len(self._durations),
+                }
+                schema_instance.register_consumer(consumer_id, SIMULATED_REPO_STATE)
+                await schema_instance.receive_message(init_message, consumer_id)
+            elif event[0] == "finish":
+                _, consumer_id, task_id, task_success, start_time = event
+                # Work is only counted once it has finished, as the run may end before it does
+                results.busy_time += now - start_time
+                if task_success:
+                    results.tasks_completed += 1
+                else:
+                    results.task_failures += 1
+                    results.wasted_work += now - start_time
+                task_complete_message = {
+                    "message_type": MessageType.TASK_COMPLETE,
+                    "schema_id": SIMULATED_SCHEMA_ID,
+                    "task_id": str(task_id),
+                    "task_success": task_success,
+                }
+                await schema_instance.receive_message(task_complete_message, consumer_id)
+
+            # Iterated over by index, as handling a message to the controller may send more
+            sent_message_index = 0
+            while sent_message_index < len(channel_layer.sent_messages):
+                consumer_id, message = channel_layer.sent_messages[sent_message_index]
+                sent_message_index += 1
+                if consumer_id == "controller":
+                    if message["type"] == "retry.after.backoff":
+                        await schema_instance.retry_after_backoff(int(message["task_id"]))
+                    elif message["type"] == "assign.after.affinity.wait":
+                        await schema_instance.assign_after_affinity_wait()
+                elif message["message_type"] == MessageType.SCHEMA_COMPLETE:
+                    schema_completed = True
+                elif message["message_type"] == MessageType.SCHEMA_FAILED:
+                    results.schema_failed = True
+                elif message["message_type"] == MessageType.BUILD_INSTRUCTION:
+                    task_id = int(message["task_id"])
+                    duration = self._durations[task_id]
+                    if rng.random() < self._config.failure_rate:
+                        duration *= rng.random()
+                        schedule(now + duration, ("finish", consumer_id, task_id, False, now))
+                    else:
+                        schedule(now + duration, ("finish", consumer_id, task_id, True, now))
+            channel_layer.sent_messages.clear()
+
+        if not schema_completed and not results.schema_failed:
+            raise RuntimeError("Simulation stalled with tasks remaining, are the task dependencies satisfiable?")
+
+        # Attempts still running when the schema failed kept their peers busy until then
+        for _, _, event in events:
+            if event[0] == "finish":
+                results.busy_time += now - event[4]
+        results.makespan = now
+        results.available_time = sum(now - join_time for join_time in peer_join_times.values())
+        return results
@@ -1,10 +1,40 @@
+import asyncio
 import json
+import logging
+import random
+
+from channels.exceptions import ChannelFull
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 
+from task_sharding.src.config import get_setting
+from task_sharding.src.controller import DEFAULT_INIT_RETRY_AFTER
+from task_sharding.src.message_type import MessageType
+
+logger = logging.getLogger(__name__)
+
+MAX_CONTROLLER_SEND_DELAY = 5.0
+
 
 class TaskShardingConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Relays messages between a client's websocket and the controller.
+
+    A websocket may also be shared by several clients, e.g. by a client daemon running on their
+    host. Each client then tags its messages with a `session_id` (and its `client_id`), and every
+    session is given its own channel, so that the controller sees it as a separate consumer.
+    Messages sent to a session's channel are tagged with its `session_id` on the way back.
+
+    The controller checks that consumers are still there by pinging them (see `Controller.sweep`),
+    which is answered here rather than by the client, and may tell a consumer it has evicted to close.
+    """
+
     def __init__(self, *args, **kwargs):
         self._schema_instance_id: str = None
+        self._sessions: dict[str, tuple] = {}
+        """
+        Maps the ID of each session on this websocket to its client ID, channel name and the task
+        forwarding messages from that channel.
+        """
         super().__init__(*args, **kwargs)
 
     async def connect(self):
@@ -17,6 +47,8 @@ class TaskShardingConsumer(AsyncJsonWebsocketConsumer):
         await self.channel_layer.send(
             "controller", {"type": "deregister.consumer", "client_id": self.client_id, "consumer_id": self.channel_name}
         )
+        for session_id in list(self._sessions):
+            await self._close_session(session_id)
 
     async def receive(self, text_data):
         """
@@ -24,14 +56,56 @@ class TaskShardingConsumer(AsyncJsonWebsocketConsumer):
         Get the event and send the appropriate event
         """
         response = json.loads(text_data)
+        client_id = self.client_id
+        consumer_id = self.channel_name
+
+        session_id = response.pop("session_id", None)
+        if session_id is not None:
+            session_id = str(session_id)
+            if response.get("message_type") == MessageType.SESSION_CLOSED:
+                await self._close_session(session_id)
+                return
+            client_id, consumer_id = await self._open_session(session_id, response.pop("client_id", None))
+
         message = {
             "type": "receive.message",
-            "client_id": self.client_id,
-            "consumer_id": self.channel_name,
+            "client_id": client_id,
+            "consumer_id": consumer_id,
             "message": response,
         }
 
-        await self.channel_layer.send("controller", message)
+        await self._send_to_controller(message, session_id)
+
+    async def _send_to_controller(self, message: dict, session_id: str = None):
+        """
+        Sends a message to the controller, for when its channel is full (e.g. when many clients start at
+        once). An INIT message is then refused, telling the client when to retry it, as nothing is lost by
+        the client waiting. Any other message is retried until there is room, holding up the websocket's
+        later messages meanwhile, as losing e.g. a TASK_COMPLETE message would stall its schema instance.
+        """
+        delay = 0.1
+        while True:
+            try:
+                await self.channel_layer.send("controller", message)
+                return
+            except ChannelFull:
+                if message["message"].get("message_type") == MessageType.INIT:
+                    retry_after = get_setting("INIT_RETRY_AFTER", DEFAULT_INIT_RETRY_AFTER) * random.uniform(1, 2)
+                    logger.warning(
+                        "Controller channel is full, client %s will retry in %.1fs", self.client_id, retry_after
+                    )
+                    reply = {
+                        "message_type": MessageType.RETRY_AFTER,
+                        "schema_id": message["message"].get("schema_id"),
+                        "retry_after": retry_after,
+                    }
+                    if session_id is not None:
+                        reply["session_id"] = session_id
+                    await self.send(text_data=json.dumps(reply))
+                    return
+                logger.warning("Controller channel is full, retrying in %.1fs", delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_CONTROLLER_SEND_DELAY)
 
     async def send_message(self, res):
         """
@@ -39,3 +113,48 @@ class TaskShardingConsumer(AsyncJsonWebsocketConsumer):
         """
         # Send message to WebSocket
         await self.send(text_data=json.dumps(res))
+
+    async def ping_consumer(self, message: dict):
+        await self.channel_layer.send("controller", {"type": "pong.consumer", "consumer_id": self.channel_name})
+
+    async def close_consumer(self, message: dict):
+        await self.close()
+
+    async def _open_session(self, session_id: str, client_id: str) -> tuple:
+        """
+        Returns the client ID and channel name of a session, giving it a channel on its first message.
+        """
+        if session_id not in self._sessions:
+            channel_name = await self.channel_layer.new_channel()
+            forward_task = asyncio.ensure_future(self._forward_session_messages(session_id, channel_name))
+            self._sessions[session_id] = (
+                client_id or "{}.{}".format(self.client_id, session_id),
+                channel_name,
+                forward_task,
+            )
+        client_id, channel_name, _ = self._sessions[session_id]
+        return client_id, channel_name
+
+    async def _close_session(self, session_id: str):
+        if session_id not in self._sessions:
+            return
+        client_id, channel_name, forward_task = self._sessions.pop(session_id)
+        forward_task.cancel()
+        await self.channel_layer.send(
+            "controller", {"type": "deregister.consumer", "client_id": client_id, "consumer_id": channel_name}
+        )
+
+    async def _forward_session_messages(self, session_id: str, channel_name: str):
+        while True:
+            message = await self.channel_layer.receive(channel_name)
+            if message.get("type") == "ping.consumer":
+                await self.channel_layer.send("controller", {"type": "pong.consumer", "consumer_id": channel_name})
+            elif message.get("type") == "close.consumer":
+                # The controller has already forgotten the session, so it only needs closing on this side
+                del self._sessions[session_id]
+                await self.send(
+                    text_data=json.dumps({"message_type": MessageType.WEBSOCKET_CLOSED, "session_id": session_id})
+                )
+                return
+            else:
+                await self.send(text_data=json.dumps({**message, "session_id": session_id}))
@@ -0,0 +1,144 @@
+import asyncio
+import gc
+import json
+import logging
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from task_sharding.src.message_type import MessageType
+from task_sharding.src.schema_details import SchemaDetails
+from task_sharding.src.schema_instance import SchemaInstance
+from task_sharding.src.task_history import TaskHistory
+from task_sharding.src.task_queue import SCHEDULING_POLICIES, create_task_queue
+
+REPO_STATE = json.dumps(
+    {
+        "org/repo_1": {"base_ref": "main", "patchset": "5bfb44678a27f9bc3b6a96ced8d0b464d7ea9b71"},
+        "org/repo_2": {"base_ref": "main", "patchset": "0f3c2e5a9d8b7c6e5f4a3b2c1d0e9f8a7b6c5d4e"},
+    }
+)
+
+
+class LastMessageChannelLayer:
+    """
+    Stands in for the channel layer of the measured schema instances, keeping only the last message they sent.
+    """
+
+    def __init__(self):
+        self.last_message: dict = None
+
+    async def send(self, channel: str, message: dict):
+        self.last_message = message
+
+
+def measure_allocated_bytes(function) -> tuple:
+    """
+    Calls `function` and returns its result, with the number of bytes it left allocated.
+    """
+    gc.collect()
+    allocated_before = tracemalloc.get_traced_memory()[0]
+    result = function()
+    gc.collect()
+    return result, tracemalloc.get_traced_memory()[0] - allocated_before
+
+
+def create_schema_instance(
+    total_tasks: int, scheduling_policy: str, task_history: TaskHistory, channel_layer: LastMessageChannelLayer = None
+) -> SchemaInstance:
+    schema_details = SchemaDetails("1", "benchmark", total_tasks)
+    return SchemaInstance(
+        schema_details,
+        task_queue=create_task_queue(scheduling_policy, total_tasks, schema_details.schema_id, task_history),
+        task_history=task_history,
+        channel_layer=channel_layer if channel_layer else LastMessageChannelLayer(),
+    )
+
+
+def register_consumers(schema_instance: SchemaInstance, total_consumers: int):
+    for consumer in range(total_consumers):
+        # Each consumer's repo state is parsed from its own INIT message, as it would be by the controller
+        schema_instance.register_consumer("specific.benchmark!{:032x}".format(consumer), json.loads(REPO_STATE))
+
+
+async def complete_every_task(schema_instance: SchemaInstance, channel_layer: LastMessageChannelLayer):
+    consumer_id = "specific.benchmark!0"
+    schema_instance.register_consumer(consumer_id, json.loads(REPO_STATE))
+    await schema_instance.receive_message({"message_type": MessageType.INIT}, consumer_id)
+    while channel_layer.last_message["message_type"] == MessageType.BUILD_INSTRUCTION:
+        task_id = channel_layer.last_message["task_id"]
+        await schema_instance.receive_message(
+            {"message_type": MessageType.TASK_COMPLETE, "task_id": task_id, "task_success": True}, consumer_id
+        )
+
+
+def run_every_task(total_tasks: int, scheduling_policy: str, task_history: TaskHistory) -> SchemaInstance:
+    channel_layer = LastMessageChannelLayer()
+    schema_instance = create_schema_instance(total_tasks, scheduling_policy, task_history, channel_layer)
+    asyncio.run(complete_every_task(schema_instance, channel_layer))
+    return schema_instance
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the memory held by schema instances with tracemalloc. "
+        "Reports bytes per task, before and after the tasks have run, and bytes per registered consumer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tasks", type=int, default=100000, help="Tasks in the measured schema instance")
+        parser.add_argument("--consumers", type=int, default=1000, help="Consumers registered with the instance")
+        parser.add_argument(
+            "--scheduling_policy", choices=SCHEDULING_POLICIES, default="lifo", help="Policy ordering the tasks"
+        )
+        parser.add_argument(
+            "--run_tasks", action="store_true", help="Also measure the instance once a consumer has run every task"
+        )
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        # The scheduler logs every assignment, which would dominate the measurement
+        logging.getLogger("task_sharding").setLevel(logging.WARNING)
+        total_tasks = options["tasks"]
+        total_consumers = options["consumers"]
+        task_history = TaskHistory()
+
+        tracemalloc.start()
+        try:
+            # An instance without tasks accounts for what every instance holds, whatever its size
+            _, empty_instance_bytes = measure_allocated_bytes(
+                lambda: create_schema_instance(0, options["scheduling_policy"], task_history)
+            )
+            schema_instance, instance_bytes = measure_allocated_bytes(
+                lambda: create_schema_instance(total_tasks, options["scheduling_policy"], task_history)
+            )
+            _, consumer_bytes = measure_allocated_bytes(lambda: register_consumers(schema_instance, total_consumers))
+            results = {
+                "tasks": total_tasks,
+                "consumers": total_consumers,
+                "bytes_per_instance": empty_instance_bytes,
+                "bytes_per_task": (instance_bytes - empty_instance_bytes) / max(total_tasks, 1),
+                "bytes_per_consumer": consumer_bytes / max(total_consumers, 1),
+            }
+
+            if options["run_tasks"]:
+                # The task history is shared by every instance, so it is filled by a first run and then
+                # only updated in place by the measured one
+                run_every_task(total_tasks, options["scheduling_policy"], task_history)
+                _, run_bytes = measure_allocated_bytes(
+                    lambda: run_every_task(total_tasks, options["scheduling_policy"], task_history)
+                )
+                results["bytes_per_task_run"] = (run_bytes - empty_instance_bytes) / max(total_tasks, 1)
+        finally:
+            tracemalloc.stop()
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write("Tasks: {}, consumers: {}".format(total_tasks, total_consumers))
+        self.stdout.write("Bytes per instance: {}".format(results["bytes_per_instance"]))
+        self.stdout.write("Bytes per task: {:.1f}".format(results["bytes_per_task"]))
+        self.stdout.write("Bytes per consumer: {:.1f}".format(results["bytes_per_consumer"]))
+        if "bytes_per_task_run" in results:
+            self.stdout.write("Bytes per task, once run: {:.1f}".format(results["bytes_per_task_run"]))
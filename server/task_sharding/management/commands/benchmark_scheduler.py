@@ -0,0 +1,127 @@
+import asyncio
+import json
+import logging
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from task_sharding.benchmark.load_generator import DURATION_DISTRIBUTIONS, LoadGeneratorConfig, run_load_generator
+
+CHANNEL_LAYERS = ("memory", "redis", "embedded")
+
+
+def create_channel_layers_setting(layer: str, redis_host: str, redis_port: int, capacity: int) -> dict:
+    if layer == "embedded":
+        return {
+            "default": {
+                "BACKEND": "task_sharding.src.embedded_channel_layer.EmbeddedChannelLayer",
+                "CONFIG": {
+                    "capacity": capacity,
+                    "controller": "task_sharding.benchmark.load_generator.ProfiledController",
+                },
+            }
+        }
+    if layer == "redis":
+        return {
+            "default": {
+                "BACKEND": "channels_redis.core.RedisChannelLayer",
+                "CONFIG": {"hosts": [(redis_host, redis_port)], "capacity": capacity},
+            }
+        }
+    return {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer", "CONFIG": {"capacity": capacity}}}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures scheduler throughput by driving the controller with synthetic peers. "
+        "Reports messages/s, INIT-to-first-task latency, assignment latency percentiles and controller CPU."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--peers", type=int, default=1000, help="Number of concurrent synthetic peers")
+        parser.add_argument("--schemas", type=int, default=10, help="Number of distinct schemas the peers share")
+        parser.add_argument("--tasks_per_schema", type=int, default=100, help="Tasks in each schema")
+        parser.add_argument(
+            "--duration_distribution",
+            choices=DURATION_DISTRIBUTIONS,
+            default="exponential",
+            help="Distribution synthetic task durations are drawn from",
+        )
+        parser.add_argument(
+            "--mean_task_duration", type=float, default=0.01, help="Mean synthetic task duration in seconds"
+        )
+        parser.add_argument(
+            "--churn", type=float, default=0.0, help="Probability that a peer disconnects part way through a task"
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Seed for the random number generator")
+        parser.add_argument("--timeout", type=float, default=60, help="Seconds a peer waits for a message")
+        parser.add_argument(
+            "--layer",
+            choices=CHANNEL_LAYERS,
+            nargs="+",
+            default=["memory"],
+            help=(
+                "Run a controller worker on the in-memory channel layer or a local Redis server, or run the "
+                "controller embedded in the server process. Give several to compare them"
+            ),
+        )
+        parser.add_argument("--redis_host", default="localhost", help="Redis host used by --layer=redis")
+        parser.add_argument("--redis_port", type=int, default=6379, help="Redis port used by --layer=redis")
+        parser.add_argument("--capacity", type=int, default=100000, help="Channel layer capacity per channel")
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        # The scheduler logs every assignment, which would dominate the measurement
+        logging.getLogger("task_sharding").setLevel(logging.WARNING)
+
+        config = LoadGeneratorConfig(
+            peers=options["peers"],
+            schemas=options["schemas"],
+            tasks_per_schema=options["tasks_per_schema"],
+            duration_distribution=options["duration_distribution"],
+            mean_task_duration=options["mean_task_duration"],
+            churn=options["churn"],
+            seed=options["seed"],
+            timeout=options["timeout"],
+        )
+        layer_results = {}
+        for layer in dict.fromkeys(options["layer"]):
+            channel_layers = create_channel_layers_setting(
+                layer, options["redis_host"], options["redis_port"], options["capacity"]
+            )
+            with override_settings(CHANNEL_LAYERS=channel_layers):
+                layer_results[layer] = asyncio.run(run_load_generator(config)).to_dict()
+
+        if options["json"]:
+            # A single layer keeps the output of earlier versions of this command
+            output = layer_results if len(layer_results) > 1 else next(iter(layer_results.values()))
+            self.stdout.write(json.dumps(output, indent=2))
+            return
+
+        self.stdout.write(
+            "Peers: {}, schemas: {}, tasks per schema: {}".format(config.peers, config.schemas, config.tasks_per_schema)
+        )
+        for layer, results in layer_results.items():
+            self.stdout.write("")
+            self.stdout.write("Layer: {}".format(layer))
+            self._write_results(results)
+
+    def _write_results(self, results: dict):
+        self.stdout.write("Messages: {} ({:.1f}/s)".format(results["messages"], results["messages_per_second"]))
+        self.stdout.write(
+            "Tasks completed: {}, abandoned: {}, schemas completed: {}".format(
+                results["tasks_completed"], results["tasks_abandoned"], results["schemas_completed"]
+            )
+        )
+        for name in ("init_to_first_task_seconds", "assignment_latency_seconds"):
+            latencies = results[name]
+            self.stdout.write(
+                "{}: p50={:.6f} p90={:.6f} p99={:.6f} max={:.6f} (n={})".format(
+                    name, latencies["p50"], latencies["p90"], latencies["p99"], latencies["max"], latencies["count"]
+                )
+            )
+        self.stdout.write(
+            "Wall time: {:.3f}s, process CPU: {:.3f}s, controller busy: {:.3f}s".format(
+                results["wall_time_seconds"], results["process_cpu_seconds"], results["controller_busy_seconds"]
+            )
+        )
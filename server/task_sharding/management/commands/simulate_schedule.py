@@ -0,0 +1,147 @@
+import asyncio
+import json
+import logging
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from task_sharding.benchmark.load_generator import DURATION_DISTRIBUTIONS, TaskDurationSampler
+from task_sharding.benchmark.simulator import ScheduleSimulator, SimulationConfig
+from task_sharding.src.retry_policy import DEFAULT_MAX_ATTEMPTS
+from task_sharding.src.task_queue import SCHEDULING_POLICIES
+
+
+def load_json_file(path: str):
+    with open(path) as file:
+        return json.load(file)
+
+
+def load_durations(path: str) -> list:
+    """
+    Loads recorded task durations, either as a list indexed by task ID or as an object
+    mapping task IDs to durations.
+    """
+    durations = load_json_file(path)
+    if isinstance(durations, dict):
+        return [float(durations[str(task_id)]) for task_id in range(len(durations))]
+    return [float(duration) for duration in durations]
+
+
+def load_dependencies(path: str) -> dict:
+    return {int(task_id): [int(dependency) for dependency in deps] for task_id, deps in load_json_file(path).items()}
+
+
+def generate_dependencies(total_tasks: int, max_dependencies: int, rng: random.Random) -> dict:
+    """
+    Generates a random task graph in which each task depends on up to `max_dependencies` earlier tasks.
+    """
+    dependencies = {}
+    for task_id in range(1, total_tasks):
+        total_dependencies = rng.randint(0, min(max_dependencies, task_id))
+        if total_dependencies:
+            dependencies[task_id] = rng.sample(range(task_id), total_dependencies)
+    return dependencies
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulates a schema instance against a virtual clock and compares scheduling policies by makespan, "
+        "peer utilisation and wasted work."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--durations_file", help="JSON file of recorded task durations in seconds")
+        parser.add_argument("--tasks", type=int, default=100, help="Number of synthetic tasks")
+        parser.add_argument("--duration_distribution", choices=DURATION_DISTRIBUTIONS, default="lognormal")
+        parser.add_argument("--mean_task_duration", type=float, default=60, help="Mean synthetic task duration")
+        parser.add_argument("--dependencies_file", help="JSON file mapping task IDs to the task IDs they depend on")
+        parser.add_argument(
+            "--max_dependencies", type=int, default=0, help="Generate a random task graph with this fan-in"
+        )
+        parser.add_argument("--peers", type=int, default=10, help="Number of peers")
+        parser.add_argument("--join_times_file", help="JSON list of the times (in seconds) each peer joins")
+        parser.add_argument(
+            "--join_window", type=float, default=0.0, help="Peers join at random times within this many seconds"
+        )
+        parser.add_argument("--failure_rate", type=float, default=0.0, help="Probability a task attempt fails")
+        parser.add_argument(
+            "--max_attempts",
+            type=int,
+            default=DEFAULT_MAX_ATTEMPTS,
+            help="Attempts at a task before the schema is failed",
+        )
+        parser.add_argument(
+            "--estimate_error",
+            type=float,
+            default=0.0,
+            help="Standard deviation of the log error of duration estimates",
+        )
+        parser.add_argument(
+            "--policies",
+            default=",".join(SCHEDULING_POLICIES),
+            help="Comma separated scheduling policies to compare: " + ", ".join(SCHEDULING_POLICIES),
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Seed for the random number generator")
+        parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        # The scheduler logs every assignment, which would drown out the results
+        logging.getLogger("task_sharding").setLevel(logging.WARNING)
+        rng = random.Random(options["seed"])
+
+        if options["durations_file"]:
+            durations = load_durations(options["durations_file"])
+        else:
+            sampler = TaskDurationSampler(options["duration_distribution"], options["mean_task_duration"], rng)
+            durations = [sampler.sample() for _ in range(options["tasks"])]
+
+        if options["dependencies_file"]:
+            dependencies = load_dependencies(options["dependencies_file"])
+        else:
+            dependencies = generate_dependencies(len(durations), options["max_dependencies"], rng)
+
+        join_times = load_json_file(options["join_times_file"]) if options["join_times_file"] else None
+        config = SimulationConfig(
+            peers=len(join_times) if join_times else options["peers"],
+            join_times=join_times,
+            join_window=options["join_window"],
+            failure_rate=options["failure_rate"],
+            estimate_error=options["estimate_error"],
+            seed=options["seed"],
+            max_attempts=options["max_attempts"],
+        )
+        if config.failure_rate >= 1:
+            raise CommandError("--failure_rate must be below 1 or no schema can complete")
+
+        simulator = ScheduleSimulator(durations, config, dependencies)
+        all_results = []
+        for scheduling_policy in options["policies"].split(","):
+            if scheduling_policy not in SCHEDULING_POLICIES:
+                raise CommandError("Unknown scheduling policy: " + scheduling_policy)
+            all_results.append(asyncio.run(simulator.run(scheduling_policy)).to_dict())
+
+        if options["json"]:
+            self.stdout.write(json.dumps(all_results, indent=2))
+            return
+
+        self.stdout.write(
+            "Tasks: {}, total work: {:.1f}s, peers: {}, lower bound: {:.1f}s".format(
+                len(durations), sum(durations), config.peers, all_results[0]["lower_bound"] if all_results else 0.0
+            )
+        )
+        self.stdout.write(
+            "{:<16}{:>14}{:>14}{:>16}{:>12}{:>16}".format(
+                "policy", "makespan (s)", "utilisation", "wasted work (s)", "failures", "schema failed"
+            )
+        )
+        for results in all_results:
+            self.stdout.write(
+                "{:<16}{:>14.1f}{:>14.1%}{:>16.1f}{:>12}{:>16}".format(
+                    results["scheduling_policy"],
+                    results["makespan"],
+                    results["peer_utilisation"],
+                    results["wasted_work"],
+                    results["task_failures"],
+                    "yes" if results["schema_failed"] else "no",
+                )
+            )
@@ -0,0 +1,53 @@
+class AffinityIndex:
+    """
+    Records which consumers of a schema instance have warm local state (e.g. a Bazel output base
+    which has already built the task's targets) for which tasks, as reported by the consumers.
+    """
+
+    def __init__(self):
+        self._consumer_tasks: dict[str, tuple] = {}
+        self._task_consumers: dict[int, set[str]] = {}
+
+    def add_consumer(self, consumer_id: str, recent_tasks):
+        """
+        Adds the tasks a consumer ran recently, ordered from least to most recent.
+        """
+        self.remove_consumer(consumer_id)
+        warm_tasks = tuple(dict.fromkeys(reversed(recent_tasks)))
+        if not warm_tasks:
+            return
+        self._consumer_tasks[consumer_id] = warm_tasks
+        for task in warm_tasks:
+            self._task_consumers.setdefault(task, set()).add(consumer_id)
+
+    def remove_consumer(self, consumer_id: str):
+        for task in self._consumer_tasks.pop(consumer_id, ()):
+            consumers = self._task_consumers[task]
+            consumers.discard(consumer_id)
+            if not consumers:
+                del self._task_consumers[task]
+
+    def remove_task(self, task: int):
+        """
+        Forgets a task, e.g. once it has been completed and will not be handed out again.
+        """
+        for consumer_id in self._task_consumers.pop(task, ()):
+            self._consumer_tasks[consumer_id] = tuple(
+                warm_task for warm_task in self._consumer_tasks[consumer_id] if warm_task != task
+            )
+
+    def get_warm_tasks(self, consumer_id: str) -> tuple:
+        """
+        Returns the tasks a consumer has warm state for, most recently run first.
+        """
+        return self._consumer_tasks.get(consumer_id, ())
+
+    def is_warm_elsewhere(self, task: int, consumer_id: str) -> bool:
+        """
+        Returns whether other consumers, but not this one, have warm state for a task.
+        """
+        consumers = self._task_consumers.get(task)
+        return consumers is not None and consumer_id not in consumers
+
+    def __bool__(self) -> bool:
+        return bool(self._task_consumers)
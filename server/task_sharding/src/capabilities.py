@@ -0,0 +1,52 @@
+class Capabilities:
+    """
+    The labels (e.g. an OS image or a toolchain) and amounts of resources (e.g. `memory_gb`) which a
+    consumer has, or which a task requires of the consumer it is handed to. Both are given in the
+    form `{"labels": [...], "resources": {name: amount}}`.
+
+    Capabilities are immutable and hashable, so that the tasks of a schema instance can be grouped by
+    their requirements, of which there are usually only a few distinct sets.
+    """
+
+    __slots__ = ("labels", "resources")
+
+    def __init__(self, labels=(), resources: dict = None):
+        self.labels = frozenset(str(label) for label in labels)
+        self.resources = tuple(sorted((str(name), float(amount)) for name, amount in (resources or {}).items()))
+
+    @staticmethod
+    def from_dict(capabilities: dict) -> "Capabilities":
+        if not capabilities:
+            return NO_CAPABILITIES
+        return Capabilities(capabilities.get("labels") or (), capabilities.get("resources"))
+
+    def to_dict(self) -> dict:
+        return {"labels": sorted(self.labels), "resources": dict(self.resources)}
+
+    def meets(self, requirements: "Capabilities") -> bool:
+        """
+        Returns whether these capabilities have every label, and at least the amount of every resource,
+        of `requirements`.
+        """
+        if not requirements.labels <= self.labels:
+            return False
+        resources = dict(self.resources)
+        return all(resources.get(name, 0.0) >= amount for name, amount in requirements.resources)
+
+    def get_total_requirements(self) -> int:
+        return len(self.labels) + len(self.resources)
+
+    def __bool__(self) -> bool:
+        return bool(self.labels or self.resources)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Capabilities) and self.labels == other.labels and self.resources == other.resources
+
+    def __hash__(self) -> int:
+        return hash((self.labels, self.resources))
+
+    def __repr__(self) -> str:
+        return "Capabilities(labels={}, resources={})".format(sorted(self.labels), dict(self.resources))
+
+
+NO_CAPABILITIES = Capabilities()
@@ -0,0 +1,10 @@
+from django.conf import settings
+
+SETTINGS_PREFIX = "TASK_SHARDING_"
+
+
+def get_setting(name: str, default=None):
+    """
+    Returns the value of the `TASK_SHARDING_<name>` Django setting, or `default` if it is not set.
+    """
+    return getattr(settings, SETTINGS_PREFIX + name, default)
@@ -0,0 +1,50 @@
+class ConsumerBatches:
+    """
+    Tracks the consumers of a schema instance which run several units at once (e.g. in one Bazel
+    invocation). Such a consumer is leased further units along with the one it is in progress on,
+    which it reports the results of along with it.
+    """
+
+    def __init__(self):
+        self._max_batch_sizes: dict[str, int] = {}
+        self._batched_units: dict[str, list] = {}
+
+    def set_max_batch_size(self, consumer_id: str, max_batch_size: int):
+        if max_batch_size > 1:
+            self._max_batch_sizes[consumer_id] = max_batch_size
+        else:
+            self._max_batch_sizes.pop(consumer_id, None)
+
+    def get_max_batch_size(self, consumer_id: str) -> int:
+        return self._max_batch_sizes.get(consumer_id, 1)
+
+    def remove_consumer(self, consumer_id: str) -> list:
+        """
+        Forgets a consumer which has left the instance, and returns the units batched for it, if any.
+        """
+        self._max_batch_sizes.pop(consumer_id, None)
+        return self._batched_units.pop(consumer_id, [])
+
+    def add(self, consumer_id: str, batch: list):
+        self._batched_units[consumer_id] = batch
+
+    def get(self, consumer_id: str) -> list:
+        return self._batched_units.get(consumer_id, [])
+
+    def pop(self, consumer_id: str) -> list:
+        return self._batched_units.pop(consumer_id, [])
+
+    def clear(self):
+        self._batched_units.clear()
+
+    def get_units(self):
+        """
+        Returns every unit batched with the unit a consumer is in progress on.
+        """
+        return (unit for batch in self._batched_units.values() for unit in batch)
+
+    def __contains__(self, consumer_id: str) -> bool:
+        return consumer_id in self._batched_units
+
+    def __len__(self) -> int:
+        return sum(len(batch) for batch in self._batched_units.values())
@@ -0,0 +1,59 @@
+class ConsumerLeases:
+    """
+    Tracks which consumers are running a task, across every schema instance they have joined. A
+    consumer may join an instance for each of several schemas (e.g. the build and test schemas of
+    one pipeline), and runs one task at a time across them all.
+
+    So that a consumer's schemas are run side by side rather than one after the other, an instance
+    whose task a consumer has just finished gives way to the consumer's other instances, as long
+    as one of them has a task to hand out.
+    """
+
+    def __init__(self, instances_of_consumers: dict = None):
+        self._instances_of_consumers = instances_of_consumers if instances_of_consumers is not None else {}
+        """
+        Maps each consumer to the schema instances it has joined, as kept by the controller.
+        """
+        self._busy_consumers: set[str] = set()
+        self._last_instances: dict[str, object] = {}
+        """
+        The instance whose task each consumer which has joined several instances ran last.
+        """
+
+    def get_instances(self, consumer_id: str) -> list:
+        return self._instances_of_consumers.get(consumer_id, [])
+
+    def is_busy(self, consumer_id: str) -> bool:
+        return consumer_id in self._busy_consumers
+
+    def can_assign(self, consumer_id: str, instance) -> bool:
+        """
+        Returns whether `instance` may hand the consumer a task.
+        """
+        if consumer_id in self._busy_consumers:
+            return False
+        if self._last_instances.get(consumer_id) is not instance:
+            return True
+        return not any(
+            other_instance is not instance and other_instance.has_tasks_to_hand_out()
+            for other_instance in self.get_instances(consumer_id)
+        )
+
+    def assign(self, consumer_id: str):
+        self._busy_consumers.add(consumer_id)
+
+    def release(self, consumer_id: str, instance):
+        self._busy_consumers.discard(consumer_id)
+        if len(self.get_instances(consumer_id)) > 1:
+            self._last_instances[consumer_id] = instance
+
+    def end_turn(self, consumer_id: str):
+        """
+        Lets the instance whose task the consumer ran last hand it another, e.g. once none of its other
+        instances has turned out to have a task it can run.
+        """
+        self._last_instances.pop(consumer_id, None)
+
+    def forget(self, consumer_id: str):
+        self._busy_consumers.discard(consumer_id)
+        self._last_instances.pop(consumer_id, None)
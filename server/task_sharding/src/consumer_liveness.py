@@ -0,0 +1,91 @@
+import collections
+import time
+
+DEFAULT_CONSUMER_IDLE_TIMEOUT = 60.0
+DEFAULT_PING_TIMEOUT = 30.0
+DEFAULT_MAX_CONSUMERS = 10000
+
+
+class ConsumerLiveness:
+    """
+    Tracks when each consumer was last heard from, so that consumers whose disconnection was never
+    reported (e.g. lost along with a Redis connection) can be found and evicted.
+
+    A consumer which has been silent for `idle_timeout` seconds is pinged, and is evicted if it has
+    still not been heard from `ping_timeout` seconds later. Beyond `max_consumers`, the consumers
+    heard from least recently are evicted straight away. Consumers are kept in the order they were
+    last heard from, so a sweep only visits those which are due a ping or an eviction.
+    """
+
+    def __init__(
+        self,
+        idle_timeout: float = DEFAULT_CONSUMER_IDLE_TIMEOUT,
+        ping_timeout: float = DEFAULT_PING_TIMEOUT,
+        max_consumers: int = DEFAULT_MAX_CONSUMERS,
+        clock=time.monotonic,
+    ):
+        self._consumers: collections.OrderedDict[str, list] = collections.OrderedDict()
+        """
+        Maps each consumer, least recently heard from first, to its client ID, when it was last heard
+        from and when it was pinged since then (or None).
+        """
+        self._idle_timeout = idle_timeout
+        self._ping_timeout = ping_timeout
+        self._max_consumers = max_consumers
+        self._clock = clock
+
+    def __len__(self) -> int:
+        return len(self._consumers)
+
+    def __contains__(self, consumer_id: str) -> bool:
+        return consumer_id in self._consumers
+
+    def seen(self, consumer_id: str, client_id: str = None):
+        """
+        Records that a consumer has been heard from. A consumer is only tracked once its client ID is
+        known, so that a late reply to a ping does not bring back a consumer which has been forgotten.
+        """
+        if consumer_id in self._consumers:
+            entry = self._consumers[consumer_id]
+            entry[1] = self._clock()
+            entry[2] = None
+            self._consumers.move_to_end(consumer_id)
+        elif client_id is not None:
+            self._consumers[consumer_id] = [client_id, self._clock(), None]
+
+    def forget(self, consumer_id: str):
+        self._consumers.pop(consumer_id, None)
+
+    def get_client_id(self, consumer_id: str) -> str:
+        return self._consumers[consumer_id][0]
+
+    def get_consumers(self) -> list:
+        """
+        Returns every tracked consumer, least recently heard from first.
+        """
+        return list(self._consumers)
+
+    def sweep(self) -> tuple:
+        """
+        Returns the consumers to ping, which are marked as pinged, and the consumers to evict, with
+        their client IDs, which are forgotten.
+        """
+        now = self._clock()
+        to_ping = []
+        to_evict = []
+        for consumer_id, (client_id, last_seen, pinged) in self._consumers.items():
+            if len(self._consumers) - len(to_evict) > self._max_consumers:
+                to_evict.append((consumer_id, client_id))
+            elif now - last_seen < self._idle_timeout:
+                # Every later consumer has been heard from more recently
+                break
+            elif pinged is None:
+                to_ping.append(consumer_id)
+            elif now - pinged >= self._ping_timeout:
+                to_evict.append((consumer_id, client_id))
+
+        for consumer_id, _ in to_evict:
+            del self._consumers[consumer_id]
+        for consumer_id in to_ping:
+            self._consumers[consumer_id][2] = now
+        return to_ping, to_evict
@@ -1,13 +1,51 @@
+import asyncio
+import collections
+import concurrent.futures
+import json
 import threading
 import logging
+import random
+import sys
+import time
 
 from channels.consumer import AsyncConsumer
 
+from task_sharding.src.capabilities import Capabilities
+from task_sharding.src.config import get_setting
+from task_sharding.src.consumer_leases import ConsumerLeases
+from task_sharding.src.consumer_liveness import (
+    DEFAULT_CONSUMER_IDLE_TIMEOUT,
+    DEFAULT_MAX_CONSUMERS,
+    DEFAULT_PING_TIMEOUT,
+    ConsumerLiveness,
+)
+from task_sharding.src.message_type import MessageType
+from task_sharding.src.metrics import SchedulerMetrics
+from task_sharding.src.repo_state_table import is_patchset_repo_state
+from task_sharding.src.retry_policy import create_retry_policy
 from task_sharding.src.schema_details import SchemaDetails
 from task_sharding.src.schema_instance import SchemaInstance
+from task_sharding.src.status_snapshot import publish_snapshots
+from task_sharding.src.task_history import DEFAULT_LOW_CACHE_HIT_RATIO, TaskHistory
+from task_sharding.src.task_queue import create_task_queue
+from task_sharding.src.task_shards import (
+    DEFAULT_MAX_AUTO_SHARDS,
+    ShardedTaskHistory,
+    TaskShards,
+    calculate_shard_counts,
+)
+from task_sharding.src.timeline import Timeline
 
 logger = logging.getLogger(__name__)
 
+MAX_FINISHED_TIMELINES = 20
+DEFAULT_MAX_RESUMABLE_INSTANCES = 20
+DEFAULT_MAX_SCHEMA_INSTANCES = 1000
+DEFAULT_SWEEP_INTERVAL = 10.0
+DEFAULT_MAX_PENDING_INITS = 1000
+DEFAULT_INIT_RETRY_AFTER = 1.0
+DEFAULT_STATUS_SNAPSHOT_INTERVAL = 1.0
+
 
 class Controller(AsyncConsumer):
     """
@@ -22,35 +60,235 @@ class Controller(AsyncConsumer):
         This lock should be used whenever interacting with the `schema_instances` list below.
         """
         self._client_id_to_consumer_id_map: dict[str, str] = {}
-        self._consumer_id_to_instance_map: dict[str, SchemaInstance] = {}
+        self._consumer_id_to_instances_map: dict[str, list[SchemaInstance]] = {}
+        """
+        Maps each consumer to the schema instances it has joined, one for each schema it runs, in the order it
+        joined them.
+        """
+        self._consumer_leases = ConsumerLeases(self._consumer_id_to_instances_map)
         self._schema_instances: list[SchemaInstance] = []
+        self._metrics = SchedulerMetrics()
+        self._task_history = TaskHistory(
+            low_cache_hit_ratio=get_setting("LOW_CACHE_HIT_RATIO", DEFAULT_LOW_CACHE_HIT_RATIO)
+        )
+        self._scheduling_policy = get_setting("SCHEDULING_POLICY", "lifo")
+        self._retry_policy = create_retry_policy()
+        self._shard_target_duration = get_setting("SHARD_TARGET_DURATION", None)
+        self._max_auto_shards = get_setting("MAX_AUTO_SHARDS", DEFAULT_MAX_AUTO_SHARDS)
+        self._finished_timelines: collections.OrderedDict[str, Timeline] = collections.OrderedDict()
+        """
+        Timelines of the most recently removed schema instances, kept so they can still be exported.
+        """
+        self._resumable_progress: collections.OrderedDict[tuple, dict] = collections.OrderedDict()
+        """
+        Progress of the most recently removed schema instances which had not finished, by their resume key
+        (see `_get_resume_key`), so that an instance created for the same schema, cache and patchsets carries on
+        from it rather than running every task again.
+        """
+        self._resume_keys: dict[SchemaInstance, tuple] = {}
+        self._max_resumable_instances = get_setting("MAX_RESUMABLE_INSTANCES", DEFAULT_MAX_RESUMABLE_INSTANCES)
+        self._consumer_liveness = ConsumerLiveness(
+            get_setting("CONSUMER_IDLE_TIMEOUT", DEFAULT_CONSUMER_IDLE_TIMEOUT),
+            get_setting("PING_TIMEOUT", DEFAULT_PING_TIMEOUT),
+            get_setting("MAX_CONSUMERS", DEFAULT_MAX_CONSUMERS),
+        )
+        self._max_schema_instances = get_setting("MAX_SCHEMA_INSTANCES", DEFAULT_MAX_SCHEMA_INSTANCES)
+        self._sweep_interval = get_setting("SWEEP_INTERVAL", DEFAULT_SWEEP_INTERVAL)
+        self._sweep_timer: asyncio.Future = None
+        self._init_batch_window = get_setting("INIT_BATCH_WINDOW", 0.0)
+        self._max_pending_inits = get_setting("MAX_PENDING_INITS", DEFAULT_MAX_PENDING_INITS)
+        self._init_retry_after = get_setting("INIT_RETRY_AFTER", DEFAULT_INIT_RETRY_AFTER)
+        self._pending_admissions: collections.OrderedDict[str, tuple] = collections.OrderedDict()
+        """
+        Maps each consumer whose INIT message is waiting to be matched in the next batch (see `admit_consumers`)
+        to its client ID and the messages it has sent, starting with the INIT message.
+        """
+        self._admission_timer: asyncio.Future = None
+        self._status_snapshot_published_time = 0.0
+        self._status_snapshot_stale = True
+        self._status_snapshot_interval = get_setting("STATUS_SNAPSHOT_INTERVAL", DEFAULT_STATUS_SNAPSHOT_INTERVAL)
+        self._status_snapshot_timer: asyncio.Future = None
+        self._status_snapshot_write: concurrent.futures.Future = None
         super().__init__(*args, **kwargs)
 
+    async def dispatch(self, message):
+        if self._sweep_timer is None and self._sweep_interval:
+            # Started with the first message, as that is when the controller's event loop is known
+            self._sweep_timer = asyncio.ensure_future(self._request_sweeps())
+        await super().dispatch(message)
+
     async def receive_message(self, message):
         msg = message["message"]
-        consumer_id = message["consumer_id"]
+        # Interned, so that the many references an instance keeps to each consumer share one string
+        consumer_id = sys.intern(message["consumer_id"])
         client_id = message["client_id"]
+        self._consumer_liveness.seen(consumer_id, client_id)
+        self._metrics.messages_received.inc(message_type=MessageType(int(msg["message_type"])).name)
 
-        if consumer_id in self._consumer_id_to_instance_map:
-            schema_instance = self._consumer_id_to_instance_map[consumer_id]
-        else:
-            # Find a matching schema instance or create one if it does not exist
-            schema_instance = self._find_matching_schema_instance(msg, consumer_id)
+        if MessageType(int(msg["message_type"])) == MessageType.SUPERSEDE:
+            # Sent by a consumer on behalf of others, so it is not passed to the consumer's own instance
+            await self.supersede_repo_state(msg["repo_state"])
+            return
+
+        await self._route_message(consumer_id, client_id, msg)
+
+    async def _route_message(self, consumer_id: str, client_id: str, msg: dict):
+        """
+        Passes a message on to the schema instance of the schema it names, which the consumer has joined, or
+        admits the consumer to an instance if it is an INIT message for a schema the consumer has not joined yet.
+        """
+        if consumer_id in self._pending_admissions:
+            # Kept in order behind the consumer's INIT message until it has been admitted
+            self._pending_admissions[consumer_id][1].append(msg)
+            return
 
-            # Triage (assign) the current consumer to this schema instance if untriaged
-            schema_instance.register_consumer(consumer_id, msg["repo_state"])
-            self._consumer_id_to_instance_map[consumer_id] = schema_instance
-            self._client_id_to_consumer_id_map[client_id] = consumer_id
+        schema_instance = self._get_schema_instance_of_consumer(consumer_id, msg.get("schema_id"))
+        if schema_instance is None:
+            if MessageType(int(msg["message_type"])) != MessageType.INIT:
+                # e.g. from a consumer which was told to retry its INIT message later, or has been evicted
+                logger.warning("Ignoring message from consumer %s, which has not been admitted", consumer_id)
+                return
+            if self._init_batch_window:
+                await self._queue_admission(consumer_id, client_id, msg)
+                return
+            schema_instance = self._admit_consumers([(consumer_id, client_id, msg)])[0]
 
         await schema_instance.receive_message(msg, consumer_id)
+        await self._offer_consumer_to_other_instances(consumer_id, schema_instance)
+        self._on_state_changed()
+
+    def _get_schema_instance_of_consumer(self, consumer_id: str, schema_id: str) -> SchemaInstance:
+        """
+        Returns the instance of a schema which the consumer has joined, or None. Messages which name no schema
+        are taken to be for the consumer's only instance.
+        """
+        schema_instances = self._consumer_id_to_instances_map.get(consumer_id, [])
+        if schema_id is None:
+            return schema_instances[0] if len(schema_instances) == 1 else None
+        for schema_instance in schema_instances:
+            if schema_instance.schema_details.schema_id == schema_id:
+                return schema_instance
+        return None
+
+    async def _offer_consumer_to_other_instances(self, consumer_id: str, schema_instance: SchemaInstance):
+        """
+        Once a consumer which has joined several instances is left idle by one of them, e.g. because it gave
+        way after handing the consumer a task (see `ConsumerLeases`), the consumer's other instances are offered
+        it in turn, and then that instance again.
+        """
+        schema_instances = self._consumer_leases.get_instances(consumer_id)
+        if len(schema_instances) < 2 or self._consumer_leases.is_busy(consumer_id):
+            return
+        position = schema_instances.index(schema_instance) if schema_instance in schema_instances else -1
+        for other_instance in schema_instances[position + 1 :] + schema_instances[: max(position, 0)]:
+            await other_instance.offer_consumer(consumer_id)
+            if self._consumer_leases.is_busy(consumer_id):
+                return
+        self._consumer_leases.end_turn(consumer_id)
+        await schema_instance.offer_consumer(consumer_id)
+
+    async def _queue_admission(self, consumer_id: str, client_id: str, msg: dict):
+        """
+        Queues an INIT message to be matched with the others received within `TASK_SHARDING_INIT_BATCH_WINDOW`
+        seconds, or tells the consumer to retry later if `TASK_SHARDING_MAX_PENDING_INITS` are already queued.
+        """
+        if len(self._pending_admissions) >= self._max_pending_inits:
+            retry_after = self._init_retry_after * random.uniform(1, 2)
+            logger.warning("Too many pending INIT messages, consumer %s will retry in %.1fs", consumer_id, retry_after)
+            self._metrics.inits_deferred.inc()
+            await self.channel_layer.send(
+                consumer_id,
+                {
+                    "type": "send.message",
+                    "message_type": MessageType.RETRY_AFTER,
+                    "schema_id": msg.get("schema_id"),
+                    "retry_after": retry_after,
+                },
+            )
+            return
+
+        self._pending_admissions[consumer_id] = (client_id, [msg])
+        if self._admission_timer is None:
+            self._admission_timer = asyncio.ensure_future(self._request_admission())
+
+    async def _request_admission(self):
+        """
+        Asks the controller to admit the queued consumers once the batch window has passed. As with sweeps,
+        this is sent as a message on the controller's channel, so that it is handled in turn.
+        """
+        await asyncio.sleep(self._init_batch_window)
+        await self.channel_layer.send("controller", {"type": "admit.consumers"})
+
+    async def admit_consumers(self, message: dict = None):
+        """
+        Admits every consumer whose INIT message has been queued, matching them to schema instances in a
+        single pass, and then passes each consumer's messages on to its instance in the order they were sent.
+        """
+        self._admission_timer = None
+        pending_admissions = self._pending_admissions
+        self._pending_admissions = collections.OrderedDict()
+        if not pending_admissions:
+            return
+
+        schema_instances = self._admit_consumers(
+            [(consumer_id, client_id, messages[0]) for consumer_id, (client_id, messages) in pending_admissions.items()]
+        )
+        for schema_instance, (consumer_id, (client_id, messages)) in zip(schema_instances, pending_admissions.items()):
+            await schema_instance.receive_message(messages[0], consumer_id)
+            await self._offer_consumer_to_other_instances(consumer_id, schema_instance)
+            for msg in messages[1:]:
+                await self._route_message(consumer_id, client_id, msg)
+        self._on_state_changed()
+
+    def _admit_consumers(self, init_messages: list) -> list:
+        """
+        Registers each consumer of `init_messages`, a list of consumer ID, client ID and INIT message, with
+        the most relevant schema instance, and returns the instances. The lock is taken once for them all,
+        and consumers with the same schema, cache and repo state are matched once.
+        """
+        matching_start_time = time.monotonic()
+        schema_instances = []
+        with self._lock:
+            matched_instances = {}
+            for consumer_id, client_id, msg in init_messages:
+                matching_key = (
+                    None
+                    if msg["complex_patchset"]
+                    else (msg["schema_id"], msg["cache_id"], json.dumps(msg["repo_state"], sort_keys=True))
+                )
+                schema_instance = matched_instances.get(matching_key)
+                if schema_instance is None or schema_instance.is_failed():
+                    # Find a matching schema instance or create one if it does not exist
+                    schema_instance = self._find_matching_schema_instance(msg, consumer_id)
+                    if matching_key is not None:
+                        matched_instances[matching_key] = schema_instance
+
+                # Triage (assign) the current consumer to this schema instance if untriaged
+                schema_instance.register_consumer(
+                    consumer_id,
+                    msg["repo_state"],
+                    msg.get("recent_tasks", ()),
+                    Capabilities.from_dict(msg.get("capabilities")),
+                    int(msg.get("max_batch_size", 1)),
+                )
+                self._consumer_id_to_instances_map.setdefault(consumer_id, []).append(schema_instance)
+                self._client_id_to_consumer_id_map[client_id] = consumer_id
+                schema_instances.append(schema_instance)
+
+        matching_time = (time.monotonic() - matching_start_time) / len(init_messages)
+        for _ in init_messages:
+            self._metrics.init_matching_seconds.observe(matching_time)
+        return schema_instances
 
     def _find_schema_instance_by_id(self, schema_instance_id: str) -> SchemaInstance:
+        """
+        Returns the running schema instance with an ID, or None, e.g. if it has been removed since.
+        """
         with self._lock:
             for instance in self._schema_instances:
                 if instance.schema_details.id == schema_instance_id:
                     return instance
-
-            raise Exception("Schema instance not found")
+            return None
 
     def _find_matching_schema_instance(self, msg: dict, consumer_id: str) -> SchemaInstance:
         """
@@ -61,45 +299,113 @@ class Controller(AsyncConsumer):
         not be a complex patchset.
 
         If no instance is found, a new schema instance will be created instead.
+
+        Must be called with `_lock` held.
         """
-        with self._lock:
-            complex_patchset = msg["complex_patchset"]
-            if not complex_patchset:
-                schema_id = msg["schema_id"]
-                cache_id = msg["cache_id"]
-                repo_state = msg["repo_state"]
-
-                matching_instance = None
-                highest_instance_score = -1
-                for instance in self._schema_instances:
-                    if (
-                        instance.schema_details.schema_id == schema_id
-                        and instance.schema_details.cache_id == cache_id
-                        and not complex_patchset
-                    ):
-                        instance_score = instance.get_total_common_patchsets_in_repo_state(repo_state)
-                        if instance_score > highest_instance_score:
-                            highest_instance_score = instance_score
-                            matching_instance = instance
-
-                if matching_instance:
-                    logger.info(
-                        "Consumer %s would be a perfect fit in existing instance: %s",
-                        consumer_id,
-                        matching_instance.schema_details.id,
-                    )
-                    return matching_instance
+        complex_patchset = msg["complex_patchset"]
+        if not complex_patchset:
+            schema_id = msg["schema_id"]
+            cache_id = msg["cache_id"]
+            repo_state = msg["repo_state"]
 
-            logger.info("No existing instance found for consumer %s", consumer_id)
-            return self._create_schema_instance(msg)
+            matching_instance = None
+            highest_instance_score = -1
+            for instance in self._schema_instances:
+                if (
+                    instance.schema_details.schema_id == schema_id
+                    and instance.schema_details.cache_id == cache_id
+                    and not complex_patchset
+                    and not instance.is_failed()
+                ):
+                    instance_score = instance.get_total_common_patchsets_in_repo_state(repo_state)
+                    if instance_score > highest_instance_score:
+                        highest_instance_score = instance_score
+                        matching_instance = instance
+
+            if matching_instance:
+                logger.info(
+                    "Consumer %s would be a perfect fit in existing instance: %s",
+                    consumer_id,
+                    matching_instance.schema_details.id,
+                )
+                return matching_instance
+
+        logger.info("No existing instance found for consumer %s", consumer_id)
+        return self._create_schema_instance(msg)
 
     def _create_schema_instance(self, msg: dict) -> SchemaInstance:
         schema_details = SchemaDetails(msg["cache_id"], msg["schema_id"], msg["total_tasks"])
         logger.info("Creating schema instance with ID: %s", schema_details.id)
-        schema_instance = SchemaInstance(schema_details)
+        streaming = bool(msg.get("streaming", False))
+        resume_key = self._get_resume_key(msg)
+        # The tasks of a streaming instance are not known up front, so it cannot be resumed
+        progress = None if streaming else self._resumable_progress.pop(resume_key, None)
+        if progress:
+            logger.info(
+                "Resuming schema instance %s with %d units already done", schema_details.id, len(progress["done_units"])
+            )
+            shard_counts = progress["shard_counts"]
+            done_units = progress["done_units"]
+        else:
+            shard_counts = calculate_shard_counts(
+                msg.get("shardable_tasks", {}),
+                schema_details.total_tasks,
+                schema_details.schema_id,
+                self._task_history,
+                self._shard_target_duration,
+                self._max_auto_shards,
+            )
+            done_units = ()
+        task_shards = TaskShards(schema_details.total_tasks, shard_counts)
+        if task_shards:
+            logger.info("Sharding tasks of schema instance %s: %s", schema_details.id, shard_counts)
+        task_queue = create_task_queue(
+            self._scheduling_policy,
+            task_shards.total_units,
+            schema_details.schema_id,
+            ShardedTaskHistory(self._task_history, task_shards) if task_shards else self._task_history,
+            completed_tasks=done_units,
+            task_requirements=self._get_unit_requirements(msg, task_shards, streaming),
+        )
+        schema_instance = SchemaInstance(
+            schema_details,
+            self._metrics,
+            task_queue,
+            self._task_history,
+            retry_policy=self._retry_policy,
+            task_shards=task_shards,
+            streaming=streaming,
+            done_units=done_units,
+            consumer_leases=self._consumer_leases,
+        )
         self._schema_instances.append(schema_instance)
+        self._resume_keys[schema_instance] = resume_key
         return schema_instance
 
+    @staticmethod
+    def _get_unit_requirements(msg: dict, task_shards: TaskShards, streaming: bool) -> dict:
+        """
+        Returns the `Capabilities` required by each unit of the tasks which have requirements, or None if
+        no task has any (or can be streamed in with some), so that no consumer's capabilities need to be
+        considered when handing out tasks.
+        """
+        unit_requirements = {}
+        for task, requirements in msg.get("task_requirements", {}).items():
+            requirements = Capabilities.from_dict(requirements)
+            if requirements and 0 <= int(task) < msg["total_tasks"]:
+                for unit in task_shards.get_units(int(task)):
+                    unit_requirements[unit] = requirements
+        return unit_requirements if unit_requirements or streaming else None
+
+    @staticmethod
+    def _get_resume_key(msg: dict) -> tuple:
+        """
+        Returns what a schema instance created for an INIT message must share with an earlier one to
+        resume its progress: the schema, the cache, the number of tasks and the patchset of every repo.
+        """
+        patchsets = {repo: state.get("patchset") for repo, state in msg.get("repo_state", {}).items()}
+        return (msg["schema_id"], msg["cache_id"], msg["total_tasks"], json.dumps(patchsets, sort_keys=True))
+
     async def deregister_consumer(self, message: dict):
         """
         Called when a consumer disconnects. The consumer is removed from the untriaged registry
@@ -108,14 +414,230 @@ class Controller(AsyncConsumer):
         client_id = message["client_id"]
         consumer_id = message["consumer_id"]
         with self._lock:
-            if client_id in self._client_id_to_consumer_id_map:
+            # The client may have reconnected as another consumer since
+            if self._client_id_to_consumer_id_map.get(client_id) == consumer_id:
                 del self._client_id_to_consumer_id_map[client_id]
-            if consumer_id in self._consumer_id_to_instance_map:
-                del self._consumer_id_to_instance_map[consumer_id]
-            for instance in self._schema_instances:
+            self._consumer_liveness.forget(consumer_id)
+            self._pending_admissions.pop(consumer_id, None)
+            instances_of_consumer = self._consumer_id_to_instances_map.pop(consumer_id, [])
+            self._consumer_leases.forget(consumer_id)
+            for instance in list(self._schema_instances):
                 instance.deregister_consumer(consumer_id)
                 if instance.get_total_registered_consumers() == 0:
-                    self._schema_instances.remove(instance)
+                    self._remove_schema_instance(instance)
+
+        # A task given back by the consumer may only be runnable by consumers which were left idle,
+        # e.g. if every other consumer had already failed it
+        for instance_of_consumer in instances_of_consumer:
+            if instance_of_consumer.get_total_registered_consumers() > 0:
+                await instance_of_consumer.send_build_instructions_to_idle_consumers({})
+        self._on_state_changed()
+
+    async def assign_after_affinity_wait(self, message: dict):
+        """
+        Sent by a schema instance once the tasks it has held back for consumers with warm state for them
+        may be handed to any consumer (see `SchemaInstance._request_from_controller`).
+        """
+        schema_instance = self._find_schema_instance_by_id(message["instance_id"])
+        if schema_instance is not None:
+            await schema_instance.assign_after_affinity_wait()
+            self._on_state_changed()
+
+    async def retry_after_backoff(self, message: dict):
+        """
+        Sent by a schema instance once the backoff before retrying a failed task has passed.
+        """
+        schema_instance = self._find_schema_instance_by_id(message["instance_id"])
+        if schema_instance is not None:
+            await schema_instance.retry_after_backoff(int(message["task_id"]))
+            self._on_state_changed()
+
+    async def pong_consumer(self, message: dict):
+        """
+        Called by a consumer in reply to a ping sent by `sweep`.
+        """
+        self._consumer_liveness.seen(message["consumer_id"])
+
+    async def _request_sweeps(self):
+        """
+        Asks the controller to sweep every `TASK_SHARDING_SWEEP_INTERVAL` seconds. The sweep is sent as a
+        message on the controller's channel, so that it is handled in turn with every other message.
+        """
+        while True:
+            await asyncio.sleep(self._sweep_interval)
+            await self.channel_layer.send("controller", {"type": "sweep"})
+
+    async def sweep(self, message: dict = None):
+        """
+        Bounds the controller's state when consumers disconnect without it being told, e.g. when
+        their disconnection is lost along with a Redis connection. Consumers which have been silent
+        for `TASK_SHARDING_CONSUMER_IDLE_TIMEOUT` seconds are pinged through the channel layer, and
+        evicted if they do not reply within `TASK_SHARDING_PING_TIMEOUT` seconds. Consumers beyond
+        `TASK_SHARDING_MAX_CONSUMERS`, and schema instances beyond `TASK_SHARDING_MAX_SCHEMA_INSTANCES`,
+        are evicted least recently active first. Schema instances left without consumers are removed.
+        """
+        consumers_to_ping, consumers_to_evict = self._consumer_liveness.sweep()
+        for consumer_id in consumers_to_ping:
+            await self.channel_layer.send(consumer_id, {"type": "ping.consumer"})
+        for consumer_id, client_id in consumers_to_evict:
+            await self._evict_consumer(consumer_id, client_id, "unresponsive")
+
+        for instance in self._get_excess_schema_instances():
+            logger.warning("Evicting schema instance %s, as there are too many", instance.schema_details.id)
+            for consumer_id, instances_of_consumer in list(self._consumer_id_to_instances_map.items()):
+                if instance in instances_of_consumer:
+                    client_id = (
+                        self._consumer_liveness.get_client_id(consumer_id)
+                        if consumer_id in self._consumer_liveness
+                        else None
+                    )
+                    await self._evict_consumer(consumer_id, client_id, "too_many_schema_instances")
+
+        with self._lock:
+            for instance in list(self._schema_instances):
+                if instance.get_total_registered_consumers() == 0:
+                    logger.info("Removing schema instance %s, as it has no consumers", instance.schema_details.id)
+                    self._remove_schema_instance(instance)
+        self._on_state_changed()
+
+    def _get_excess_schema_instances(self) -> list:
+        """
+        Returns the schema instances beyond `TASK_SHARDING_MAX_SCHEMA_INSTANCES`, those whose consumers
+        were heard from least recently first.
+        """
+        with self._lock:
+            total_excess = len(self._schema_instances) - self._max_schema_instances
+            if total_excess <= 0:
+                return []
+            instances_by_activity = {instance: None for instance in self._schema_instances}
+            for consumer_id in self._consumer_liveness.get_consumers():
+                for instance in self._consumer_id_to_instances_map.get(consumer_id, []):
+                    if instance in instances_by_activity:
+                        # Moved to the end, so that the instances end up ordered by their latest activity
+                        del instances_by_activity[instance]
+                        instances_by_activity[instance] = None
+            return list(instances_by_activity)[:total_excess]
+
+    async def _evict_consumer(self, consumer_id: str, client_id: str, reason: str):
+        logger.warning("Evicting consumer %s (%s)", consumer_id, reason)
+        self._metrics.consumers_evicted.inc(reason=reason)
+        # In case the consumer is still there, e.g. if only its replies were lost, it is told to close
+        await self.channel_layer.send(consumer_id, {"type": "close.consumer"})
+        await self.deregister_consumer({"client_id": client_id, "consumer_id": consumer_id})
+
+    def _remove_schema_instance(self, instance: SchemaInstance):
+        """
+        Must be called with `_lock` held.
+        """
+        self._schema_instances.remove(instance)
+        self._retain_finished_timeline(instance)
+        self._retain_resumable_progress(instance)
+        self._metrics.queue_depth.remove(
+            instance_id=instance.schema_details.id, schema_id=instance.schema_details.schema_id
+        )
+        self._metrics.tasks_in_progress.remove(
+            instance_id=instance.schema_details.id, schema_id=instance.schema_details.schema_id
+        )
+
+    async def supersede_repo_state(self, repo_state: dict) -> list:
+        """
+        Cancels every schema instance with a consumer on `repo_state` (a repo state as sent in INIT
+        messages, of which only the patchsets are compared), e.g. because a newer patchset has been
+        pushed. The instances are removed straight away, so that no new consumer joins them, and their
+        consumers are told to stop. Returns the IDs of the cancelled instances, of which there are none
+        if `repo_state` does not name a patchset for each of its repositories.
+        """
+        if not is_patchset_repo_state(repo_state):
+            logger.warning("Ignoring request to supersede malformed repo state %r", repo_state)
+            return []
+        with self._lock:
+            superseded_instances = [
+                instance for instance in self._schema_instances if instance.has_repo_state(repo_state)
+            ]
+            # Consumers stay mapped to their instance, which ignores anything they send until they disconnect
+            for instance in superseded_instances:
+                self._remove_schema_instance(instance)
+
+        for instance in superseded_instances:
+            logger.info("Schema instance %s has been superseded", instance.schema_details.id)
+            self._metrics.schema_instances_superseded.inc(schema_id=instance.schema_details.schema_id)
+            await instance.supersede()
+        self._on_state_changed()
+        return [instance.schema_details.id for instance in superseded_instances]
+
+    async def supersede_repo_state_msg(self, message: dict):
+        channel_name = message["channel_name"]
+        superseded_instances = await self.supersede_repo_state(message["repo_state"])
+        await self.channel_layer.send(
+            channel_name, {"type": channel_name, "superseded_instances": superseded_instances}
+        )
+
+    def _on_state_changed(self):
+        """
+        Marks the status snapshot as stale, and publishes a new one if the last was published
+        `TASK_SHARDING_STATUS_SNAPSHOT_INTERVAL` seconds ago or more, or else once that has passed.
+        """
+        self._status_snapshot_stale = True
+        remaining_interval = self._status_snapshot_interval - (time.monotonic() - self._status_snapshot_published_time)
+        if remaining_interval <= 0:
+            self._publish_status_snapshot()
+        elif self._status_snapshot_timer is None:
+            self._status_snapshot_timer = asyncio.ensure_future(self._request_status_snapshot(remaining_interval))
+
+    async def _request_status_snapshot(self, delay: float):
+        """
+        Asks the controller to publish the changes made since the last status snapshot once the interval
+        has passed. As with sweeps, this is sent as a message on the controller's channel, so that it is
+        handled in turn with every other message.
+        """
+        await asyncio.sleep(delay)
+        await self.channel_layer.send("controller", {"type": "publish.status.snapshot"})
+
+    async def publish_status_snapshot(self, message: dict = None):
+        self._status_snapshot_timer = None
+        if self._status_snapshot_stale:
+            self._publish_status_snapshot()
+
+    def _publish_status_snapshot(self):
+        """
+        Publishes a new status snapshot, along with a metrics snapshot, which `/status` and `/metrics`
+        serve without involving the controller (see `store_status_snapshot`), so polling them never
+        touches the live scheduling state. Only building the snapshots is done on the scheduling path,
+        while storing them is left to a thread of its own (see `publish_snapshots`).
+        """
+        with self._lock:
+            schema_instances = tuple(self._schema_instances)
+        status_snapshot = {
+            "published_at": time.time(),
+            "schema_instances": [instance.get_status() for instance in schema_instances],
+        }
+        self._status_snapshot_write = publish_snapshots(status_snapshot, self.get_metrics_snapshot())
+        self._status_snapshot_published_time = time.monotonic()
+        self._status_snapshot_stale = False
+
+    async def wait_for_status_snapshot_msg(self, message: dict):
+        """
+        Replies once the last status snapshot published has been stored.
+        """
+        channel_name = message["channel_name"]
+        if self._status_snapshot_write is not None:
+            await asyncio.wrap_future(self._status_snapshot_write)
+        await self.channel_layer.send(channel_name, {"type": channel_name})
+
+    def _retain_finished_timeline(self, instance: SchemaInstance):
+        self._finished_timelines[instance.schema_details.id] = instance.timeline
+        while len(self._finished_timelines) > MAX_FINISHED_TIMELINES:
+            self._finished_timelines.popitem(last=False)
+
+    def _retain_resumable_progress(self, instance: SchemaInstance):
+        resume_key = self._resume_keys.pop(instance, None)
+        progress = instance.get_progress()
+        if resume_key is None or progress is None or self._max_resumable_instances <= 0:
+            return
+        self._resumable_progress[resume_key] = progress
+        self._resumable_progress.move_to_end(resume_key)
+        while len(self._resumable_progress) > self._max_resumable_instances:
+            self._resumable_progress.popitem(last=False)
 
     def get_total_registered_consumers(self) -> int:
         total_registered_consumers = 0
@@ -143,10 +665,45 @@ class Controller(AsyncConsumer):
 
     def get_schema_instance_id_for_client_id(self, client_id: str) -> str:
         consumer_id = self._client_id_to_consumer_id_map[client_id]
-        return self._consumer_id_to_instance_map[consumer_id].schema_details.id
+        return self._consumer_id_to_instances_map[consumer_id][0].schema_details.id
 
     async def get_schema_instance_id_for_client_id_msg(self, message: dict) -> str:
         channel_name = message["channel_name"]
         client_id = message["id"]
         schema_instance_id = self.get_schema_instance_id_for_client_id(client_id)
         await self.channel_layer.send(channel_name, {"type": channel_name, "schema_instance_id": schema_instance_id})
+
+    def get_metrics_snapshot(self) -> list:
+        """
+        Refreshes the per-instance gauges and returns a serialisable copy of every metric.
+        No lock is taken, so a scrape never waits on (or holds up) the scheduling path.
+        """
+        schema_instances = tuple(self._schema_instances)
+        self._metrics.schema_instances.set(len(schema_instances))
+        for instance in schema_instances:
+            labels = {"instance_id": instance.schema_details.id, "schema_id": instance.schema_details.schema_id}
+            self._metrics.queue_depth.set(instance.get_total_tasks_not_started(), **labels)
+            self._metrics.tasks_in_progress.set(instance.get_total_tasks_in_progress(), **labels)
+        return self._metrics.snapshot()
+
+    async def get_metrics_snapshot_msg(self, message: dict):
+        channel_name = message["channel_name"]
+        metrics_snapshot = self.get_metrics_snapshot()
+        await self.channel_layer.send(channel_name, {"type": channel_name, "metrics_snapshot": metrics_snapshot})
+
+    def get_schema_instance_timeline(self, schema_instance_id: str) -> dict:
+        """
+        Returns the timeline of a running or recently finished schema instance in the
+        Chrome Trace Event format, or None if the instance is unknown.
+        """
+        for instance in tuple(self._schema_instances):
+            if instance.schema_details.id == schema_instance_id:
+                return instance.timeline.to_chrome_trace(schema_instance_id)
+        if schema_instance_id in self._finished_timelines:
+            return self._finished_timelines[schema_instance_id].to_chrome_trace(schema_instance_id)
+        return None
+
+    async def get_schema_instance_timeline_msg(self, message: dict):
+        channel_name = message["channel_name"]
+        timeline = self.get_schema_instance_timeline(message["id"])
+        await self.channel_layer.send(channel_name, {"type": channel_name, "timeline": timeline})
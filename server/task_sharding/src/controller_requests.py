@@ -0,0 +1,25 @@
+import asyncio
+
+from channels.layers import get_channel_layer
+
+CONTROLLER_REQUEST_TIMEOUT = 5
+
+
+async def request_from_controller(
+    message_type: str, response_key: str, message: dict = None, timeout: float = CONTROLLER_REQUEST_TIMEOUT
+):
+    """
+    Sends a request message to the controller over the channel layer and waits for its response
+    on a freshly created reply channel. Raises `asyncio.TimeoutError` if the controller does not
+    respond in time.
+    """
+    channel_layer = get_channel_layer()
+    channel_name = await channel_layer.new_channel()
+
+    request = dict(message) if message else {}
+    request["type"] = message_type
+    request["channel_name"] = channel_name
+    await channel_layer.send("controller", request)
+
+    response = await asyncio.wait_for(channel_layer.receive(channel_name), timeout)
+    return response[response_key]
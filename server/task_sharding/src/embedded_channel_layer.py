@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+from django.utils.module_loading import import_string
+
+CONTROLLER_CHANNEL = "controller"
+DEFAULT_CONTROLLER = "task_sharding.src.controller.Controller"
+
+
+class EmbeddedChannelLayer(InMemoryChannelLayer):
+    """
+    A channel layer for running the whole server in a single process. Messages sent to the
+    controller channel are handed straight to a controller owned by the layer, rather than queued
+    for a separate `runworker controller` process, and every other message (e.g. those sent to
+    consumers) goes through an in-process queue.
+
+    Messages are not copied as they would be by other layers, so they must not be modified once sent.
+    """
+
+    def __init__(self, controller: str = DEFAULT_CONTROLLER, **kwargs):
+        super().__init__(**kwargs)
+        self._controller_class = import_string(controller)
+        self._controller = None
+        self._controller_lock: asyncio.Lock = None
+
+    async def send(self, channel: str, message: dict):
+        if channel == CONTROLLER_CHANNEL:
+            await self._dispatch_to_controller(message)
+            return
+
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        queue = self.channels.setdefault(channel, asyncio.Queue())
+        if queue.qsize() >= self.capacity:
+            raise ChannelFull(channel)
+        queue.put_nowait((time.time() + self.expiry, message))
+
+    async def _dispatch_to_controller(self, message: dict):
+        if self._controller is None:
+            # Created on first use, so that the lock belongs to the running event loop
+            self._controller = self._controller_class()
+            self._controller.channel_layer = self
+            self._controller_lock = asyncio.Lock()
+
+        # The controller handles one message at a time, as it does when run as a worker
+        async with self._controller_lock:
+            await self._controller.dispatch(message)
@@ -0,0 +1,158 @@
+import logging
+import logging.handlers
+import queue
+
+from task_sharding.src.config import get_setting
+
+DEFAULT_EVENT_LEVELS = {
+    # Emitted for every task, so these are kept out of INFO logs by default
+    "assigned": logging.DEBUG,
+    "completed": logging.DEBUG,
+    "tasks_remaining": logging.DEBUG,
+    "schema_complete_sent": logging.DEBUG,
+    # Tasks which no consumer can run wait until one which can connects, which may be never
+    "requirements_unmet": logging.WARNING,
+}
+DEFAULT_EVENT_LEVEL = logging.INFO
+DEFAULT_MAX_QUEUED_RECORDS = 10000
+
+
+class _LazyEvent:
+    """
+    Formats an event only when a handler actually writes it out.
+    """
+
+    __slots__ = ("prefix", "event", "fields")
+
+    def __init__(self, prefix: str, event: str, fields: dict):
+        self.prefix = prefix
+        self.event = event
+        self.fields = fields
+
+    def __str__(self) -> str:
+        formatted_fields = " ".join("{}={}".format(key, value) for key, value in self.fields.items())
+        return "[{}] {} {}".format(self.prefix, self.event, formatted_fields).rstrip()
+
+
+class EventLogger:
+    """
+    Logs structured scheduling events. Each event type has its own level and sample rate, and both
+    are checked before anything is formatted. Events are passed to the logger as a lazily formatted
+    argument, with the event name and fields attached to the record as `event` and `event_fields`.
+    """
+
+    def __init__(self, logger: logging.Logger, prefix: str, levels: dict = None, sample_rates: dict = None):
+        self._logger = logger
+        self._prefix = prefix
+        self._levels = levels if levels is not None else DEFAULT_EVENT_LEVELS
+        self._sample_rates = sample_rates if sample_rates is not None else {}
+        self._sample_credits = {}
+
+    def emit(self, event: str, **fields):
+        level = self._levels.get(event, DEFAULT_EVENT_LEVEL)
+        if not self._logger.isEnabledFor(level):
+            return
+
+        sample_rate = self._sample_rates.get(event, 1.0)
+        if sample_rate < 1.0:
+            # Deterministic sampling: emit one in every 1/sample_rate events of this type
+            credit = self._sample_credits.get(event, 0.0) + sample_rate
+            if credit < 1.0:
+                self._sample_credits[event] = credit
+                return
+            self._sample_credits[event] = credit - 1.0
+
+        self._logger.log(
+            level, "%s", _LazyEvent(self._prefix, event, fields), extra={"event": event, "event_fields": fields}
+        )
+
+
+def create_event_logger(logger: logging.Logger, prefix: str) -> EventLogger:
+    """
+    Creates an event logger configured by the `TASK_SHARDING_EVENT_LOG_LEVELS` and
+    `TASK_SHARDING_EVENT_LOG_SAMPLE_RATES` settings, which map event names to a level name
+    (e.g. "DEBUG") and to the fraction of events to keep respectively.
+    """
+    levels = dict(DEFAULT_EVENT_LEVELS)
+    for event, level in get_setting("EVENT_LOG_LEVELS", {}).items():
+        levels[event] = logging.getLevelName(level) if isinstance(level, str) else level
+    return EventLogger(logger, prefix, levels, get_setting("EVENT_LOG_SAMPLE_RATES", {}))
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    """
+    Writes the records queued by a `NonBlockingLogHandler`, followed by a warning of how many records
+    it dropped each time the queue drains after some were.
+    """
+
+    def __init__(self, handler: "NonBlockingLogHandler"):
+        super().__init__(handler.queue, handler.target)
+        self._handler = handler
+        self._reported_dropped_records = 0
+
+    def handle(self, record: logging.LogRecord):
+        super().handle(record)
+        if self.queue.empty():
+            self.report_dropped_records()
+
+    def report_dropped_records(self):
+        dropped_records = self._handler.dropped_records - self._reported_dropped_records
+        if dropped_records <= 0:
+            return
+        self._reported_dropped_records += dropped_records
+        super().handle(
+            logging.LogRecord(
+                __name__,
+                logging.WARNING,
+                __file__,
+                0,
+                "Dropped %d log records, as they were logged faster than they could be written",
+                (dropped_records,),
+                None,
+            )
+        )
+
+    def enqueue_sentinel(self):
+        # Wait for room in the queue, so records already queued are still written on shutdown
+        self.queue.put(self._sentinel)
+
+
+class NonBlockingLogHandler(logging.handlers.QueueHandler):
+    """
+    A log handler which hands records to a background thread for formatting and writing, so that
+    logging never blocks the caller. Records are dropped if the queue is full, and how many were
+    is logged once the queue has drained.
+    """
+
+    def __init__(self, target: logging.Handler = None, max_queued_records: int = DEFAULT_MAX_QUEUED_RECORDS):
+        super().__init__(queue.Queue(max_queued_records))
+        self.target = target if target else logging.StreamHandler()
+        self.dropped_records = 0
+        self._listener = _QueueListener(self)
+        self._listener.start()
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread, by the target handler
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike QueueHandler, leave the message unformatted; the listener thread formats it
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_records += 1
+
+    def flush(self):
+        self.target.flush()
+
+    def close(self):
+        if self._listener:
+            self._listener.stop()
+            # Records dropped after the queue last drained
+            self._listener.report_dropped_records()
+            self._listener = None
+        self.target.close()
+        super().close()
@@ -0,0 +1,226 @@
+import math
+
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+DEFAULT_DURATION_BUCKETS = (1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1200.0, 1800.0, 3600.0)
+RATIO_BUCKETS = (0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+
+class _Metric:
+    metric_type: str = None
+
+    def __init__(self, name: str, documentation: str, label_names: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[label_name]) for label_name in self.label_names)
+
+    def remove(self, **labels):
+        self._values.pop(self._key(labels), None)
+
+    def clear(self):
+        self._values = {}
+
+    def snapshot(self) -> dict:
+        """
+        Returns a plain, serialisable copy of the metric. The copy is taken without any
+        locks because metrics are only ever written from the controller's event loop.
+        """
+        return {
+            "name": self.name,
+            "type": self.metric_type,
+            "help": self.documentation,
+            "samples": [[dict(zip(self.label_names, key)), value] for key, value in list(self._values.items())],
+        }
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(
+        self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_LATENCY_BUCKETS
+    ):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        if key not in self._values:
+            # Per-bucket (non-cumulative) counts, followed by the sum and the total count
+            self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        bucket_counts, total, count = self._values[key]
+        for index, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                bucket_counts[index] += 1
+                break
+        self._values[key] = [bucket_counts, total + value, count + 1]
+
+    def snapshot(self) -> dict:
+        snapshot = super().snapshot()
+        snapshot["buckets"] = list(self.buckets)
+        snapshot["samples"] = [
+            [labels, [list(bucket_counts), total, count]]
+            for labels, (bucket_counts, total, count) in snapshot["samples"]
+        ]
+        return snapshot
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def counter(self, name: str, documentation: str, label_names: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, label_names))
+
+    def histogram(
+        self, name: str, documentation: str, label_names: tuple = (), buckets: tuple = DEFAULT_LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, label_names, buckets))
+
+    def _register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> list:
+        return [metric.snapshot() for metric in self._metrics]
+
+
+class SchedulerMetrics:
+    """
+    The set of metrics recorded by the controller and its schema instances.
+    """
+
+    def __init__(self):
+        self.registry = MetricsRegistry()
+        self.messages_received = self.registry.counter(
+            "task_sharding_controller_messages_total",
+            "Messages handled by the controller.",
+            ("message_type",),
+        )
+        self.init_matching_seconds = self.registry.histogram(
+            "task_sharding_init_matching_seconds",
+            "Time taken to match an INIT message to a schema instance.",
+        )
+        self.assignment_latency_seconds = self.registry.histogram(
+            "task_sharding_assignment_latency_seconds",
+            "Time between a TASK_COMPLETE and the next BUILD_INSTRUCTION sent to the same consumer.",
+        )
+        self.task_duration_seconds = self.registry.histogram(
+            "task_sharding_task_duration_seconds",
+            "Time between a BUILD_INSTRUCTION and its TASK_COMPLETE.",
+            ("schema_id", "task_success"),
+            DEFAULT_DURATION_BUCKETS,
+        )
+        self.task_outcomes = self.registry.counter(
+            "task_sharding_task_outcomes_total",
+            "Tasks which passed first time, passed after failing (flaky) or ran out of attempts (broken).",
+            ("schema_id", "outcome"),
+        )
+        self.task_cache_hit_ratio = self.registry.histogram(
+            "task_sharding_task_cache_hit_ratio",
+            "Cache hit ratios of task runs, as reported by the consumers which ran them.",
+            ("schema_id",),
+            RATIO_BUCKETS,
+        )
+        self.affinity_assignments = self.registry.counter(
+            "task_sharding_affinity_assignments_total",
+            "Tasks assigned, by whether the consumer reported warm state for the task.",
+            ("schema_id", "warm"),
+        )
+        self.schema_instances_superseded = self.registry.counter(
+            "task_sharding_schema_instances_superseded_total",
+            "Schema instances cancelled because their repo state was superseded.",
+            ("schema_id",),
+        )
+        self.inits_deferred = self.registry.counter(
+            "task_sharding_inits_deferred_total",
+            "INIT messages which consumers were told to retry later, as too many were waiting to be matched.",
+        )
+        self.consumers_evicted = self.registry.counter(
+            "task_sharding_consumers_evicted_total",
+            "Consumers evicted without having disconnected, as unresponsive or to bound the controller's state.",
+            ("reason",),
+        )
+        self.queue_depth = self.registry.gauge(
+            "task_sharding_queue_depth",
+            "Tasks waiting to be assigned, per schema instance.",
+            ("instance_id", "schema_id"),
+        )
+        self.tasks_in_progress = self.registry.gauge(
+            "task_sharding_tasks_in_progress",
+            "Tasks currently assigned to a consumer, per schema instance.",
+            ("instance_id", "schema_id"),
+        )
+        self.schema_instances = self.registry.gauge(
+            "task_sharding_schema_instances",
+            "Schema instances currently running.",
+        )
+
+    def snapshot(self) -> list:
+        return self.registry.snapshot()
+
+
+def _format_labels(labels: dict, extra_labels: dict = None) -> str:
+    labels = dict(labels, **(extra_labels or {}))
+    if not labels:
+        return ""
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+def render_prometheus(snapshot: list) -> str:
+    """
+    Renders a metrics snapshot in the Prometheus text exposition format.
+    """
+    lines = []
+    for metric in snapshot:
+        name = metric["name"]
+        lines.append("# HELP {} {}".format(name, metric["help"]))
+        lines.append("# TYPE {} {}".format(name, metric["type"]))
+        if metric["type"] != "histogram":
+            for labels, value in metric["samples"]:
+                lines.append("{}{} {}".format(name, _format_labels(labels), _format_value(value)))
+            continue
+
+        for labels, (bucket_counts, total, count) in metric["samples"]:
+            cumulative_count = 0
+            for upper_bound, bucket_count in zip(metric["buckets"], bucket_counts):
+                cumulative_count += bucket_count
+                lines.append(
+                    "{}_bucket{} {}".format(
+                        name, _format_labels(labels, {"le": _format_value(upper_bound)}), cumulative_count
+                    )
+                )
+            lines.append("{}_bucket{} {}".format(name, _format_labels(labels, {"le": "+Inf"}), count))
+            lines.append("{}_sum{} {}".format(name, _format_labels(labels), _format_value(total)))
+            lines.append("{}_count{} {}".format(name, _format_labels(labels), count))
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,67 @@
+from array import array
+import math
+
+NOT_REMAINING = -1.0
+
+
+class RemainingWork:
+    """
+    Keeps the expected durations of the units of a schema instance which have not passed yet, along
+    with their total, so that the time the instance has left can be estimated without going through
+    every unit. A unit's expected duration is taken when it is added, and is not updated if more
+    durations of its task are recorded while the instance runs.
+    """
+
+    __slots__ = ("_durations", "_known_duration", "_known_units", "_unknown_units")
+
+    def __init__(self):
+        self._durations = array("d")
+        """
+        The expected duration of each unit, NaN if it is not known, or `NOT_REMAINING` if the unit has
+        passed or was never added. Held as machine doubles, as there may be many thousands of units.
+        """
+        self._known_duration = 0.0
+        self._known_units = 0
+        self._unknown_units = 0
+
+    def add(self, unit: int, expected_duration: float = None):
+        if unit >= len(self._durations):
+            self._durations.extend([NOT_REMAINING] * (unit + 1 - len(self._durations)))
+        elif unit in self:
+            return
+        if expected_duration is None:
+            self._durations[unit] = math.nan
+            self._unknown_units += 1
+        else:
+            self._durations[unit] = expected_duration
+            self._known_duration += expected_duration
+            self._known_units += 1
+
+    def remove(self, unit: int):
+        if unit not in self:
+            return
+        expected_duration = self._durations[unit]
+        self._durations[unit] = NOT_REMAINING
+        if math.isnan(expected_duration):
+            self._unknown_units -= 1
+            return
+        self._known_units -= 1
+        # Reset once empty, so that rounding errors do not build up
+        self._known_duration = self._known_duration - expected_duration if self._known_units else 0.0
+
+    def get_expected_duration(self, unit: int) -> float:
+        """
+        Returns the expected duration the unit was added with, or None if it was not known.
+        """
+        expected_duration = self._durations[unit]
+        return None if math.isnan(expected_duration) else expected_duration
+
+    def get_totals(self) -> tuple:
+        """
+        Returns the total expected duration of the remaining units whose duration is known, how many
+        of them there are, and how many remaining units have no known duration.
+        """
+        return self._known_duration, self._known_units, self._unknown_units
+
+    def __contains__(self, unit: int) -> bool:
+        return 0 <= unit < len(self._durations) and self._durations[unit] != NOT_REMAINING
@@ -0,0 +1,124 @@
+import json
+import sys
+
+
+class RepoStateTable:
+    """
+    Holds a single copy of each distinct repo state registered with a schema instance, as its
+    consumers mostly share the same one. The strings of each repo state are interned, so that they
+    are also shared with the repo states held by other instances.
+    """
+
+    __slots__ = ("_repo_states",)
+
+    def __init__(self):
+        self._repo_states: dict[str, list] = {}
+        """
+        Maps the canonical JSON form of each repo state to the repo state and its number of references.
+        """
+
+    def add(self, repo_state: dict) -> dict:
+        """
+        Adds a reference to a repo state, and returns the copy of it held by the table.
+        """
+        key = json.dumps(repo_state, sort_keys=True)
+        entry = self._repo_states.get(key)
+        if entry is None:
+            entry = self._repo_states[key] = [_intern_strings(repo_state), 0]
+        entry[1] += 1
+        return entry[0]
+
+    def remove(self, repo_state: dict):
+        """
+        Removes a reference to a repo state, forgetting it once nothing refers to it.
+        """
+        key = json.dumps(repo_state, sort_keys=True)
+        entry = self._repo_states[key]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._repo_states[key]
+
+    def has_patchsets(self, repo_state: dict) -> bool:
+        """
+        Returns whether a repo state in the table is on the patchset given for every repository in `repo_state`.
+        An empty repo state names no patchset, so it is never had.
+        """
+        if not repo_state:
+            return False
+        return any(
+            all(
+                repo_name in table_repo_state
+                and table_repo_state[repo_name]["patchset"] == repo_state[repo_name]["patchset"]
+                for repo_name in repo_state
+            )
+            for table_repo_state in self
+        )
+
+    def get_total_common_patchsets(self, repo_state: dict) -> int:
+        """
+        Scores how closely the repo states in the table match `repo_state` by the patchsets they have in
+        common with it, or returns -1 if any of them is of other repositories or branches.
+        """
+        common_patchsets_sum = -1
+
+        # Loop over every repository sent by the client
+        for repo_name in repo_state:
+            client_repo = repo_state[repo_name]
+            client_branch = client_repo["base_ref"]
+
+            # Loop over the repo state of every consumer in the table
+            unique_patchsets_in_repo = set()
+            for consumer_repo_state in self:
+                # Repos must be the same
+                if not repo_name in consumer_repo_state:
+                    return -1
+
+                consumer_repo = consumer_repo_state[repo_name]
+                consumer_branch = consumer_repo["base_ref"]
+
+                # Branch name must be the same
+                if not client_branch == consumer_branch:
+                    return -1
+
+                # Add existing repo patchesets to a set
+                if "additional_patchsets" in consumer_repo:
+                    unique_patchsets_in_repo.update(consumer_repo["additional_patchsets"])
+                unique_patchsets_in_repo.add(consumer_repo["patchset"])
+
+            # Sum up the total number of common patchsets and add it to a total
+            if "additional_patchsets" in client_repo:
+                common_patchsets_sum += sum(
+                    patchset in client_repo["additional_patchsets"] for patchset in unique_patchsets_in_repo
+                )
+            if client_repo["patchset"] in unique_patchsets_in_repo:
+                common_patchsets_sum += 1
+
+        return common_patchsets_sum
+
+    def __iter__(self):
+        return (repo_state for repo_state, _ in self._repo_states.values())
+
+    def __len__(self) -> int:
+        return len(self._repo_states)
+
+
+def is_patchset_repo_state(repo_state) -> bool:
+    """
+    Returns whether `repo_state` names the patchset of at least one repository, in the form
+    `{"org/repo": {"patchset": "<sha>", ...}}`, as a repo state to supersede must.
+    """
+    return (
+        isinstance(repo_state, dict)
+        and len(repo_state) > 0
+        and all(isinstance(repo, dict) and isinstance(repo.get("patchset"), str) for repo in repo_state.values())
+    )
+
+
+def _intern_strings(value):
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, dict):
+        return {sys.intern(key): _intern_strings(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_intern_strings(item) for item in value]
+    return value
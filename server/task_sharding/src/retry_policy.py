@@ -0,0 +1,52 @@
+from task_sharding.src.config import get_setting
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BACKOFF = 0.0
+DEFAULT_BACKOFF_MULTIPLIER = 2.0
+
+
+class RetryPolicy:
+    """
+    Decides what happens to a task after a failed attempt. A task is retried until it has failed
+    `max_attempts` times, at which point it is considered broken and its schema instance is failed.
+    Each retry is delayed by `backoff` seconds, multiplied by `backoff_multiplier` for every
+    further failure. With `exclude_failed_peers`, a task is not given back to a consumer which has
+    already failed it, unless every registered consumer has.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        backoff: float = DEFAULT_BACKOFF,
+        backoff_multiplier: float = DEFAULT_BACKOFF_MULTIPLIER,
+        exclude_failed_peers: bool = True,
+    ):
+        if max_attempts < 1:
+            raise ValueError("max_attempts must be at least 1")
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_multiplier = backoff_multiplier
+        self.exclude_failed_peers = exclude_failed_peers
+
+    def should_retry(self, failed_attempts: int) -> bool:
+        return failed_attempts < self.max_attempts
+
+    def get_backoff(self, failed_attempts: int) -> float:
+        """
+        Returns how many seconds to wait before retrying a task which has failed `failed_attempts` times.
+        """
+        return self.backoff * self.backoff_multiplier ** max(failed_attempts - 1, 0)
+
+
+def create_retry_policy() -> RetryPolicy:
+    """
+    Creates a retry policy configured by the `TASK_SHARDING_RETRY_MAX_ATTEMPTS`,
+    `TASK_SHARDING_RETRY_BACKOFF`, `TASK_SHARDING_RETRY_BACKOFF_MULTIPLIER` and
+    `TASK_SHARDING_RETRY_EXCLUDE_FAILED_PEERS` settings.
+    """
+    return RetryPolicy(
+        get_setting("RETRY_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS),
+        get_setting("RETRY_BACKOFF", DEFAULT_BACKOFF),
+        get_setting("RETRY_BACKOFF_MULTIPLIER", DEFAULT_BACKOFF_MULTIPLIER),
+        get_setting("RETRY_EXCLUDE_FAILED_PEERS", True),
+    )
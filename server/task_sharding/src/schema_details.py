@@ -1,9 +1,13 @@
+import sys
 import uuid
 
 
 class SchemaDetails:
+    __slots__ = ("cache_id", "schema_id", "total_tasks", "id")
+
     def __init__(self, cache_id: str, schema_id: str, total_tasks: int) -> None:
-        self.cache_id = cache_id
-        self.schema_id = schema_id
+        # Interned, as they are shared by every instance of the same schema
+        self.cache_id = sys.intern(cache_id) if isinstance(cache_id, str) else cache_id
+        self.schema_id = sys.intern(schema_id) if isinstance(schema_id, str) else schema_id
         self.total_tasks = total_tasks
         self.id = str(uuid.uuid4())
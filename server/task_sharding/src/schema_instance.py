@@ -1,46 +1,225 @@
+import asyncio
 import logging
 import threading
+import time
 
 from channels.layers import get_channel_layer
+from task_sharding.src.affinity_index import AffinityIndex
+from task_sharding.src.capabilities import NO_CAPABILITIES, Capabilities
+from task_sharding.src.config import get_setting
+from task_sharding.src.consumer_batches import ConsumerBatches
+from task_sharding.src.consumer_leases import ConsumerLeases
+from task_sharding.src.event_log import create_event_logger
 from task_sharding.src.message_type import MessageType
+from task_sharding.src.metrics import SchedulerMetrics
+from task_sharding.src.remaining_work import RemainingWork
+from task_sharding.src.repo_state_table import RepoStateTable
+from task_sharding.src.retry_policy import RetryPolicy, create_retry_policy
 from task_sharding.src.schema_details import SchemaDetails
+from task_sharding.src.shard_results import ShardResults
+from task_sharding.src.task_history import TaskHistory
+from task_sharding.src.task_queue import ExcludedTasks, LifoTaskQueue, TaskQueue
+from task_sharding.src.task_shards import TaskShards
+from task_sharding.src.task_states import TaskState, TaskStates
+from task_sharding.src.task_stream import TaskStream
+from task_sharding.src.timeline import Timeline, TimelineEventType
+from task_sharding.src.unit_leases import UnitLeases
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_AFFINITY_WAIT = 5.0
+MAX_LOW_CACHE_HIT_TASKS = 10
+
 
 class SchemaInstance:
-    def __init__(self, schema_details: SchemaDetails):
+    # A controller may hold many instances at once, each with many consumers and tasks, so
+    # instances keep no attribute dictionary, and their per-task state is held compactly (see
+    # `TaskQueue`, `TaskSet` and `RepoStateTable`)
+    __slots__ = (
+        "schema_details",
+        "_task_shards",
+        "_task_states",
+        "_remaining_work",
+        "_consumer_leases",
+        "_to_do_tasks",
+        "_channel_layer",
+        "_metrics",
+        "_task_history",
+        "_clock",
+        "_retry_policy",
+        "_events",
+        "timeline",
+        "_registered_consumers",
+        "_leases",
+        "_batches",
+        "_repo_states",
+        "_repo_state_table",
+        "_consumer_lock",
+        "_total_tasks_completed",
+        "_failed",
+        "_superseded",
+        "_task_stream",
+        "_failed_attempts",
+        "_failed_consumers",
+        "_backoff_timers",
+        "_shard_results",
+        "_affinity",
+        "_affinity_wait",
+        "_affinity_hold_times",
+        "_affinity_timer",
+        "_artifacts",
+        "_unmet_requirements",
+        "_dispatch",
+    )
+
+    def __init__(
+        self,
+        schema_details: SchemaDetails,
+        metrics: SchedulerMetrics = None,
+        task_queue: TaskQueue = None,
+        task_history: TaskHistory = None,
+        channel_layer=None,
+        clock=time.monotonic,
+        retry_policy: RetryPolicy = None,
+        task_shards: TaskShards = None,
+        streaming: bool = False,
+        done_units=(),
+        consumer_leases: ConsumerLeases = None,
+    ):
+        """
+        `done_units` are the units completed by an earlier instance of the same schema (see
+        `get_progress`), which are not run again. A given `task_queue` must not hold them.
+        `consumer_leases` are shared with the other instances which the consumers may join.
+        """
         self.schema_details = schema_details
-        self._to_do_tasks = list(range(0, self.schema_details.total_tasks))
-        self._channel_layer = get_channel_layer()
+        # Tasks are handed out in units, which are either whole tasks or shards of them (see `TaskShards`)
+        self._task_shards = task_shards if task_shards else TaskShards(self.schema_details.total_tasks)
+        self._task_states = TaskStates(self._task_shards.total_units, done_units)
+        self._to_do_tasks = (
+            task_queue
+            if task_queue
+            else LifoTaskQueue(
+                self._task_states.get_units(TaskState.PENDING) if done_units else range(0, len(self._task_states))
+            )
+        )
+        self._consumer_leases = consumer_leases if consumer_leases else ConsumerLeases()
+        self._channel_layer = channel_layer if channel_layer else get_channel_layer()
+        self._metrics = metrics if metrics else SchedulerMetrics()
+        self._task_history = task_history if task_history else TaskHistory()
+        self._clock = clock
+        self._retry_policy = retry_policy if retry_policy else create_retry_policy()
+        self._events = create_event_logger(logger, self.schema_details.id)
+        self.timeline = Timeline()
+
+        # The expected durations of the units still to pass, kept up to date to estimate the time remaining
+        self._remaining_work = RemainingWork()
+        for unit in self._task_states.get_units(TaskState.PENDING) if done_units else range(len(self._task_states)):
+            self._remaining_work.add(unit, self._get_expected_duration(unit))
 
         self._registered_consumers = set()
-        self._in_progress_consumers = {}
+        self._leases = UnitLeases(clock)
+        self._batches = ConsumerBatches()
+        # Consumers refer to the table's copy of their repo state, which they mostly share
         self._repo_states = {}
+        self._repo_state_table = RepoStateTable()
         self._consumer_lock = threading.Lock()
+        self._total_tasks_completed = self._task_states.count(TaskState.DONE)
+        self._failed = False
+        self._superseded = False
+
+        self._task_stream = TaskStream(streaming)
+
+        # Failure tracking for tasks which have failed but not (yet) passed
+        self._failed_attempts: dict[int, int] = {}
+        self._failed_consumers: dict[int, set[str]] = {}
+        self._backoff_timers: dict[int, asyncio.Future] = {}
+
+        self._shard_results = ShardResults()
+
+        # Tasks are held back for consumers with warm state for them, for up to `_affinity_wait` seconds
+        self._affinity = AffinityIndex()
+        self._affinity_wait = get_setting("AFFINITY_WAIT", DEFAULT_AFFINITY_WAIT)
+        self._affinity_hold_times: dict[int, float] = {}
+        self._affinity_timer: asyncio.Future = None
+
+        # Where the consumers which passed each unit serve its outputs from, if they announced them
+        self._artifacts: dict[int, dict] = {}
+
+        # The requirements of ready tasks which no registered consumer meets, which have been warned of
+        self._unmet_requirements: set[Capabilities] = set()
 
         self._dispatch = {
-            MessageType.INIT: self._send_build_instructions,
+            MessageType.INIT: self._receive_init,
             MessageType.TASK_COMPLETE: self._receive_task_completed,
+            MessageType.TASK_PROGRESS: self._receive_task_progress,
+            MessageType.ADD_TASKS: self._receive_added_tasks,
+            MessageType.END_OF_TASKS: self._receive_end_of_tasks,
         }
 
-    def register_consumer(self, consumer_id: str, repo_state: dict):
-        self._print_with_prefix("Registering consumer " + consumer_id)
+    def register_consumer(
+        self,
+        consumer_id: str,
+        repo_state: dict,
+        recent_tasks=(),
+        capabilities: Capabilities = NO_CAPABILITIES,
+        max_batch_size: int = 1,
+    ):
+        """
+        Adds a consumer to the instance. `recent_tasks` are the tasks of this schema the consumer
+        has run recently, least recent first, which it is likely to run faster than other consumers.
+        The consumer is only handed tasks whose requirements its `capabilities` meet, and up to
+        `max_batch_size` of them at a time, which it runs together (e.g. in one Bazel invocation).
+        """
+        self._events.emit("registered", consumer_id=consumer_id)
         with self._consumer_lock:
+            if consumer_id in self._repo_states:
+                self._repo_state_table.remove(self._repo_states[consumer_id])
             self._registered_consumers.add(consumer_id)
-            self._repo_states[consumer_id] = repo_state
+            self._repo_states[consumer_id] = self._repo_state_table.add(repo_state)
+            self._affinity.add_consumer(
+                consumer_id,
+                [
+                    unit
+                    for task in recent_tasks
+                    if 0 <= int(task) < self.schema_details.total_tasks
+                    for unit in self._task_shards.get_units(int(task))
+                ],
+            )
+            self._to_do_tasks.add_consumer(consumer_id, capabilities)
+            self._batches.set_max_batch_size(consumer_id, max_batch_size)
+            self.timeline.record(TimelineEventType.REGISTER, consumer_id)
+            self._warn_of_unmet_requirements()
 
     def deregister_consumer(self, consumer_id: str):
         with self._consumer_lock:
-            if consumer_id in self._registered_consumers:
-                self._registered_consumers.remove(consumer_id)
-            if consumer_id in self._in_progress_consumers:
-                task_id = self._in_progress_consumers[consumer_id]
-                del self._in_progress_consumers[consumer_id]
-                self._to_do_tasks.append(task_id)
-                self._print_with_prefix("Unassigning task ID " + str(task_id) + " from consumer " + consumer_id)
+            if consumer_id not in self._registered_consumers:
+                return
+            self._registered_consumers.remove(consumer_id)
+            batched_units = self._batches.remove_consumer(consumer_id)
+            leased_unit = self._leases.remove_consumer(consumer_id)
+            if leased_unit is not None:
+                self._consumer_leases.release(consumer_id, self)
+                for unit in [leased_unit, *batched_units]:
+                    # The unit may have been completed by another consumer while this one was running it
+                    if self._task_states.get(unit) == TaskState.LEASED:
+                        self._requeue_unit(unit, consumer_id, "deregistered")
             if consumer_id in self._repo_states:
-                del self._repo_states[consumer_id]
+                self._repo_state_table.remove(self._repo_states.pop(consumer_id))
+            self._affinity.remove_consumer(consumer_id)
+            self._to_do_tasks.remove_consumer(consumer_id)
+            self.timeline.record(TimelineEventType.DEREGISTER, consumer_id)
+            self._warn_of_unmet_requirements()
+
+    def _warn_of_unmet_requirements(self):
+        """
+        Warns of ready tasks which cannot be handed out because no registered consumer meets their
+        requirements, once for each set of requirements until a consumer which meets it registers.
+        """
+        unmet_requirements = self._to_do_tasks.get_unmet_requirements()
+        for requirements, tasks in unmet_requirements.items():
+            if requirements not in self._unmet_requirements:
+                self._events.emit("requirements_unmet", requirements=requirements, tasks=tasks)
+        self._unmet_requirements = set(unmet_requirements)
 
     def is_consumer_registered(self, uuid: str) -> bool:
         return uuid in self._registered_consumers
@@ -48,110 +227,722 @@ class SchemaInstance:
     def get_total_registered_consumers(self) -> int:
         return len(self._registered_consumers)
 
-    def get_total_common_patchsets_in_repo_state(self, repo_state: dict) -> int:
-        common_patchsets_sum = -1
-
-        # Loop over every repository sent by the client
-        for repo_name in repo_state:
-            client_repo = repo_state[repo_name]
-            client_branch = client_repo["base_ref"]
-
-            # Loop over every consumer assigned to this schema instance
-            unique_patchsets_in_repo = set()
-            for consumer_id in self._repo_states:
-                # Repos must be the same
-                if not repo_name in self._repo_states[consumer_id]:
-                    return -1
-
-                consumer_repo = self._repo_states[consumer_id][repo_name]
-                consumer_branch = consumer_repo["base_ref"]
-
-                # Branch name must be the same
-                if not client_branch == consumer_branch:
-                    return -1
-
-                # Add existing repo patchesets to a set
-                if "additional_patchsets" in consumer_repo:
-                    unique_patchsets_in_repo.update(consumer_repo["additional_patchsets"])
-                unique_patchsets_in_repo.add(consumer_repo["patchset"])
-
-            # Sum up the total number of common patchsets and add it to a total
-            if "additional_patchsets" in client_repo:
-                common_patchsets_sum += sum(
-                    patchset in client_repo["additional_patchsets"] for patchset in unique_patchsets_in_repo
-                )
-            if client_repo["patchset"] in unique_patchsets_in_repo:
-                common_patchsets_sum += 1
+    def has_tasks_to_hand_out(self) -> bool:
+        return len(self._to_do_tasks) > 0 and not self._failed and not self._superseded
+
+    def get_total_tasks_not_started(self) -> int:
+        return len(self._to_do_tasks) + len(self._backoff_timers)
+
+    def get_total_tasks_in_progress(self) -> int:
+        return len(self._leases) + len(self._batches)
 
-        return common_patchsets_sum
+    def get_status(self) -> dict:
+        """
+        Returns a newly built, plain description of the instance which is never modified afterwards.
+        """
+        with self._consumer_lock:
+            consumers = [
+                {
+                    "consumer_id": consumer_id,
+                    # Shared rather than copied, as a registered repo state is never modified
+                    "repo_state": self._repo_states.get(consumer_id),
+                    "task_id": self._leases.get_unit(consumer_id),
+                    "batch": list(self._batches.get(consumer_id)),
+                    "progress": self._leases.get_progress(consumer_id),
+                    "estimated_remaining_time": self.estimate_task_remaining_time(consumer_id),
+                }
+                for consumer_id in sorted(self._registered_consumers)
+            ]
+            return {
+                "id": self.schema_details.id,
+                "schema_id": self.schema_details.schema_id,
+                "cache_id": self.schema_details.cache_id,
+                "total_tasks": self.schema_details.total_tasks,
+                "total_units": self._task_shards.total_units,
+                "consumers": consumers,
+                "tasks_not_started": len(self._to_do_tasks) + len(self._backoff_timers),
+                "tasks_in_progress": sorted([*self._leases.get_units(), *self._batches.get_units()]),
+                "tasks_completed": self._total_tasks_completed,
+                "task_states": {state.name.lower(): self._task_states.count(state) for state in TaskState},
+                "failed_attempts": {str(task): attempts for task, attempts in self._failed_attempts.items()},
+                "failed": self._failed,
+                "streaming": self._task_stream.is_open(),
+                "estimated_time_remaining": self.estimate_time_remaining(),
+                "unmet_requirements": [
+                    {"requirements": requirements.to_dict(), "tasks": tasks}
+                    for requirements, tasks in self._to_do_tasks.get_unmet_requirements().items()
+                ],
+                "low_cache_hit_tasks": [
+                    {"task_id": str(task), "cache_hit_ratio": cache_hit_ratio}
+                    for task, cache_hit_ratio in self._task_history.get_low_cache_hit_tasks(
+                        self.schema_details.schema_id, MAX_LOW_CACHE_HIT_TASKS
+                    )
+                ],
+            }
+
+    def estimate_task_remaining_time(self, consumer_id: str) -> float:
+        """
+        Estimates how many seconds the task in progress on a consumer has left (see
+        `UnitLeases.estimate_remaining_time`), or None if it has no task or nothing is known about it.
+        """
+        task = self._leases.get_unit(consumer_id)
+        if task is None:
+            return None
+        return self._leases.estimate_remaining_time(consumer_id, self._get_expected_duration(task))
+
+    def estimate_time_remaining(self) -> float:
+        """
+        Estimates how many seconds the instance has left, assuming its consumers stay and share the
+        remaining work evenly. Tasks without a known duration are assumed to take as long as the
+        average task that has one. Returns None if no remaining task has a known duration.
+
+        Only the units in progress are looked at one by one, as the expected durations of the others
+        are kept totalled (see `RemainingWork`), so that the estimate stays cheap enough for every status.
+        """
+        in_progress_units = tuple(self._leases.items())
+        in_progress_estimates = [self.estimate_task_remaining_time(consumer_id) for consumer_id, _ in in_progress_units]
+
+        # The rest of the remaining units, including those batched with a unit in progress, which are run after it
+        known_duration, known_units, unknown_units = self._remaining_work.get_totals()
+        for _, unit in in_progress_units:
+            if unit not in self._remaining_work:
+                continue
+            expected_duration = self._remaining_work.get_expected_duration(unit)
+            if expected_duration is None:
+                unknown_units -= 1
+            else:
+                known_duration -= expected_duration
+                known_units -= 1
+
+        known_estimates = [estimate for estimate in in_progress_estimates if estimate is not None]
+        if not known_estimates and not known_units:
+            return None if in_progress_estimates or unknown_units else 0.0
+
+        default_estimate = (sum(known_estimates) + known_duration) / (len(known_estimates) + known_units)
+        in_progress_estimates = [default_estimate if e is None else e for e in in_progress_estimates]
+        total_work = sum(in_progress_estimates) + known_duration + unknown_units * default_estimate
+        return max(max(in_progress_estimates, default=0.0), total_work / max(len(self._registered_consumers), 1))
+
+    def _get_expected_duration(self, unit: int) -> float:
+        """
+        Returns the expected duration of a unit, with each shard of a task expected to take an equal share.
+        """
+        task, _, total_shards = self._task_shards.get_shard(unit)
+        expected_duration = self._task_history.get_expected_duration(self.schema_details.schema_id, task)
+        return expected_duration / total_shards if expected_duration is not None else None
+
+    def _get_unit(self, msg: dict) -> int:
+        return self._task_shards.get_unit(int(msg["task_id"]), int(msg.get("shard_index", 0)))
+
+    def is_failed(self) -> bool:
+        """
+        Returns whether a task has run out of attempts, in which case the instance will never complete.
+        """
+        return self._failed
+
+    def has_repo_state(self, repo_state: dict) -> bool:
+        """
+        Returns whether a consumer of the instance is on the patchset given for every repository in `repo_state`.
+        An empty repo state names no patchset, so no instance has it.
+        """
+        with self._consumer_lock:
+            return self._repo_state_table.has_patchsets(repo_state)
+
+    def get_total_common_patchsets_in_repo_state(self, repo_state: dict) -> int:
+        return self._repo_state_table.get_total_common_patchsets(repo_state)
 
     async def receive_message(self, msg: dict, consumer_id: str):
         msg["message_type"] = MessageType(int(msg["message_type"]))
         await self._dispatch.get(msg["message_type"])(msg=msg, consumer_id=consumer_id)
 
+    async def _receive_init(self, msg: dict, consumer_id: str):
+        await self._send_build_instructions(msg, consumer_id)
+        with self._consumer_lock:
+            artifacts_message = self._create_artifacts_message(sorted(self._artifacts)) if self._artifacts else None
+        if artifacts_message:
+            # A consumer which joins late can still fetch the outputs of the units passed before it joined
+            await self._channel_layer.send(consumer_id, artifacts_message)
+
+    async def offer_consumer(self, consumer_id: str):
+        """
+        Hands the consumer a task if it is idle, e.g. once it has finished a task of another instance it has joined.
+        """
+        if consumer_id in self._registered_consumers:
+            await self._send_build_instructions({}, consumer_id)
+
     async def _send_build_instructions(self, msg: dict, consumer_id: str):
         with self._consumer_lock:
-            if len(self._to_do_tasks) > 0:
-                task = self._to_do_tasks.pop()
-                self._in_progress_consumers[consumer_id] = task
+            if consumer_id in self._leases or not self._consumer_leases.can_assign(consumer_id, self):
+                # A consumer runs one task at a time, across every instance it has joined
+                return
+            if len(self._to_do_tasks) > 0 and not self._failed and not self._superseded:
+                warm_tasks = self._affinity.get_warm_tasks(consumer_id)
+                held_tasks = set()
+                excluded_tasks = self._get_excluded_tasks(consumer_id, held_tasks)
 
-                self._print_with_prefix("Assigning task ID " + str(task) + " to consumer " + consumer_id)
+                task = self._to_do_tasks.pop(consumer_id, excluded_tasks, warm_tasks)
+                if task is None:
+                    # Every remaining task is waiting on a dependency, has already failed on this
+                    # consumer, or is being held for a consumer with warm state for it
+                    if held_tasks:
+                        self._schedule_assignment_after_affinity_wait()
+                    return
+                assignment_latency = self._leases.assign(consumer_id, task)
+                self._consumer_leases.assign(consumer_id)
+                self._task_states.set(task, TaskState.LEASED)
+                self._metrics.affinity_assignments.inc(schema_id=self.schema_details.schema_id, warm=task in warm_tasks)
+                self.timeline.record(TimelineEventType.ASSIGN, consumer_id, task)
+                if assignment_latency is not None:
+                    self._metrics.assignment_latency_seconds.observe(assignment_latency)
 
-                await self._channel_layer.send(
-                    consumer_id,
-                    {
-                        "type": "send.message",
-                        "message_type": MessageType.BUILD_INSTRUCTION,
-                        "schema_id": self.schema_details.schema_id,
-                        "task_id": str(task),
-                    },
+                self._events.emit("assigned", consumer_id=consumer_id, task_id=task)
+
+                build_instruction = {
+                    "type": "send.message",
+                    "message_type": MessageType.BUILD_INSTRUCTION,
+                    "schema_id": self.schema_details.schema_id,
+                    **self._describe_assigned_unit(task),
+                }
+                batch = self._lease_batch(consumer_id, task, excluded_tasks, warm_tasks)
+                if batch:
+                    build_instruction["batch"] = [self._describe_assigned_unit(unit) for unit in batch]
+                await self._channel_layer.send(consumer_id, build_instruction)
+
+    def _lease_batch(self, consumer_id: str, task: int, excluded_tasks, warm_tasks) -> list:
+        """
+        Leases further units to a consumer along with `task`, up to its maximum batch size, and returns
+        them. Shards are only run on their own, as the shard a test runs is set for the whole run.
+        """
+        max_batch_size = self._batches.get_max_batch_size(consumer_id)
+        if max_batch_size <= 1 or self._task_shards.get_shard(task)[2] > 1:
+            return []
+        batch = []
+        while len(batch) + 1 < max_batch_size:
+            unit = self._to_do_tasks.pop(consumer_id, excluded_tasks, warm_tasks)
+            if unit is None:
+                break
+            if self._task_shards.get_shard(unit)[2] > 1:
+                self._to_do_tasks.append(unit)
+                break
+            self._task_states.set(unit, TaskState.LEASED)
+            self.timeline.record(TimelineEventType.BATCH, consumer_id, unit)
+            self._events.emit("assigned", consumer_id=consumer_id, task_id=unit, batched_with=task)
+            batch.append(unit)
+        if batch:
+            self._batches.add(consumer_id, batch)
+        return batch
+
+    def _describe_assigned_unit(self, unit: int) -> dict:
+        """
+        Returns the fields which tell a consumer which unit it has been assigned, along with the task
+        itself if it was streamed, as the consumer may not have enumerated it yet.
+        """
+        description = self._task_shards.describe_unit(unit)
+        streamed_task = self._task_stream.get(self._task_shards.get_shard(unit)[0])
+        if streamed_task is not None:
+            description["task"] = streamed_task
+        return description
+
+    def _is_held_for_other_consumers(self, task: int, consumer_id: str, now: float) -> bool:
+        """
+        Returns whether a task is held back from a consumer because other consumers have warm state
+        for it. A task is held for `TASK_SHARDING_AFFINITY_WAIT` seconds from when it was first held
+        back, after which any consumer may take it.
+        """
+        if not self._affinity.is_warm_elsewhere(task, consumer_id):
+            return False
+        return now - self._affinity_hold_times.setdefault(task, now) < self._affinity_wait
+
+    def _schedule_assignment_after_affinity_wait(self):
+        if self._affinity_timer is None:
+            self._affinity_timer = asyncio.ensure_future(
+                self._request_from_controller(self._affinity_wait, "assign.after.affinity.wait")
+            )
+
+    async def assign_after_affinity_wait(self):
+        """
+        Called by the controller once the tasks held back for consumers with warm state for them may
+        be handed to any consumer.
+        """
+        self._affinity_timer = None
+        await self.send_build_instructions_to_idle_consumers({})
+
+    async def _request_from_controller(self, delay: float, message_type: str, **fields):
+        """
+        Asks the controller to call back into the instance after `delay` seconds. As with the controller's
+        sweeps, this is sent as a message on the controller's channel, so that it is handled in turn with
+        every other message, rather than while another is being handled with `_consumer_lock` held.
+        """
+        await asyncio.sleep(delay)
+        await self._channel_layer.send(
+            "controller", {"type": message_type, "instance_id": self.schema_details.id, **fields}
+        )
+
+    def _get_excluded_tasks(self, consumer_id: str, held_tasks: set):
+        """
+        Returns the tasks which should not be given to a consumer, because it has already failed them or
+        because they are held for other consumers, adding the held tasks it passes over to `held_tasks`.
+        Tasks which every registered consumer has failed are not excluded, so they can still be retried.
+
+        Tasks are only checked as they come up in the queue, as there may be far more failed or warm
+        tasks than are passed over.
+        """
+        exclude_failed = self._retry_policy.exclude_failed_peers and self._failed_consumers
+        hold_tasks = self._affinity and self._affinity_wait > 0
+        if not exclude_failed and not hold_tasks:
+            return ()
+        now = self._clock()
+
+        def is_excluded(task: int) -> bool:
+            if exclude_failed:
+                failed_consumers = self._failed_consumers.get(task)
+                if (
+                    failed_consumers
+                    and consumer_id in failed_consumers
+                    and not self._registered_consumers <= failed_consumers
+                ):
+                    return True
+            if hold_tasks and self._is_held_for_other_consumers(task, consumer_id, now):
+                held_tasks.add(task)
+                return True
+            return False
+
+        return ExcludedTasks(is_excluded)
+
+    async def _receive_task_progress(self, msg: dict, consumer_id: str):
+        self._leases.set_progress(consumer_id, self._get_unit(msg), float(msg["progress"]))
+
+    async def _receive_added_tasks(self, msg: dict, consumer_id: str):
+        """
+        Appends tasks to the instance. `first_task_id` is the ID of the first task in the message,
+        so that tasks which have already been added, e.g. by another consumer streaming the same
+        schema, are skipped.
+        """
+        with self._consumer_lock:
+            if not self._task_stream.is_open() or self._failed or self._superseded:
+                return
+            first_task = int(msg["first_task_id"])
+            added_tasks = self._task_stream.get_new_tasks(first_task, msg["tasks"], self.schema_details.total_tasks)
+            if added_tasks is None:
+                logger.warning(
+                    "Ignoring tasks from %d added to instance %s, which only has %d tasks",
+                    first_task,
+                    self.schema_details.id,
+                    self.schema_details.total_tasks,
                 )
+                return
+
+            for task_definition in added_tasks:
+                task = self.schema_details.total_tasks
+                self.schema_details.total_tasks += 1
+                self._task_stream.add(task, task_definition)
+                unit = self._task_shards.add_task(task)
+                self._task_states.resize(self._task_shards.total_units)
+                requirements = task_definition.get("requires") if isinstance(task_definition, dict) else None
+                self._to_do_tasks.add_task(unit, Capabilities.from_dict(requirements))
+                self._remaining_work.add(unit, self._get_expected_duration(unit))
+            self._events.emit("tasks_added", consumer_id=consumer_id, tasks=len(added_tasks))
+            self._warn_of_unmet_requirements()
+
+        await self.send_build_instructions_to_idle_consumers(msg)
+
+    async def _receive_end_of_tasks(self, msg: dict, consumer_id: str):
+        with self._consumer_lock:
+            if not self._task_stream.end():
+                return
+            self._events.emit("end_of_tasks", consumer_id=consumer_id, total_tasks=self.schema_details.total_tasks)
+
+        # The stream may end after every task has already completed
+        if not self._failed and not self._superseded:
+            await self._send_schema_complete()
 
     async def _receive_task_completed(self, msg: dict, consumer_id: str):
+        """
+        Records the result of a unit. Results are idempotent: a result for a unit which is already
+        done (or has run out of attempts), e.g. a TASK_COMPLETE sent again after a reconnect, is
+        ignored. A consumer may also report that a unit it does not hold has passed, in which case
+        it is done all the same, and is no longer handed out. A consumer still running it is told to
+        abort it, and stays busy until it reports its own result, which is then ignored.
+
+        The results of the units batched with the one a consumer holds are reported in the `batch` of
+        its message, and recorded in the same way. A batched unit it does not report is queued again.
+        """
+        if self._failed or self._superseded:
+            # Results arriving after the instance has failed or been superseded are of no use
+            return
+
+        broken_task = None
+        aborted_consumer = None
+        announced_units = []
         with self._consumer_lock:
-            task_id = msg["task_id"]
+            unit = self._get_unit(msg)
+            if not 0 <= unit < len(self._task_states):
+                logger.warning("Ignoring result of unknown task %s from consumer %s", msg["task_id"], consumer_id)
+                return
             task_success = msg["task_success"]
-            del self._in_progress_consumers[consumer_id]
-            if task_success:
-                self._print_with_prefix("Consumer " + consumer_id + " completed task " + task_id)
+            leased = self._leases.get_unit(consumer_id) == unit
+            state = self._task_states.get(unit)
+            batched = leased and consumer_id in self._batches
+            if batched:
+                broken_task = self._record_batch_results(consumer_id, msg.get("batch"), announced_units)
+
+            if state in (TaskState.DONE, TaskState.FAILED) or not (leased or task_success):
+                self._events.emit("result_ignored", consumer_id=consumer_id, task_id=unit, state=state.name.lower())
+                if not leased:
+                    return
+                # Another consumer completed the unit while this one was running it
+                self._release_lease(consumer_id, task_success)
             else:
-                # TODO: Do something on a task failure
-                self._to_do_tasks.append(int(task_id))
-            tasks_not_started = len(self._to_do_tasks)
-            tasks_in_progress = len(self._in_progress_consumers)
-
-        if tasks_not_started > 0 or tasks_in_progress > 0:
-            self._print_with_prefix(
-                "There are currently "
-                + str(tasks_not_started)
-                + " tasks not yet assigned and "
-                + str(tasks_in_progress)
-                + " tasks in progress"
+                if leased:
+                    task_duration = self._release_lease(consumer_id, task_success)
+                    if batched:
+                        # The lease was held for the whole batch rather than for this unit alone
+                        task_duration = None
+                else:
+                    task_duration = None
+                    aborted_consumer = self._withdraw_unit(unit)
+                if self._record_result(unit, consumer_id, msg, task_duration, announced_units) and broken_task is None:
+                    broken_task = unit
+            if announced_units:
+                artifacts_message = self._create_artifacts_message(announced_units)
+                artifacts_recipients = [
+                    other_consumer for other_consumer in self._registered_consumers if other_consumer != consumer_id
+                ]
+            tasks_not_started = len(self._to_do_tasks) + len(self._backoff_timers)
+            tasks_in_progress = len(self._leases)
+
+        if aborted_consumer is not None:
+            await self._channel_layer.send(
+                aborted_consumer,
+                {
+                    "type": "send.message",
+                    "message_type": MessageType.ABORT_TASK,
+                    "schema_id": self.schema_details.schema_id,
+                    **self._task_shards.describe_unit(unit),
+                },
             )
+        if announced_units:
+            # Sent as soon as the unit passes, rather than with SCHEMA_COMPLETE, so that the other consumers
+            # can fetch the outputs while the consumer which serves them is still running
+            for other_consumer in artifacts_recipients:
+                await self._channel_layer.send(other_consumer, artifacts_message)
+
+        if broken_task is not None:
+            await self._send_schema_failed(broken_task)
+        elif tasks_not_started > 0 or tasks_in_progress > 0:
+            self._events.emit("tasks_remaining", not_started=tasks_not_started, in_progress=tasks_in_progress)
             await self._send_build_instructions(msg, consumer_id)
+            await self.send_build_instructions_to_idle_consumers(msg)
         else:
             await self._send_schema_complete()
 
+    def _record_batch_results(self, consumer_id: str, batch_results: list, announced_units: list) -> int:
+        """
+        Records the results a consumer reports for the units batched with the one it holds, and queues
+        those it does not report again. Returns a unit which has run out of attempts, if any.
+        """
+        broken_unit = None
+        reported_results = {self._get_unit(result): result for result in batch_results or ()}
+        for unit in self._batches.pop(consumer_id):
+            if self._task_states.get(unit) != TaskState.LEASED:
+                # Completed by another consumer while this one was running it
+                self._events.emit("result_ignored", consumer_id=consumer_id, task_id=unit, state="done")
+            elif unit not in reported_results:
+                self._requeue_unit(unit, consumer_id, "unreported")
+            elif self._record_result(unit, consumer_id, reported_results[unit], None, announced_units):
+                broken_unit = unit if broken_unit is None else broken_unit
+        return broken_unit
+
+    def _record_result(
+        self, unit: int, consumer_id: str, result: dict, task_duration: float, announced_units: list
+    ) -> bool:
+        """
+        Records a consumer's result for a unit which is not yet done, given its duration if known. Units
+        whose outputs the consumer announced are added to `announced_units`. Returns True if the unit
+        has failed and run out of attempts.
+        """
+        task_stats = result.get("task_stats")
+        # The consumer's own measurement leaves out the time spent sending messages
+        if isinstance(task_stats, dict) and isinstance(task_stats.get("duration"), (int, float)):
+            task_duration = task_stats["duration"]
+        if result.get("cached"):
+            # The consumer had already run the task with the same inputs, so it took no time to say so
+            task_duration = None
+
+        if isinstance(task_stats, dict):
+            self._record_task_stats(unit, task_stats)
+
+        if not result["task_success"]:
+            return self._record_task_failure(unit, consumer_id)
+        self._complete_unit(unit, consumer_id, task_duration)
+        if self._record_artifacts(unit, result.get("artifacts")):
+            announced_units.append(unit)
+        return False
+
+    def _requeue_unit(self, unit: int, consumer_id: str, reason: str):
+        self._task_states.set(unit, TaskState.PENDING)
+        self._to_do_tasks.append(unit)
+        self.timeline.record(TimelineEventType.REQUEUE, consumer_id, unit)
+        self._events.emit("requeued", consumer_id=consumer_id, task_id=unit, reason=reason)
+
+    def _release_lease(self, consumer_id: str, task_success: bool) -> float:
+        """
+        Frees a consumer from the unit it was running, and returns how long it ran for, if known.
+        """
+        task_duration = self._leases.release(consumer_id)
+        self._consumer_leases.release(consumer_id, self)
+        if task_duration is None:
+            return None
+        self._metrics.task_duration_seconds.observe(
+            task_duration,
+            schema_id=self.schema_details.schema_id,
+            task_success=bool(task_success),
+        )
+        return task_duration
+
+    def _withdraw_unit(self, unit: int) -> str:
+        """
+        Stops a unit which has been completed by a consumer it was not leased to from being handed
+        out again. Returns the consumer to tell to abort it, if any, which keeps its lease until it
+        reports a result for the unit, so that it is not handed another task while it still runs it.
+        A consumer running the unit in a batch is left to finish the rest of the batch.
+        """
+        if unit in self._backoff_timers:
+            self._backoff_timers.pop(unit).cancel()
+        elif self._task_states.get(unit) == TaskState.PENDING:
+            self._to_do_tasks.remove(unit)
+        else:
+            for consumer_id, leased_unit in self._leases.items():
+                if leased_unit == unit and consumer_id not in self._batches:
+                    return consumer_id
+        return None
+
+    def _complete_unit(self, unit: int, consumer_id: str, task_duration: float):
+        self._task_states.set(unit, TaskState.DONE)
+        self._remaining_work.remove(unit)
+        self._total_tasks_completed += 1
+        self._to_do_tasks.task_completed(unit)
+        self.timeline.record(TimelineEventType.COMPLETE, consumer_id, unit)
+        self._events.emit("completed", consumer_id=consumer_id, task_id=unit)
+        self._record_unit_completed(unit, task_duration)
+        self._affinity.remove_task(unit)
+        self._affinity_hold_times.pop(unit, None)
+
+    def _record_artifacts(self, unit: int, artifacts: dict) -> bool:
+        """
+        Keeps the location of a unit's outputs announced by the consumer which passed it, as
+        `{"url": ..., "files": {path: size}}`, to be passed on to the other consumers, so that they
+        can fetch the outputs from it directly. Returns whether there were any.
+        """
+        if not isinstance(artifacts, dict) or not isinstance(artifacts.get("url"), str):
+            return False
+        self._artifacts[unit] = {"url": artifacts["url"], "files": dict(artifacts.get("files") or {})}
+        return True
+
+    def _create_artifacts_message(self, units: list) -> dict:
+        return {
+            "type": "send.message",
+            "message_type": MessageType.ARTIFACTS,
+            "schema_id": self.schema_details.schema_id,
+            "artifacts": [{**self._task_shards.describe_unit(unit), **self._artifacts[unit]} for unit in units],
+        }
+
+    def get_progress(self) -> dict:
+        """
+        Returns the units which are done, with the shard counts the units were numbered by, so that
+        a new instance of the same schema can be resumed from them (see `done_units`). The progress
+        is plain data, which may be stored e.g. as JSON. Returns None if there is nothing to resume
+        from: no unit is done, every unit is, or the instance has failed, been superseded or been
+        streamed tasks which a new instance would not know.
+        """
+        with self._consumer_lock:
+            total_done = self._task_states.count(TaskState.DONE)
+            if (
+                self._failed
+                or self._superseded
+                or self._task_stream.is_open()
+                or self._task_stream
+                or total_done in (0, len(self._task_states))
+            ):
+                return None
+            return {
+                "shard_counts": self._task_shards.get_shard_counts(),
+                "done_units": self._task_states.get_units(TaskState.DONE),
+            }
+
+    def _record_unit_completed(self, unit: int, duration: float):
+        """
+        Records the duration and outcome of a task once it has passed. A sharded task has passed
+        once every one of its shards has, and its duration is the sum of theirs.
+        """
+        task, _, total_shards = self._task_shards.get_shard(unit)
+        failed_attempts = self._failed_attempts.pop(unit, 0)
+        self._failed_consumers.pop(unit, None)
+        if total_shards > 1:
+            task_result = self._shard_results.add_passed_shard(task, total_shards, duration, failed_attempts)
+            if task_result is None:
+                return
+            duration, failed_attempts = task_result
+
+        if duration is not None:
+            self._task_history.record_duration(self.schema_details.schema_id, task, duration)
+        self._record_task_outcome(task, failed_attempts, True)
+
+    def _record_task_stats(self, unit: int, task_stats: dict):
+        task, _, _ = self._task_shards.get_shard(unit)
+        self._task_history.record_task_stats(self.schema_details.schema_id, task, task_stats)
+        if isinstance(task_stats.get("cache_hit_ratio"), (int, float)):
+            self._metrics.task_cache_hit_ratio.observe(
+                task_stats["cache_hit_ratio"], schema_id=self.schema_details.schema_id
+            )
+
+    def _record_task_outcome(self, task: int, failed_attempts: int, succeeded: bool):
+        outcome = self._task_history.record_outcome(self.schema_details.schema_id, task, failed_attempts, succeeded)
+        self._metrics.task_outcomes.inc(schema_id=self.schema_details.schema_id, outcome=outcome)
+
+    def _record_task_failure(self, task: int, consumer_id: str) -> bool:
+        """
+        Records a failed attempt at a task and, if the retry policy allows, queues it to be retried
+        (after a backoff, if one is configured). Returns True if the task has run out of attempts.
+        """
+        failed_attempts = self._failed_attempts.get(task, 0) + 1
+        self._failed_attempts[task] = failed_attempts
+        self._failed_consumers.setdefault(task, set()).add(consumer_id)
+        self._events.emit("failed", consumer_id=consumer_id, task_id=task, attempt=failed_attempts)
+        self.timeline.record(TimelineEventType.FAIL, consumer_id, task)
+
+        if not self._retry_policy.should_retry(failed_attempts):
+            self._task_states.set(task, TaskState.FAILED)
+            sharded_task, _, _ = self._task_shards.get_shard(task)
+            failed_attempts += self._shard_results.pop_failed_attempts(sharded_task)
+            self._record_task_outcome(sharded_task, failed_attempts, False)
+            return True
+
+        self.timeline.record(TimelineEventType.REQUEUE, consumer_id, task)
+        self._task_states.set(task, TaskState.PENDING)
+        backoff = self._retry_policy.get_backoff(failed_attempts)
+        if backoff > 0:
+            self._backoff_timers[task] = asyncio.ensure_future(
+                self._request_from_controller(backoff, "retry.after.backoff", task_id=task)
+            )
+        else:
+            self._to_do_tasks.append(task)
+        return False
+
+    async def retry_after_backoff(self, task: int):
+        """
+        Called by the controller once a failed task's backoff has passed, to queue it to be retried.
+        """
+        with self._consumer_lock:
+            if task not in self._backoff_timers:
+                # e.g. completed by another consumer, or the instance has failed, since the backoff started
+                return
+            del self._backoff_timers[task]
+            self._to_do_tasks.append(task)
+        await self.send_build_instructions_to_idle_consumers({})
+
+    async def send_build_instructions_to_idle_consumers(self, msg: dict):
+        """
+        Hands out tasks to consumers which are registered but have nothing to do, e.g. because
+        the tasks that were left when they last asked were waiting on a dependency, or had
+        already failed on them.
+        """
+        with self._consumer_lock:
+            idle_consumers = [
+                consumer_id for consumer_id in self._registered_consumers if consumer_id not in self._leases
+            ]
+        for consumer_id in idle_consumers:
+            if len(self._to_do_tasks) == 0:
+                break
+            await self._send_build_instructions(msg, consumer_id)
+
     async def _send_schema_complete(self):
         with self._consumer_lock:
-            tasks_not_started = len(self._to_do_tasks)
-            tasks_in_progress = len(self._in_progress_consumers)
+            tasks_not_started = len(self._to_do_tasks) + len(self._backoff_timers)
+            tasks_in_progress = len(self._leases)
 
-            if tasks_not_started == 0 and tasks_in_progress == 0:
-                self._print_with_prefix("Schema completed")
+            if tasks_not_started == 0 and tasks_in_progress == 0 and not self._task_stream.is_open():
+                self._events.emit("schema_completed", consumers=len(self._registered_consumers))
+                schema_complete = {
+                    "type": "send.message",
+                    "message_type": MessageType.SCHEMA_COMPLETE,
+                    "schema_id": self.schema_details.schema_id,
+                }
                 for consumer_id in self._registered_consumers:
-                    self._print_with_prefix("Sending schema complete message to consumer " + consumer_id)
-                    await self._channel_layer.send(
-                        consumer_id,
-                        {
-                            "type": "send.message",
-                            "message_type": MessageType.SCHEMA_COMPLETE,
-                            "schema_id": self.schema_details.schema_id,
-                        },
-                    )
+                    self._events.emit("schema_complete_sent", consumer_id=consumer_id)
+                    await self._channel_layer.send(consumer_id, schema_complete)
                 return True
 
             return False
 
-    def _print_with_prefix(self, msg: str):
-        logger.info("[" + self.schema_details.id + "] " + msg)
+    async def _send_schema_failed(self, task: int):
+        """
+        Fails the instance because `task` has run out of attempts. Every consumer is told, so that
+        they stop their current task rather than work towards a schema which cannot complete.
+        """
+        with self._consumer_lock:
+            self._failed = True
+            self._drain()
+
+            self._events.emit("schema_failed", task_id=task, consumers=len(self._registered_consumers))
+            for consumer_id in self._registered_consumers:
+                await self._channel_layer.send(
+                    consumer_id,
+                    {
+                        "type": "send.message",
+                        "message_type": MessageType.SCHEMA_FAILED,
+                        "schema_id": self.schema_details.schema_id,
+                        **self._task_shards.describe_unit(task),
+                    },
+                )
+
+    async def supersede(self):
+        """
+        Cancels the instance because the repo state it was run for has been superseded, e.g. by a
+        newer patchset. Consumers with a task in progress are told to abort it, and every consumer
+        is told the schema has been superseded so that it stops waiting for further tasks.
+        """
+        with self._consumer_lock:
+            self._superseded = True
+            consumers_with_tasks = [consumer_id for consumer_id, _ in self._leases.items()]
+            self._drain()
+
+            self._events.emit(
+                "superseded", consumers=len(self._registered_consumers), tasks_in_progress=len(consumers_with_tasks)
+            )
+            for consumer_id in consumers_with_tasks:
+                await self._channel_layer.send(
+                    consumer_id,
+                    {
+                        "type": "send.message",
+                        "message_type": MessageType.ABORT_TASK,
+                        "schema_id": self.schema_details.schema_id,
+                    },
+                )
+            for consumer_id in self._registered_consumers:
+                await self._channel_layer.send(
+                    consumer_id,
+                    {
+                        "type": "send.message",
+                        "message_type": MessageType.SCHEMA_SUPERSEDED,
+                        "schema_id": self.schema_details.schema_id,
+                    },
+                )
+
+    def _drain(self):
+        """
+        Stops any further tasks being handed out, and forgets the tasks in progress.
+        """
+        for backoff_timer in self._backoff_timers.values():
+            backoff_timer.cancel()
+        self._backoff_timers.clear()
+        if self._affinity_timer:
+            self._affinity_timer.cancel()
+            self._affinity_timer = None
+        for consumer_id, unit in self._leases.items():
+            self._consumer_leases.release(consumer_id, self)
+            for leased_unit in [unit, *self._batches.get(consumer_id)]:
+                if self._task_states.get(leased_unit) == TaskState.LEASED:
+                    self._task_states.set(leased_unit, TaskState.PENDING)
+        self._leases.clear()
+        self._batches.clear()
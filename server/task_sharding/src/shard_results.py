@@ -0,0 +1,30 @@
+class ShardResults:
+    """
+    Collects the results of the shards of sharded tasks, as a sharded task has only passed once
+    every one of its shards has, and its duration is the sum of theirs.
+    """
+
+    def __init__(self):
+        self._durations: dict[int, list] = {}
+        self._failed_attempts: dict[int, int] = {}
+
+    def add_passed_shard(self, task: int, total_shards: int, duration: float, failed_attempts: int) -> tuple:
+        """
+        Records a passed shard of a task, with its duration if known and how many attempts at it failed.
+        Returns None while other shards of the task have yet to pass, and otherwise the task's duration,
+        if every shard's was known, and how many attempts at its shards failed.
+        """
+        durations = self._durations.setdefault(task, [])
+        durations.append(duration)
+        self._failed_attempts[task] = self._failed_attempts.get(task, 0) + failed_attempts
+        if len(durations) < total_shards:
+            return None
+        del self._durations[task]
+        return None if None in durations else sum(durations), self._failed_attempts.pop(task)
+
+    def pop_failed_attempts(self, task: int) -> int:
+        """
+        Returns how many attempts at the shards of a task which passed had failed, and forgets them,
+        e.g. once another shard has run out of attempts.
+        """
+        return self._failed_attempts.pop(task, 0)
@@ -0,0 +1,71 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+import logging
+
+from django.core.cache import caches
+
+from task_sharding.src.config import get_setting
+
+STATUS_SNAPSHOT_KEY = "task_sharding_status_snapshot"
+METRICS_SNAPSHOT_KEY = "task_sharding_metrics_snapshot"
+
+logger = logging.getLogger(__name__)
+
+# A single thread, so that snapshots are stored in the order they are published and an older one never
+# replaces a newer one
+_publisher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="snapshot-publisher")
+
+
+def get_status_cache():
+    """
+    Returns the Django cache named by `TASK_SHARDING_STATUS_CACHE`, which the controller publishes its
+    status and metrics snapshots to, and which must be shared with the server processes serving `/status`
+    and `/metrics`.
+    """
+    return caches[get_setting("STATUS_CACHE", "default")]
+
+
+def store_status_snapshot(status_snapshot: dict):
+    """
+    Replaces the published status snapshot. It never expires, so the last one published is served
+    even while the controller is idle.
+    """
+    get_status_cache().set(STATUS_SNAPSHOT_KEY, status_snapshot, timeout=None)
+
+
+def load_status_snapshot() -> dict:
+    """
+    Returns the last published status snapshot, or None if none has been published yet. It is read
+    from the cache without involving the controller, so polling it adds nothing to its work.
+    """
+    return get_status_cache().get(STATUS_SNAPSHOT_KEY)
+
+
+def store_metrics_snapshot(metrics_snapshot: list):
+    """
+    Replaces the published metrics snapshot, which is published along with the status snapshot.
+    """
+    get_status_cache().set(METRICS_SNAPSHOT_KEY, metrics_snapshot, timeout=None)
+
+
+def load_metrics_snapshot() -> list:
+    """
+    Returns the last published metrics snapshot, or None if none has been published yet, so that
+    scrapes are served without involving the controller.
+    """
+    return get_status_cache().get(METRICS_SNAPSHOT_KEY)
+
+
+def publish_snapshots(status_snapshot: dict, metrics_snapshot: list) -> Future:
+    """
+    Stores a status and a metrics snapshot on a thread of their own, as the cache may write them to
+    disk, and returns the future of the write. The snapshots must not be modified afterwards.
+    """
+    return _publisher.submit(_store_snapshots, status_snapshot, metrics_snapshot)
+
+
+def _store_snapshots(status_snapshot: dict, metrics_snapshot: list):
+    try:
+        store_status_snapshot(status_snapshot)
+        store_metrics_snapshot(metrics_snapshot)
+    except Exception:
+        logger.exception("Failed to publish the status and metrics snapshots")
@@ -0,0 +1,83 @@
+import heapq
+
+DEFAULT_SMOOTHING_FACTOR = 0.3
+DEFAULT_LOW_CACHE_HIT_RATIO = 0.5
+TASK_OUTCOMES = ("passed", "flaky", "broken")
+
+
+class TaskHistory:
+    """
+    Keeps an exponentially weighted moving average of how long each task of a schema takes.
+    It is shared by every schema instance of a controller, so durations observed by one
+    instance of a schema inform the scheduling of later instances of the same schema.
+    """
+
+    def __init__(
+        self,
+        smoothing_factor: float = DEFAULT_SMOOTHING_FACTOR,
+        low_cache_hit_ratio: float = DEFAULT_LOW_CACHE_HIT_RATIO,
+    ):
+        self._smoothing_factor = smoothing_factor
+        self._durations: dict[tuple, float] = {}
+        self._outcomes: dict[tuple, dict[str, int]] = {}
+        self._task_stats: dict[str, dict[int, dict]] = {}
+        self._low_cache_hit_ratio = low_cache_hit_ratio
+        self._low_cache_hit_tasks: dict[str, dict[int, float]] = {}
+        """
+        The latest cache hit ratio of each task of a schema for which it was at most `low_cache_hit_ratio`,
+        kept apart so that finding them does not go through the stats of every task.
+        """
+
+    def record_duration(self, schema_id: str, task_id: int, duration: float):
+        key = (schema_id, task_id)
+        if key in self._durations:
+            previous = self._durations[key]
+            duration = previous + self._smoothing_factor * (duration - previous)
+        self._durations[key] = duration
+
+    def get_expected_duration(self, schema_id: str, task_id: int, default: float = None) -> float:
+        return self._durations.get((schema_id, task_id), default)
+
+    def record_outcome(self, schema_id: str, task_id: int, failed_attempts: int, succeeded: bool) -> str:
+        """
+        Records how a run of a task ended: "passed" first time, "flaky" if it passed after failing,
+        or "broken" if it never passed. Returns the outcome.
+        """
+        if not succeeded:
+            outcome = "broken"
+        elif failed_attempts:
+            outcome = "flaky"
+        else:
+            outcome = "passed"
+        outcomes = self._outcomes.setdefault((schema_id, task_id), dict.fromkeys(TASK_OUTCOMES, 0))
+        outcomes[outcome] += 1
+        return outcome
+
+    def get_outcomes(self, schema_id: str, task_id: int) -> dict:
+        return dict(self._outcomes.get((schema_id, task_id), dict.fromkeys(TASK_OUTCOMES, 0)))
+
+    def record_task_stats(self, schema_id: str, task_id: int, task_stats: dict):
+        """
+        Keeps the statistics reported by the consumer with the latest result of a task (e.g. its
+        action cache hit ratio).
+        """
+        self._task_stats.setdefault(schema_id, {})[task_id] = task_stats
+        low_cache_hit_tasks = self._low_cache_hit_tasks.setdefault(schema_id, {})
+        cache_hit_ratio = task_stats.get("cache_hit_ratio")
+        if isinstance(cache_hit_ratio, (int, float)) and cache_hit_ratio <= self._low_cache_hit_ratio:
+            low_cache_hit_tasks[task_id] = cache_hit_ratio
+        else:
+            low_cache_hit_tasks.pop(task_id, None)
+
+    def get_task_stats(self, schema_id: str, task_id: int) -> dict:
+        return self._task_stats.get(schema_id, {}).get(task_id)
+
+    def get_low_cache_hit_tasks(self, schema_id: str, limit: int = None) -> list:
+        """
+        Returns the tasks of a schema whose latest cache hit ratio was at most `low_cache_hit_ratio`, as
+        (task ID, cache hit ratio) pairs from the lowest ratio up, and at most `limit` of them.
+        """
+        low_cache_hit_tasks = self._low_cache_hit_tasks.get(schema_id, {}).items()
+        if limit is not None:
+            return heapq.nsmallest(limit, low_cache_hit_tasks, key=lambda task: task[1])
+        return sorted(low_cache_hit_tasks, key=lambda task: task[1])
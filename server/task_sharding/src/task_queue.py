@@ -0,0 +1,527 @@
+from array import array
+import heapq
+import itertools
+
+from task_sharding.src.capabilities import NO_CAPABILITIES, Capabilities
+from task_sharding.src.task_history import TaskHistory
+from task_sharding.src.task_set import TaskSet
+
+DEFAULT_TASK_DURATION = 1.0
+
+
+class TaskQueue:
+    """
+    Holds the tasks of a schema instance which have not been assigned yet, and decides which
+    task is handed out next. Subclasses implement the ordering of tasks that are ready to run.
+
+    Tasks may optionally depend on other tasks, in which case they are held back until every
+    dependency has been completed (see `task_completed`). Tasks given back with `append`, e.g.
+    after a failure or a disconnect, have already had their dependencies met.
+    """
+
+    def __init__(self, tasks, dependencies: dict = None):
+        self._blocked: dict[int, int] = {}
+        self._dependents: dict[int, list[int]] = {}
+        self._completed = TaskSet()
+
+        for task in tasks:
+            task_dependencies = dependencies.get(task, ()) if dependencies else ()
+            if task_dependencies:
+                self._blocked[task] = len(task_dependencies)
+                for dependency in task_dependencies:
+                    self._dependents.setdefault(dependency, []).append(task)
+
+        for task in tasks:
+            if task not in self._blocked:
+                self._push_ready(task)
+
+    def __len__(self) -> int:
+        return self._ready_count() + len(self._blocked)
+
+    def append(self, task: int):
+        self._push_ready(task)
+
+    def add_task(self, task: int, requirements: Capabilities = NO_CAPABILITIES):
+        """
+        Adds a task which was not known when the queue was created, e.g. one streamed in by a
+        consumer. Added tasks have no dependencies. Only a `RequirementsTaskQueue` keeps the
+        `requirements` of the task.
+        """
+        self._push_ready(task)
+
+    def add_consumer(self, consumer_id: str, capabilities: Capabilities):
+        """
+        Tells the queue what a consumer is capable of. Only a `RequirementsTaskQueue` holds tasks which
+        not every consumer may be handed.
+        """
+
+    def remove_consumer(self, consumer_id: str):
+        pass
+
+    def get_unmet_requirements(self) -> dict:
+        """
+        Returns the requirements of ready tasks which no consumer added to the queue meets, mapped to how
+        many ready tasks have them. Only a `RequirementsTaskQueue` can hold such tasks.
+        """
+        return {}
+
+    def remove(self, task: int) -> bool:
+        """
+        Removes a task which is ready to run, e.g. because it has been completed without being
+        handed out, and returns whether it was.
+        """
+        return self._remove_ready(task)
+
+    def pop(self, consumer_id: str = None, excluded_tasks=(), preferred_tasks=()) -> int:
+        """
+        Removes and returns the next task to run, passing over any in `excluded_tasks` (which may be
+        `ExcludedTasks`), or None if every remaining task is blocked or excluded. The first ready task in
+        `preferred_tasks` is handed out ahead of the usual order.
+        """
+        if self._ready_count() == 0:
+            return None
+        for task in preferred_tasks:
+            if task not in excluded_tasks and self._remove_ready(task):
+                return task
+        if not excluded_tasks:
+            return self._pop_ready(consumer_id)
+
+        task = None
+        passed_over = []
+        while self._ready_count() > 0:
+            candidate = self._pop_ready(consumer_id)
+            if candidate not in excluded_tasks:
+                task = candidate
+                break
+            passed_over.append(candidate)
+
+        # Pushing back in reverse restores the order the tasks were in
+        for passed_over_task in reversed(passed_over):
+            self._push_ready(passed_over_task)
+        return task
+
+    def get_tasks(self) -> list:
+        """
+        Returns every task in the queue, ready or blocked, in no particular order.
+        """
+        return [*self._ready_tasks(), *self._blocked]
+
+    def task_completed(self, task: int):
+        if task in self._completed:
+            return
+        self._completed.add(task)
+        for dependent in self._dependents.pop(task, ()):
+            self._blocked[dependent] -= 1
+            if self._blocked[dependent] == 0:
+                del self._blocked[dependent]
+                self._push_ready(dependent)
+
+    def _ready_count(self) -> int:
+        raise NotImplementedError()
+
+    def _ready_tasks(self):
+        raise NotImplementedError()
+
+    def _push_ready(self, task: int):
+        raise NotImplementedError()
+
+    def _pop_ready(self, consumer_id: str) -> int:
+        raise NotImplementedError()
+
+    def _remove_ready(self, task: int) -> bool:
+        """
+        Removes a task if it is ready to run, and returns whether it was.
+        """
+        raise NotImplementedError()
+
+
+class ExcludedTasks:
+    """
+    The tasks `TaskQueue.pop` should pass over, decided by `is_excluded` as each candidate comes up
+    rather than gathered up front, as finding every excluded task may mean looking at far more tasks
+    than are popped.
+    """
+
+    __slots__ = ("_is_excluded",)
+
+    def __init__(self, is_excluded):
+        self._is_excluded = is_excluded
+
+    def __contains__(self, task: int) -> bool:
+        return self._is_excluded(task)
+
+
+class LifoTaskQueue(TaskQueue):
+    """
+    Hands out the most recently queued task first. Without any re-queued tasks this is the
+    highest numbered task.
+
+    The ready tasks are held in an array of machine integers, as there may be many thousands of them.
+    Removing a task only takes it out of `_ready_set`, leaving its entry in the array to be skipped
+    when it reaches the top, so that removing a task does not search the array.
+    """
+
+    def __init__(self, tasks, dependencies: dict = None):
+        self._ready = array("q")
+        self._ready_set = TaskSet()
+        """
+        The tasks which are ready. Only the topmost entry of a task in `_ready` counts.
+        """
+        super().__init__(tasks, dependencies)
+
+    def _ready_count(self) -> int:
+        return len(self._ready_set)
+
+    def _ready_tasks(self):
+        return self._ready_set
+
+    def _push_ready(self, task: int):
+        self._ready.append(task)
+        self._ready_set.add(task)
+
+    def _pop_ready(self, consumer_id: str) -> int:
+        while True:
+            task = self._ready.pop()
+            if task in self._ready_set:
+                self._ready_set.discard(task)
+                return task
+
+    def _remove_ready(self, task: int) -> bool:
+        if task not in self._ready_set:
+            return False
+        self._ready_set.discard(task)
+        if len(self._ready) > 2 * len(self._ready_set):
+            self._compact()
+        return True
+
+    def _compact(self):
+        """
+        Drops the entries of removed tasks once they make up most of the array.
+        """
+        kept_tasks = TaskSet()
+        ready = []
+        for task in reversed(self._ready):
+            if task in self._ready_set and task not in kept_tasks:
+                kept_tasks.add(task)
+                ready.append(task)
+        ready.reverse()
+        self._ready = array("q", ready)
+
+
+class PriorityTaskQueue(TaskQueue):
+    """
+    Hands out the ready task with the highest priority first. Ties are broken LIFO.
+
+    Removing a task only forgets its entry in `_ready_entries`, leaving it in the heap to be skipped
+    when it is popped, so that removing a task does not search and re-heapify the heap.
+    """
+
+    def __init__(self, tasks, dependencies: dict = None):
+        self._ready = []
+        self._ready_entries: dict[int, int] = {}
+        """
+        The ready tasks, each mapped to when its current entry in `_ready` was pushed.
+        """
+        self._pushed = 0
+        super().__init__(tasks, dependencies)
+
+    def get_priority(self, task: int) -> float:
+        raise NotImplementedError()
+
+    def _ready_count(self) -> int:
+        return len(self._ready_entries)
+
+    def _ready_tasks(self):
+        return self._ready_entries.keys()
+
+    def _push_ready(self, task: int):
+        self._pushed += 1
+        self._ready_entries[task] = self._pushed
+        heapq.heappush(self._ready, (-self.get_priority(task), -self._pushed, task))
+
+    def _pop_ready(self, consumer_id: str) -> int:
+        while True:
+            _, pushed, task = heapq.heappop(self._ready)
+            if self._ready_entries.get(task) == -pushed:
+                del self._ready_entries[task]
+                return task
+
+    def _remove_ready(self, task: int) -> bool:
+        if self._ready_entries.pop(task, None) is None:
+            return False
+        if len(self._ready) > 2 * len(self._ready_entries):
+            # Drops the entries of removed tasks once they make up most of the heap
+            self._ready = [entry for entry in self._ready if self._ready_entries.get(entry[2]) == -entry[1]]
+            heapq.heapify(self._ready)
+        return True
+
+
+class LongestFirstTaskQueue(PriorityTaskQueue):
+    """
+    Hands out the task expected to take the longest first (longest processing time first),
+    which keeps long tasks from being left until the end of a schema. Tasks which have never
+    been timed are treated as `default_duration` long.
+    """
+
+    def __init__(
+        self,
+        tasks,
+        schema_id: str,
+        task_history: TaskHistory,
+        dependencies: dict = None,
+        default_duration: float = DEFAULT_TASK_DURATION,
+    ):
+        self._schema_id = schema_id
+        self._task_history = task_history
+        self._default_duration = default_duration
+        super().__init__(tasks, dependencies)
+
+    def get_priority(self, task: int) -> float:
+        return self._task_history.get_expected_duration(self._schema_id, task, self._default_duration)
+
+
+class CriticalPathTaskQueue(PriorityTaskQueue):
+    """
+    Hands out the ready task with the longest chain of work still depending on it first, so the
+    critical path of the task graph is started as early as possible.
+    """
+
+    def __init__(
+        self,
+        tasks,
+        schema_id: str,
+        task_history: TaskHistory,
+        dependencies: dict = None,
+        default_duration: float = DEFAULT_TASK_DURATION,
+        critical_path_lengths: dict = None,
+    ):
+        """
+        `critical_path_lengths` may be given if they have already been calculated, e.g. when the queue
+        holds part of a larger task graph.
+        """
+        tasks = list(tasks)
+        self._get_duration = lambda task: task_history.get_expected_duration(schema_id, task, default_duration)
+        self._critical_path_lengths = (
+            critical_path_lengths
+            if critical_path_lengths is not None
+            else self._calculate_critical_path_lengths(tasks, dependencies or {}, self._get_duration)
+        )
+        super().__init__(tasks, dependencies)
+
+    def get_priority(self, task: int) -> float:
+        return self._critical_path_lengths[task]
+
+    def add_task(self, task: int, requirements: Capabilities = NO_CAPABILITIES):
+        # Nothing can depend on a task added later, so its critical path is only itself
+        self._critical_path_lengths[task] = self._get_duration(task)
+        super().add_task(task, requirements)
+
+    @staticmethod
+    def _calculate_critical_path_lengths(tasks: list, dependencies: dict, get_duration) -> dict:
+        dependents = {task: [] for task in tasks}
+        remaining_dependents = {task: 0 for task in tasks}
+        for task in tasks:
+            for dependency in dependencies.get(task, ()):
+                dependents[dependency].append(task)
+                remaining_dependents[dependency] += 1
+
+        # Walk the graph backwards from the tasks nothing depends on (Kahn's algorithm)
+        critical_path_lengths = {}
+        to_visit = [task for task in tasks if remaining_dependents[task] == 0]
+        while to_visit:
+            task = to_visit.pop()
+            critical_path_lengths[task] = get_duration(task) + max(
+                (critical_path_lengths[dependent] for dependent in dependents[task]), default=0.0
+            )
+            for dependency in dependencies.get(task, ()):
+                remaining_dependents[dependency] -= 1
+                if remaining_dependents[dependency] == 0:
+                    to_visit.append(dependency)
+
+        if len(critical_path_lengths) != len(tasks):
+            raise ValueError("Task dependencies contain a cycle")
+        return critical_path_lengths
+
+
+class RequirementsTaskQueue(TaskQueue):
+    """
+    Holds tasks which may require capabilities of the consumer they are handed to (see `Capabilities`),
+    e.g. a large amount of memory or a certain toolchain. The ready tasks are kept in a queue of their
+    own for each distinct set of requirements, made by `create_queue` from a list of tasks, which
+    decides their order. Each consumer is matched with the queues whose requirements it meets when it
+    is added, so that finding a task for a consumer only looks at those queues, rather than at every
+    ready task.
+
+    A consumer is handed the tasks with the most requirements it meets first, leaving the tasks which
+    any consumer can run to consumers which cannot run anything else. Tasks whose requirements no
+    consumer meets wait until such a consumer is added (see `get_unmet_requirements`).
+    """
+
+    def __init__(self, tasks, create_queue, task_requirements: dict, dependencies: dict = None):
+        self._create_queue = create_queue
+        self._task_requirements: dict[int, Capabilities] = {
+            task: requirements for task, requirements in task_requirements.items() if requirements
+        }
+        """
+        The requirements of each task which has any.
+        """
+        self._queues: dict[Capabilities, TaskQueue] = {}
+        self._consumer_capabilities: dict[str, Capabilities] = {}
+        self._consumer_queues: dict[str, list[TaskQueue]] = {}
+        """
+        The queues each consumer may be handed tasks from, those with the most requirements first.
+        """
+        self._queue_consumers: dict[TaskQueue, int] = {}
+        """
+        How many consumers may be handed tasks from each queue.
+        """
+        super().__init__(tasks, dependencies)
+
+    def pop(self, consumer_id: str = None, excluded_tasks=(), preferred_tasks=()) -> int:
+        queues = self._get_queues_of_consumer(consumer_id)
+        for task in preferred_tasks:
+            if (
+                task not in excluded_tasks
+                and self._queues.get(self._task_requirements.get(task, NO_CAPABILITIES)) in queues
+                and self._remove_ready(task)
+            ):
+                return task
+        return self._pop_ready(consumer_id, excluded_tasks)
+
+    def add_task(self, task: int, requirements: Capabilities = NO_CAPABILITIES):
+        if requirements:
+            self._task_requirements[task] = requirements
+        self._get_queue(requirements).add_task(task)
+
+    def add_consumer(self, consumer_id: str, capabilities: Capabilities):
+        self._consumer_capabilities[consumer_id] = capabilities
+        self._set_consumer_queues(consumer_id, self._match_queues(capabilities))
+
+    def remove_consumer(self, consumer_id: str):
+        self._consumer_capabilities.pop(consumer_id, None)
+        self._set_consumer_queues(consumer_id, None)
+
+    def get_unmet_requirements(self) -> dict:
+        return {
+            requirements: len(queue)
+            for requirements, queue in self._queues.items()
+            if len(queue) > 0 and not self._queue_consumers.get(queue)
+        }
+
+    def _set_consumer_queues(self, consumer_id: str, queues: list):
+        for queue in self._consumer_queues.pop(consumer_id, ()):
+            self._queue_consumers[queue] -= 1
+        if queues is None:
+            return
+        self._consumer_queues[consumer_id] = queues
+        for queue in queues:
+            self._queue_consumers[queue] = self._queue_consumers.get(queue, 0) + 1
+
+    def _get_queues_of_consumer(self, consumer_id: str) -> list:
+        if consumer_id in self._consumer_queues:
+            return self._consumer_queues[consumer_id]
+        return self._match_queues(NO_CAPABILITIES)
+
+    def _match_queues(self, capabilities: Capabilities) -> list:
+        return [
+            self._queues[requirements]
+            for requirements in sorted(self._queues, key=Capabilities.get_total_requirements, reverse=True)
+            if capabilities.meets(requirements)
+        ]
+
+    def _get_queue(self, requirements: Capabilities) -> TaskQueue:
+        if requirements not in self._queues:
+            self._queues[requirements] = self._create_queue(())
+            # Only when a task with new requirements is added, which is rare after the queue is created
+            for consumer_id, capabilities in self._consumer_capabilities.items():
+                self._set_consumer_queues(consumer_id, self._match_queues(capabilities))
+        return self._queues[requirements]
+
+    def _ready_count(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _ready_tasks(self):
+        return itertools.chain.from_iterable(queue.get_tasks() for queue in self._queues.values())
+
+    def _push_ready(self, task: int):
+        self._get_queue(self._task_requirements.get(task, NO_CAPABILITIES)).append(task)
+
+    def _pop_ready(self, consumer_id: str, excluded_tasks=()) -> int:
+        for queue in self._get_queues_of_consumer(consumer_id):
+            task = queue.pop(consumer_id, excluded_tasks)
+            if task is not None:
+                return task
+        return None
+
+    def _remove_ready(self, task: int) -> bool:
+        queue = self._queues.get(self._task_requirements.get(task, NO_CAPABILITIES))
+        return queue is not None and queue.remove(task)
+
+
+SCHEDULING_POLICIES = ("lifo", "longest_first", "critical_path")
+
+
+def create_task_queue(
+    scheduling_policy: str,
+    total_tasks: int,
+    schema_id: str,
+    task_history: TaskHistory,
+    dependencies: dict = None,
+    completed_tasks=(),
+    task_requirements: dict = None,
+) -> TaskQueue:
+    """
+    Creates a queue of the tasks from 0 to `total_tasks`, leaving out `completed_tasks`, e.g. those
+    completed by an earlier instance of the same schema. If `task_requirements` are given, mapping
+    tasks to the `Capabilities` they require, the queue keeps the tasks of each set of requirements
+    apart (see `RequirementsTaskQueue`).
+    """
+    if scheduling_policy not in SCHEDULING_POLICIES:
+        raise ValueError("Unknown scheduling policy: " + scheduling_policy)
+    tasks = range(0, total_tasks)
+    if completed_tasks:
+        completed_tasks = TaskSet(completed_tasks)
+        tasks = [task for task in tasks if task not in completed_tasks]
+        if dependencies:
+            dependencies = {
+                task: [dependency for dependency in task_dependencies if dependency not in completed_tasks]
+                for task, task_dependencies in dependencies.items()
+                if task not in completed_tasks
+            }
+    if task_requirements is None:
+        return _create_policy_task_queue(scheduling_policy, tasks, schema_id, task_history, dependencies)
+
+    critical_path_lengths = None
+    if scheduling_policy == "critical_path":
+        # Each queue holds part of the task graph, but is ordered by the critical paths through all of it
+        tasks = list(tasks)
+        critical_path_lengths = CriticalPathTaskQueue._calculate_critical_path_lengths(
+            tasks,
+            dependencies or {},
+            lambda task: task_history.get_expected_duration(schema_id, task, DEFAULT_TASK_DURATION),
+        )
+    return RequirementsTaskQueue(
+        tasks,
+        lambda queue_tasks: _create_policy_task_queue(
+            scheduling_policy, queue_tasks, schema_id, task_history, critical_path_lengths=critical_path_lengths
+        ),
+        task_requirements,
+        dependencies,
+    )
+
+
+def _create_policy_task_queue(
+    scheduling_policy: str,
+    tasks,
+    schema_id: str,
+    task_history: TaskHistory,
+    dependencies: dict = None,
+    critical_path_lengths: dict = None,
+) -> TaskQueue:
+    if scheduling_policy == "lifo":
+        return LifoTaskQueue(tasks, dependencies)
+    if scheduling_policy == "longest_first":
+        return LongestFirstTaskQueue(tasks, schema_id, task_history, dependencies)
+    return CriticalPathTaskQueue(
+        tasks, schema_id, task_history, dependencies, critical_path_lengths=critical_path_lengths
+    )
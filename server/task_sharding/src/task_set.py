@@ -0,0 +1,41 @@
+class TaskSet:
+    """
+    A set of task IDs held as a bitset, for sets which may come to hold every task of a large
+    schema instance (e.g. the completed tasks). It takes one bit per task ID up to the highest
+    one added, rather than the ~60 bytes per member of a set of ints.
+    """
+
+    __slots__ = ("_bits", "_count")
+
+    def __init__(self, tasks=()):
+        self._bits = bytearray()
+        self._count = 0
+        for task in tasks:
+            self.add(task)
+
+    def add(self, task: int):
+        index, mask = task >> 3, 1 << (task & 7)
+        if index >= len(self._bits):
+            self._bits.extend(bytes(index + 1 - len(self._bits)))
+        if not self._bits[index] & mask:
+            self._bits[index] |= mask
+            self._count += 1
+
+    def discard(self, task: int):
+        if task in self:
+            self._bits[task >> 3] &= ~(1 << (task & 7)) & 0xFF
+            self._count -= 1
+
+    def __contains__(self, task: int) -> bool:
+        index = task >> 3
+        return 0 <= index < len(self._bits) and bool(self._bits[index] & (1 << (task & 7)))
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self):
+        for index, byte in enumerate(self._bits):
+            if byte:
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield (index << 3) | bit
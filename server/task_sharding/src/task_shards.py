@@ -0,0 +1,137 @@
+import statistics
+
+from task_sharding.src.task_history import TaskHistory
+
+DEFAULT_MAX_AUTO_SHARDS = 16
+
+
+class TaskShards:
+    """
+    Maps the units of work handed out by a schema instance onto the tasks of its schema. A task
+    split into N shards is handed out as N units: the first shard keeps the task's ID and the rest
+    are numbered upwards from the schema's total number of tasks. Every other task is a single
+    unit with the same ID as the task.
+
+    Tasks added to a running instance (see `add_task`) are never sharded, and their units are
+    numbered after every existing unit.
+    """
+
+    def __init__(self, total_tasks: int, shard_counts: dict = None):
+        self._shards: dict[int, tuple] = {}
+        self._task_units: dict[int, list[int]] = {}
+
+        next_unit = total_tasks
+        for task, total_shards in sorted((shard_counts or {}).items()):
+            if total_shards < 2:
+                continue
+            units = [task, *range(next_unit, next_unit + total_shards - 1)]
+            next_unit += total_shards - 1
+            self._task_units[task] = units
+            for shard_index, unit in enumerate(units):
+                self._shards[unit] = (task, shard_index, total_shards)
+        self.total_units = next_unit
+
+    def add_task(self, task: int) -> int:
+        """
+        Adds a task with the next task ID, and returns its unit.
+        """
+        if not self._task_units:
+            # Without shards, units and tasks keep the same IDs
+            self.total_units = task + 1
+            return task
+        unit = self.total_units
+        self.total_units += 1
+        self._task_units[task] = [unit]
+        self._shards[unit] = (task, 0, 1)
+        return unit
+
+    def __bool__(self) -> bool:
+        return bool(self._task_units)
+
+    def get_shard(self, unit: int) -> tuple:
+        """
+        Returns the task, shard index and total number of shards of a unit.
+        """
+        return self._shards.get(unit, (unit, 0, 1))
+
+    def get_unit(self, task: int, shard_index: int = 0) -> int:
+        units = self._task_units.get(task)
+        return units[shard_index] if units else task
+
+    def get_units(self, task: int) -> list:
+        return self._task_units.get(task, [task])
+
+    def describe_unit(self, unit: int) -> dict:
+        """
+        Returns the fields which tell a consumer which task, and which shard of it, a unit is.
+        """
+        task, shard_index, total_shards = self.get_shard(unit)
+        if total_shards == 1:
+            return {"task_id": str(task)}
+        return {"task_id": str(task), "shard_index": shard_index, "total_shards": total_shards}
+
+    def get_shard_counts(self) -> dict:
+        """
+        Returns the shard counts the units were numbered by, which number them the same way again.
+        Tasks added to a running instance are left out, as they are not known to a new instance.
+        """
+        return {task: len(units) for task, units in self._task_units.items() if len(units) > 1}
+
+
+class ShardedTaskHistory:
+    """
+    Presents a task history by unit rather than by task, for task queues ordering the units of a
+    sharded schema instance. Each shard is expected to take an equal share of its task's duration.
+    """
+
+    def __init__(self, task_history: TaskHistory, task_shards: TaskShards):
+        self._task_history = task_history
+        self._task_shards = task_shards
+
+    def get_expected_duration(self, schema_id: str, unit: int, default: float = None) -> float:
+        task, _, total_shards = self._task_shards.get_shard(unit)
+        expected_duration = self._task_history.get_expected_duration(schema_id, task)
+        return default if expected_duration is None else expected_duration / total_shards
+
+
+def calculate_shard_counts(
+    shardable_tasks: dict,
+    total_tasks: int,
+    schema_id: str,
+    task_history: TaskHistory,
+    target_duration: float = None,
+    max_shards: int = DEFAULT_MAX_AUTO_SHARDS,
+) -> dict:
+    """
+    Decides how many shards each shardable task is split into. `shardable_tasks` maps task IDs
+    to a shard count, or to 0 to derive the count from the task's expected duration: enough
+    shards that each takes about `target_duration`, by default the median expected duration of
+    the schema's unsharded tasks. Tasks which have never been timed are not split.
+    """
+    shard_counts = {}
+    auto_sharded_tasks = []
+    for task, total_shards in shardable_tasks.items():
+        task = int(task)
+        if not 0 <= task < total_tasks:
+            continue
+        if int(total_shards) > 0:
+            shard_counts[task] = int(total_shards)
+        else:
+            auto_sharded_tasks.append(task)
+
+    if auto_sharded_tasks and target_duration is None:
+        unsharded_durations = [
+            task_history.get_expected_duration(schema_id, task)
+            for task in range(total_tasks)
+            if task not in shard_counts and task not in auto_sharded_tasks
+        ]
+        unsharded_durations = [duration for duration in unsharded_durations if duration is not None]
+        target_duration = statistics.median(unsharded_durations) if unsharded_durations else None
+
+    for task in auto_sharded_tasks:
+        expected_duration = task_history.get_expected_duration(schema_id, task)
+        if expected_duration is None or not target_duration:
+            continue
+        shard_counts[task] = min(max(round(expected_duration / target_duration), 1), max_shards)
+
+    return shard_counts
@@ -0,0 +1,61 @@
+import enum
+
+
+class TaskState(enum.IntEnum):
+    PENDING = 0
+    """
+    Waiting to be handed out, including after a failed attempt or while backing off before a retry.
+    """
+    LEASED = 1
+    """
+    Handed out to a consumer which has not reported its result yet.
+    """
+    DONE = 2
+    """
+    Reported as passed, which is final: any later result for the unit is ignored.
+    """
+    FAILED = 3
+    """
+    Out of attempts, which fails the schema instance.
+    """
+
+
+class TaskStates:
+    """
+    Tracks the state of every unit of a schema instance, in a single byte per unit, along with how
+    many units are in each state.
+    """
+
+    __slots__ = ("_states", "_counts")
+
+    def __init__(self, total_units: int, done_units=()):
+        self._states = bytearray(total_units)
+        self._counts = [0] * len(TaskState)
+        self._counts[TaskState.PENDING] = total_units
+        for unit in done_units:
+            self.set(unit, TaskState.DONE)
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def resize(self, total_units: int):
+        """
+        Adds pending units up to `total_units`, e.g. for tasks streamed into the instance.
+        """
+        if total_units > len(self._states):
+            self._counts[TaskState.PENDING] += total_units - len(self._states)
+            self._states.extend(bytes(total_units - len(self._states)))
+
+    def get(self, unit: int) -> TaskState:
+        return TaskState(self._states[unit])
+
+    def set(self, unit: int, state: TaskState):
+        self._counts[self._states[unit]] -= 1
+        self._counts[state] += 1
+        self._states[unit] = state
+
+    def count(self, state: TaskState) -> int:
+        return self._counts[state]
+
+    def get_units(self, state: TaskState) -> list:
+        return [unit for unit, unit_state in enumerate(self._states) if unit_state == state]
@@ -0,0 +1,43 @@
+class TaskStream:
+    """
+    The tasks added to a streaming schema instance while it runs. A streaming instance cannot
+    complete until a consumer marks the end of the stream. Added tasks are passed on to consumers in
+    their build instructions, as a consumer may be given a task before it has enumerated the task itself.
+    """
+
+    def __init__(self, streaming: bool = False):
+        self._open = streaming
+        self._tasks: dict[int, dict] = {}
+
+    def is_open(self) -> bool:
+        return self._open
+
+    def end(self) -> bool:
+        """
+        Marks the end of the stream, and returns whether it was still open.
+        """
+        was_open = self._open
+        self._open = False
+        return was_open
+
+    def get_new_tasks(self, first_task: int, tasks: list, total_tasks: int) -> list:
+        """
+        Returns the tasks of an ADD_TASKS message, whose first task has the ID `first_task`, which are
+        not among the instance's `total_tasks` yet, e.g. because another consumer streaming the same
+        schema added them first. Returns None if the tasks would leave a gap after the existing ones.
+        """
+        if first_task > total_tasks:
+            return None
+        return tasks[total_tasks - first_task :]
+
+    def add(self, task: int, task_definition):
+        self._tasks[task] = task_definition
+
+    def get(self, task: int):
+        """
+        Returns the definition of a task added to the stream, or None if the task was not streamed.
+        """
+        return self._tasks.get(task)
+
+    def __bool__(self) -> bool:
+        return bool(self._tasks)
@@ -0,0 +1,121 @@
+import collections
+import enum
+import time
+
+DEFAULT_TIMELINE_MAX_EVENTS = 10000
+
+
+class TimelineEventType(str, enum.Enum):
+    REGISTER = "register"
+    ASSIGN = "assign"
+    # A unit assigned along with the task last assigned to the consumer, which runs them as a batch
+    BATCH = "batch"
+    COMPLETE = "complete"
+    FAIL = "fail"
+    REQUEUE = "requeue"
+    DEREGISTER = "deregister"
+
+
+class Timeline:
+    """
+    A bounded record of the scheduling events of a single schema instance. Events are stored
+    as compact tuples in a ring buffer, so the oldest events are dropped once `max_events` is reached.
+    """
+
+    def __init__(self, max_events: int = DEFAULT_TIMELINE_MAX_EVENTS):
+        self._events = collections.deque(maxlen=max_events)
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def record(self, event_type: TimelineEventType, consumer_id: str, task_id: int = None):
+        self._events.append((time.time(), event_type, consumer_id, task_id))
+
+    def to_chrome_trace(self, instance_id: str) -> dict:
+        """
+        Converts the timeline to the Chrome Trace Event format (loadable in chrome://tracing or Perfetto).
+        Each consumer gets its own lane; task executions are duration events and every other
+        event is an instant marker on the consumer's lane.
+        """
+        events = tuple(self._events)
+        trace_events = [
+            {"name": "process_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": "Schema instance " + instance_id}}
+        ]
+        lanes = {}
+        running_tasks = {}
+
+        for timestamp, event_type, consumer_id, task_id in events:
+            if consumer_id not in lanes:
+                lanes[consumer_id] = len(lanes) + 1
+                trace_events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": 1,
+                        "tid": lanes[consumer_id],
+                        "args": {"name": consumer_id},
+                    }
+                )
+            lane = lanes[consumer_id]
+            timestamp_us = int(timestamp * 1000000)
+
+            if event_type == TimelineEventType.ASSIGN:
+                # A consumer runs one task, or one batch of tasks, at a time
+                running_tasks[consumer_id] = {task_id: timestamp_us}
+                continue
+            if event_type == TimelineEventType.BATCH:
+                running_tasks.setdefault(consumer_id, {})[task_id] = timestamp_us
+                continue
+
+            if event_type in (TimelineEventType.COMPLETE, TimelineEventType.FAIL, TimelineEventType.REQUEUE):
+                started_us = running_tasks.get(consumer_id, {}).pop(task_id, None)
+                if started_us is not None:
+                    trace_events.append(
+                        {
+                            "name": "task " + str(task_id),
+                            "cat": "task",
+                            "ph": "X",
+                            "pid": 1,
+                            "tid": lane,
+                            "ts": started_us,
+                            "dur": timestamp_us - started_us,
+                            "args": {"task_id": task_id, "result": event_type.value},
+                        }
+                    )
+                    if event_type == TimelineEventType.COMPLETE:
+                        continue
+
+            args = {"consumer_id": consumer_id}
+            if task_id is not None:
+                args["task_id"] = task_id
+            trace_events.append(
+                {
+                    "name": event_type.value,
+                    "cat": "scheduler",
+                    "ph": "i",
+                    "s": "t",
+                    "pid": 1,
+                    "tid": lane,
+                    "ts": timestamp_us,
+                    "args": args,
+                }
+            )
+
+        # Tasks which are still running are drawn up to the time of the export
+        now_us = int(time.time() * 1000000)
+        for consumer_id, consumer_running_tasks in running_tasks.items():
+            for task_id, started_us in consumer_running_tasks.items():
+                trace_events.append(
+                    {
+                        "name": "task " + str(task_id),
+                        "cat": "task",
+                        "ph": "X",
+                        "pid": 1,
+                        "tid": lanes[consumer_id],
+                        "ts": started_us,
+                        "dur": now_us - started_us,
+                        "args": {"task_id": task_id, "result": "running"},
+                    }
+                )
+
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
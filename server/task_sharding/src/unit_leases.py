@@ -0,0 +1,99 @@
+class UnitLeases:
+    """
+    Tracks the unit each consumer of a schema instance is in progress on, from when it is handed the
+    unit until it reports a result for it or leaves the instance, along with when it was handed the
+    unit and the progress it has reported, to estimate how long the unit has left.
+    """
+
+    def __init__(self, clock):
+        self._clock = clock
+        self._units: dict[str, int] = {}
+        self._assigned_times: dict[str, float] = {}
+        self._released_times: dict[str, float] = {}
+        self._progress: dict[str, float] = {}
+        """
+        The latest progress (from 0 to 1) reported for the unit in progress on each consumer.
+        """
+
+    def assign(self, consumer_id: str, unit: int) -> float:
+        """
+        Leases a unit to a consumer. Returns how long the consumer waited for it since it released its
+        last lease, if it has held one.
+        """
+        now = self._clock()
+        self._units[consumer_id] = unit
+        self._assigned_times[consumer_id] = now
+        released_time = self._released_times.pop(consumer_id, None)
+        return now - released_time if released_time is not None else None
+
+    def release(self, consumer_id: str) -> float:
+        """
+        Frees a consumer from the unit it was running, and returns how long it ran for, if known.
+        """
+        del self._units[consumer_id]
+        self._progress.pop(consumer_id, None)
+        now = self._clock()
+        self._released_times[consumer_id] = now
+        assigned_time = self._assigned_times.pop(consumer_id, None)
+        return now - assigned_time if assigned_time is not None else None
+
+    def remove_consumer(self, consumer_id: str) -> int:
+        """
+        Forgets a consumer which has left the instance, and returns the unit it held, if any.
+        """
+        self._assigned_times.pop(consumer_id, None)
+        self._released_times.pop(consumer_id, None)
+        self._progress.pop(consumer_id, None)
+        return self._units.pop(consumer_id, None)
+
+    def clear(self):
+        """
+        Forgets every lease, e.g. once no further units will be handed out.
+        """
+        self._units.clear()
+        self._assigned_times.clear()
+        self._progress.clear()
+
+    def get_unit(self, consumer_id: str) -> int:
+        return self._units.get(consumer_id)
+
+    def items(self):
+        return self._units.items()
+
+    def get_units(self):
+        return self._units.values()
+
+    def set_progress(self, consumer_id: str, unit: int, progress: float):
+        """
+        Keeps the progress reported for a unit if the consumer still holds it. Only the latest progress
+        is kept, so progress reports cost no more than a dictionary update.
+        """
+        if self._units.get(consumer_id) == unit:
+            self._progress[consumer_id] = min(max(progress, 0.0), 1.0)
+
+    def get_progress(self, consumer_id: str) -> float:
+        return self._progress.get(consumer_id)
+
+    def estimate_remaining_time(self, consumer_id: str, expected_duration: float) -> float:
+        """
+        Estimates how many seconds the unit in progress on a consumer has left. The progress reported
+        by the consumer is extrapolated and weighted by how far the unit has got, with the rest of the
+        weight given to the unit's expected duration. Returns None if neither is known.
+        """
+        now = self._clock()
+        elapsed = now - self._assigned_times.get(consumer_id, now)
+        history_estimate = max(expected_duration - elapsed, 0.0) if expected_duration is not None else None
+
+        progress = self._progress.get(consumer_id)
+        if not progress:
+            return history_estimate
+        progress_estimate = elapsed * (1 - progress) / progress
+        if history_estimate is None:
+            return progress_estimate
+        return progress * progress_estimate + (1 - progress) * history_estimate
+
+    def __contains__(self, consumer_id: str) -> bool:
+        return consumer_id in self._units
+
+    def __len__(self) -> int:
+        return len(self._units)
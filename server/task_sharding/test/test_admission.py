@@ -0,0 +1,93 @@
+import json
+
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from django.test import TestCase, override_settings
+
+from task_sharding.src.message_type import MessageType
+from task_sharding.test.defaults import (
+    create_application,
+    create_default_build_instruction_message,
+    create_default_client_init_message,
+)
+from task_sharding.test.utils import (
+    prompt_response_from_communicator,
+    proxy_message_from_channel_to_communicator,
+    send_message_between_communicators,
+)
+
+
+class TaskShardingTests__Admission(TestCase):
+    @override_settings(TASK_SHARDING_INIT_BATCH_WINDOW=0.01)
+    async def test__when_consumers_send_init_messages_together__expect_them_matched_in_one_batch(self):
+        """
+        GIVEN a controller which matches the INIT messages received within a batch window together.
+        WHEN two consumers send the same INIT message within the window.
+        EXPECT neither to be given a task until the window has passed,
+          AND then both to be given a task of a single schema instance.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer1 = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer1.connect()
+        consumer2 = WebsocketCommunicator(application, "/ws/api/1/2/")
+        await consumer2.connect()
+
+        await send_message_between_communicators(consumer1, controller, create_default_client_init_message(2))
+        await send_message_between_communicators(consumer2, controller, create_default_client_init_message(2))
+        self.assertTrue(await consumer1.receive_nothing())
+
+        # The controller's own request to admit the batch, once the window has passed
+        await proxy_message_from_channel_to_communicator("controller", controller)
+        self.assertDictEqual(create_default_build_instruction_message("1"), json.loads(await consumer1.receive_from()))
+        self.assertDictEqual(create_default_build_instruction_message("0"), json.loads(await consumer2.receive_from()))
+        self.assertEqual(
+            1,
+            await prompt_response_from_communicator(
+                controller, "get.total.running.schema.instances.msg", "total_running_schema_instances"
+            ),
+        )
+
+        await consumer1.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+        await consumer2.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+
+    @override_settings(
+        TASK_SHARDING_INIT_BATCH_WINDOW=60, TASK_SHARDING_MAX_PENDING_INITS=1, TASK_SHARDING_INIT_RETRY_AFTER=2
+    )
+    async def test__when_too_many_init_messages_are_pending__expect_the_consumer_told_to_retry_later(self):
+        """
+        GIVEN a controller which holds at most one INIT message while waiting to match a batch.
+        WHEN two consumers send INIT messages within the batch window.
+        EXPECT the second consumer to be told to retry after 2 to 4 seconds,
+          AND its later messages to be ignored until it does.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer1 = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer1.connect()
+        consumer2 = WebsocketCommunicator(application, "/ws/api/1/2/")
+        await consumer2.connect()
+
+        await send_message_between_communicators(consumer1, controller, create_default_client_init_message())
+        await send_message_between_communicators(consumer2, controller, create_default_client_init_message())
+        retry_after_msg = json.loads(await consumer2.receive_from())
+        self.assertEqual(MessageType.RETRY_AFTER, retry_after_msg["message_type"])
+        self.assertTrue(2 <= retry_after_msg["retry_after"] <= 4)
+
+        await send_message_between_communicators(
+            consumer2, controller, {"message_type": MessageType.END_OF_TASKS, "schema_id": "1"}
+        )
+        await controller.send_input({"type": "admit.consumers"})
+        self.assertDictEqual(create_default_build_instruction_message("0"), json.loads(await consumer1.receive_from()))
+        self.assertEqual(
+            1,
+            await prompt_response_from_communicator(
+                controller, "get.total.registered.consumers.msg", "total_registered_consumers"
+            ),
+        )
+
+        await consumer1.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+        await consumer2.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
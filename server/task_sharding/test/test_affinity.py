@@ -0,0 +1,94 @@
+import json
+
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from django.test import TestCase, override_settings
+
+from task_sharding.src.task_history import TaskHistory
+from task_sharding.src.task_queue import LifoTaskQueue, LongestFirstTaskQueue
+from task_sharding.test.defaults import (
+    create_application,
+    create_default_build_instruction_message,
+    create_default_client_init_message,
+)
+from task_sharding.test.utils import proxy_message_from_channel_to_communicator, send_message_between_communicators
+
+
+def create_client_init_message_with_recent_tasks(total_tasks: int, recent_tasks: list) -> dict:
+    init_msg = create_default_client_init_message(total_tasks)
+    init_msg["recent_tasks"] = recent_tasks
+    return init_msg
+
+
+class TaskShardingTests__PreferredTasks(TestCase):
+    def test__when_preferred_tasks_are_ready__expect_the_first_ready_preferred_task_handed_out(self):
+        """
+        GIVEN a LIFO and a longest first task queue with four tasks.
+        WHEN a task is popped preferring tasks 5 (unknown) and 1, and then without a preference.
+        EXPECT task 1 to be handed out first, followed by the tasks in their usual order.
+        """
+        task_history = TaskHistory()
+        for task, duration in enumerate([1.0, 2.0, 3.0, 4.0]):
+            task_history.record_duration("1", task, duration)
+
+        for task_queue in (LifoTaskQueue(range(4)), LongestFirstTaskQueue(range(4), "1", task_history)):
+            self.assertEqual(1, task_queue.pop(preferred_tasks=(5, 1)))
+            self.assertEqual([3, 2, 0], [task_queue.pop(), task_queue.pop(), task_queue.pop()])
+
+
+class TaskShardingTests__Affinity(TestCase):
+    async def test__when_a_consumer_reports_recent_tasks__expect_it_to_be_given_a_warm_task(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN a consumer connects with three tasks,
+          AND a second consumer connects which recently ran task 0.
+        EXPECT the first consumer to be given task 2 and the second consumer to be given task 0.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer1 = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer1.connect()
+        consumer2 = WebsocketCommunicator(application, "/ws/api/1/2/")
+        await consumer2.connect()
+
+        await send_message_between_communicators(consumer1, controller, create_default_client_init_message(3))
+        self.assertDictEqual(create_default_build_instruction_message("2"), json.loads(await consumer1.receive_from()))
+        await send_message_between_communicators(
+            consumer2, controller, create_client_init_message_with_recent_tasks(3, ["0"])
+        )
+        self.assertDictEqual(create_default_build_instruction_message("0"), json.loads(await consumer2.receive_from()))
+
+        await consumer1.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+        await consumer2.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+
+    @override_settings(TASK_SHARDING_AFFINITY_WAIT=0.1)
+    async def test__when_only_a_task_warm_on_a_busy_consumer_is_left__expect_it_held_back_for_a_bounded_wait(self):
+        """
+        GIVEN a controller which holds tasks back for consumers with warm state for 0.1 seconds.
+        WHEN a consumer which recently ran tasks 0 and 1 connects with two tasks,
+          AND a second consumer without any recent tasks connects.
+        EXPECT the first consumer to be given its most recent task, 1,
+          AND the second consumer to be given task 0 only once the wait has passed.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer1 = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer1.connect()
+        consumer2 = WebsocketCommunicator(application, "/ws/api/1/2/")
+        await consumer2.connect()
+
+        await send_message_between_communicators(
+            consumer1, controller, create_client_init_message_with_recent_tasks(2, ["0", "1"])
+        )
+        self.assertDictEqual(create_default_build_instruction_message("1"), json.loads(await consumer1.receive_from()))
+        await send_message_between_communicators(consumer2, controller, create_default_client_init_message(2))
+        self.assertTrue(await consumer2.receive_nothing(timeout=0.05))
+        # The instance asks the controller to hand out the held back task once the wait has passed
+        await proxy_message_from_channel_to_communicator("controller", controller)
+        self.assertDictEqual(create_default_build_instruction_message("0"), json.loads(await consumer2.receive_from()))
+
+        await consumer1.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+        await consumer2.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
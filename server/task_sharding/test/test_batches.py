@@ -0,0 +1,88 @@
+import json
+
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from django.test import TestCase
+
+from task_sharding.test.defaults import (
+    create_application,
+    create_default_build_instruction_message,
+    create_default_client_init_message,
+    create_default_schema_complete_message,
+    create_default_task_complete_message,
+)
+from task_sharding.test.utils import proxy_message_from_channel_to_communicator, send_message_between_communicators
+
+
+def create_batched_task_complete_message(task_id: str, batch_results: dict) -> dict:
+    return {
+        **create_default_task_complete_message(task_id),
+        "batch": [
+            {"task_id": batch_task_id, "task_success": success} for batch_task_id, success in batch_results.items()
+        ],
+    }
+
+
+class TaskShardingTests__Batches(TestCase):
+    async def test__when_a_consumer_runs_tasks_in_batches__expect_several_tasks_leased_and_reported_at_once(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN a consumer which runs up to three tasks at a time connects with four tasks,
+          AND passes its first batch apart from one task, which fails.
+        EXPECT the consumer to be leased three tasks at first,
+          AND the failed task to be retried in a batch with the remaining task,
+          AND the schema to complete once that batch passes.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        await send_message_between_communicators(
+            consumer, controller, {**create_default_client_init_message(4), "max_batch_size": 3}
+        )
+        self.assertDictEqual(
+            {**create_default_build_instruction_message("3"), "batch": [{"task_id": "2"}, {"task_id": "1"}]},
+            json.loads(await consumer.receive_from()),
+        )
+
+        await send_message_between_communicators(
+            consumer, controller, create_batched_task_complete_message("3", {"2": True, "1": False})
+        )
+        self.assertDictEqual(
+            {**create_default_build_instruction_message("1"), "batch": [{"task_id": "0"}]},
+            json.loads(await consumer.receive_from()),
+        )
+
+        await send_message_between_communicators(
+            consumer, controller, create_batched_task_complete_message("1", {"0": True})
+        )
+        self.assertDictEqual(create_default_schema_complete_message(), json.loads(await consumer.receive_from()))
+
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+
+    async def test__when_a_consumer_does_not_report_a_batched_task__expect_it_handed_out_again(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN a consumer which runs up to two tasks at a time connects with two tasks,
+          AND reports the result of the task it was sent first, but not of the task batched with it.
+        EXPECT the unreported task to be handed out again on its own.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        await send_message_between_communicators(
+            consumer, controller, {**create_default_client_init_message(2), "max_batch_size": 2}
+        )
+        self.assertDictEqual(
+            {**create_default_build_instruction_message("1"), "batch": [{"task_id": "0"}]},
+            json.loads(await consumer.receive_from()),
+        )
+
+        await send_message_between_communicators(consumer, controller, create_default_task_complete_message("1"))
+        self.assertDictEqual(create_default_build_instruction_message("0"), json.loads(await consumer.receive_from()))
+
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
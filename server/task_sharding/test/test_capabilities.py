@@ -0,0 +1,141 @@
+import json
+
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from django.test import TestCase, override_settings
+
+from task_sharding.src.capabilities import Capabilities
+from task_sharding.src.task_history import TaskHistory
+from task_sharding.src.task_queue import create_task_queue
+from task_sharding.test.defaults import (
+    create_application,
+    create_default_build_instruction_message,
+    create_default_client_init_message,
+    create_default_task_complete_message,
+)
+from task_sharding.test.utils import (
+    get_published_status_snapshot,
+    proxy_message_from_channel_to_communicator,
+    send_message_between_communicators,
+)
+
+
+def create_client_init_message_with_capabilities(total_tasks: int, capabilities: dict = None) -> dict:
+    init_msg = create_default_client_init_message(total_tasks)
+    init_msg["task_requirements"] = {"1": {"labels": ["large-memory"], "resources": {"memory_gb": 64}}}
+    if capabilities:
+        init_msg["capabilities"] = capabilities
+    return init_msg
+
+
+class TaskShardingTests__Capabilities(TestCase):
+    def test__when_tasks_have_requirements__expect_each_consumer_handed_only_tasks_it_can_run(self):
+        """
+        GIVEN a LIFO task queue of four tasks, of which task 1 requires a label and task 3 requires the label
+          AND an amount of memory.
+        WHEN a consumer with neither and a consumer with both take tasks in turn.
+        EXPECT the capable consumer to be given the task with the most requirements first, then task 1,
+          AND the other consumer to be given only the tasks without requirements.
+        """
+        large_memory = Capabilities(["large-memory"])
+        task_queue = create_task_queue(
+            "lifo",
+            4,
+            "1",
+            TaskHistory(),
+            task_requirements={1: large_memory, 3: Capabilities(["large-memory"], {"memory_gb": 64})},
+        )
+        task_queue.add_consumer("small", Capabilities())
+        task_queue.add_consumer("large", Capabilities(["large-memory", "ubuntu"], {"memory_gb": 128}))
+
+        self.assertEqual(2, task_queue.pop("small"))
+        self.assertEqual(3, task_queue.pop("large"))
+        self.assertEqual(0, task_queue.pop("small", preferred_tasks=(1,)))
+        self.assertIsNone(task_queue.pop("small"))
+        self.assertEqual(1, len(task_queue))
+        self.assertEqual(1, task_queue.pop("large"))
+
+        # A task streamed in with requirements of its own is only handed to a consumer which meets them
+        task_queue.add_task(4, Capabilities(["windows"]))
+        self.assertIsNone(task_queue.pop("large"))
+        self.assertEqual({Capabilities(["windows"]): 1}, task_queue.get_unmet_requirements())
+        task_queue.add_consumer("windows", Capabilities(["windows"]))
+        self.assertEqual({}, task_queue.get_unmet_requirements())
+        self.assertEqual(4, task_queue.pop("windows"))
+
+    async def test__when_only_a_task_with_requirements_is_left__expect_it_given_to_a_consumer_which_meets_them(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN a consumer without capabilities connects with two tasks, of which task 1 requires a label and memory,
+          AND a second consumer with the label and enough memory connects.
+        EXPECT the first consumer to be given task 0, although task 1 would be handed out first otherwise,
+          AND the second consumer to be given task 1.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer1 = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer1.connect()
+        consumer2 = WebsocketCommunicator(application, "/ws/api/1/2/")
+        await consumer2.connect()
+
+        await send_message_between_communicators(consumer1, controller, create_client_init_message_with_capabilities(2))
+        self.assertDictEqual(create_default_build_instruction_message("0"), json.loads(await consumer1.receive_from()))
+        await send_message_between_communicators(
+            consumer2,
+            controller,
+            create_client_init_message_with_capabilities(
+                2, {"labels": ["large-memory"], "resources": {"memory_gb": 64}}
+            ),
+        )
+        self.assertDictEqual(create_default_build_instruction_message("1"), json.loads(await consumer2.receive_from()))
+
+        await consumer1.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+        await consumer2.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+
+    @override_settings(TASK_SHARDING_STATUS_SNAPSHOT_INTERVAL=0)
+    async def test__when_no_consumer_meets_the_requirements_of_a_task__expect_a_warning_and_the_task_in_status(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN a consumer without capabilities connects with two tasks, of which task 1 requires a label and memory,
+          AND completes task 0.
+        EXPECT a warning that no consumer meets the requirements of task 1,
+          AND the requirements to be listed in the instance's status until a consumer which meets them connects.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer1 = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer1.connect()
+        consumer2 = WebsocketCommunicator(application, "/ws/api/1/2/")
+        await consumer2.connect()
+
+        with self.assertLogs("task_sharding.src.schema_instance", "WARNING") as logs:
+            await send_message_between_communicators(
+                consumer1, controller, create_client_init_message_with_capabilities(2)
+            )
+            await consumer1.receive_from()
+        self.assertIn("requirements_unmet", logs.output[0])
+
+        await send_message_between_communicators(consumer1, controller, create_default_task_complete_message("0"))
+        self.assertTrue(await consumer1.receive_nothing())
+        status_snapshot = await get_published_status_snapshot(controller)
+        self.assertEqual(
+            [{"requirements": {"labels": ["large-memory"], "resources": {"memory_gb": 64.0}}, "tasks": 1}],
+            status_snapshot["schema_instances"][0]["unmet_requirements"],
+        )
+
+        await send_message_between_communicators(
+            consumer2,
+            controller,
+            create_client_init_message_with_capabilities(
+                2, {"labels": ["large-memory"], "resources": {"memory_gb": 64}}
+            ),
+        )
+        self.assertDictEqual(create_default_build_instruction_message("1"), json.loads(await consumer2.receive_from()))
+        status_snapshot = await get_published_status_snapshot(controller)
+        self.assertEqual([], status_snapshot["schema_instances"][0]["unmet_requirements"])
+
+        await consumer1.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+        await consumer2.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
@@ -0,0 +1,67 @@
+from django.test import TestCase
+
+from task_sharding.benchmark.simulator import SimulatedChannelLayer
+from task_sharding.src.repo_state_table import RepoStateTable
+from task_sharding.src.schema_details import SchemaDetails
+from task_sharding.src.schema_instance import SchemaInstance
+from task_sharding.src.task_set import TaskSet
+from task_sharding.test.defaults import create_default_client_init_message
+
+
+class TaskShardingTests__CompactState(TestCase):
+    def test__when_tasks_are_added_to_and_discarded_from_a_task_set__expect_it_to_behave_as_a_set(self):
+        """
+        GIVEN an empty task set.
+        WHEN tasks 0, 9, 9 and 100000 are added, and then task 9 is discarded twice.
+        EXPECT the set to hold tasks 0 and 100000 only, in order,
+          AND to take no more than a bit per task ID.
+        """
+        task_set = TaskSet()
+        for task in (0, 9, 9, 100000):
+            task_set.add(task)
+        task_set.discard(9)
+        task_set.discard(9)
+
+        self.assertEqual(2, len(task_set))
+        self.assertEqual([0, 100000], list(task_set))
+        self.assertNotIn(9, task_set)
+        self.assertNotIn(100001, task_set)
+        self.assertEqual(100000 // 8 + 1, len(task_set._bits))
+
+    def test__when_consumers_register_with_equal_repo_states__expect_one_copy_kept_until_they_all_deregister(self):
+        """
+        GIVEN a schema instance.
+        WHEN two consumers register with equal, but separately parsed, repo states,
+          AND then deregister one after the other.
+        EXPECT both consumers to refer to a single copy of the repo state,
+          AND it to be forgotten only once both have deregistered.
+        """
+        schema_instance = SchemaInstance(SchemaDetails("1", "1", 1), channel_layer=SimulatedChannelLayer())
+        for consumer_id in ("consumer1", "consumer2"):
+            schema_instance.register_consumer(consumer_id, create_default_client_init_message()["repo_state"])
+
+        status = schema_instance.get_status()
+        self.assertEqual(status["consumers"][0]["repo_state"], status["consumers"][1]["repo_state"])
+        self.assertEqual(1, len(schema_instance._repo_state_table))
+        self.assertIs(schema_instance._repo_states["consumer1"], schema_instance._repo_states["consumer2"])
+
+        schema_instance.deregister_consumer("consumer1")
+        self.assertTrue(schema_instance.has_repo_state(create_default_client_init_message()["repo_state"]))
+        schema_instance.deregister_consumer("consumer2")
+        self.assertFalse(schema_instance.has_repo_state(create_default_client_init_message()["repo_state"]))
+        self.assertEqual(0, len(schema_instance._repo_state_table))
+
+    def test__when_equal_repo_states_are_added_to_different_tables__expect_them_to_share_interned_strings(self):
+        """
+        GIVEN two repo state tables, e.g. those of two schema instances.
+        WHEN equal repo states, whose patchsets are separate strings, are added to each.
+        EXPECT the copies held by both tables to share a single patchset string.
+        """
+        patchsets = ["".join(["5bfb44678a27f9bc3b6a96ced8d0b464", "d7ea9b71"]) for _ in range(2)]
+        self.assertIsNot(patchsets[0], patchsets[1])
+
+        repo_states = [
+            RepoStateTable().add({"org/repo_1": {"base_ref": "main", "patchset": patchset}}) for patchset in patchsets
+        ]
+
+        self.assertIs(repo_states[0]["org/repo_1"]["patchset"], repo_states[1]["org/repo_1"]["patchset"])
@@ -0,0 +1,57 @@
+import json
+
+from channels.testing import WebsocketCommunicator
+from django.test import AsyncClient, TestCase, override_settings
+
+from task_sharding.benchmark.load_generator import LoadGeneratorConfig, run_load_generator
+from task_sharding.test.defaults import (
+    create_application,
+    create_default_build_instruction_message,
+    create_default_client_init_message,
+    create_default_schema_complete_message,
+    create_default_task_complete_message,
+)
+
+EMBEDDED_CHANNEL_LAYERS = {"default": {"BACKEND": "task_sharding.src.embedded_channel_layer.EmbeddedChannelLayer"}}
+
+
+@override_settings(CHANNEL_LAYERS=EMBEDDED_CHANNEL_LAYERS)
+class TaskShardingTests__EmbeddedController(TestCase):
+    async def test__when_a_consumer_runs_a_schema_with_an_embedded_controller__expect_no_controller_worker_needed(
+        self,
+    ):
+        """
+        GIVEN an embedded channel layer, and no controller worker.
+        WHEN a consumer connects with one task and completes it,
+          AND the /status endpoint is requested.
+        EXPECT the consumer to be given the task and told the schema is complete,
+          AND the status to describe the consumer's schema instance.
+        """
+        application = create_application()
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        await consumer.send_to(text_data=json.dumps(create_default_client_init_message()))
+        self.assertDictEqual(create_default_build_instruction_message(), json.loads(await consumer.receive_from()))
+        await consumer.send_to(text_data=json.dumps(create_default_task_complete_message()))
+        self.assertDictEqual(create_default_schema_complete_message(), json.loads(await consumer.receive_from()))
+
+        response = await AsyncClient().get("/status")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(json.loads(response.content)["schema_instances"]))
+
+        await consumer.disconnect()
+
+    async def test__when_synthetic_peers_run_against_an_embedded_controller__expect_every_schema_to_complete(self):
+        """
+        GIVEN a load generator configured with twenty peers across two schemas.
+        WHEN the load generator runs on an embedded channel layer.
+        EXPECT every task and schema to be completed without a controller worker.
+        """
+        config = LoadGeneratorConfig(peers=20, schemas=2, tasks_per_schema=30, mean_task_duration=0.001, timeout=10)
+
+        results = (await run_load_generator(config)).to_dict()
+
+        self.assertEqual(60, results["tasks_completed"])
+        self.assertEqual(2, results["schemas_completed"])
+        self.assertEqual(40, results["assignment_latency_seconds"]["count"])
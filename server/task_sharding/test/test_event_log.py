@@ -0,0 +1,136 @@
+import logging
+import re
+import threading
+
+from django.test import TestCase
+
+from task_sharding.src.event_log import EventLogger, NonBlockingLogHandler
+
+
+class CountingFormattable:
+    def __init__(self):
+        self.times_formatted = 0
+
+    def __str__(self):
+        self.times_formatted += 1
+        return "formatted"
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(self.format(record))
+
+
+class BlockingHandler(RecordingHandler):
+    def __init__(self):
+        super().__init__()
+        self.unblocked = threading.Event()
+
+    def emit(self, record):
+        self.unblocked.wait()
+        super().emit(record)
+
+
+def create_logger(name: str, handler: logging.Handler, level: int = logging.INFO) -> logging.Logger:
+    test_logger = logging.getLogger(name)
+    test_logger.handlers = [handler]
+    test_logger.propagate = False
+    test_logger.setLevel(level)
+    return test_logger
+
+
+class TaskShardingTests__EventLog(TestCase):
+    def test__when_an_event_is_below_the_logger_level__expect_it_never_to_be_formatted(self):
+        """
+        GIVEN an event logger where "assigned" events are logged at DEBUG and the logger is at INFO.
+        WHEN an "assigned" and a "registered" event are emitted.
+        EXPECT only the "registered" event to be formatted and written.
+        """
+        handler = RecordingHandler()
+        events = EventLogger(create_logger("test_event_log_levels", handler), "instance", {"assigned": logging.DEBUG})
+        field = CountingFormattable()
+
+        events.emit("assigned", task_id=field)
+        self.assertEqual(0, field.times_formatted)
+        self.assertEqual([], handler.messages)
+
+        events.emit("registered", consumer_id="consumer_1", task_id=field)
+        self.assertEqual(["[instance] registered consumer_id=consumer_1 task_id=formatted"], handler.messages)
+
+    def test__when_an_event_type_is_sampled__expect_only_that_fraction_of_events_logged(self):
+        """
+        GIVEN an event logger which samples a quarter of "completed" events.
+        WHEN eight "completed" and two "failed" events are emitted.
+        EXPECT two "completed" events and both "failed" events to be logged.
+        """
+        handler = RecordingHandler()
+        events = EventLogger(create_logger("test_event_log_sampling", handler), "instance", {}, {"completed": 0.25})
+
+        for task_id in range(8):
+            events.emit("completed", task_id=task_id)
+        events.emit("failed", task_id=8)
+        events.emit("failed", task_id=9)
+
+        self.assertEqual(
+            [
+                "[instance] completed task_id=3",
+                "[instance] completed task_id=7",
+                "[instance] failed task_id=8",
+                "[instance] failed task_id=9",
+            ],
+            handler.messages,
+        )
+
+    def test__when_records_are_logged_through_the_non_blocking_handler__expect_them_written_by_the_target(self):
+        """
+        GIVEN a non-blocking handler with room for a single queued record.
+        WHEN records are logged faster than they can be written.
+        EXPECT each record to either be written by the target handler or counted as dropped.
+        """
+        target = RecordingHandler()
+        handler = NonBlockingLogHandler(target, max_queued_records=1)
+        handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        test_logger = create_logger("test_event_log_non_blocking", handler)
+
+        for index in range(100):
+            test_logger.info("message %s", index)
+        handler.close()
+
+        self.assertEqual("INFO message 0", target.messages[0])
+        written_messages = [message for message in target.messages if message.startswith("INFO")]
+        self.assertEqual(100, len(written_messages) + handler.dropped_records)
+
+    def test__when_records_are_dropped__expect_a_warning_of_how_many_once_the_queue_drains(self):
+        """
+        GIVEN a non-blocking handler with room for a single queued record,
+          AND a target handler which is blocked from writing.
+        WHEN 10 records are logged,
+          AND the target handler is then unblocked.
+        EXPECT the records which were not dropped to be written,
+          AND to be followed by a warning of how many records were dropped.
+        """
+        target = BlockingHandler()
+        handler = NonBlockingLogHandler(target, max_queued_records=1)
+        handler.setFormatter(logging.Formatter("%(levelname)s %(message)s"))
+        test_logger = create_logger("test_event_log_dropped_records", handler)
+
+        for index in range(10):
+            test_logger.info("message %s", index)
+        target.unblocked.set()
+        handler.close()
+
+        self.assertGreater(handler.dropped_records, 0)
+        self.assertEqual("INFO message 0", target.messages[0])
+        written_messages = [message for message in target.messages if message.startswith("INFO")]
+        reported_drops = [
+            int(re.match(r"WARNING Dropped (\d+) log records", message).group(1))
+            for message in target.messages
+            if message.startswith("WARNING")
+        ]
+        self.assertEqual(10, len(written_messages) + handler.dropped_records)
+        self.assertEqual(handler.dropped_records, sum(reported_drops))
+        self.assertTrue(target.messages[-1].startswith("WARNING"))
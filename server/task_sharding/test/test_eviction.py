@@ -0,0 +1,128 @@
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from django.test import TestCase, override_settings
+
+from task_sharding.src.consumer_liveness import ConsumerLiveness
+from task_sharding.test.defaults import create_application, create_default_client_init_message
+from task_sharding.test.utils import (
+    get_published_status_snapshot,
+    prompt_response_from_communicator,
+    proxy_message_from_channel_to_communicator,
+    send_message_between_communicators,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+async def send_init_message_from_lost_consumer(controller: ApplicationCommunicator, name: str, schema_id: str = "1"):
+    """
+    Sends an INIT message to the controller on behalf of a consumer which is not there to receive
+    anything, as if it had gone without its disconnection being reported.
+    """
+    await controller.send_input(
+        {
+            "type": "receive.message",
+            "client_id": name,
+            "consumer_id": "specific.{}!lost".format(name),
+            "message": {**create_default_client_init_message(), "schema_id": schema_id},
+        }
+    )
+
+
+class TaskShardingTests__Eviction(TestCase):
+    def test__when_consumers_are_silent__expect_them_pinged_and_then_evicted_least_recently_heard_from_first(self):
+        """
+        GIVEN consumer liveness with a 10 second idle timeout, a 5 second ping timeout and at most two consumers.
+        WHEN consumers 1 and 2 are heard from, and swept after 10 seconds,
+          AND consumer 2 replies, and they are swept again after another 5 seconds,
+          AND then consumers 3 and 4 are heard from.
+        EXPECT both consumers pinged after 10 seconds, and only consumer 1 evicted after 15 seconds,
+          AND consumer 2 evicted to make room for consumers 3 and 4, as it was heard from least recently.
+        """
+        clock = FakeClock()
+        consumer_liveness = ConsumerLiveness(idle_timeout=10, ping_timeout=5, max_consumers=2, clock=clock)
+        consumer_liveness.seen("consumer1", "client1")
+        consumer_liveness.seen("consumer2", "client2")
+
+        clock.now = 10
+        self.assertEqual((["consumer1", "consumer2"], []), consumer_liveness.sweep())
+        consumer_liveness.seen("consumer2")
+        clock.now = 15
+        self.assertEqual(([], [("consumer1", "client1")]), consumer_liveness.sweep())
+
+        # A late reply does not bring back an evicted consumer
+        consumer_liveness.seen("consumer1")
+        consumer_liveness.seen("consumer3", "client3")
+        consumer_liveness.seen("consumer4", "client4")
+        self.assertEqual(([], [("consumer2", "client2")]), consumer_liveness.sweep())
+        self.assertEqual(["consumer3", "consumer4"], consumer_liveness.get_consumers())
+
+    @override_settings(TASK_SHARDING_CONSUMER_IDLE_TIMEOUT=0, TASK_SHARDING_PING_TIMEOUT=0)
+    async def test__when_a_consumer_is_lost_without_disconnecting__expect_it_evicted_by_a_sweep(self):
+        """
+        GIVEN a controller which pings consumers as soon as they are silent, and evicts them if they do not reply.
+        WHEN a connected consumer and a lost consumer, whose disconnection was never reported, join a schema instance,
+          AND the controller sweeps twice.
+        EXPECT both consumers to be pinged by the first sweep, and only the connected consumer to reply,
+          AND the lost consumer to be evicted by the second sweep, leaving the connected consumer registered.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+        await send_message_between_communicators(consumer, controller, create_default_client_init_message(2))
+        await send_init_message_from_lost_consumer(controller, "lost")
+        self.assertEqual(
+            2,
+            await prompt_response_from_communicator(
+                controller, "get.total.registered.consumers.msg", "total_registered_consumers"
+            ),
+        )
+
+        await controller.send_input({"type": "sweep"})
+        # The connected consumer's reply to its ping
+        await proxy_message_from_channel_to_communicator("controller", controller)
+        await controller.send_input({"type": "sweep"})
+
+        self.assertEqual(
+            1,
+            await prompt_response_from_communicator(
+                controller, "get.total.registered.consumers.msg", "total_registered_consumers"
+            ),
+        )
+
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+
+    @override_settings(TASK_SHARDING_MAX_SCHEMA_INSTANCES=1, TASK_SHARDING_STATUS_SNAPSHOT_INTERVAL=0)
+    async def test__when_there_are_too_many_schema_instances__expect_the_least_recently_active_evicted(self):
+        """
+        GIVEN a controller which keeps at most one schema instance.
+        WHEN consumers of two different schemas connect, one after the other,
+          AND the controller sweeps.
+        EXPECT the instance of the first schema to be evicted along with its consumer.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        await send_init_message_from_lost_consumer(controller, "first", schema_id="1")
+        await send_init_message_from_lost_consumer(controller, "second", schema_id="2")
+        self.assertEqual(
+            2,
+            await prompt_response_from_communicator(
+                controller, "get.total.running.schema.instances.msg", "total_running_schema_instances"
+            ),
+        )
+
+        await controller.send_input({"type": "sweep"})
+
+        status_snapshot = await get_published_status_snapshot(controller)
+        self.assertEqual(["2"], [instance["schema_id"] for instance in status_snapshot["schema_instances"]])
+        self.assertEqual(
+            ["specific.second!lost"],
+            [consumer["consumer_id"] for consumer in status_snapshot["schema_instances"][0]["consumers"]],
+        )
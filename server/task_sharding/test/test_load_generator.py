@@ -0,0 +1,21 @@
+from django.test import TestCase
+
+from task_sharding.benchmark.load_generator import LoadGeneratorConfig, run_load_generator
+
+
+class TaskShardingTests__LoadGenerator(TestCase):
+    async def test__when_synthetic_peers_run_against_the_controller__expect_every_schema_to_complete(self):
+        """
+        GIVEN a load generator configured with twenty peers across two schemas.
+        WHEN the load generator runs against a controller worker.
+        EXPECT every task and schema to be completed and latencies to be reported.
+        """
+        config = LoadGeneratorConfig(peers=20, schemas=2, tasks_per_schema=30, mean_task_duration=0.001, timeout=10)
+
+        results = (await run_load_generator(config)).to_dict()
+
+        self.assertEqual(60, results["tasks_completed"])
+        self.assertEqual(2, results["schemas_completed"])
+        self.assertEqual(20, results["init_to_first_task_seconds"]["count"])
+        self.assertEqual(40, results["assignment_latency_seconds"]["count"])
+        self.assertGreater(results["messages_per_second"], 0)
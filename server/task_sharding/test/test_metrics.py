@@ -0,0 +1,168 @@
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from django.test import AsyncClient, TestCase, override_settings
+
+from task_sharding.src.metrics import MetricsRegistry, render_prometheus
+from task_sharding.src.status_snapshot import get_status_cache
+from task_sharding.src.task_history import TaskHistory
+from task_sharding.test.defaults import (
+    create_application,
+    create_default_client_init_message,
+    create_default_task_complete_message,
+)
+from task_sharding.test.utils import (
+    get_published_status_snapshot,
+    proxy_message_from_channel_to_communicator,
+    prompt_response_from_communicator,
+    send_message_between_communicators,
+)
+
+
+def find_metric(metrics_snapshot: list, name: str) -> dict:
+    return next(metric for metric in metrics_snapshot if metric["name"] == name)
+
+
+class TaskShardingTests__MetricsRendering(TestCase):
+    def test__when_metrics_are_recorded__expect_prometheus_text_format(self):
+        """
+        GIVEN a metrics registry with a counter and a histogram.
+        WHEN values are recorded and the snapshot is rendered.
+        EXPECT the output to follow the Prometheus text exposition format.
+        """
+        registry = MetricsRegistry()
+        counter = registry.counter("messages_total", "Messages.", ("message_type",))
+        histogram = registry.histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+
+        counter.inc(message_type="INIT")
+        counter.inc(message_type="INIT")
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        rendered = render_prometheus(registry.snapshot())
+
+        self.assertIn("# TYPE messages_total counter", rendered)
+        self.assertIn('messages_total{message_type="INIT"} 2.0', rendered)
+        self.assertIn('latency_seconds_bucket{le="0.1"} 1', rendered)
+        self.assertIn('latency_seconds_bucket{le="1.0"} 2', rendered)
+        self.assertIn('latency_seconds_bucket{le="+Inf"} 3', rendered)
+        self.assertIn("latency_seconds_count 3", rendered)
+
+
+class TaskShardingTests__ControllerMetrics(TestCase):
+    async def test__when_a_consumer_completes_a_task__expect_scheduler_metrics_recorded(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN a consumer connects with two tasks and completes the first.
+        EXPECT the message counter, task duration, assignment latency and queue gauges to be populated.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        await send_message_between_communicators(consumer, controller, create_default_client_init_message(2))
+        await consumer.receive_from()
+        await send_message_between_communicators(consumer, controller, create_default_task_complete_message("1"))
+        await consumer.receive_from()
+
+        metrics_snapshot = await prompt_response_from_communicator(
+            controller, "get.metrics.snapshot.msg", "metrics_snapshot"
+        )
+
+        messages_received = find_metric(metrics_snapshot, "task_sharding_controller_messages_total")
+        self.assertCountEqual(
+            [[{"message_type": "INIT"}, 1], [{"message_type": "TASK_COMPLETE"}, 1]], messages_received["samples"]
+        )
+        self.assertEqual(1, find_metric(metrics_snapshot, "task_sharding_init_matching_seconds")["samples"][0][1][2])
+        self.assertEqual(
+            1, find_metric(metrics_snapshot, "task_sharding_assignment_latency_seconds")["samples"][0][1][2]
+        )
+        task_durations = find_metric(metrics_snapshot, "task_sharding_task_duration_seconds")["samples"]
+        self.assertEqual({"schema_id": "1", "task_success": "True"}, task_durations[0][0])
+        self.assertEqual(0, find_metric(metrics_snapshot, "task_sharding_queue_depth")["samples"][0][1])
+        self.assertEqual(1, find_metric(metrics_snapshot, "task_sharding_tasks_in_progress")["samples"][0][1])
+
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+
+    async def test__when_the_metrics_endpoint_is_scraped__expect_the_published_snapshot_to_be_rendered(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController, which has not yet published a metrics snapshot.
+        WHEN the /metrics endpoint is requested before and after a consumer connects.
+        EXPECT it to be unavailable at first, and then to return the published snapshot in the Prometheus
+          text format, without a message being sent to the controller for either request.
+        """
+        get_status_cache().clear()
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        response = await AsyncClient().get("/metrics")
+        self.assertEqual(503, response.status_code)
+
+        await send_message_between_communicators(consumer, controller, create_default_client_init_message())
+        await consumer.receive_from()
+        await get_published_status_snapshot(controller)
+        response = await AsyncClient().get("/metrics")
+
+        self.assertEqual(200, response.status_code)
+        self.assertIn(b'task_sharding_controller_messages_total{message_type="INIT"} 1.0', response.content)
+        self.assertIn(b"task_sharding_schema_instances 1.0", response.content)
+
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+
+
+class TaskShardingTests__TaskStats(TestCase):
+    def test__when_task_stats_are_recorded__expect_low_cache_hit_tasks_found(self):
+        """
+        GIVEN a task history with stats for three tasks, with cache hit ratios of 0.9, 0.1 and 0.4.
+        WHEN the tasks with a low cache hit ratio, of at most 0.5 by default, are requested.
+        EXPECT the tasks with ratios of 0.1 and 0.4, lowest first.
+        """
+        task_history = TaskHistory()
+        for task_id, cache_hit_ratio in enumerate([0.9, 0.1, 0.4]):
+            task_history.record_task_stats("1", task_id, {"cache_hit_ratio": cache_hit_ratio})
+        task_history.record_task_stats("2", 0, {"cache_hit_ratio": 0.0})
+
+        self.assertEqual([(1, 0.1), (2, 0.4)], task_history.get_low_cache_hit_tasks("1"))
+        self.assertEqual([(1, 0.1)], task_history.get_low_cache_hit_tasks("1", limit=1))
+
+    @override_settings(TASK_SHARDING_STATUS_SNAPSHOT_INTERVAL=0)
+    async def test__when_a_consumer_reports_task_stats__expect_cache_hit_ratio_exported_and_in_status(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN a consumer completes a task and reports a low cache hit ratio in its stats.
+        EXPECT the ratio to be observed by the schema's cache hit ratio histogram,
+          AND the task to be listed as a low cache hit task in the instance's status.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        await send_message_between_communicators(consumer, controller, create_default_client_init_message(2))
+        await consumer.receive_from()
+        task_complete_msg = create_default_task_complete_message("1")
+        task_complete_msg["task_stats"] = {"cache_hit_ratio": 0.25, "actions_executed": 12, "duration": 3.5}
+        await send_message_between_communicators(consumer, controller, task_complete_msg)
+        await consumer.receive_from()
+
+        metrics_snapshot = await prompt_response_from_communicator(
+            controller, "get.metrics.snapshot.msg", "metrics_snapshot"
+        )
+
+        self.assertEqual(
+            [[{"schema_id": "1"}, [[0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0], 0.25, 1]]],
+            find_metric(metrics_snapshot, "task_sharding_task_cache_hit_ratio")["samples"],
+        )
+
+        status_snapshot = await get_published_status_snapshot(controller)
+        self.assertEqual(
+            [{"task_id": "1", "cache_hit_ratio": 0.25}],
+            status_snapshot["schema_instances"][0]["low_cache_hit_tasks"],
+        )
+
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
@@ -0,0 +1,78 @@
+import json
+
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from django.test import TestCase
+
+from task_sharding.test.defaults import (
+    create_application,
+    create_default_build_instruction_message,
+    create_default_client_init_message,
+    create_default_schema_complete_message,
+    create_default_task_complete_message,
+)
+from task_sharding.test.utils import (
+    prompt_response_from_communicator,
+    proxy_message_from_channel_to_communicator,
+    send_message_between_communicators,
+)
+
+
+def create_message_for_schema(message: dict, schema_id: str) -> dict:
+    return {**message, "schema_id": schema_id}
+
+
+class TaskShardingTests__MultipleSchemas(TestCase):
+    async def test__when_a_consumer_joins_two_schemas__expect_their_tasks_interleaved_one_at_a_time(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN a consumer sends INIT messages for two schemas of two tasks each,
+          AND completes every task it is given.
+        EXPECT the consumer to join an instance of each schema,
+          AND to be given one task at a time, alternating between the schemas,
+          AND each schema to complete once its own tasks have.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        await send_message_between_communicators(consumer, controller, create_default_client_init_message(2))
+        self.assertDictEqual(create_default_build_instruction_message("1"), json.loads(await consumer.receive_from()))
+        await send_message_between_communicators(
+            consumer, controller, create_message_for_schema(create_default_client_init_message(2), "2")
+        )
+        self.assertTrue(await consumer.receive_nothing())
+        self.assertEqual(
+            2,
+            await prompt_response_from_communicator(
+                controller, "get.total.running.schema.instances.msg", "total_running_schema_instances"
+            ),
+        )
+
+        received_msgs = []
+        for schema_id, task_id in (("1", "1"), ("2", "1"), ("1", "0")):
+            await send_message_between_communicators(
+                consumer,
+                controller,
+                create_message_for_schema(create_default_task_complete_message(task_id), schema_id),
+            )
+            received_msgs.append(json.loads(await consumer.receive_from()))
+        received_msgs.append(json.loads(await consumer.receive_from()))
+        await send_message_between_communicators(
+            consumer, controller, create_message_for_schema(create_default_task_complete_message("0"), "2")
+        )
+        received_msgs.append(json.loads(await consumer.receive_from()))
+
+        self.assertEqual(
+            [
+                create_message_for_schema(create_default_build_instruction_message("1"), "2"),
+                create_default_build_instruction_message("0"),
+                create_default_schema_complete_message(),
+                create_message_for_schema(create_default_build_instruction_message("0"), "2"),
+                create_message_for_schema(create_default_schema_complete_message(), "2"),
+            ],
+            received_msgs,
+        )
+
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
@@ -0,0 +1,111 @@
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from django.test import TestCase, override_settings
+
+from task_sharding.benchmark.simulator import SimulatedChannelLayer
+from task_sharding.src.message_type import MessageType
+from task_sharding.src.schema_details import SchemaDetails
+from task_sharding.src.schema_instance import SchemaInstance
+from task_sharding.src.task_history import TaskHistory
+from task_sharding.test.defaults import (
+    create_application,
+    create_default_client_init_message,
+    create_default_task_complete_message,
+)
+from task_sharding.test.utils import (
+    get_published_status_snapshot,
+    proxy_message_from_channel_to_communicator,
+    send_message_between_communicators,
+)
+
+
+def create_task_progress_message(task_id: str, progress: float) -> dict:
+    return {"message_type": MessageType.TASK_PROGRESS, "schema_id": "1", "task_id": task_id, "progress": progress}
+
+
+class TaskShardingTests__RemainingTimeEstimates(TestCase):
+    async def test__when_a_task_reports_progress__expect_progress_and_history_combined_in_the_estimates(self):
+        """
+        GIVEN a schema instance with three tasks, where task 2 is expected to take 10 seconds.
+        WHEN a consumer is given task 2 and reports being 80% through it after 4 seconds.
+        EXPECT the task's remaining time to be 2 seconds: the progress estimate of 1 second weighted by
+          0.8 plus the history estimate of 6 seconds weighted by 0.2,
+          AND the instance to have 6 seconds left, as the other tasks are assumed to take as long.
+        """
+        now = 0.0
+        task_history = TaskHistory()
+        task_history.record_duration("1", 2, 10.0)
+        schema_instance = SchemaInstance(
+            SchemaDetails("1", "1", 3),
+            task_history=task_history,
+            channel_layer=SimulatedChannelLayer(),
+            clock=lambda: now,
+        )
+        init_msg = create_default_client_init_message(3)
+        schema_instance.register_consumer("consumer", init_msg["repo_state"])
+        await schema_instance.receive_message(init_msg, "consumer")
+
+        now = 4.0
+        self.assertEqual(6.0, schema_instance.estimate_task_remaining_time("consumer"))
+        await schema_instance.receive_message(create_task_progress_message("2", 0.8), "consumer")
+
+        self.assertAlmostEqual(2.0, schema_instance.estimate_task_remaining_time("consumer"))
+        self.assertAlmostEqual(6.0, schema_instance.estimate_time_remaining())
+
+    async def test__when_a_consumer_reports_a_cached_result__expect_no_duration_recorded_for_the_task(self):
+        """
+        GIVEN a schema instance with two tasks.
+        WHEN a consumer reports task 1 as passed from its task cache after 4 seconds,
+          AND then runs task 0 for 3 seconds.
+        EXPECT only task 0 to have an expected duration.
+        """
+        now = 0.0
+        task_history = TaskHistory()
+        schema_instance = SchemaInstance(
+            SchemaDetails("1", "1", 2),
+            task_history=task_history,
+            channel_layer=SimulatedChannelLayer(),
+            clock=lambda: now,
+        )
+        init_msg = create_default_client_init_message(2)
+        schema_instance.register_consumer("consumer", init_msg["repo_state"])
+        await schema_instance.receive_message(init_msg, "consumer")
+
+        now = 4.0
+        await schema_instance.receive_message({**create_default_task_complete_message("1"), "cached": True}, "consumer")
+        now = 7.0
+        await schema_instance.receive_message(create_default_task_complete_message("0"), "consumer")
+
+        self.assertIsNone(task_history.get_expected_duration("1", 1))
+        self.assertEqual(3.0, task_history.get_expected_duration("1", 0))
+
+
+class TaskShardingTests__TaskProgress(TestCase):
+    @override_settings(TASK_SHARDING_STATUS_SNAPSHOT_INTERVAL=0)
+    async def test__when_a_consumer_reports_progress__expect_it_in_the_status_snapshot(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN a consumer connects with two tasks and reports being half way through task 1,
+          AND then reports progress for a task it is not running.
+        EXPECT the status snapshot to show the progress of task 1 and an estimate for the instance,
+          AND no reply to either progress message.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        await send_message_between_communicators(consumer, controller, create_default_client_init_message(2))
+        await consumer.receive_from()
+        await send_message_between_communicators(consumer, controller, create_task_progress_message("1", 0.5))
+        await send_message_between_communicators(consumer, controller, create_task_progress_message("0", 0.9))
+        self.assertTrue(await consumer.receive_nothing())
+
+        status_snapshot = await get_published_status_snapshot(controller)
+
+        instance_status = status_snapshot["schema_instances"][0]
+        self.assertEqual(0.5, instance_status["consumers"][0]["progress"])
+        self.assertIsNotNone(instance_status["consumers"][0]["estimated_remaining_time"])
+        self.assertIsNotNone(instance_status["estimated_time_remaining"])
+
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
@@ -0,0 +1,160 @@
+from django.test import TestCase
+
+from task_sharding.benchmark.simulator import ScheduleSimulator, SimulationConfig
+from task_sharding.src.task_history import TaskHistory
+from task_sharding.src.task_queue import (
+    CriticalPathTaskQueue,
+    ExcludedTasks,
+    LifoTaskQueue,
+    LongestFirstTaskQueue,
+)
+
+
+def drain(task_queue) -> list:
+    tasks = []
+    while len(task_queue) > 0:
+        task = task_queue.pop()
+        if task is None:
+            break
+        tasks.append(task)
+    return tasks
+
+
+class TaskShardingTests__TaskQueues(TestCase):
+    def test__when_tasks_are_queued_lifo__expect_highest_and_requeued_tasks_first(self):
+        """
+        GIVEN a LIFO task queue with three tasks.
+        WHEN a task is popped and then re-queued.
+        EXPECT the re-queued task to be handed out again first.
+        """
+        task_queue = LifoTaskQueue(range(3))
+        self.assertEqual(2, task_queue.pop())
+        task_queue.append(2)
+        self.assertEqual([2, 1, 0], drain(task_queue))
+
+    def test__when_tasks_are_queued_longest_first__expect_tasks_ordered_by_expected_duration(self):
+        """
+        GIVEN a longest-first task queue and a history of task durations.
+        WHEN every task is popped.
+        EXPECT the tasks in descending order of expected duration, with untimed tasks at the default.
+        """
+        task_history = TaskHistory()
+        task_history.record_duration("1", 0, 10.0)
+        task_history.record_duration("1", 1, 0.5)
+        task_history.record_duration("1", 3, 30.0)
+
+        task_queue = LongestFirstTaskQueue(range(4), "1", task_history)
+
+        self.assertEqual([3, 0, 2, 1], drain(task_queue))
+
+    def test__when_tasks_have_dependencies__expect_tasks_held_back_until_dependencies_complete(self):
+        """
+        GIVEN a critical path task queue where task 2 depends on tasks 0 and 1.
+        WHEN tasks 0 and 1 are popped, and only task 0 is completed.
+        EXPECT task 2 to stay blocked until task 1 is completed too.
+        """
+        task_queue = CriticalPathTaskQueue(range(3), "1", TaskHistory(), {2: [0, 1]})
+
+        self.assertCountEqual([0, 1], drain(task_queue))
+        self.assertEqual(1, len(task_queue))
+        task_queue.task_completed(0)
+        self.assertIsNone(task_queue.pop())
+        task_queue.task_completed(1)
+        self.assertEqual(2, task_queue.pop())
+
+    def test__when_tasks_have_chains_of_dependents__expect_longest_chain_started_first(self):
+        """
+        GIVEN a critical path task queue where task 0 heads a chain of two tasks and task 1 has none.
+        WHEN the first task is popped.
+        EXPECT the head of the longest chain to be handed out first.
+        """
+        task_queue = CriticalPathTaskQueue(range(3), "1", TaskHistory(), {2: [0]})
+        self.assertEqual(0, task_queue.pop())
+
+    def test__when_tasks_are_removed_and_requeued__expect_each_ready_task_handed_out_once(self):
+        """
+        GIVEN a LIFO and a longest-first task queue with five tasks.
+        WHEN tasks are removed, one of them is re-queued, and a task is popped passing over another.
+        EXPECT removed tasks to be skipped, and every ready task to be handed out exactly once.
+        """
+        for task_queue in (LifoTaskQueue(range(5)), LongestFirstTaskQueue(range(5), "1", TaskHistory())):
+            self.assertTrue(task_queue.remove(3))
+            self.assertTrue(task_queue.remove(1))
+            self.assertFalse(task_queue.remove(1))
+            task_queue.append(1)
+            self.assertEqual(4, len(task_queue))
+            self.assertCountEqual([0, 1, 2, 4], task_queue.get_tasks())
+
+            self.assertEqual(4, task_queue.pop(excluded_tasks=ExcludedTasks(lambda task: task == 1)))
+            self.assertEqual([1, 2, 0], drain(task_queue))
+
+
+class TaskShardingTests__ScheduleSimulator(TestCase):
+    async def test__when_one_task_dominates__expect_longest_first_to_beat_lifo(self):
+        """
+        GIVEN two peers and a schema whose lowest numbered task takes as long as all the others combined.
+        WHEN the schedule is simulated with the LIFO and longest-first policies.
+        EXPECT LIFO to leave the long task until last and longest-first to reach the optimal makespan.
+        """
+        durations = [10.0] + [1.0] * 10
+        simulator = ScheduleSimulator(durations, SimulationConfig(peers=2))
+
+        lifo_results = (await simulator.run("lifo")).to_dict()
+        longest_first_results = (await simulator.run("longest_first")).to_dict()
+
+        self.assertEqual(15.0, lifo_results["makespan"])
+        self.assertEqual(10.0, longest_first_results["makespan"])
+        self.assertEqual(10.0, longest_first_results["lower_bound"])
+        self.assertEqual(1.0, longest_first_results["peer_utilisation"])
+        self.assertEqual(11, longest_first_results["tasks_completed"])
+
+    async def test__when_task_attempts_fail__expect_failed_attempts_reported_as_wasted_work(self):
+        """
+        GIVEN a simulation in which half of all task attempts fail,
+          AND tasks may be attempted many times.
+        WHEN the schedule is simulated.
+        EXPECT every task to eventually complete and the failed attempts to be counted as wasted work.
+        """
+        simulator = ScheduleSimulator([1.0] * 20, SimulationConfig(peers=3, failure_rate=0.5, seed=1, max_attempts=100))
+
+        results = (await simulator.run("lifo")).to_dict()
+
+        self.assertEqual(20, results["tasks_completed"])
+        self.assertGreater(results["task_failures"], 0)
+        self.assertGreater(results["wasted_work"], 0)
+        self.assertFalse(results["schema_failed"])
+
+    async def test__when_the_schema_fails_with_attempts_in_flight__expect_only_the_time_spent_until_then_counted(self):
+        """
+        GIVEN a simulation in which every task attempt fails part way through,
+          AND tasks may only be attempted once.
+        WHEN the schedule is simulated.
+        EXPECT the schema to fail with the first failed attempt,
+          AND the attempts still running then to count as busy only until then, rather than as completed.
+        """
+        simulator = ScheduleSimulator([1.0] * 20, SimulationConfig(peers=3, failure_rate=1.0, seed=1, max_attempts=1))
+
+        results = (await simulator.run("lifo")).to_dict()
+
+        self.assertTrue(results["schema_failed"])
+        self.assertEqual(0, results["tasks_completed"])
+        self.assertEqual(1, results["task_failures"])
+        self.assertAlmostEqual(1.0, results["peer_utilisation"])
+
+    async def test__when_failed_tasks_are_retried_after_a_backoff__expect_the_simulator_to_retry_them(self):
+        """
+        GIVEN a simulation in which half of all task attempts fail,
+          AND failed tasks are retried after a backoff.
+        WHEN the schedule is simulated.
+        EXPECT the retries the schema instance requests of the controller to be made,
+          AND every task to eventually complete.
+        """
+        simulator = ScheduleSimulator(
+            [1.0] * 10, SimulationConfig(peers=2, failure_rate=0.5, seed=1, max_attempts=10, backoff=0.001)
+        )
+
+        results = (await simulator.run("lifo")).to_dict()
+
+        self.assertEqual(10, results["tasks_completed"])
+        self.assertGreater(results["task_failures"], 0)
+        self.assertFalse(results["schema_failed"])
@@ -3,8 +3,10 @@ import json
 from channels.testing import ApplicationCommunicator, WebsocketCommunicator
 from django.test import TestCase
 
+from task_sharding.src.message_type import MessageType
 from task_sharding.test.defaults import (
     create_application,
+    create_default_build_instruction_message,
     create_default_client_init_message,
     create_default_task_complete_message,
     create_default_schema_complete_message,
@@ -94,3 +96,52 @@ class TaskShardingTests__SchemaCompleted(TestCase):
             controller, "get.total.running.schema.instances.msg", "total_running_schema_instances"
         )
         self.assertEqual(0, total_running_schema_instances)
+
+    async def test__when_a_consumer_announces_the_artifacts_of_a_task__expect_them_passed_on_as_the_task_passes(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN two consumers connect with three tasks,
+          AND the first consumer passes task 2 and announces where it serves the task's outputs from,
+          AND a third consumer connects,
+          AND the second consumer passes task 1 without announcing any.
+        EXPECT the second consumer to be told where the outputs of task 2 are as soon as it passes,
+          AND the third consumer to be told when it connects,
+          AND none of them to be told with the schema complete message.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumers = []
+        for consumer_number in range(1, 4):
+            consumer = WebsocketCommunicator(application, "/ws/api/1/{}/".format(consumer_number))
+            await consumer.connect()
+            consumers.append(consumer)
+        artifacts = {"url": "http://127.0.0.1:8001/artifacts/key/", "files": {"out/report.xml": 100}}
+        artifacts_msg = {
+            "type": "send.message",
+            "message_type": MessageType.ARTIFACTS,
+            "schema_id": "1",
+            "artifacts": [{"task_id": "2", **artifacts}],
+        }
+
+        for consumer in consumers[:2]:
+            await send_message_between_communicators(consumer, controller, create_default_client_init_message(3))
+            await consumer.receive_from()
+        await send_message_between_communicators(
+            consumers[0], controller, {**create_default_task_complete_message("2"), "artifacts": artifacts}
+        )
+        self.assertDictEqual(
+            create_default_build_instruction_message("0"), json.loads(await consumers[0].receive_from())
+        )
+        self.assertDictEqual(artifacts_msg, json.loads(await consumers[1].receive_from()))
+
+        await send_message_between_communicators(consumers[2], controller, create_default_client_init_message(3))
+        self.assertDictEqual(artifacts_msg, json.loads(await consumers[2].receive_from()))
+
+        await send_message_between_communicators(consumers[1], controller, create_default_task_complete_message("1"))
+        await send_message_between_communicators(consumers[0], controller, create_default_task_complete_message("0"))
+        for consumer in consumers:
+            self.assertDictEqual(create_default_schema_complete_message(), json.loads(await consumer.receive_from()))
+
+        for consumer in consumers:
+            await consumer.disconnect()
+            await proxy_message_from_channel_to_communicator("controller", controller)
@@ -148,11 +148,11 @@ class TaskShardingTests__TwoConsumersTaskComplete(TestCase):
         self.assertDictEqual(expected_client_2_build_instruction_msg, json.loads(actual_build_instruction_msg))
 
         # Send client task complete message to controller
-        client_1_task_complete_msg = create_default_task_complete_message("0")
+        client_1_task_complete_msg = create_default_task_complete_message("1")
         await send_message_between_communicators(self.consumer1, self.controller, client_1_task_complete_msg)
 
         # Send client task complete message to controller
-        client_2_task_complete_msg = create_default_task_complete_message("1")
+        client_2_task_complete_msg = create_default_task_complete_message("0")
         await send_message_between_communicators(self.consumer2, self.controller, client_2_task_complete_msg)
 
         # Assert the controller sent the correct schema complete message to the consumer
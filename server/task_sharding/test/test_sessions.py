@@ -0,0 +1,110 @@
+import json
+
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from django.test import TestCase
+
+from task_sharding.src.message_type import MessageType
+from task_sharding.test.defaults import (
+    create_application,
+    create_default_build_instruction_message,
+    create_default_client_init_message,
+    create_default_schema_complete_message,
+    create_default_task_complete_message,
+)
+from task_sharding.test.utils import (
+    proxy_message_from_channel_to_communicator,
+    prompt_response_from_communicator,
+    send_message_between_communicators,
+)
+
+
+class TaskShardingTests__Sessions(TestCase):
+    async def test__when_two_sessions_share_a_websocket__expect_each_run_as_a_separate_consumer(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN a single websocket sends the INIT messages of two sessions, for a schema with two tasks.
+        EXPECT each session to be given a different task, tagged with its session ID,
+          AND the controller to see two registered consumers,
+          AND both sessions to be told the schema is complete once both tasks have completed.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        daemon = WebsocketCommunicator(application, "/ws/api/1/host/")
+        await daemon.connect()
+
+        for session_id in ("a", "b"):
+            client_init_msg = create_default_client_init_message(2)
+            client_init_msg.update(session_id=session_id, client_id="client_" + session_id)
+            await send_message_between_communicators(daemon, controller, client_init_msg)
+
+        build_instruction_msgs = [json.loads(await daemon.receive_from()) for _ in range(2)]
+        self.assertCountEqual(
+            [
+                {**create_default_build_instruction_message("1"), "session_id": "a"},
+                {**create_default_build_instruction_message("0"), "session_id": "b"},
+            ],
+            build_instruction_msgs,
+        )
+        self.assertEqual(
+            2,
+            await prompt_response_from_communicator(
+                controller, "get.total.registered.consumers.msg", "total_registered_consumers"
+            ),
+        )
+
+        for build_instruction_msg in build_instruction_msgs:
+            task_complete_msg = create_default_task_complete_message(build_instruction_msg["task_id"])
+            task_complete_msg["session_id"] = build_instruction_msg["session_id"]
+            await send_message_between_communicators(daemon, controller, task_complete_msg)
+
+        schema_complete_msgs = [json.loads(await daemon.receive_from()) for _ in range(2)]
+        self.assertCountEqual(
+            [
+                {**create_default_schema_complete_message(), "session_id": "a"},
+                {**create_default_schema_complete_message(), "session_id": "b"},
+            ],
+            schema_complete_msgs,
+        )
+
+        await daemon.disconnect()
+        for _ in range(3):
+            await proxy_message_from_channel_to_communicator("controller", controller)
+
+    async def test__when_a_session_is_closed__expect_only_its_consumer_deregistered(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN a single websocket sends the INIT messages of two sessions, for a schema with two tasks,
+          AND then closes the first session.
+        EXPECT the controller to see one registered consumer,
+          AND none once the websocket disconnects.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        daemon = WebsocketCommunicator(application, "/ws/api/1/host/")
+        await daemon.connect()
+
+        for session_id in ("a", "b"):
+            client_init_msg = create_default_client_init_message(2)
+            client_init_msg["session_id"] = session_id
+            await send_message_between_communicators(daemon, controller, client_init_msg)
+        for _ in range(2):
+            await daemon.receive_from()
+
+        session_closed_msg = {"message_type": MessageType.SESSION_CLOSED, "session_id": "a"}
+        await send_message_between_communicators(daemon, controller, session_closed_msg)
+        self.assertEqual(
+            1,
+            await prompt_response_from_communicator(
+                controller, "get.total.registered.consumers.msg", "total_registered_consumers"
+            ),
+        )
+
+        await daemon.disconnect()
+        for _ in range(2):
+            await proxy_message_from_channel_to_communicator("controller", controller)
+        self.assertEqual(
+            0,
+            await prompt_response_from_communicator(
+                controller, "get.total.registered.consumers.msg", "total_registered_consumers"
+            ),
+        )
@@ -0,0 +1,112 @@
+import json
+
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from django.test import AsyncClient, TestCase, override_settings
+
+from task_sharding.src.status_snapshot import get_status_cache
+from task_sharding.test.defaults import (
+    create_application,
+    create_default_client_init_message,
+    create_default_task_complete_message,
+)
+from task_sharding.test.utils import (
+    get_published_status_snapshot,
+    proxy_message_from_channel_to_communicator,
+    send_message_between_communicators,
+)
+
+
+class TaskShardingTests__StatusSnapshot(TestCase):
+    @override_settings(TASK_SHARDING_STATUS_SNAPSHOT_INTERVAL=0)
+    async def test__when_a_consumer_is_working_on_a_schema__expect_the_status_snapshot_to_describe_it(self):
+        """
+        GIVEN a controller which publishes a status snapshot on every change.
+        WHEN a consumer connects with three tasks and completes one.
+        EXPECT the snapshot to show the consumer, its in-progress task and the task counts.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        init_msg = create_default_client_init_message(3)
+        await send_message_between_communicators(consumer, controller, init_msg)
+        await consumer.receive_from()
+        await send_message_between_communicators(consumer, controller, create_default_task_complete_message("2"))
+        await consumer.receive_from()
+
+        status_snapshot = await get_published_status_snapshot(controller)
+
+        self.assertEqual(1, len(status_snapshot["schema_instances"]))
+        instance_status = status_snapshot["schema_instances"][0]
+        self.assertEqual("1", instance_status["schema_id"])
+        self.assertEqual(1, instance_status["tasks_not_started"])
+        self.assertEqual([1], instance_status["tasks_in_progress"])
+        self.assertEqual(1, instance_status["tasks_completed"])
+        self.assertEqual(1, len(instance_status["consumers"]))
+        self.assertEqual(init_msg["repo_state"], instance_status["consumers"][0]["repo_state"])
+        self.assertEqual(1, instance_status["consumers"][0]["task_id"])
+
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+
+    @override_settings(TASK_SHARDING_STATUS_SNAPSHOT_INTERVAL=0.2)
+    async def test__when_the_state_changes_within_the_snapshot_interval__expect_it_published_afterwards(self):
+        """
+        GIVEN a controller with a status snapshot interval.
+        WHEN a consumer connects, and completes a task within the interval.
+        EXPECT the snapshot published on connection to be served until the interval has passed,
+          AND then a snapshot with the completed task to be published.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        await send_message_between_communicators(consumer, controller, create_default_client_init_message(2))
+        await consumer.receive_from()
+        first_snapshot = await get_published_status_snapshot(controller)
+        await send_message_between_communicators(consumer, controller, create_default_task_complete_message("1"))
+        await consumer.receive_from()
+        second_snapshot = await get_published_status_snapshot(controller)
+
+        self.assertEqual(first_snapshot, second_snapshot)
+        self.assertEqual(0, second_snapshot["schema_instances"][0]["tasks_completed"])
+
+        await proxy_message_from_channel_to_communicator("controller", controller)
+        third_snapshot = await get_published_status_snapshot(controller)
+
+        self.assertEqual(1, third_snapshot["schema_instances"][0]["tasks_completed"])
+
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+
+    @override_settings(TASK_SHARDING_STATUS_SNAPSHOT_INTERVAL=0)
+    async def test__when_the_status_endpoint_is_requested__expect_the_published_snapshot_as_json(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController, which has not yet published a status snapshot.
+        WHEN the /status endpoint is requested before and after a consumer connects.
+        EXPECT it to be unavailable at first, and then to return the published snapshot as JSON,
+          without a message being sent to the controller for either request.
+        """
+        get_status_cache().clear()
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        response = await AsyncClient().get("/status")
+        self.assertEqual(503, response.status_code)
+
+        await send_message_between_communicators(consumer, controller, create_default_client_init_message())
+        await consumer.receive_from()
+        await get_published_status_snapshot(controller)
+        response = await AsyncClient().get("/status")
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(
+            ["1"], [instance["schema_id"] for instance in json.loads(response.content)["schema_instances"]]
+        )
+
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
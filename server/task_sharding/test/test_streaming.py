@@ -0,0 +1,74 @@
+import json
+
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from django.test import TestCase
+
+from task_sharding.src.message_type import MessageType
+from task_sharding.test.defaults import (
+    create_application,
+    create_default_build_instruction_message,
+    create_default_client_init_message,
+    create_default_schema_complete_message,
+    create_default_task_complete_message,
+)
+from task_sharding.test.utils import proxy_message_from_channel_to_communicator, send_message_between_communicators
+
+
+def create_add_tasks_message(first_task_id: int, tasks: list) -> dict:
+    return {"message_type": MessageType.ADD_TASKS, "schema_id": "1", "first_task_id": first_task_id, "tasks": tasks}
+
+
+def create_streamed_build_instruction_message(task_id: str, task: dict) -> dict:
+    build_instruction_msg = create_default_build_instruction_message(task_id)
+    build_instruction_msg["task"] = task
+    return build_instruction_msg
+
+
+class TaskShardingTests__StreamingSchemas(TestCase):
+    async def test__when_tasks_are_streamed__expect_them_handed_out_and_the_schema_completed_at_the_end_of_the_stream(
+        self,
+    ):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN a consumer connects with a streaming schema of no tasks,
+          AND streams tasks 0 and 1, and then tasks 0 to 2 again,
+          AND completes every task it is given,
+          AND marks the end of the stream.
+        EXPECT each task to be handed out once, along with its definition,
+          AND the schema to complete only once the stream has ended.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        client_init_msg = create_default_client_init_message(0)
+        client_init_msg["streaming"] = True
+        await send_message_between_communicators(consumer, controller, client_init_msg)
+        self.assertTrue(await consumer.receive_nothing())
+
+        tasks = [{"task": "//:a"}, {"task": "//:b"}, {"task": "//:c"}]
+        await send_message_between_communicators(consumer, controller, create_add_tasks_message(0, tasks[:2]))
+        self.assertDictEqual(
+            create_streamed_build_instruction_message("1", tasks[1]), json.loads(await consumer.receive_from())
+        )
+
+        await send_message_between_communicators(consumer, controller, create_add_tasks_message(0, tasks))
+        for task_id in ("1", "2", "0"):
+            if task_id != "1":
+                self.assertDictEqual(
+                    create_streamed_build_instruction_message(task_id, tasks[int(task_id)]),
+                    json.loads(await consumer.receive_from()),
+                )
+            await send_message_between_communicators(
+                consumer, controller, create_default_task_complete_message(task_id)
+            )
+        self.assertTrue(await consumer.receive_nothing())
+
+        await send_message_between_communicators(
+            consumer, controller, {"message_type": MessageType.END_OF_TASKS, "schema_id": "1"}
+        )
+        self.assertDictEqual(create_default_schema_complete_message(), json.loads(await consumer.receive_from()))
+
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
@@ -0,0 +1,143 @@
+import asyncio
+import json
+
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from django.test import AsyncClient, TestCase
+
+from task_sharding.src.message_type import MessageType
+from task_sharding.test.defaults import (
+    create_application,
+    create_default_build_instruction_message,
+    create_default_client_init_message,
+)
+from task_sharding.test.utils import (
+    proxy_message_from_channel_to_communicator,
+    prompt_response_from_communicator,
+    send_message_between_communicators,
+)
+
+
+class TaskShardingTests__Supersede(TestCase):
+    async def test__when_a_consumer_supersedes_a_repo_state__expect_its_instance_cancelled_and_its_consumers_freed(
+        self,
+    ):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN two consumers connect with one task, so that only the first is given the task,
+          AND a third consumer marks their repo state as superseded.
+        EXPECT the first consumer to be told to abort its task,
+          AND both consumers to be told the schema has been superseded,
+          AND the instance to be removed, so that a new consumer with the same schema starts afresh.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer1 = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer1.connect()
+        consumer2 = WebsocketCommunicator(application, "/ws/api/1/2/")
+        await consumer2.connect()
+        consumer3 = WebsocketCommunicator(application, "/ws/api/1/3/")
+        await consumer3.connect()
+
+        client_init_msg = create_default_client_init_message()
+        await send_message_between_communicators(consumer1, controller, client_init_msg)
+        self.assertDictEqual(create_default_build_instruction_message(), json.loads(await consumer1.receive_from()))
+        await send_message_between_communicators(consumer2, controller, client_init_msg)
+
+        supersede_msg = {"message_type": MessageType.SUPERSEDE, "repo_state": client_init_msg["repo_state"]}
+        await send_message_between_communicators(consumer3, controller, supersede_msg)
+
+        self.assertEqual(MessageType.ABORT_TASK, json.loads(await consumer1.receive_from())["message_type"])
+        for consumer in (consumer1, consumer2):
+            self.assertDictEqual(
+                {"type": "send.message", "message_type": MessageType.SCHEMA_SUPERSEDED, "schema_id": "1"},
+                json.loads(await consumer.receive_from()),
+            )
+        self.assertTrue(await consumer3.receive_nothing())
+        self.assertEqual(
+            0,
+            await prompt_response_from_communicator(
+                controller, "get.total.running.schema.instances.msg", "total_running_schema_instances"
+            ),
+        )
+
+        await send_message_between_communicators(consumer3, controller, client_init_msg)
+        self.assertDictEqual(create_default_build_instruction_message(), json.loads(await consumer3.receive_from()))
+
+        for consumer in (consumer1, consumer2, consumer3):
+            await consumer.disconnect()
+            await proxy_message_from_channel_to_communicator("controller", controller)
+
+    async def test__when_a_repo_state_is_superseded_over_http__expect_the_cancelled_instances_returned(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController with one consumer on a schema.
+        WHEN the consumer's repo state is posted to the /supersede endpoint, with CSRF checks enforced.
+        EXPECT the ID of the consumer's instance to be returned,
+          AND the consumer to be told the schema has been superseded.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        client_init_msg = create_default_client_init_message()
+        await send_message_between_communicators(consumer, controller, client_init_msg)
+        await consumer.receive_from()
+        schema_instance_id = await prompt_response_from_communicator(
+            controller, "get.schema.instance.id.for.client.id.msg", "schema_instance_id", {"id": "1"}
+        )
+
+        response, _ = await asyncio.gather(
+            AsyncClient(enforce_csrf_checks=True).post(
+                "/supersede", {"repo_state": client_init_msg["repo_state"]}, content_type="application/json"
+            ),
+            proxy_message_from_channel_to_communicator("controller", controller),
+        )
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({"superseded_instances": [schema_instance_id]}, json.loads(response.content))
+        self.assertEqual(MessageType.ABORT_TASK, json.loads(await consumer.receive_from())["message_type"])
+        self.assertEqual(MessageType.SCHEMA_SUPERSEDED, json.loads(await consumer.receive_from())["message_type"])
+
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+
+    async def test__when_an_empty_or_malformed_repo_state_is_superseded__expect_it_rejected_and_nothing_cancelled(
+        self,
+    ):
+        """
+        GIVEN a freshly instantiated TaskShardingController with one consumer on a schema.
+        WHEN an empty repo state and malformed ones are posted to the /supersede endpoint,
+          AND the same repo states are sent in SUPERSEDE messages by a second consumer.
+        EXPECT each post to be rejected as a bad request,
+          AND the consumer's instance to keep running, with the controller still handling its messages.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer1 = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer1.connect()
+        consumer2 = WebsocketCommunicator(application, "/ws/api/1/2/")
+        await consumer2.connect()
+
+        await send_message_between_communicators(consumer1, controller, create_default_client_init_message())
+        await consumer1.receive_from()
+
+        for repo_state in ({}, {"org/repo_1": "5bfb4467"}, {"org/repo_1": {"base_ref": "main"}}, ["org/repo_1"]):
+            response = await AsyncClient().post(
+                "/supersede", {"repo_state": repo_state}, content_type="application/json"
+            )
+            self.assertEqual(400, response.status_code)
+
+            supersede_msg = {"message_type": MessageType.SUPERSEDE, "repo_state": repo_state}
+            await send_message_between_communicators(consumer2, controller, supersede_msg)
+
+        self.assertTrue(await consumer1.receive_nothing())
+        self.assertEqual(
+            1,
+            await prompt_response_from_communicator(
+                controller, "get.total.running.schema.instances.msg", "total_running_schema_instances"
+            ),
+        )
+
+        for consumer in (consumer1, consumer2):
+            await consumer.disconnect()
+            await proxy_message_from_channel_to_communicator("controller", controller)
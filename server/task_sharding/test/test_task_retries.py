@@ -0,0 +1,159 @@
+import json
+
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from django.test import TestCase, override_settings
+
+from task_sharding.src.message_type import MessageType
+from task_sharding.src.retry_policy import RetryPolicy
+from task_sharding.src.task_history import TaskHistory
+from task_sharding.src.task_queue import LifoTaskQueue
+from task_sharding.test.defaults import (
+    create_application,
+    create_default_build_instruction_message,
+    create_default_client_init_message,
+    create_default_schema_complete_message,
+    create_default_task_complete_message,
+)
+from task_sharding.test.utils import (
+    get_published_status_snapshot,
+    proxy_message_from_channel_to_communicator,
+    send_message_between_communicators,
+)
+
+
+class TaskShardingTests__RetryPolicy(TestCase):
+    def test__when_a_task_fails_repeatedly__expect_exponential_backoff_until_attempts_run_out(self):
+        """
+        GIVEN a retry policy of three attempts with a one second backoff.
+        WHEN a task fails one, two and three times.
+        EXPECT retries after 1 and 2 seconds, and no retry after the third failure.
+        """
+        retry_policy = RetryPolicy(max_attempts=3, backoff=1.0)
+
+        self.assertEqual([1.0, 2.0], [retry_policy.get_backoff(1), retry_policy.get_backoff(2)])
+        self.assertEqual([True, True, False], [retry_policy.should_retry(attempts) for attempts in (1, 2, 3)])
+
+    def test__when_task_outcomes_are_recorded__expect_passed_flaky_and_broken_runs_counted(self):
+        """
+        GIVEN a task history.
+        WHEN a task passes first time, passes after a failure, and never passes.
+        EXPECT one run of each outcome to be recorded for the task.
+        """
+        task_history = TaskHistory()
+
+        outcomes = [
+            task_history.record_outcome("1", 0, 0, True),
+            task_history.record_outcome("1", 0, 2, True),
+            task_history.record_outcome("1", 0, 3, False),
+        ]
+
+        self.assertEqual(["passed", "flaky", "broken"], outcomes)
+        self.assertEqual({"passed": 1, "flaky": 1, "broken": 1}, task_history.get_outcomes("1", 0))
+
+    def test__when_tasks_are_excluded__expect_the_next_task_handed_out_and_the_order_kept(self):
+        """
+        GIVEN a LIFO task queue with three tasks.
+        WHEN a task is popped with the two most recent tasks excluded.
+        EXPECT the oldest task to be handed out, and the excluded tasks to stay in order.
+        """
+        task_queue = LifoTaskQueue(range(3))
+
+        self.assertEqual(0, task_queue.pop(excluded_tasks={1, 2}))
+        self.assertEqual(None, task_queue.pop(excluded_tasks={1, 2}))
+        self.assertEqual([2, 1], [task_queue.pop(), task_queue.pop()])
+
+
+class TaskShardingTests__TaskRetries(TestCase):
+    async def test__when_a_consumer_fails_a_task__expect_the_task_retried_on_another_consumer(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN two consumers connect and each is given one of two tasks,
+          AND the first consumer fails its task,
+          AND the second consumer completes its task.
+        EXPECT the failed task to be given to the second consumer rather than back to the first
+          AND the schema to complete once it passes.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer1 = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer1.connect()
+        consumer2 = WebsocketCommunicator(application, "/ws/api/1/2/")
+        await consumer2.connect()
+
+        client_init_msg = create_default_client_init_message(2)
+        await send_message_between_communicators(consumer1, controller, client_init_msg)
+        self.assertDictEqual(create_default_build_instruction_message("1"), json.loads(await consumer1.receive_from()))
+        await send_message_between_communicators(consumer2, controller, client_init_msg)
+        self.assertDictEqual(create_default_build_instruction_message("0"), json.loads(await consumer2.receive_from()))
+
+        await send_message_between_communicators(
+            consumer1, controller, create_default_task_complete_message("1", False)
+        )
+        self.assertTrue(await consumer1.receive_nothing())
+
+        await send_message_between_communicators(consumer2, controller, create_default_task_complete_message("0"))
+        self.assertDictEqual(create_default_build_instruction_message("1"), json.loads(await consumer2.receive_from()))
+
+        await send_message_between_communicators(consumer2, controller, create_default_task_complete_message("1"))
+        self.assertDictEqual(create_default_schema_complete_message(), json.loads(await consumer1.receive_from()))
+        self.assertDictEqual(create_default_schema_complete_message(), json.loads(await consumer2.receive_from()))
+
+        await consumer1.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+        await consumer2.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+
+    @override_settings(TASK_SHARDING_RETRY_MAX_ATTEMPTS=2, TASK_SHARDING_STATUS_SNAPSHOT_INTERVAL=0)
+    async def test__when_a_task_runs_out_of_attempts__expect_the_schema_failed(self):
+        """
+        GIVEN a controller which attempts each task at most twice.
+        WHEN a single consumer connects and fails its only task twice.
+        EXPECT the task to be retried once on the same consumer, as no other consumer can take it,
+          AND then the consumer to be sent a schema failed message.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        await send_message_between_communicators(consumer, controller, create_default_client_init_message())
+        self.assertDictEqual(create_default_build_instruction_message(), json.loads(await consumer.receive_from()))
+
+        await send_message_between_communicators(consumer, controller, create_default_task_complete_message("0", False))
+        self.assertDictEqual(create_default_build_instruction_message(), json.loads(await consumer.receive_from()))
+
+        await send_message_between_communicators(consumer, controller, create_default_task_complete_message("0", False))
+        self.assertDictEqual(
+            {"type": "send.message", "message_type": MessageType.SCHEMA_FAILED, "schema_id": "1", "task_id": "0"},
+            json.loads(await consumer.receive_from()),
+        )
+
+        status_snapshot = await get_published_status_snapshot(controller)
+        self.assertTrue(status_snapshot["schema_instances"][0]["failed"])
+
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+
+    @override_settings(TASK_SHARDING_RETRY_BACKOFF=0.1)
+    async def test__when_retries_are_backed_off__expect_the_failed_task_resent_after_the_backoff(self):
+        """
+        GIVEN a controller which waits 0.1 seconds before retrying a failed task.
+        WHEN a single consumer connects and fails its only task.
+        EXPECT nothing to be sent straight away, and the task to be resent once the backoff has passed.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        await send_message_between_communicators(consumer, controller, create_default_client_init_message())
+        self.assertDictEqual(create_default_build_instruction_message(), json.loads(await consumer.receive_from()))
+
+        await send_message_between_communicators(consumer, controller, create_default_task_complete_message("0", False))
+        self.assertTrue(await consumer.receive_nothing(timeout=0.05))
+        # The instance asks the controller to retry the task once the backoff has passed
+        await proxy_message_from_channel_to_communicator("controller", controller)
+        self.assertDictEqual(create_default_build_instruction_message(), json.loads(await consumer.receive_from()))
+
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
@@ -0,0 +1,138 @@
+import json
+
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from django.test import TestCase
+
+from task_sharding.benchmark.simulator import SimulatedChannelLayer
+from task_sharding.src.message_type import MessageType
+from task_sharding.src.schema_details import SchemaDetails
+from task_sharding.src.schema_instance import SchemaInstance
+from task_sharding.src.task_history import TaskHistory
+from task_sharding.src.task_shards import TaskShards, calculate_shard_counts
+from task_sharding.test.defaults import (
+    create_application,
+    create_default_build_instruction_message,
+    create_default_client_init_message,
+    create_default_schema_complete_message,
+    create_default_task_complete_message,
+)
+from task_sharding.test.utils import proxy_message_from_channel_to_communicator, send_message_between_communicators
+
+
+class TaskShardingTests__ShardCounts(TestCase):
+    def test__when_tasks_are_auto_sharded__expect_shards_about_as_long_as_the_median_task(self):
+        """
+        GIVEN a schema of five tasks, where tasks 0 to 2 take 10 seconds, task 3 takes 40 seconds,
+          AND task 4 has never been timed.
+        WHEN tasks 3 and 4 are declared auto-shardable, and task 0 is declared with 3 shards.
+        EXPECT task 0 to keep its 3 shards, task 3 to be split into 4 shards of about 10 seconds,
+          AND task 4 not to be split.
+        """
+        task_history = TaskHistory()
+        for task, duration in ((0, 10.0), (1, 10.0), (2, 10.0), (3, 40.0)):
+            task_history.record_duration("1", task, duration)
+
+        shard_counts = calculate_shard_counts({"0": 3, "3": 0, "4": 0}, 5, "1", task_history)
+
+        self.assertEqual({0: 3, 3: 4}, shard_counts)
+
+    def test__when_an_auto_sharded_task_is_very_long__expect_its_shards_capped(self):
+        """
+        GIVEN a task expected to take 100 seconds.
+        WHEN it is auto-sharded with a target of 1 second per shard and at most 8 shards.
+        EXPECT it to be split into 8 shards.
+        """
+        task_history = TaskHistory()
+        task_history.record_duration("1", 0, 100.0)
+
+        self.assertEqual({0: 8}, calculate_shard_counts({"0": 0}, 1, "1", task_history, 1.0, 8))
+
+    def test__when_tasks_are_sharded__expect_shards_numbered_after_the_schema_tasks(self):
+        """
+        GIVEN a schema of three tasks.
+        WHEN task 1 is split into three shards.
+        EXPECT five units, where the shards of task 1 are units 1, 3 and 4.
+        """
+        task_shards = TaskShards(3, {1: 3})
+
+        self.assertEqual(5, task_shards.total_units)
+        self.assertEqual([1, 3, 4], task_shards.get_units(1))
+        self.assertEqual((1, 2, 3), task_shards.get_shard(4))
+        self.assertEqual((2, 0, 1), task_shards.get_shard(2))
+
+
+class TaskShardingTests__TaskShards(TestCase):
+    async def test__when_a_consumer_runs_every_shard_of_a_task__expect_the_task_recorded_once_with_their_total_duration(
+        self,
+    ):
+        """
+        GIVEN a schema instance with one task split into two shards.
+        WHEN a consumer runs the second shard in 3 seconds and the first shard in 5 seconds.
+        EXPECT each build instruction to carry its shard index and total,
+          AND the task's expected duration to be 8 seconds once both shards have passed,
+          AND the schema to complete with a single passing run of the task.
+        """
+        now = 0.0
+        task_history = TaskHistory()
+        channel_layer = SimulatedChannelLayer()
+        schema_instance = SchemaInstance(
+            SchemaDetails("1", "1", 1),
+            task_history=task_history,
+            channel_layer=channel_layer,
+            clock=lambda: now,
+            task_shards=TaskShards(1, {0: 2}),
+        )
+        init_msg = create_default_client_init_message()
+        schema_instance.register_consumer("consumer", init_msg["repo_state"])
+        await schema_instance.receive_message(init_msg, "consumer")
+
+        shard_messages = []
+        for shard_duration in (3.0, 5.0):
+            _, build_instruction_msg = channel_layer.sent_messages[-1]
+            shard_messages.append(build_instruction_msg)
+            self.assertEqual(None, task_history.get_expected_duration("1", 0))
+
+            now += shard_duration
+            task_complete_msg = create_default_task_complete_message("0")
+            task_complete_msg["shard_index"] = build_instruction_msg["shard_index"]
+            await schema_instance.receive_message(task_complete_msg, "consumer")
+
+        self.assertEqual(
+            [(1, 2), (0, 2)], [(message["shard_index"], message["total_shards"]) for message in shard_messages]
+        )
+        self.assertEqual(8.0, task_history.get_expected_duration("1", 0))
+        self.assertEqual({"passed": 1, "flaky": 0, "broken": 0}, task_history.get_outcomes("1", 0))
+        self.assertEqual(MessageType.SCHEMA_COMPLETE, channel_layer.sent_messages[-1][1]["message_type"])
+
+    async def test__when_a_consumer_declares_a_shardable_task__expect_the_controller_to_hand_out_its_shards(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN a consumer connects with two tasks, declaring task 1 with two shards,
+          AND completes every build instruction it is given.
+        EXPECT the consumer to be given both shards of task 1 and then task 0,
+          AND then a schema complete message.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        client_init_msg = create_default_client_init_message(2)
+        client_init_msg["shardable_tasks"] = {"1": 2}
+        await send_message_between_communicators(consumer, controller, client_init_msg)
+
+        for shard_index in (1, 0):
+            build_instruction_msg = create_default_build_instruction_message("1")
+            build_instruction_msg.update(shard_index=shard_index, total_shards=2)
+            self.assertDictEqual(build_instruction_msg, json.loads(await consumer.receive_from()))
+
+            task_complete_msg = create_default_task_complete_message("1")
+            task_complete_msg.update(shard_index=shard_index, total_shards=2)
+            await send_message_between_communicators(consumer, controller, task_complete_msg)
+
+        self.assertDictEqual(create_default_build_instruction_message("0"), json.loads(await consumer.receive_from()))
+        await send_message_between_communicators(consumer, controller, create_default_task_complete_message("0"))
+        self.assertDictEqual(create_default_schema_complete_message(), json.loads(await consumer.receive_from()))
+
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
@@ -0,0 +1,138 @@
+import json
+
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from django.test import TestCase, override_settings
+
+from task_sharding.src.message_type import MessageType
+from task_sharding.src.task_states import TaskState, TaskStates
+from task_sharding.test.defaults import (
+    create_application,
+    create_default_build_instruction_message,
+    create_default_client_init_message,
+    create_default_schema_complete_message,
+    create_default_task_complete_message,
+)
+from task_sharding.test.utils import (
+    get_published_status_snapshot,
+    proxy_message_from_channel_to_communicator,
+    send_message_between_communicators,
+)
+
+
+class TaskShardingTests__TaskStates(TestCase):
+    def test__when_units_change_state__expect_the_counts_of_each_state_kept(self):
+        """
+        GIVEN task states for three units, of which unit 2 is already done.
+        WHEN unit 0 is leased, unit 1 fails, and a fourth unit is added.
+        EXPECT one unit in each state but the pending one, which unit 3 has joined.
+        """
+        task_states = TaskStates(3, done_units=[2])
+        task_states.set(0, TaskState.LEASED)
+        task_states.set(1, TaskState.FAILED)
+        task_states.resize(4)
+
+        self.assertEqual(4, len(task_states))
+        self.assertEqual([1, 1, 1, 1], [task_states.count(state) for state in TaskState])
+        self.assertEqual([3], task_states.get_units(TaskState.PENDING))
+        self.assertEqual(TaskState.DONE, task_states.get(2))
+
+    @override_settings(TASK_SHARDING_STATUS_SNAPSHOT_INTERVAL=0)
+    async def test__when_a_task_complete_message_is_sent_twice__expect_the_task_completed_once(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN a consumer connects with two tasks and completes the first task it is given,
+          AND then sends the same task complete message again.
+        EXPECT the second message to be ignored, rather than handing out or counting anything,
+          AND the schema to complete once the other task passes.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        await send_message_between_communicators(consumer, controller, create_default_client_init_message(2))
+        self.assertDictEqual(create_default_build_instruction_message("1"), json.loads(await consumer.receive_from()))
+        await send_message_between_communicators(consumer, controller, create_default_task_complete_message("1"))
+        self.assertDictEqual(create_default_build_instruction_message("0"), json.loads(await consumer.receive_from()))
+
+        await send_message_between_communicators(consumer, controller, create_default_task_complete_message("1"))
+        self.assertTrue(await consumer.receive_nothing())
+        status_snapshot = await get_published_status_snapshot(controller)
+        self.assertEqual(1, status_snapshot["schema_instances"][0]["tasks_completed"])
+        self.assertEqual(
+            {"pending": 0, "leased": 1, "done": 1, "failed": 0}, status_snapshot["schema_instances"][0]["task_states"]
+        )
+
+        await send_message_between_communicators(consumer, controller, create_default_task_complete_message("0"))
+        self.assertDictEqual(create_default_schema_complete_message(), json.loads(await consumer.receive_from()))
+
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+
+    async def test__when_a_consumer_passes_a_task_leased_to_another__expect_the_other_told_to_abort_it(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN a consumer connects with four tasks and is given task 3,
+          AND a second consumer connects, is given task 2, and reports that task 3 has passed.
+        EXPECT the first consumer to be told to abort task 3, rather than be given another task while it runs it,
+          AND to be given task 1 once it has reported its own result for task 3, which is ignored.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer1 = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer1.connect()
+        consumer2 = WebsocketCommunicator(application, "/ws/api/1/2/")
+        await consumer2.connect()
+
+        await send_message_between_communicators(consumer1, controller, create_default_client_init_message(4))
+        self.assertDictEqual(create_default_build_instruction_message("3"), json.loads(await consumer1.receive_from()))
+        await send_message_between_communicators(consumer2, controller, create_default_client_init_message(4))
+        self.assertDictEqual(create_default_build_instruction_message("2"), json.loads(await consumer2.receive_from()))
+
+        await send_message_between_communicators(consumer2, controller, create_default_task_complete_message("3"))
+        self.assertDictEqual(
+            {"type": "send.message", "message_type": MessageType.ABORT_TASK, "schema_id": "1", "task_id": "3"},
+            json.loads(await consumer1.receive_from()),
+        )
+        self.assertTrue(await consumer1.receive_nothing())
+        self.assertTrue(await consumer2.receive_nothing())
+
+        await send_message_between_communicators(
+            consumer1, controller, create_default_task_complete_message("3", False)
+        )
+        self.assertDictEqual(create_default_build_instruction_message("1"), json.loads(await consumer1.receive_from()))
+
+        await consumer1.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+        await consumer2.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+
+    async def test__when_every_consumer_leaves_before_the_schema_completes__expect_a_new_instance_to_resume(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN a consumer connects with two tasks, completes one and disconnects while running the other,
+          AND a new consumer then connects with the same schema, cache and repo state.
+        EXPECT the new consumer to be given only the task which was not completed,
+          AND the schema to complete once it passes.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer1 = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer1.connect()
+
+        await send_message_between_communicators(consumer1, controller, create_default_client_init_message(2))
+        self.assertDictEqual(create_default_build_instruction_message("1"), json.loads(await consumer1.receive_from()))
+        await send_message_between_communicators(consumer1, controller, create_default_task_complete_message("1"))
+        self.assertDictEqual(create_default_build_instruction_message("0"), json.loads(await consumer1.receive_from()))
+        await consumer1.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+
+        consumer2 = WebsocketCommunicator(application, "/ws/api/1/2/")
+        await consumer2.connect()
+        await send_message_between_communicators(consumer2, controller, create_default_client_init_message(2))
+        self.assertDictEqual(create_default_build_instruction_message("0"), json.loads(await consumer2.receive_from()))
+        await send_message_between_communicators(consumer2, controller, create_default_task_complete_message("0"))
+        self.assertDictEqual(create_default_schema_complete_message(), json.loads(await consumer2.receive_from()))
+
+        await consumer2.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
@@ -0,0 +1,129 @@
+from channels.testing import ApplicationCommunicator, WebsocketCommunicator
+from django.test import TestCase
+
+from task_sharding.src.timeline import Timeline, TimelineEventType
+from task_sharding.test.defaults import (
+    create_application,
+    create_default_client_init_message,
+    create_default_task_complete_message,
+)
+from task_sharding.test.utils import (
+    proxy_message_from_channel_to_communicator,
+    prompt_response_from_communicator,
+    send_message_between_communicators,
+)
+
+
+class TaskShardingTests__Timeline(TestCase):
+    def test__when_more_events_are_recorded_than_the_limit__expect_oldest_events_dropped(self):
+        """
+        GIVEN a timeline bounded to three events.
+        WHEN five events are recorded.
+        EXPECT only the three most recent events to be kept.
+        """
+        timeline = Timeline(max_events=3)
+        for task_id in range(5):
+            timeline.record(TimelineEventType.ASSIGN, "consumer", task_id)
+
+        trace = timeline.to_chrome_trace("instance")
+
+        self.assertEqual(3, len(timeline))
+        running_task_ids = [event["args"]["task_id"] for event in trace["traceEvents"] if event["ph"] == "X"]
+        self.assertEqual([4], running_task_ids)
+
+    def test__when_tasks_run_on_two_consumers__expect_one_lane_per_consumer(self):
+        """
+        GIVEN a timeline with two consumers.
+        WHEN one consumer completes a task and the other fails a task.
+        EXPECT a duration event per task on separate lanes, and fail/requeue markers.
+        """
+        timeline = Timeline()
+        timeline.record(TimelineEventType.REGISTER, "consumer_1")
+        timeline.record(TimelineEventType.REGISTER, "consumer_2")
+        timeline.record(TimelineEventType.ASSIGN, "consumer_1", 1)
+        timeline.record(TimelineEventType.ASSIGN, "consumer_2", 0)
+        timeline.record(TimelineEventType.COMPLETE, "consumer_1", 1)
+        timeline.record(TimelineEventType.FAIL, "consumer_2", 0)
+        timeline.record(TimelineEventType.REQUEUE, "consumer_2", 0)
+
+        trace_events = timeline.to_chrome_trace("instance")["traceEvents"]
+
+        lane_names = {event["tid"]: event["args"]["name"] for event in trace_events if event["name"] == "thread_name"}
+        self.assertEqual({1: "consumer_1", 2: "consumer_2"}, lane_names)
+        task_events = [(event["tid"], event["args"]["result"]) for event in trace_events if event["ph"] == "X"]
+        self.assertEqual([(1, "complete"), (2, "fail")], task_events)
+        instant_events = [(event["tid"], event["name"]) for event in trace_events if event["ph"] == "i"]
+        self.assertEqual([(1, "register"), (2, "register"), (2, "fail"), (2, "requeue")], instant_events)
+
+
+class TaskShardingTests__ControllerTimeline(TestCase):
+    async def test__when_a_schema_instance_finishes__expect_its_timeline_to_remain_exportable(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN a consumer completes a single task schema and disconnects.
+        EXPECT the removed instance's timeline to be exportable with register, task and deregister events.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        await send_message_between_communicators(consumer, controller, create_default_client_init_message())
+        await consumer.receive_from()
+        schema_instance_id = await prompt_response_from_communicator(
+            controller, "get.schema.instance.id.for.client.id.msg", "schema_instance_id", {"id": "1"}
+        )
+        await send_message_between_communicators(consumer, controller, create_default_task_complete_message())
+        await consumer.receive_from()
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
+
+        timeline = await prompt_response_from_communicator(
+            controller, "get.schema.instance.timeline.msg", "timeline", {"id": schema_instance_id}
+        )
+
+        event_names = [event["name"] for event in timeline["traceEvents"] if event["ph"] != "M"]
+        self.assertEqual(["register", "task 0", "deregister"], event_names)
+
+        unknown_timeline = await prompt_response_from_communicator(
+            controller, "get.schema.instance.timeline.msg", "timeline", {"id": "unknown"}
+        )
+        self.assertIsNone(unknown_timeline)
+
+    async def test__when_a_consumer_runs_a_batch_of_tasks__expect_a_duration_event_for_each_task_of_the_batch(self):
+        """
+        GIVEN a freshly instantiated TaskShardingController.
+        WHEN a consumer which runs up to three tasks at a time connects with three tasks,
+          AND passes its batch.
+        EXPECT the instance's timeline to hold a completed duration event for each of the three tasks.
+        """
+        application = create_application()
+        controller = ApplicationCommunicator(application, {"type": "channel", "channel": "controller"})
+        consumer = WebsocketCommunicator(application, "/ws/api/1/1/")
+        await consumer.connect()
+
+        await send_message_between_communicators(
+            consumer, controller, {**create_default_client_init_message(3), "max_batch_size": 3}
+        )
+        await consumer.receive_from()
+        schema_instance_id = await prompt_response_from_communicator(
+            controller, "get.schema.instance.id.for.client.id.msg", "schema_instance_id", {"id": "1"}
+        )
+        task_complete_msg = {
+            **create_default_task_complete_message("2"),
+            "batch": [{"task_id": "1", "task_success": True}, {"task_id": "0", "task_success": True}],
+        }
+        await send_message_between_communicators(consumer, controller, task_complete_msg)
+        await consumer.receive_from()
+
+        timeline = await prompt_response_from_communicator(
+            controller, "get.schema.instance.timeline.msg", "timeline", {"id": schema_instance_id}
+        )
+
+        task_events = [
+            (event["name"], event["args"]["result"]) for event in timeline["traceEvents"] if event["ph"] == "X"
+        ]
+        self.assertCountEqual([("task 0", "complete"), ("task 1", "complete"), ("task 2", "complete")], task_events)
+
+        await consumer.disconnect()
+        await proxy_message_from_channel_to_communicator("controller", controller)
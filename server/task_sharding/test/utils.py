@@ -3,6 +3,8 @@ import json
 
 from channels.layers import get_channel_layer
 
+from task_sharding.src.status_snapshot import load_status_snapshot
+
 
 async def send_message_between_communicators(
     websocket_communicator, application_communicator, message, channel_layer="controller"
@@ -31,3 +33,12 @@ async def prompt_response_from_communicator(
     if response_key:
         return instances_created_msg[response_key]
     return instances_created_msg
+
+
+async def get_published_status_snapshot(controller_communicator: any) -> dict:
+    """
+    Returns the status snapshot last published by the controller, once it has handled every message sent to it
+    and stored the snapshot.
+    """
+    await prompt_response_from_communicator(controller_communicator, "wait.for.status.snapshot.msg")
+    return load_status_snapshot()
@@ -0,0 +1,78 @@
+import asyncio
+import json
+
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
+
+from task_sharding.src.controller_requests import request_from_controller
+from task_sharding.src.metrics import render_prometheus
+from task_sharding.src.repo_state_table import is_patchset_repo_state
+from task_sharding.src.status_snapshot import load_metrics_snapshot, load_status_snapshot
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+async def metrics(request):
+    # Read from where the controller publishes it, so that scrapes never hold up scheduling
+    metrics_snapshot = load_metrics_snapshot()
+    if metrics_snapshot is None:
+        return HttpResponse("No metrics have been published yet\n", status=503, content_type="text/plain")
+
+    return HttpResponse(render_prometheus(metrics_snapshot), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+async def schema_instance_timeline(request, schema_instance_id: str):
+    try:
+        timeline = await request_from_controller(
+            "get.schema.instance.timeline.msg", "timeline", {"id": str(schema_instance_id)}
+        )
+    except asyncio.TimeoutError:
+        return HttpResponse("Controller did not respond\n", status=503, content_type="text/plain")
+
+    if timeline is None:
+        return HttpResponse("Schema instance not found\n", status=404, content_type="text/plain")
+
+    response = JsonResponse(timeline)
+    response["Content-Disposition"] = 'attachment; filename="{}.trace.json"'.format(schema_instance_id)
+    return response
+
+
+async def status(request):
+    # Read from where the controller publishes it, rather than asked of the controller
+    status_snapshot = load_status_snapshot()
+    if status_snapshot is None:
+        return HttpResponse("No status has been published yet\n", status=503, content_type="text/plain")
+
+    return JsonResponse(status_snapshot)
+
+
+async def supersede(request):
+    """
+    Cancels the schema instances running for a repo state, given as JSON in the same form as in
+    INIT messages, e.g. `{"repo_state": {"org/repo": {"patchset": "<sha>"}}}`.
+    """
+    if request.method != "POST":
+        return HttpResponseNotAllowed(["POST"])
+    try:
+        repo_state = json.loads(request.body)["repo_state"]
+    except (ValueError, KeyError, TypeError):
+        repo_state = None
+    if not is_patchset_repo_state(repo_state):
+        return HttpResponse(
+            'Expected a JSON object with a repo_state of the form {"org/repo": {"patchset": "<sha>"}}\n',
+            status=400,
+            content_type="text/plain",
+        )
+
+    try:
+        superseded_instances = await request_from_controller(
+            "supersede.repo.state.msg", "superseded_instances", {"repo_state": repo_state}
+        )
+    except asyncio.TimeoutError:
+        return HttpResponse("Controller did not respond\n", status=503, content_type="text/plain")
+
+    return JsonResponse({"superseded_instances": superseded_instances})
+
+
+# Triggered by other services rather than from a browser session. Django's `csrf_exempt` decorator
+# cannot wrap async views in this version of Django, so the attribute it sets is set directly.
+supersede.csrf_exempt = True